@@ -0,0 +1,138 @@
+"""
+Analysis Cache
+Persistent cache for AI project/file analysis results.
+
+Entries are keyed by a content fingerprint of the prompt inputs (Merkle hash
+of the files that went into the prompt, plus skill level and any other
+inputs), so an unchanged workspace never pays for the same model call twice.
+Each entry records the workspace paths it depends on; saving one of those
+files drops the entry. Entries live in MongoDB and survive restarts.
+
+Entries expire ttl seconds after their last use (a Mongo TTL index on
+expires_at), and the least recently used are evicted once the collection
+holds more than max_entries. Usage is written back at most once per
+touch_interval per entry, so cache hits are read-only.
+"""
+
+import hashlib
+import json
+import time
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, Optional, Any, Iterable
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(kind: str, *parts: Any) -> str:
+    """Stable key from the analysis kind and its JSON-serializable inputs"""
+    payload = json.dumps([kind, *parts], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class AnalysisCache:
+    """Fingerprint-keyed analysis results stored in a Mongo collection"""
+
+    def __init__(self, collection, ttl: float = 30 * 24 * 3600, max_entries: int = 20000,
+                 touch_interval: float = 3600, evict_every: int = 100):
+        self.collection = collection
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.touch_interval = touch_interval
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._puts = 0
+        self._indexed = False
+
+    async def _ensure_indexes(self) -> None:
+        if self._indexed:
+            return
+        self._indexed = True
+        try:
+            await self.collection.create_index("key", unique=True)
+            await self.collection.create_index([("project_id", 1), ("paths", 1)])
+            await self.collection.create_index("last_used")
+            await self.collection.create_index("expires_at", expireAfterSeconds=0)
+        except Exception as e:
+            logger.warning(f"Analysis cache index creation failed: {e}")
+
+    def _expiry(self) -> datetime:
+        return datetime.now(timezone.utc) + timedelta(seconds=self.ttl)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        await self._ensure_indexes()
+        entry = await self.collection.find_one({"key": key}, {"_id": 0, "result": 1, "last_used": 1, "expires_at": 1})
+        if entry is None or self._expired(entry):
+            self.misses += 1
+            return None
+        self.hits += 1
+        now = time.time()
+        if now - entry.get("last_used", 0) > self.touch_interval:
+            await self.collection.update_one(
+                {"key": key},
+                {"$set": {"last_used": now, "expires_at": self._expiry()}}
+            )
+        return entry["result"]
+
+    @staticmethod
+    def _expired(entry: Dict[str, Any]) -> bool:
+        # The TTL monitor only runs once a minute; don't serve what it hasn't removed yet
+        expires_at = entry.get("expires_at")
+        if expires_at is None:
+            return False
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        return expires_at <= datetime.now(timezone.utc)
+
+    async def put(self, key: str, kind: str, project_id: str, paths: Iterable[str],
+                  result: Dict[str, Any], skill_level: Optional[str] = None) -> None:
+        await self._ensure_indexes()
+        await self.collection.update_one(
+            {"key": key},
+            {"$set": {
+                "key": key,
+                "kind": kind,
+                "project_id": project_id,
+                "paths": sorted(set(paths)),
+                "skill_level": skill_level,
+                "result": result,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "last_used": time.time(),
+                "expires_at": self._expiry()
+            }},
+            upsert=True
+        )
+        self._puts += 1
+        if self._puts % self.evict_every == 0:
+            await self.evict()
+
+    async def evict(self) -> int:
+        """Delete least recently used entries beyond max_entries"""
+        excess = await self.collection.count_documents({}) - self.max_entries
+        if excess <= 0:
+            return 0
+        cursor = self.collection.find({}, {"_id": 1}).sort("last_used", 1).limit(excess)
+        ids = [doc["_id"] async for doc in cursor]
+        result = await self.collection.delete_many({"_id": {"$in": ids}})
+        self.evictions += result.deleted_count
+        return result.deleted_count
+
+    async def invalidate_paths(self, project_id: str, paths: List[str]) -> int:
+        """Drop this project's entries that depend on any of `paths`"""
+        result = await self.collection.delete_many({"project_id": project_id, "paths": {"$in": list(paths)}})
+        return result.deleted_count
+
+    async def invalidate_project(self, project_id: str) -> int:
+        result = await self.collection.delete_many({"project_id": project_id})
+        return result.deleted_count
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "evictions": self.evictions
+        }
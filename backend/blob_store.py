@@ -0,0 +1,346 @@
+"""
+Content-Addressed Blob Store
+Deduplicated storage for workspace files.
+
+Files are stored once under their SHA-256 and cloned into each workspace
+with a reflink (FICLONE) - true copy-on-write. Workspace files never share
+an inode with a blob or with each other, so in-place writes (terminal
+commands, editors, build tools) stay private to their workspace. Clones
+keep the workspace file's mode and mtime.
+
+Deduplication needs reflinks. On filesystems without them (ext4, tmpfs)
+sharing would take hard links, which in-place writes would corrupt, and a
+copy into the store would only double disk use, so the store is bypassed:
+uploads are not ingested and forks are plain copies. storage_mode() reports
+which applies; upload and fork responses carry it.
+
+Blobs carry a sentinel mtime; a blob whose mtime has moved was modified
+after it was stored and is no longer trusted. Upload trees (path -> digest
+maps of pristine uploads) are what keeps blobs alive: gc drops trees that
+no live project refers to and every blob no remaining tree references.
+"""
+
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import secrets
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Optional, Any, Set, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+FICLONE = 0x40049409  # linux/fs.h _IOW(0x94, 9, int)
+BLOB_MTIME = 0  # Sentinel mtime of untouched blobs (clones get the workspace file's mtime)
+
+GC_GRACE_SECONDS = 600  # Blobs/trees this new may belong to an upload still in progress
+
+# Directories never worth deduplicating or forking (reinstalled per workspace)
+FORK_SKIP_DIRS = {'node_modules', '__pycache__', 'venv', '.venv', 'env', '.next'}
+
+
+def atomic_write(path: Path, data: bytes) -> None:
+    """Write via temp file + rename so readers never see a partial file"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=str(path.parent), prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        try:
+            os.chmod(tmp_name, os.stat(path).st_mode & 0o777)
+        except FileNotFoundError:
+            os.chmod(tmp_name, 0o644)
+        os.replace(tmp_name, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def atomic_write_text(path: Path, text: str) -> None:
+    atomic_write(path, text.encode('utf-8'))
+
+
+class BlobStore:
+    """Hash-named file store with reflink/copy materialization"""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.blobs_dir = self.root / "blobs"
+        self.trees_dir = self.root / "trees"
+        self.blobs_dir.mkdir(parents=True, exist_ok=True)
+        self.trees_dir.mkdir(parents=True, exist_ok=True)
+        self.reflink_supported: Optional[bool] = None
+
+    # ---------- blobs ----------
+
+    def blob_path(self, digest: str) -> Path:
+        return self.blobs_dir / digest[:2] / digest[2:]
+
+    def _blob_intact(self, blob: Path) -> bool:
+        try:
+            return blob.stat().st_mtime == BLOB_MTIME
+        except FileNotFoundError:
+            return False
+
+    def has_blob(self, digest: str) -> bool:
+        return self._blob_intact(self.blob_path(digest))
+
+    def _reflink(self, src: Path, dst: Path) -> bool:
+        if self.reflink_supported is False:
+            return False
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            shutil.copystat(src, dst)
+            self.reflink_supported = True
+            return True
+        except OSError as e:
+            try:
+                os.unlink(dst)
+            except FileNotFoundError:
+                pass
+            if e.errno in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS):
+                self.reflink_supported = False
+                return False
+            raise
+
+    def storage_mode(self, directory: Path) -> str:
+        """"reflink" if files in directory can share extents with blobs, else "copy"; probed once"""
+        if self.reflink_supported is None:
+            fd, probe = tempfile.mkstemp(dir=str(self.blobs_dir), prefix=".probe.")
+            os.write(fd, b"probe")
+            os.close(fd)
+            dst = Path(directory) / f".reflink-probe.{secrets.token_hex(6)}"
+            try:
+                self._reflink(Path(probe), dst)
+            except OSError as e:
+                logger.warning(f"Reflink probe failed: {e}")
+                self.reflink_supported = False
+            finally:
+                os.unlink(probe)
+                dst.unlink(missing_ok=True)
+        return "reflink" if self.reflink_supported else "copy"
+
+    def _clone(self, src: Path, dst: Path) -> str:
+        """Clone src to a not-yet-existing dst as a separate inode; returns the method used"""
+        if self._reflink(src, dst):
+            return "reflink"
+        shutil.copyfile(src, dst)
+        return "copy"
+
+    def _store(self, path: Path, digest: str) -> None:
+        """Copy a workspace file's content into the store under digest"""
+        blob = self.blob_path(digest)
+        blob.parent.mkdir(exist_ok=True)
+        tmp = blob.with_name(f".{blob.name}.{secrets.token_hex(6)}.tmp")
+        self._clone(path, tmp)
+        os.chmod(tmp, 0o644)
+        os.utime(tmp, (BLOB_MTIME, BLOB_MTIME))
+        os.replace(tmp, blob)
+
+    def materialize(self, digest: str, dest: Path, mode: int = 0o644, mtime: Optional[float] = None) -> str:
+        """Place a copy of a blob at dest (replacing whatever is there) with the given mode and mtime"""
+        dest = Path(dest)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dest.with_name(f".{dest.name}.{secrets.token_hex(6)}.clone")
+        method = self._clone(self.blob_path(digest), tmp)
+        os.chmod(tmp, mode & 0o7777)
+        os.utime(tmp, None if mtime is None else (mtime, mtime))
+        os.replace(tmp, dest)
+        return method
+
+    def ingest_file(self, path: Path, digest: Optional[str] = None) -> Tuple[str, bool]:
+        """
+        Deduplicate one workspace file. Returns (digest, was_duplicate).
+        With reflink support the workspace file is replaced by a clone of the
+        blob (same mode and mtime); otherwise it is left untouched.
+        """
+        path = Path(path)
+        if digest is None:
+            digest = self.hash_file(path)
+
+        blob = self.blob_path(digest)
+        duplicate = self._blob_intact(blob)
+        if not duplicate:
+            self._store(path, digest)
+        if self.reflink_supported:
+            st = path.stat()
+            self.materialize(digest, path, st.st_mode, st.st_mtime)
+        return digest, duplicate
+
+    @staticmethod
+    def hash_file(path: Path, chunk_size: int = 1024 * 1024) -> str:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    # ---------- workspaces ----------
+
+    def ingest_workspace(self, workspace_path: Path) -> Dict[str, Any]:
+        """Deduplicate every regular file in a freshly extracted workspace (reflink hosts only)"""
+        workspace_path = Path(workspace_path)
+        entries: Dict[str, str] = {}
+        modes: Dict[str, int] = {}
+        duplicate_bytes = 0
+        mode = self.storage_mode(workspace_path.parent)
+        if mode == "copy":
+            return {"entries": entries, "modes": modes, "duplicate_bytes": 0, "mode": mode}
+        for root, dirs, files in os.walk(workspace_path):
+            for name in files:
+                full_path = Path(root) / name
+                if full_path.is_symlink() or not full_path.is_file():
+                    continue
+                st = full_path.stat()
+                digest, duplicate = self.ingest_file(full_path)
+                rel_path = full_path.relative_to(workspace_path).as_posix()
+                entries[rel_path] = digest
+                if st.st_mode & 0o7777 != 0o644:
+                    modes[rel_path] = st.st_mode & 0o7777
+                if duplicate:
+                    duplicate_bytes += st.st_size
+        return {"entries": entries, "modes": modes, "duplicate_bytes": duplicate_bytes, "mode": mode}
+
+    def materialize_tree(self, tree: Dict[str, Any], workspace_path: Path) -> bool:
+        """Recreate a workspace from a saved tree; False if any blob is missing"""
+        entries, modes = tree["entries"], tree.get("modes", {})
+        if not all(self.has_blob(digest) for digest in set(entries.values())):
+            return False
+        workspace_path = Path(workspace_path)
+        for rel_path, digest in entries.items():
+            self.materialize(digest, workspace_path / rel_path, modes.get(rel_path, 0o644))
+        return True
+
+    def fork_workspace(self, src: Path, dst: Path,
+                       known_files: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """
+        Create dst as a copy of src. With reflinks, files whose manifest entry
+        (hash, size, mtime) is still current are cloned straight from their
+        blob and other files are ingested first; without, every file is
+        copied. Every file keeps its mode and mtime. Dependency and cache
+        directories (FORK_SKIP_DIRS) are not carried over.
+        """
+        src, dst = Path(src), Path(dst)
+        known_files = known_files or {}
+        linked = 0
+        ingested = 0
+        copied = 0
+        entries: Dict[str, str] = {}
+        mode = self.storage_mode(dst.parent)
+
+        for root, dirs, files in os.walk(src):
+            dirs[:] = [d for d in dirs if d not in FORK_SKIP_DIRS]
+            rel_root = Path(root).relative_to(src)
+            (dst / rel_root).mkdir(parents=True, exist_ok=True)
+            for name in files:
+                full_path = Path(root) / name
+                if full_path.is_symlink() or not full_path.is_file():
+                    continue
+                rel_path = (rel_root / name).as_posix()
+                if mode == "copy":
+                    shutil.copy2(full_path, dst / rel_path)
+                    copied += 1
+                    continue
+                st = full_path.stat()
+                known = known_files.get(rel_path)
+                if known and known.get("hash") and self.has_blob(known["hash"]) \
+                        and known.get("size") == st.st_size and known.get("mtime") == st.st_mtime:
+                    digest = known["hash"]
+                    linked += 1
+                else:
+                    digest, _ = self.ingest_file(full_path)
+                    ingested += 1
+                self.materialize(digest, dst / rel_path, st.st_mode, st.st_mtime)
+                entries[rel_path] = digest
+
+        return {"entries": entries, "linked": linked, "ingested": ingested, "copied": copied, "mode": mode}
+
+    # ---------- tree objects (pristine uploads) ----------
+
+    def save_tree(self, tree_id: str, entries: Dict[str, str], modes: Optional[Dict[str, int]] = None) -> None:
+        atomic_write_text(self.trees_dir / f"{tree_id}.json", json.dumps({"entries": entries, "modes": modes or {}}))
+
+    def load_tree(self, tree_id: str) -> Optional[Dict[str, Any]]:
+        """{"entries": path -> digest, "modes": path -> mode} or None"""
+        path = self.trees_dir / f"{tree_id}.json"
+        if not path.exists():
+            return None
+        try:
+            data = json.loads(path.read_text())
+        except Exception as e:
+            logger.warning(f"Discarding unreadable tree {tree_id}: {e}")
+            return None
+        if "entries" not in data:  # Trees saved before modes were recorded
+            data = {"entries": data, "modes": {}}
+        return data
+
+    # ---------- maintenance ----------
+
+    def gc(self, live_trees: Set[str]) -> Dict[str, int]:
+        """
+        Drop tree objects not in live_trees, then every blob no remaining
+        tree references and every blob modified after it was stored. Trees
+        and blobs younger than GC_GRACE_SECONDS are kept, since an upload may
+        still be between ingesting its files and saving its tree.
+        """
+        cutoff = time.time() - GC_GRACE_SECONDS
+        trees_removed = 0
+        referenced: Set[str] = set()
+        for tree_file in self.trees_dir.glob("*.json"):
+            try:
+                recent = tree_file.stat().st_mtime > cutoff
+            except FileNotFoundError:
+                continue
+            if tree_file.stem in live_trees or recent:
+                tree = self.load_tree(tree_file.stem)
+                if tree is not None:
+                    referenced.update(tree["entries"].values())
+                    continue
+            tree_file.unlink(missing_ok=True)
+            trees_removed += 1
+
+        removed = 0
+        freed = 0
+        for shard in self.blobs_dir.iterdir():
+            if not shard.is_dir():
+                continue
+            for blob in shard.iterdir():
+                digest = shard.name + blob.name
+                try:
+                    st = blob.stat()
+                except FileNotFoundError:
+                    continue
+                if st.st_ctime > cutoff:
+                    continue
+                if digest in referenced and st.st_mtime == BLOB_MTIME:
+                    continue
+                blob.unlink(missing_ok=True)
+                removed += 1
+                freed += st.st_blocks * 512
+
+        return {"trees_removed": trees_removed, "blobs_removed": removed, "bytes_freed": freed}
+
+    def stats(self) -> Dict[str, Any]:
+        blobs = 0
+        total = 0
+        for shard in self.blobs_dir.iterdir():
+            if shard.is_dir():
+                for blob in shard.iterdir():
+                    blobs += 1
+                    total += blob.stat().st_size
+        return {
+            "blobs": blobs,
+            "bytes": total,
+            "trees": len(list(self.trees_dir.glob("*.json"))),
+            "reflink": bool(self.reflink_supported)
+        }
@@ -0,0 +1,486 @@
+"""
+Build Cache
+Compile-and-run for C, C++, Go, Rust, Java and TypeScript with cached artifacts.
+
+A build is identified by the hash of its sources, compiler flags and the
+toolchain's version string. The first run compiles into a staging
+directory that is renamed into the store once complete; later runs of the
+same inputs skip straight to execution. Failed compiles are cached too, so
+re-running unchanged broken code returns the same diagnostics immediately.
+
+Compiles are bounded by a semaphore and identical concurrent builds wait
+for a single compile. Compile and run timings are reported separately.
+
+Entry sizes and recency are kept in memory (the store is scanned once, on
+first use) so eviction never walks the store. Eviction runs on the event
+loop under the entry's key lock and skips entries that are being built or
+are pinned by a running program.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import time
+import uuid
+from contextlib import asynccontextmanager
+from pathlib import Path, PurePosixPath
+from typing import Dict, List, Optional, Any
+import logging
+
+logger = logging.getLogger(__name__)
+
+MAX_OUTPUT_CHARS = 50000
+MAX_PROJECT_SOURCES = 200
+MAX_PROJECT_SOURCE_BYTES = 2 * 1024 * 1024
+
+JAVA_CLASS_RE = re.compile(r'public\s+(?:final\s+|abstract\s+)*class\s+(\w+)')
+C_FLAG_RE = re.compile(r'^-(O[0-3sz]?|g|W[\w=-]*|w|std=[\w+]+|D\w+(=[\w.]*)?|U\w+|l[\w+-]+|f[\w-]+|pthread|march=native)$')
+
+TOOLCHAINS: Dict[str, Dict[str, Any]] = {
+    "c": {
+        "extensions": (".c", ".h"), "default_main": "main.c", "compiler": "gcc",
+        "flags": ["-O2", "-std=c17"], "flag_re": C_FLAG_RE,
+    },
+    "cpp": {
+        "extensions": (".cpp", ".cc", ".cxx", ".hpp", ".hh", ".h"), "default_main": "main.cpp", "compiler": "g++",
+        "flags": ["-O2", "-std=c++17"], "flag_re": C_FLAG_RE,
+    },
+    "go": {
+        "extensions": (".go",), "default_main": "main.go", "compiler": "go",
+        "flags": [], "flag_re": re.compile(r'^-(race|trimpath|ldflags=-s -w)$'),
+    },
+    "rust": {
+        "extensions": (".rs",), "default_main": "main.rs", "compiler": "rustc",
+        "flags": ["-O", "--edition", "2021"], "flag_re": re.compile(r'^(-O|-g|-C(opt-level=[0-3sz]|debuginfo=[0-2]))$'),
+    },
+    "java": {
+        "extensions": (".java",), "default_main": "Main.java", "compiler": "javac",
+        "flags": [], "flag_re": re.compile(r'^-(g|nowarn|Xlint(:[\w,-]+)?|deprecation)$'),
+    },
+    "typescript": {
+        "extensions": (".ts", ".tsx"), "default_main": "main.ts", "compiler": "tsc",
+        "flags": ["--target", "es2020", "--module", "commonjs", "--esModuleInterop", "--skipLibCheck"],
+        "flag_re": re.compile(r'^--(strict|noImplicitAny|strictNullChecks|experimentalDecorators)$'),
+    },
+}
+
+LANGUAGE_ALIASES = {
+    "c": "c", "cpp": "cpp", "c++": "cpp", "cxx": "cpp",
+    "go": "go", "golang": "go", "rust": "rust", "rs": "rust",
+    "java": "java", "typescript": "typescript", "ts": "typescript",
+}
+
+EXTENSION_LANGUAGES = {".c": "c", ".cpp": "cpp", ".cc": "cpp", ".cxx": "cpp", ".go": "go",
+                       ".rs": "rust", ".java": "java", ".ts": "typescript"}
+
+
+class BuildError(ValueError):
+    """Raised for unsupported languages, disallowed flags or missing toolchains"""
+
+
+def resolve_language(name: str) -> Optional[str]:
+    return LANGUAGE_ALIASES.get(name.lower().strip())
+
+
+def language_for_path(path: str) -> Optional[str]:
+    return EXTENSION_LANGUAGES.get(PurePosixPath(path).suffix.lower())
+
+
+def default_main(language: str, code: str) -> str:
+    """File name for a single snippet (Java needs it to match the public class)"""
+    if language == "java":
+        match = JAVA_CLASS_RE.search(code)
+        return f"{match.group(1)}.java" if match else "Main.java"
+    return TOOLCHAINS[language]["default_main"]
+
+
+def project_sources(workspace_path: Path, rel_path: str, language: str) -> Optional[Dict[str, str]]:
+    """
+    The file plus its same-language siblings (headers, modules, other classes),
+    or None when the file cannot be built standalone (Go inside a module).
+    """
+    workspace_path = Path(workspace_path)
+    main = workspace_path / rel_path
+    directory = main.parent
+    if language == "go":
+        probe = directory
+        while True:
+            if (probe / "go.mod").exists():
+                return None
+            if probe == workspace_path or probe.parent == probe:
+                break
+            probe = probe.parent
+        return {main.name: main.read_text(errors='replace')}
+
+    extensions = TOOLCHAINS[language]["extensions"]
+    sources: Dict[str, str] = {}
+    total = 0
+    for candidate in sorted(directory.iterdir()):
+        if not candidate.is_file() or candidate.suffix.lower() not in extensions:
+            continue
+        if len(sources) >= MAX_PROJECT_SOURCES:
+            break
+        text = candidate.read_text(errors='replace')
+        total += len(text)
+        if total > MAX_PROJECT_SOURCE_BYTES:
+            break
+        sources[candidate.name] = text
+    sources[main.name] = main.read_text(errors='replace')
+    return sources
+
+
+class BuildCache:
+    """Content-keyed compiled artifacts with bounded, single-flight compiles"""
+
+    def __init__(self, root: Path, max_bytes: int = 2 * 1024 ** 3, max_compiles: Optional[int] = None,
+                 compile_timeout: int = 120):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.compile_timeout = compile_timeout
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.go_build_cache = self.root / "go-build"
+        self._compile_slots = asyncio.Semaphore(max_compiles or max(1, (os.cpu_count() or 2) // 2))
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._lock_users: Dict[str, int] = {}  # Holders and waiters; the lock is dropped at zero
+        self._pins: Dict[str, int] = {}  # Runs executing an entry's artifacts
+        self._index: Optional[Dict[str, Dict[str, Any]]] = None  # key -> {language, path, size, last_used}
+        self._index_lock = asyncio.Lock()
+        self._tool_versions: Dict[str, Optional[str]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.compile_seconds_saved = 0.0
+        self.evictions = 0
+
+    # ---------- keys ----------
+
+    def toolchain_version(self, language: str) -> Optional[str]:
+        """Compiler version string, or None when the compiler is not installed"""
+        compiler = TOOLCHAINS[language]["compiler"]
+        if compiler not in self._tool_versions:
+            path = shutil.which(compiler)
+            version = None
+            if path:
+                args = [path, "version"] if compiler == "go" else [path, "--version"]
+                try:
+                    result = subprocess.run(args, capture_output=True, text=True, timeout=10)
+                    version = (result.stdout or result.stderr).strip().splitlines()[0]
+                except (OSError, subprocess.TimeoutExpired, IndexError):
+                    version = "unknown"
+            self._tool_versions[compiler] = version
+        return self._tool_versions[compiler]
+
+    def check_flags(self, language: str, flags: Optional[List[str]]) -> List[str]:
+        flags = list(flags or [])
+        pattern = TOOLCHAINS[language]["flag_re"]
+        rejected = [f for f in flags if not pattern.match(f)]
+        if rejected:
+            raise BuildError(f"Flags not allowed for {language}: {' '.join(rejected)}")
+        return TOOLCHAINS[language]["flags"] + flags
+
+    @staticmethod
+    def cache_key(language: str, sources: Dict[str, str], main: str, flags: List[str], version: str) -> str:
+        digest = hashlib.sha256()
+        digest.update(json.dumps([language, main, flags, version]).encode())
+        for name in sorted(sources):
+            digest.update(b"\0" + name.encode() + b"\0")
+            digest.update(hashlib.sha256(sources[name].encode()).digest())
+        return digest.hexdigest()[:32]
+
+    @asynccontextmanager
+    async def _locked(self, key: str):
+        """Hold the key's lock; the lock object is forgotten once nobody holds or awaits it"""
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._lock_users[key] = self._lock_users.get(key, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._lock_users[key] -= 1
+            if not self._lock_users[key]:
+                del self._lock_users[key]
+                del self._locks[key]
+
+    def _unpin(self, key: str) -> None:
+        self._pins[key] -= 1
+        if not self._pins[key]:
+            del self._pins[key]
+
+    def _entry_dir(self, language: str, key: str) -> Path:
+        return self.root / language / key
+
+    @staticmethod
+    def _read_meta(entry: Path) -> Optional[Dict[str, Any]]:
+        try:
+            return json.loads((entry / "meta.json").read_text())
+        except (OSError, ValueError):
+            return None
+
+    # ---------- compiling ----------
+
+    def _commands(self, language: str, main: str, sources: Dict[str, str], flags: List[str]) -> Dict[str, Any]:
+        """Compile argv (run in the build dir) and run argv template ({out} is the artifact dir)"""
+        stem = PurePosixPath(main).stem
+        units = [n for n in sorted(sources) if n.endswith(('.c', '.cpp', '.cc', '.cxx'))] or [main]
+        if language == "c":
+            return {"compile": ["gcc", *flags, "-o", "out/program", *units, "-lm"], "run": ["{out}/program"]}
+        if language == "cpp":
+            return {"compile": ["g++", *flags, "-o", "out/program", *units], "run": ["{out}/program"]}
+        if language == "go":
+            return {"compile": ["go", "build", *flags, "-o", "out/program", main], "run": ["{out}/program"]}
+        if language == "rust":
+            return {"compile": ["rustc", *flags, "-o", "out/program", main], "run": ["{out}/program"]}
+        if language == "java":
+            java_units = [n for n in sorted(sources) if n.endswith('.java')]
+            return {"compile": ["javac", *flags, "-d", "out", *java_units], "run": ["java", "-cp", "{out}", stem]}
+        return {"compile": ["tsc", *flags, "--rootDir", ".", "--outDir", "out", main],
+                "run": ["node", f"{{out}}/{stem}.js"]}
+
+    def _compile_env(self) -> Dict[str, str]:
+        return {**os.environ, "GOCACHE": str(self.go_build_cache), "GO111MODULE": "off"}
+
+    async def _compile(self, language: str, key: str, sources: Dict[str, str], main: str,
+                       flags: List[str], version: str) -> Dict[str, Any]:
+        entry = self._entry_dir(language, key)
+        staging = entry.with_name(f".{key}.{uuid.uuid4().hex[:8]}.staging")
+        commands = self._commands(language, main, sources, flags)
+        try:
+            for name, text in sources.items():
+                (staging / name).parent.mkdir(parents=True, exist_ok=True)
+                (staging / name).write_text(text)
+            (staging / "out").mkdir(exist_ok=True)
+
+            started = time.perf_counter()
+            async with self._compile_slots:
+                process = await asyncio.create_subprocess_exec(
+                    *commands["compile"], cwd=str(staging), env=self._compile_env(),
+                    stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
+                )
+                try:
+                    output, _ = await asyncio.wait_for(process.communicate(), timeout=self.compile_timeout)
+                except asyncio.TimeoutError:
+                    process.kill()
+                    await process.wait()
+                    return {"success": False, "seconds": round(time.perf_counter() - started, 3),
+                            "output": f"Compilation timed out ({self.compile_timeout} second limit)",
+                            "cached": False}
+            seconds = round(time.perf_counter() - started, 3)
+            text = output.decode(errors='replace')[-MAX_OUTPUT_CHARS:]
+
+            # tsc emits JavaScript despite type errors; those are reported, not fatal
+            artifact = commands["run"][-1].replace("{out}", "out")
+            success = process.returncode == 0 or (language == "typescript" and (staging / artifact).exists())
+
+            for name in sources:
+                (staging / name).unlink(missing_ok=True)
+            meta = {"key": key, "language": language, "main": main, "flags": flags, "toolchain": version,
+                    "success": success, "output": text, "seconds": seconds, "run": commands["run"],
+                    "created_at": time.time(), "last_used": time.time()}
+            if not success:
+                shutil.rmtree(staging / "out", ignore_errors=True)
+            (staging / "meta.json").write_text(json.dumps(meta))
+            shutil.rmtree(entry, ignore_errors=True)  # Stale partial entry from an interrupted compile
+            entry.parent.mkdir(parents=True, exist_ok=True)
+            os.rename(staging, entry)
+            return {"success": success, "seconds": seconds, "output": text, "cached": False}
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    async def build(self, language: str, sources: Dict[str, str], main: str,
+                    flags: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Compile (or reuse) a build; returns {key, success, seconds, output, cached, run}"""
+        result = await self._build(language, sources, main, flags)
+        self._unpin(result["key"])
+        return result
+
+    async def _build(self, language: str, sources: Dict[str, str], main: str,
+                     flags: Optional[List[str]]) -> Dict[str, Any]:
+        """build() that returns with the entry pinned; the caller unpins it"""
+        if language not in TOOLCHAINS:
+            raise BuildError(f"Language {language} is not supported for compiled execution")
+        flags = self.check_flags(language, flags)
+        version = await asyncio.to_thread(self.toolchain_version, language)
+        if version is None:
+            raise BuildError(f"{TOOLCHAINS[language]['compiler']} is not installed on this server")
+        key = self.cache_key(language, sources, main, flags, version)
+        entry = self._entry_dir(language, key)
+        await self._ensure_index()
+
+        async with self._locked(key):
+            meta = await asyncio.to_thread(self._read_meta, entry)
+            if meta is not None:
+                self.hits += 1
+                self.compile_seconds_saved += meta.get("seconds", 0)
+                await asyncio.to_thread(self._touch, entry)
+                await self._record(language, key, entry)
+                self._pins[key] = self._pins.get(key, 0) + 1
+                return {"key": key, "success": meta["success"], "seconds": 0.0, "output": meta["output"],
+                        "cached": True, "run": meta["run"], "entry": entry}
+            self.misses += 1
+            (entry.parent).mkdir(parents=True, exist_ok=True)
+            result = await self._compile(language, key, sources, main, flags, version)
+            await self._record(language, key, entry)
+            self._pins[key] = self._pins.get(key, 0) + 1
+
+        try:
+            await self.evict()
+        except BaseException:
+            self._unpin(key)
+            raise
+        run = self._commands(language, main, sources, flags)["run"]
+        return {"key": key, **result, "run": run, "entry": entry}
+
+    # ---------- running ----------
+
+    async def run(self, language: str, sources: Dict[str, str], main: str, flags: Optional[List[str]] = None,
+                  cwd: Optional[Path] = None, env: Optional[Dict[str, str]] = None, timeout: int = 30,
+                  stdin: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Build if needed, then execute. Returns {language, key, compile: {...},
+        run: {exit_code, stdout, stderr, seconds, timed_out} or None when the
+        compile failed}.
+        """
+        build = await self._build(language, sources, main, flags)
+        try:
+            return await self._run(build, language, cwd, env, timeout, stdin)
+        finally:
+            self._unpin(build["key"])
+
+    async def _run(self, build: Dict[str, Any], language: str, cwd: Optional[Path],
+                   env: Optional[Dict[str, str]], timeout: int, stdin: Optional[str]) -> Dict[str, Any]:
+        result = {
+            "language": language,
+            "key": build["key"],
+            "compile": {"success": build["success"], "seconds": build["seconds"],
+                        "cached": build["cached"], "output": build["output"]},
+            "run": None
+        }
+        if not build["success"]:
+            return result
+
+        out_dir = str(build["entry"] / "out")
+        argv = [arg.replace("{out}", out_dir) for arg in build["run"]]
+        started = time.perf_counter()
+        process = await asyncio.create_subprocess_exec(
+            *argv, cwd=str(cwd or build["entry"]), env=env or dict(os.environ),
+            stdin=asyncio.subprocess.PIPE if stdin is not None else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        timed_out = False
+        try:
+            stdout, stderr = await asyncio.wait_for(
+                process.communicate(stdin.encode() if stdin is not None else None), timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            process.kill()
+            stdout, stderr = await process.communicate()
+            timed_out = True
+        result["run"] = {
+            "exit_code": 124 if timed_out else process.returncode,
+            "stdout": stdout.decode(errors='replace')[-MAX_OUTPUT_CHARS:],
+            "stderr": stderr.decode(errors='replace')[-MAX_OUTPUT_CHARS:],
+            "seconds": round(time.perf_counter() - started, 3),
+            "timed_out": timed_out
+        }
+        return result
+
+    # ---------- housekeeping ----------
+
+    @staticmethod
+    def _touch(entry: Path) -> None:
+        try:
+            os.utime(entry / "meta.json")
+        except OSError:
+            pass
+
+    @staticmethod
+    def _measure(entry: Path) -> Optional[Dict[str, Any]]:
+        """Size and last use of a complete entry, or None for staging/partial/missing ones"""
+        try:
+            last_used = (entry / "meta.json").stat().st_mtime
+        except OSError:
+            return None
+        size = 0
+        for f in entry.rglob('*'):
+            try:
+                if f.is_file():
+                    size += f.stat().st_size
+            except OSError:
+                continue
+        return {"path": str(entry), "size": size, "last_used": last_used}
+
+    def _scan(self) -> Dict[str, Dict[str, Any]]:
+        index = {}
+        for language in TOOLCHAINS:
+            directory = self.root / language
+            if not directory.is_dir():
+                continue
+            for entry in directory.iterdir():
+                info = self._measure(entry)
+                if info is not None:
+                    index[entry.name] = {"language": language, **info}
+        return index
+
+    async def _ensure_index(self) -> None:
+        if self._index is not None:
+            return
+        async with self._index_lock:
+            if self._index is None:
+                self._index = await asyncio.to_thread(self._scan)
+
+    async def _record(self, language: str, key: str, entry: Path) -> None:
+        """Update the in-memory index after a hit or compile; caller holds the key lock"""
+        known = self._index.get(key)
+        if known is not None:
+            known["last_used"] = time.time()
+            return
+        info = await asyncio.to_thread(self._measure, entry)
+        if info is not None:
+            self._index[key] = {"language": language, **info}
+
+    def entries(self) -> List[Dict[str, Any]]:
+        return [{"key": key, **info} for key, info in (self._index or {}).items()]
+
+    async def evict(self, max_bytes: Optional[int] = None) -> Dict[str, int]:
+        """Remove least recently used builds until the store fits in max_bytes"""
+        await self._ensure_index()
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        total = sum(info["size"] for info in self._index.values())
+        removed = 0
+        freed = 0
+        for key, info in sorted(self._index.items(), key=lambda item: item[1]["last_used"]):
+            if total <= max_bytes:
+                break
+            lock = self._locks.get(key)
+            if key in self._pins or (lock is not None and lock.locked()):
+                continue  # Being built or run
+            async with self._locked(key):
+                if key in self._pins or self._index.get(key) is not info:
+                    continue
+                await asyncio.to_thread(shutil.rmtree, info["path"], True)
+                del self._index[key]
+            total -= info["size"]
+            freed += info["size"]
+            removed += 1
+        self.evictions += removed
+        return {"entries_removed": removed, "bytes_freed": freed}
+
+    async def stats(self) -> Dict[str, Any]:
+        await self._ensure_index()
+        entries = self.entries()
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(entries),
+            "bytes": sum(e["size"] for e in entries),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "compile_seconds_saved": round(self.compile_seconds_saved, 2),
+            "evictions": self.evictions,
+            "toolchains": {lang: self._tool_versions.get(spec["compiler"]) for lang, spec in TOOLCHAINS.items()
+                           if spec["compiler"] in self._tool_versions}
+        }
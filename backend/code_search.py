@@ -0,0 +1,333 @@
+"""
+Code Search
+Per-project trigram index for literal, regex and path-glob queries.
+
+The index is built from the workspace manifest and kept in sync with it by
+manifest version, so only files changed since the last sync are re-indexed.
+Queries intersect trigram posting sets to find candidate files, then verify
+candidates against the real file content line by line.
+
+A published index is never modified. Each sync builds the next version on
+a copy in a worker thread - posting sets are copied only when first
+touched - and swaps it in on the loop, so queries always run against a
+complete index without waiting for a sync. Removed documents stay in
+posting sets as dead ids until enough accumulate to be worth compacting.
+"""
+
+import asyncio
+import fnmatch
+import re
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Any, Set, AsyncIterator
+import logging
+
+try:
+    import re._parser as sre_parse
+    from re._constants import LITERAL, SUBPATTERN, MAX_REPEAT, MIN_REPEAT
+except ImportError:  # Python < 3.11
+    import sre_parse
+    from sre_constants import LITERAL, SUBPATTERN, MAX_REPEAT, MIN_REPEAT
+
+logger = logging.getLogger(__name__)
+
+MAX_INDEX_FILE_SIZE = 1024 * 1024  # Larger files are not indexed
+BINARY_SNIFF_BYTES = 8192
+
+
+def trigrams(text: str) -> Set[str]:
+    """Lowercased trigrams of a string"""
+    text = text.lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def regex_required_literals(pattern: str) -> List[str]:
+    """
+    Literal runs every match of `pattern` must contain.
+
+    Walks the parsed regex: consecutive LITERAL nodes form a run; groups and
+    repeats with min >= 1 contribute their own runs; anything optional or
+    alternative ends the current run. Returns [] when nothing is required.
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error:
+        return []
+
+    literals: List[str] = []
+
+    def walk(seq):
+        run = []
+        for op, arg in seq:
+            if op == LITERAL:
+                run.append(chr(arg))
+                continue
+            if run:
+                literals.append(''.join(run))
+                run = []
+            if op == SUBPATTERN:
+                walk(arg[-1])
+            elif op in (MAX_REPEAT, MIN_REPEAT) and arg[0] >= 1:
+                walk(arg[2])
+        if run:
+            literals.append(''.join(run))
+
+    walk(parsed)
+    return [lit for lit in literals if len(lit) >= 3]
+
+
+class ProjectSearchIndex:
+    """Trigram posting sets for one workspace"""
+
+    def __init__(self):
+        self.doc_ids: Dict[str, int] = {}
+        self.paths: Dict[int, str] = {}
+        self.postings: Dict[str, Set[int]] = {}
+        self.unindexed: Set[str] = set()  # Too large or binary: path-glob only
+        self.version = -1
+        self.dead = 0  # Removed ids still present in posting sets
+        self._next_id = 0
+        self._owned: Set[str] = set()  # Posting sets this copy may modify
+
+    def copy(self) -> "ProjectSearchIndex":
+        """Shallow copy to build the next version on; posting sets are copied on first write"""
+        clone = ProjectSearchIndex()
+        clone.doc_ids = dict(self.doc_ids)
+        clone.paths = dict(self.paths)
+        clone.postings = dict(self.postings)
+        clone.unindexed = set(self.unindexed)
+        clone.version, clone.dead, clone._next_id = self.version, self.dead, self._next_id
+        return clone
+
+    def remove(self, path: str) -> None:
+        self.unindexed.discard(path)
+        doc_id = self.doc_ids.pop(path, None)
+        if doc_id is not None:
+            del self.paths[doc_id]
+            self.dead += 1
+
+    def add(self, path: str, text: Optional[str]) -> None:
+        self.remove(path)
+        if text is None:
+            self.unindexed.add(path)
+            return
+        doc_id = self._next_id
+        self._next_id += 1
+        self.doc_ids[path] = doc_id
+        self.paths[doc_id] = path
+        for tri in trigrams(text):
+            if tri not in self._owned:
+                self.postings[tri] = set(self.postings.get(tri, ()))
+                self._owned.add(tri)
+            self.postings[tri].add(doc_id)
+
+    def compact(self) -> None:
+        """Drop dead ids from every posting set (into new sets) once they outnumber live documents"""
+        if self.dead <= max(1024, len(self.doc_ids)):
+            return
+        paths = self.paths
+        postings = {}
+        for tri, posting in self.postings.items():
+            live = {d for d in posting if d in paths}
+            if live:
+                postings[tri] = live
+        self.postings = postings
+        self._owned = set(postings)
+        self.dead = 0
+
+    def all_paths(self) -> List[str]:
+        return sorted(list(self.doc_ids) + list(self.unindexed))
+
+    def candidates(self, required: List[str]) -> List[str]:
+        """Paths containing every trigram of every required literal"""
+        if not required:
+            return sorted(self.doc_ids)
+        tris = set()
+        for literal in required:
+            tris |= trigrams(literal)
+        postings = sorted((self.postings.get(t, set()) for t in tris), key=len)
+        if not postings or not postings[0]:
+            return []
+        docs = set(postings[0])
+        for posting in postings[1:]:
+            docs &= posting
+            if not docs:
+                return []
+        return sorted(self.paths[d] for d in docs if d in self.paths)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "documents": len(self.doc_ids),
+            "unindexed": len(self.unindexed),
+            "trigrams": len(self.postings),
+            "dead_ids": self.dead
+        }
+
+
+def read_indexable_text(full_path: Path, size: int) -> Optional[str]:
+    """File text for indexing, or None for large/binary/unreadable files"""
+    if size > MAX_INDEX_FILE_SIZE:
+        return None
+    try:
+        data = full_path.read_bytes()
+    except OSError:
+        return None
+    if b'\0' in data[:BINARY_SNIFF_BYTES]:
+        return None
+    return data.decode('utf-8', errors='replace')
+
+
+class CodeSearchService:
+    """Owns per-project indexes and runs queries against them"""
+
+    def __init__(self, batch_size: int = 64):
+        self.indexes: Dict[str, ProjectSearchIndex] = {}
+        self.batch_size = batch_size
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def _lock(self, project_id: str) -> asyncio.Lock:
+        if project_id not in self._locks:
+            self._locks[project_id] = asyncio.Lock()
+        return self._locks[project_id]
+
+    @staticmethod
+    def _apply(base: Optional[ProjectSearchIndex], workspace_path: Path,
+               changed: List[Dict[str, Any]], deleted: List[str]) -> ProjectSearchIndex:
+        """Build the next index off a copy; the published one keeps serving queries meanwhile"""
+        index = base.copy() if base is not None else ProjectSearchIndex()
+        for path in deleted:
+            index.remove(path)
+        for entry in changed:
+            index.add(entry["path"], read_indexable_text(workspace_path / entry["path"], entry["size"]))
+        index.compact()
+        index._owned = set()
+        return index
+
+    async def sync(self, project_id: str, workspace_path: Path, manifest: Dict[str, Any],
+                   manifest_store) -> ProjectSearchIndex:
+        """Bring the index up to the manifest's version (full build on first use)"""
+        workspace_path = Path(workspace_path)
+        async with self._lock(project_id):
+            index = self.indexes.get(project_id)
+            if index is not None and index.version == manifest["version"]:
+                return index
+
+            delta = manifest_store.changes_since(manifest, index.version) if index is not None else None
+            if delta is None:
+                index = None
+                changed = [{"path": p, **meta} for p, meta in manifest["files"].items()]
+                deleted = []
+            else:
+                changed, deleted = delta["changed"], delta["deleted"]
+
+            index = await asyncio.to_thread(self._apply, index, workspace_path, changed, deleted)
+            index.version = manifest["version"]
+            self.indexes[project_id] = index
+            return index
+
+    def forget(self, project_id: str) -> None:
+        self.indexes.pop(project_id, None)
+        self._locks.pop(project_id, None)
+
+    @staticmethod
+    def _match_file(full_path: Path, rel_path: str, matcher, context: int, limit: int) -> List[Dict[str, Any]]:
+        try:
+            text = full_path.read_text(errors='replace')
+        except OSError:
+            return []
+        lines = text.splitlines()
+        results = []
+        for i, line in enumerate(lines):
+            match = matcher(line)
+            if not match:
+                continue
+            results.append({
+                "path": rel_path,
+                "line": i + 1,
+                "column": match.start() + 1,
+                "text": line[:500],
+                "before": [l[:500] for l in lines[max(0, i - context):i]],
+                "after": [l[:500] for l in lines[i + 1:i + 1 + context]]
+            })
+            if len(results) >= limit:
+                break
+        return results
+
+    async def search(
+        self,
+        project_id: str,
+        workspace_path: Path,
+        query: str = "",
+        mode: str = "literal",
+        glob: Optional[str] = None,
+        case_sensitive: bool = False,
+        context: int = 2,
+        max_results: int = 200
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Yield match dicts as candidate files are verified, then a final
+        summary dict with "done": True.
+
+        mode: literal | regex | path (glob only, one result per file)
+
+        Call sync() first. The query runs against the index published at the
+        time of the call; a concurrent sync swaps in a new one without
+        touching it.
+        """
+        index = self.indexes[project_id]
+        started = time.perf_counter()
+        workspace_path = Path(workspace_path)
+        flags = 0 if case_sensitive else re.IGNORECASE
+
+        def glob_ok(path: str) -> bool:
+            return not glob or fnmatch.fnmatch(path, glob) or fnmatch.fnmatch(Path(path).name, glob)
+
+        if mode == "path":
+            matched = 0
+            for path in index.all_paths():
+                if glob_ok(path) and (not query or query.lower() in path.lower()):
+                    yield {"path": path}
+                    matched += 1
+                    if matched >= max_results:
+                        break
+            yield {"done": True, "matches": matched, "files_scanned": 0,
+                   "truncated": matched >= max_results,
+                   "elapsed_ms": round((time.perf_counter() - started) * 1000, 2)}
+            return
+
+        if mode == "regex":
+            regex = re.compile(query, flags)
+            required = regex_required_literals(query)
+        else:
+            regex = re.compile(re.escape(query), flags)
+            required = [query] if len(query) >= 3 else []
+
+        candidates = [p for p in index.candidates(required) if glob_ok(p)]
+        matched = 0
+        scanned = 0
+        for start in range(0, len(candidates), self.batch_size):
+            batch = candidates[start:start + self.batch_size]
+            batch_results = await asyncio.to_thread(
+                lambda: [
+                    r
+                    for p in batch
+                    for r in self._match_file(workspace_path / p, p, regex.search, context, max_results)
+                ]
+            )
+            scanned += len(batch)
+            for result in batch_results:
+                yield result
+                matched += 1
+                if matched >= max_results:
+                    break
+            if matched >= max_results:
+                break
+
+        yield {"done": True, "matches": matched, "files_scanned": scanned,
+               "candidates": len(candidates), "truncated": matched >= max_results,
+               "elapsed_ms": round((time.perf_counter() - started) * 1000, 2)}
+
+
+# Global code search service
+code_search = CodeSearchService()
@@ -0,0 +1,524 @@
+"""
+Dependency Cache
+Shared, content-keyed dependency installs for project workspaces.
+
+A dependency set is identified by the hash of its manifest/lock files plus
+the toolchain version. Each set is installed once into the store and then
+linked into every workspace that needs it:
+- npm/yarn/pnpm: node_modules is installed in a staging directory holding
+  only package.json and the lockfile (root lifecycle scripts run there,
+  before the set is published), then cloned into workspaces - reflinked
+  where the filesystem supports it, copied otherwise - so nothing a
+  workspace does to its node_modules reaches the store
+- pip: one virtualenv per dependency set; each workspace gets a small
+  .venv whose site-packages points at it through a .pth file, plus the
+  store's console scripts re-pointed at the workspace interpreter
+- go: a shared GOMODCACHE (Go's module cache is already content-addressed)
+
+Sets that reference workspace files (local paths, editable installs, npm
+workspaces, lifecycle scripts that need the project's sources) cannot be
+shared and are installed directly into the workspace. Least recently used
+sets are evicted when the store grows past max_bytes; python sets still
+referenced by a live workspace are kept. GOMODCACHE has its own budget,
+go_max_bytes, and is cleared as a whole when it outgrows it.
+"""
+
+import asyncio
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Any, Callable, Awaitable, Set
+import logging
+
+from blob_store import FICLONE
+
+logger = logging.getLogger(__name__)
+
+NPM_LOCKFILES = ['package-lock.json', 'npm-shrinkwrap.json', 'yarn.lock', 'pnpm-lock.yaml']
+ROOT_LIFECYCLE_SCRIPTS = ['preinstall', 'install', 'postinstall', 'prepare']
+LOCAL_NPM_PREFIXES = ('file:', 'link:', 'workspace:', 'portal:')
+
+OutputCallback = Optional[Callable[[str], Awaitable[None]]]
+
+
+def directory_size(path: Path) -> int:
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                st = os.lstat(os.path.join(root, name))
+                total += st.st_size
+            except OSError:
+                pass
+    return total
+
+
+_reflink_supported: Optional[bool] = None
+
+
+def clone_file(src: Path, dst: Path) -> None:
+    """Copy src to dst as a separate inode, by reflink where the filesystem supports it"""
+    global _reflink_supported
+    if _reflink_supported is not False:
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            shutil.copystat(src, dst)
+            _reflink_supported = True
+            return
+        except OSError as e:
+            if e.errno not in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS):
+                raise
+            _reflink_supported = False
+    shutil.copy2(src, dst)
+
+
+def clone_tree(src: Path, dst: Path) -> int:
+    """Recreate src at dst with cloned files and copied symlinks; returns files cloned"""
+    cloned = 0
+    src, dst = Path(src), Path(dst)
+    for root, dirs, files in os.walk(src):
+        rel_root = Path(root).relative_to(src)
+        target_root = dst / rel_root
+        target_root.mkdir(parents=True, exist_ok=True)
+        for name in dirs + files:
+            source = Path(root) / name
+            target = target_root / name
+            if source.is_symlink():
+                if not os.path.lexists(target):
+                    os.symlink(os.readlink(source), target)
+                if name in dirs:
+                    dirs.remove(name)  # Do not descend through symlinked directories
+                continue
+            if name in files:
+                if os.path.lexists(target):
+                    os.unlink(target)
+                clone_file(source, target)
+                cloned += 1
+    return cloned
+
+
+class DependencyCache:
+    """Install each distinct dependency set once and link it into workspaces"""
+
+    def __init__(self, root: Path, max_bytes: int = 8 * 1024 ** 3, go_max_bytes: int = 4 * 1024 ** 3,
+                 timeout: int = 300):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.go_max_bytes = go_max_bytes
+        self.timeout = timeout
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.go_mod_cache = self.root / "go" / "mod"
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._tool_versions: Dict[str, str] = {}
+        self.hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+        self.evictions = 0
+        self.bytes_evicted = 0
+
+    # ---------- planning ----------
+
+    def _tool_version(self, tool: str) -> str:
+        if tool not in self._tool_versions:
+            if tool == "python":
+                version = f"{sys.version_info.major}.{sys.version_info.minor}"
+            else:
+                try:
+                    args = [tool, "version"] if tool == "go" else [tool, "--version"]
+                    version = subprocess.run(args, capture_output=True, text=True, timeout=10).stdout.strip()
+                except (OSError, subprocess.TimeoutExpired):
+                    version = "unknown"
+            self._tool_versions[tool] = version
+        return self._tool_versions[tool]
+
+    @staticmethod
+    def _npm_cacheable(package: Dict[str, Any]) -> bool:
+        if package.get("workspaces"):
+            return False
+        for field in ("dependencies", "devDependencies", "optionalDependencies"):
+            for spec in (package.get(field) or {}).values():
+                if isinstance(spec, str) and spec.startswith(LOCAL_NPM_PREFIXES):
+                    return False
+        return True
+
+    @staticmethod
+    def _pip_cacheable(requirements: str) -> bool:
+        for line in requirements.splitlines():
+            line = line.strip()
+            if line.startswith(('-e', '--editable', '-r', '--requirement', '-c', '--constraint', '.', '/', 'file:')):
+                return False
+        return True
+
+    def plan(self, workspace_path: Path) -> Optional[Dict[str, Any]]:
+        """Detect the package manager and the files that define the dependency set"""
+        workspace_path = Path(workspace_path)
+        if (workspace_path / 'package.json').exists():
+            if (workspace_path / 'yarn.lock').exists():
+                manager, command = "yarn", "yarn install"
+            elif (workspace_path / 'pnpm-lock.yaml').exists():
+                manager, command = "pnpm", "pnpm install"
+            elif (workspace_path / 'package-lock.json').exists():
+                manager, command = "npm", "npm ci"
+            else:
+                manager, command = "npm", "npm install"
+            try:
+                package = json.loads((workspace_path / 'package.json').read_text())
+            except (OSError, ValueError):
+                package = {}
+            files = ['package.json'] + [f for f in NPM_LOCKFILES + ['.npmrc'] if (workspace_path / f).exists()]
+            return {"ecosystem": "node", "manager": manager, "command": command, "files": files,
+                    "tool": "node", "package": package, "cacheable": self._npm_cacheable(package)}
+        if (workspace_path / 'requirements.txt').exists():
+            try:
+                requirements = (workspace_path / 'requirements.txt').read_text()
+            except OSError:
+                requirements = ""
+            return {"ecosystem": "python", "manager": "pip", "command": "pip install -r requirements.txt",
+                    "files": ['requirements.txt'], "tool": "python",
+                    "cacheable": self._pip_cacheable(requirements)}
+        if (workspace_path / 'go.mod').exists():
+            files = ['go.mod'] + (['go.sum'] if (workspace_path / 'go.sum').exists() else [])
+            return {"ecosystem": "go", "manager": "go", "command": "go mod download", "files": files,
+                    "tool": "go", "cacheable": True}
+        return None
+
+    def cache_key(self, workspace_path: Path, plan: Dict[str, Any]) -> str:
+        digest = hashlib.sha256()
+        digest.update(f"{plan['manager']}\0{self._tool_version(plan['tool'])}\0".encode())
+        for name in sorted(plan["files"]):
+            digest.update(name.encode() + b'\0')
+            digest.update((Path(workspace_path) / name).read_bytes() + b'\0')
+        return digest.hexdigest()[:32]
+
+    # ---------- store entries ----------
+
+    def _entry_dir(self, ecosystem: str, key: str) -> Path:
+        return self.root / ecosystem / key
+
+    def _read_meta(self, entry: Path) -> Optional[Dict[str, Any]]:
+        try:
+            return json.loads((entry / "meta.json").read_text())
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, entry: Path, meta: Dict[str, Any]) -> None:
+        tmp = entry / f".meta.{uuid.uuid4().hex}.tmp"
+        tmp.write_text(json.dumps(meta))
+        os.replace(tmp, entry / "meta.json")
+
+    def _touch(self, entry: Path, workspace_path: Path) -> None:
+        meta = self._read_meta(entry) or {}
+        meta["last_used"] = time.time()
+        workspaces = set(meta.get("workspaces", []))
+        workspaces.add(str(workspace_path))
+        meta["workspaces"] = sorted(workspaces)
+        self._write_meta(entry, meta)
+
+    def _lock(self, key: str) -> asyncio.Lock:
+        if key not in self._locks:
+            self._locks[key] = asyncio.Lock()
+        return self._locks[key]
+
+    # ---------- running ----------
+
+    async def _run(self, command: str, cwd: Path, env: Dict[str, str], on_output: OutputCallback) -> tuple:
+        """Run a shell command, streaming merged output lines; returns (returncode, output)
+
+        The command gets its own process group so a timeout also kills the
+        npm/pip processes the shell started.
+        """
+        process = await asyncio.create_subprocess_shell(
+            command, cwd=str(cwd), env=env,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+            start_new_session=True
+        )
+        lines: List[str] = []
+
+        async def pump():
+            async for raw in process.stdout:
+                line = raw.decode(errors='replace').rstrip('\n')
+                lines.append(line)
+                if on_output:
+                    await on_output(line)
+
+        try:
+            await asyncio.wait_for(asyncio.gather(pump(), process.wait()), timeout=self.timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            await process.wait()
+            raise
+        return process.returncode, "\n".join(lines)
+
+    def base_env(self) -> Dict[str, str]:
+        return {**os.environ, "GOMODCACHE": str(self.go_mod_cache), "GOFLAGS": "-modcacherw"}
+
+    def project_env(self, workspace_path: Path) -> Dict[str, str]:
+        """Environment for running project commands against its installed dependencies"""
+        env = self.base_env()
+        venv = Path(workspace_path) / ".venv"
+        if (venv / "bin" / "python").exists():
+            env["VIRTUAL_ENV"] = str(venv)
+            env["PATH"] = f"{venv / 'bin'}{os.pathsep}{env.get('PATH', '')}"
+        return env
+
+    # ---------- per-ecosystem install/link ----------
+
+    async def _build_node(self, workspace_path: Path, plan: Dict[str, Any], entry: Path,
+                          on_output: OutputCallback) -> tuple:
+        staging = entry.with_name(f".{entry.name}.{uuid.uuid4().hex[:8]}.staging")
+        staging.mkdir(parents=True)
+        try:
+            # Root lifecycle scripts run here as part of the install, so whatever they do
+            # to node_modules is in the entry before it is published
+            for name in plan["files"]:
+                shutil.copy2(Path(workspace_path) / name, staging / name)
+            code, output = await self._run(plan["command"], staging, self.base_env(), on_output)
+            if code == 0:
+                (staging / "node_modules").mkdir(exist_ok=True)
+                os.replace(staging, entry)
+            return code, output
+        finally:
+            if staging.exists():
+                shutil.rmtree(staging, ignore_errors=True)
+
+    async def _link_node(self, workspace_path: Path, plan: Dict[str, Any], entry: Path,
+                         on_output: OutputCallback) -> tuple:
+        target = Path(workspace_path) / "node_modules"
+        if target.exists():
+            await asyncio.to_thread(shutil.rmtree, target, True)
+        cloned = await asyncio.to_thread(clone_tree, entry / "node_modules", target)
+        return 0, f"Cloned {cloned} files from dependency cache"
+
+    async def _build_python(self, workspace_path: Path, plan: Dict[str, Any], entry: Path,
+                            on_output: OutputCallback) -> tuple:
+        # Virtualenvs are not relocatable, so this one is built in place; meta.json marks it complete
+        entry.mkdir(parents=True)
+        shutil.copy2(Path(workspace_path) / "requirements.txt", entry / "requirements.txt")
+        code, output = await self._run(f'"{sys.executable}" -m venv venv', entry, self.base_env(), on_output)
+        if code == 0:
+            pip_code, pip_output = await self._run(
+                "venv/bin/python -m pip install --disable-pip-version-check -r requirements.txt",
+                entry, self.base_env(), on_output
+            )
+            code, output = pip_code, output + "\n" + pip_output
+        if code != 0:
+            shutil.rmtree(entry, ignore_errors=True)
+        return code, output
+
+    def _link_python_sync(self, workspace_path: Path, entry: Path) -> str:
+        venv = Path(workspace_path) / ".venv"
+        if venv.exists():
+            shutil.rmtree(venv)
+        subprocess.run([sys.executable, "-m", "venv", "--without-pip", str(venv)],
+                       check=True, capture_output=True, timeout=60)
+        shared_site = next((entry / "venv" / "lib").glob("python*/site-packages"))
+        own_site = next((venv / "lib").glob("python*/site-packages"))
+        (own_site / "_shared_dependencies.pth").write_text(str(shared_site) + "\n")
+
+        # Console scripts (pytest, uvicorn, ...) re-pointed at the workspace interpreter
+        shared_python = str(entry / "venv" / "bin" / "python")
+        own_python = str(venv / "bin" / "python")
+        scripts = 0
+        for script in (entry / "venv" / "bin").iterdir():
+            target = venv / "bin" / script.name
+            if target.exists() or script.is_symlink() or not script.is_file():
+                continue
+            try:
+                text = script.read_text()
+            except (OSError, UnicodeDecodeError):
+                continue
+            first, _, rest = text.partition("\n")
+            if first.startswith("#!") and "python" in first:
+                target.write_text(first.replace(shared_python, own_python) + "\n" + rest)
+                target.chmod(0o755)
+                scripts += 1
+        return f"Linked shared environment {entry.name} ({scripts} scripts)"
+
+    async def _link_python(self, workspace_path: Path, plan: Dict[str, Any], entry: Path,
+                           on_output: OutputCallback) -> tuple:
+        return 0, await asyncio.to_thread(self._link_python_sync, workspace_path, entry)
+
+    async def _build_go(self, workspace_path: Path, plan: Dict[str, Any], entry: Path,
+                        on_output: OutputCallback) -> tuple:
+        code, output = await self._run(plan["command"], workspace_path, self.base_env(), on_output)
+        if code == 0:
+            entry.mkdir(parents=True, exist_ok=True)
+        return code, output
+
+    async def _link_go(self, workspace_path: Path, plan: Dict[str, Any], entry: Path,
+                       on_output: OutputCallback) -> tuple:
+        return 0, "Modules already present in shared GOMODCACHE"
+
+    async def _install_direct(self, workspace_path: Path, plan: Dict[str, Any], on_output: OutputCallback) -> tuple:
+        """Uncacheable sets: install straight into the workspace (python into its own .venv)"""
+        if plan["ecosystem"] == "python":
+            venv = Path(workspace_path) / ".venv"
+            code, output = await self._run(f'"{sys.executable}" -m venv .venv', workspace_path, self.base_env(), on_output)
+            if code != 0:
+                return code, output
+            command = f'"{venv / "bin" / "python"}" -m pip install --disable-pip-version-check -r requirements.txt'
+            return await self._run(command, workspace_path, self.base_env(), on_output)
+        return await self._run(plan["command"], workspace_path, self.base_env(), on_output)
+
+    @staticmethod
+    def _has_lifecycle_scripts(plan: Dict[str, Any]) -> bool:
+        scripts = (plan.get("package") or {}).get("scripts") or {}
+        return any(name in scripts for name in ROOT_LIFECYCLE_SCRIPTS)
+
+    # ---------- public API ----------
+
+    async def install(self, workspace_path: Path, on_output: OutputCallback = None) -> Dict[str, Any]:
+        """
+        Install a workspace's dependencies, reusing the shared store.
+        Returns {success, output, error, ecosystem, cache_hit, key, seconds}.
+        """
+        workspace_path = Path(workspace_path)
+        started = time.perf_counter()
+        plan = await asyncio.to_thread(self.plan, workspace_path)
+        if plan is None:
+            return {"success": False, "output": "", "error": "No package manager detected",
+                    "ecosystem": None, "cache_hit": False, "key": None, "seconds": 0.0}
+
+        build = getattr(self, f"_build_{plan['ecosystem']}")
+        link = getattr(self, f"_link_{plan['ecosystem']}")
+        result = {"ecosystem": plan["ecosystem"], "manager": plan["manager"], "cache_hit": False, "key": None}
+
+        try:
+            if not plan["cacheable"]:
+                self.uncacheable += 1
+                code, output = await self._install_direct(workspace_path, plan, on_output)
+            else:
+                key = await asyncio.to_thread(self.cache_key, workspace_path, plan)
+                entry = self._entry_dir(plan["ecosystem"], key)
+                result["key"] = key
+                async with self._lock(key):
+                    if (entry / "meta.json").exists():
+                        self.hits += 1
+                        result["cache_hit"] = True
+                        if on_output:
+                            await on_output(f"Dependency cache hit ({key})")
+                        code, output = 0, ""
+                    else:
+                        self.misses += 1
+                        if entry.exists() and plan["ecosystem"] != "go":
+                            # Left behind by an interrupted build
+                            await asyncio.to_thread(shutil.rmtree, entry, True)
+                        entry.parent.mkdir(parents=True, exist_ok=True)
+                        code, output = await build(workspace_path, plan, entry, on_output)
+                        if code == 0:
+                            size = await asyncio.to_thread(directory_size, entry)
+                            self._write_meta(entry, {
+                                "key": key, "ecosystem": plan["ecosystem"], "manager": plan["manager"],
+                                "size": size, "created_at": datetime.now(timezone.utc).isoformat(),
+                                "last_used": time.time(), "workspaces": []
+                            })
+                    if code == 0:
+                        link_code, link_output = await link(workspace_path, plan, entry, on_output)
+                        code, output = link_code, (output + "\n" + link_output).strip()
+                        await asyncio.to_thread(self._touch, entry, workspace_path)
+                if code != 0 and self._has_lifecycle_scripts(plan):
+                    # Most likely a script that needs the project's sources, which the staging build lacks
+                    self.uncacheable += 1
+                    if on_output:
+                        await on_output("Lifecycle scripts failed in the shared build; installing in place")
+                    result["key"] = None
+                    code, output = await self._install_direct(workspace_path, plan, on_output)
+                elif code == 0 and not result["cache_hit"]:
+                    await self.evict()
+        except asyncio.TimeoutError:
+            code, output = 124, "Installation timed out"
+        except Exception as e:
+            logger.error(f"Dependency install error: {e}")
+            code, output = 1, str(e)
+
+        result.update({
+            "success": code == 0,
+            "output": output if code == 0 else "",
+            "error": None if code == 0 else output,
+            "seconds": round(time.perf_counter() - started, 2)
+        })
+        return result
+
+    def entries(self) -> List[Dict[str, Any]]:
+        entries = []
+        for ecosystem in ("node", "python", "go"):
+            directory = self.root / ecosystem
+            if not directory.is_dir():
+                continue
+            for entry in directory.iterdir():
+                if entry.name.startswith(".") or entry.name == "mod":
+                    continue
+                meta = self._read_meta(entry)
+                if meta:
+                    entries.append({**meta, "path": str(entry)})
+        return entries
+
+    async def evict(self, max_bytes: Optional[int] = None) -> Dict[str, int]:
+        """Remove least recently used sets until the store fits in max_bytes"""
+        # Lock state is read here, on the loop; the walk and deletes run in a thread
+        busy = {key for key, lock in self._locks.items() if lock.locked()}
+        return await asyncio.to_thread(self._evict_sync, self.max_bytes if max_bytes is None else max_bytes, busy)
+
+    def _evict_sync(self, max_bytes: int, busy: Set[str]) -> Dict[str, int]:
+        entries = sorted(self.entries(), key=lambda e: e.get("last_used", 0))
+        total = sum(e.get("size", 0) for e in entries if e["ecosystem"] != "go")
+        removed = 0
+        freed = 0
+
+        # GOMODCACHE is shared by every go set, so it is budgeted and cleared as a whole
+        go_entries = [e for e in entries if e["ecosystem"] == "go"]
+        if self.go_mod_cache.exists() and not any(e["key"] in busy for e in go_entries):
+            go_bytes = directory_size(self.go_mod_cache)
+            if go_bytes > self.go_max_bytes:
+                for entry in go_entries:
+                    shutil.rmtree(entry["path"], ignore_errors=True)
+                shutil.rmtree(self.go_mod_cache, ignore_errors=True)
+                removed += len(go_entries)
+                freed += go_bytes
+
+        for entry in entries:
+            if total <= max_bytes:
+                break
+            if entry["ecosystem"] == "go" or entry["key"] in busy:
+                continue
+            # Python workspaces import straight from the shared venv
+            if entry["ecosystem"] == "python" and any(Path(w, ".venv").exists() for w in entry.get("workspaces", [])):
+                continue
+            shutil.rmtree(entry["path"], ignore_errors=True)
+            total -= entry.get("size", 0)
+            freed += entry.get("size", 0)
+            removed += 1
+        self.evictions += removed
+        self.bytes_evicted += freed
+        return {"entries_removed": removed, "bytes_freed": freed}
+
+    def stats(self) -> Dict[str, Any]:
+        entries = self.entries()
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(entries),
+            "bytes": sum(e.get("size", 0) for e in entries),
+            "max_bytes": self.max_bytes,
+            "go_mod_cache_bytes": directory_size(self.go_mod_cache) if self.go_mod_cache.exists() else 0,
+            "go_max_bytes": self.go_max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "uncacheable": self.uncacheable,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "bytes_evicted": self.bytes_evicted
+        }
@@ -0,0 +1,207 @@
+"""
+File Access
+Conditional, ranged and line-addressed reads of workspace files.
+
+Validators come from a single stat() call: the ETag combines inode, size and
+mtime, which changes on every atomic save (new inode) and on in-place edits.
+Each representation of a version (raw bytes, JSON body, a JSON line range)
+gets its own ETag, so a cache never revalidates one against another.
+Line ranges are served through a sparse line-offset index (one byte offset
+every LINE_INDEX_STRIDE lines) so reading lines 100000-100200 of a large
+log seeks close to the target instead of scanning from the start.
+"""
+
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from email.utils import formatdate
+from pathlib import Path
+from typing import Dict, List, Optional, Any, Iterator, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+BINARY_SNIFF_BYTES = 8192
+LINE_INDEX_STRIDE = 1024
+STREAM_CHUNK_SIZE = 64 * 1024
+MAX_LINE_INDEXES = 64
+
+# Bytes that never appear in text files (allowing \t \n \f \r and ESC)
+_TEXT_CONTROL = {7, 8, 9, 10, 12, 13, 27}
+_NON_TEXT_BYTES = bytes(b for b in range(32) if b not in _TEXT_CONTROL) + b'\x7f'
+
+
+def file_etag(st: os.stat_result, representation: str = "") -> str:
+    """ETag of the file's current version; representation ("json", "lines=1-50") tags non-raw bodies"""
+    version = f"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"
+    return f'"{version};{representation}"' if representation else f'"{version}"'
+
+
+def etag_version(etag: str) -> str:
+    """The file version an ETag of any representation refers to"""
+    bare = etag.strip()
+    bare = bare[2:] if bare.startswith('W/') else bare
+    return bare.strip('"').split(';', 1)[0]
+
+
+def last_modified(st: os.stat_result) -> str:
+    return formatdate(st.st_mtime, usegmt=True)
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """If-None-Match / If-Match comparison (weak comparison, '*' matches anything)"""
+    if not header:
+        return False
+    tags = [t.strip() for t in header.split(',')]
+    bare = etag[2:] if etag.startswith('W/') else etag
+    return '*' in tags or any((t[2:] if t.startswith('W/') else t) == bare for t in tags)
+
+
+def is_binary(path: Path) -> bool:
+    """Sniff the first block: NUL bytes or many control characters mean binary"""
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(BINARY_SNIFF_BYTES)
+    except OSError:
+        return False
+    if not head:
+        return False
+    if b'\0' in head:
+        return True
+    control = len(head) - len(head.translate(None, _NON_TEXT_BYTES))
+    return control / len(head) > 0.3
+
+
+def guess_media_type(path: Path, binary: bool) -> str:
+    media_type, _ = mimetypes.guess_type(path.name)
+    if media_type:
+        return media_type
+    return 'application/octet-stream' if binary else 'text/plain; charset=utf-8'
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single "bytes=start-end" range into inclusive offsets.
+    Returns None for no/unsupported (multi-range) headers, raises ValueError
+    when the range cannot be satisfied.
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    start_s, _, end_s = header[6:].strip().partition('-')
+    try:
+        if start_s == '':
+            length = int(end_s)
+            if length <= 0:
+                raise ValueError("Empty suffix range")
+            start, end = max(0, size - length), size - 1
+        else:
+            start = int(start_s)
+            end = int(end_s) if end_s else size - 1
+    except ValueError:
+        raise ValueError(f"Malformed range: {header}")
+    end = min(end, size - 1)
+    if start >= size or start > end:
+        raise ValueError(f"Range not satisfiable: {header}")
+    return start, end
+
+
+def parse_line_range(value: str) -> Tuple[int, Optional[int]]:
+    """'100-200' -> (100, 200); '100-' -> (100, None); '7' -> (7, 7). Lines are 1-based."""
+    start_s, sep, end_s = value.partition('-')
+    start = int(start_s) if start_s else 1
+    end = (int(end_s) if end_s else None) if sep else start
+    if start < 1 or (end is not None and end < start):
+        raise ValueError(f"Invalid line range: {value}")
+    return start, end
+
+
+def iter_file(path: Path, start: int = 0, end: Optional[int] = None,
+              chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """Yield bytes start..end (inclusive) of a file in chunks"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = None if end is None else end - start + 1
+        while remaining is None or remaining > 0:
+            chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+
+class LineIndexCache:
+    """Sparse line offset tables per (path, etag), LRU-bounded"""
+
+    def __init__(self, max_entries: int = MAX_LINE_INDEXES, stride: int = LINE_INDEX_STRIDE):
+        self.max_entries = max_entries
+        self.stride = stride
+        self._indexes: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()  # get() runs in to_thread workers
+
+    def _build(self, path: Path) -> Dict[str, Any]:
+        offsets = [0]  # offsets[k] = byte offset of line k * stride + 1
+        lines = 0
+        position = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                lines += 1
+                position += len(line)
+                if lines % self.stride == 0:
+                    offsets.append(position)
+        return {"offsets": offsets, "total_lines": lines}
+
+    def get(self, path: Path, etag: str) -> Dict[str, Any]:
+        key = (str(path), etag)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                self._indexes.move_to_end(key)
+                return index
+        index = self._build(path)  # Outside the lock; a concurrent duplicate build is harmless
+        with self._lock:
+            # Drop stale versions of the same file along with LRU overflow
+            for stale in [k for k in self._indexes if k[0] == key[0]]:
+                del self._indexes[stale]
+            self._indexes[key] = index
+            while len(self._indexes) > self.max_entries:
+                self._indexes.popitem(last=False)
+        return index
+
+    def read_lines(self, path: Path, etag: str, start: int, end: Optional[int],
+                   max_bytes: int) -> Dict[str, Any]:
+        """Lines start..end (1-based, inclusive), stopping early at max_bytes"""
+        index = self.get(path, etag)
+        total = index["total_lines"]
+        end = total if end is None else min(end, total)
+        block = min((start - 1) // self.stride, len(index["offsets"]) - 1)
+        line_no = block * self.stride
+        collected: List[bytes] = []
+        size = 0
+        truncated = False
+        with open(path, 'rb') as f:
+            f.seek(index["offsets"][block])
+            for line in f:
+                line_no += 1
+                if line_no < start:
+                    continue
+                if line_no > end:
+                    break
+                if size + len(line) > max_bytes:
+                    truncated = True
+                    end = line_no - 1
+                    break
+                collected.append(line)
+                size += len(line)
+        return {
+            "content": b''.join(collected).decode('utf-8', errors='replace'),
+            "start_line": start,
+            "end_line": max(end, start - 1),
+            "total_lines": total,
+            "truncated": truncated
+        }
+
+
+# Global line index cache
+line_indexes = LineIndexCache()
@@ -7,27 +7,304 @@ import asyncio
 import subprocess
 import json
 import os
+import signal
 import uuid
 import time
-import requests
+import hashlib
+import base64
+import fcntl
+import heapq
+import math
+import re
+import threading
+import httpx
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from typing import Dict, List, Optional, Any
 from pathlib import Path
+from urllib.parse import urlparse
 import html2text
 from bs4 import BeautifulSoup
+from vector_index import VectorIndex, embed
 from playwright.async_api import async_playwright, Browser, Page
 import logging
 
 logger = logging.getLogger(__name__)
 
+try:
+    import lxml
+    LXML_AVAILABLE = True
+except ImportError:
+    LXML_AVAILABLE = False
+    logger.info("lxml not installed; web fetch uses html.parser")
+
 # ============== BACKGROUND TASK MANAGER ==============
 
+PROCESS_BUFFER_BYTES = 256 * 1024  # Per stream, per session
+PROCESS_READ_CHUNK = 64 * 1024
+PROCESS_POLL_MAX_BYTES = 256 * 1024
+PROCESS_MAX_WAIT_MS = 30000  # Upper bound for a single long-poll
+PROCESS_LOG_DIR = Path("/tmp/moltbot_workspace/process_logs")
+PROCESS_LOG_ROTATE_BYTES = 8 * 1024 * 1024
+PROCESS_LOG_BACKUPS = 3  # Rotated segments kept per stream besides the current one
+PROCESS_KILL_GRACE = 2.0
+
+
+class OutputRing:
+    """
+    Fixed-size byte ring for one output stream.
+    
+    Offsets are absolute byte positions in the stream, so a reader's cursor
+    stays valid as old bytes are overwritten. With a log prefix every byte is
+    also appended to rotating segment files named after their start offset;
+    reads that fall behind the ring are served from the segments still on
+    disk instead of being dropped.
+    """
+    
+    def __init__(self, capacity: int = PROCESS_BUFFER_BYTES, log_prefix: Optional[Path] = None,
+                 rotate_bytes: int = PROCESS_LOG_ROTATE_BYTES, backups: int = PROCESS_LOG_BACKUPS):
+        self.capacity = capacity
+        self.buffer = bytearray(capacity)
+        self.end = 0  # Total bytes ever written
+        self.memory_start = 0  # Restored rings hold nothing in memory
+        self.log_prefix = log_prefix
+        self.rotate_bytes = rotate_bytes
+        self.backups = backups
+        self.segments: List[tuple] = []  # (start_offset, path), oldest first
+        self._log = None
+        self._log_size = 0
+    
+    @classmethod
+    def restore(cls, log_prefix: Path) -> "OutputRing":
+        """Read-only ring over a finished stream's log segments"""
+        ring = cls(capacity=1, log_prefix=log_prefix)
+        ring.segments = ring._discover()
+        if ring.segments:
+            start, path = ring.segments[-1]
+            try:
+                ring.end = start + path.stat().st_size
+            except OSError:
+                ring.end = start
+        ring.memory_start = ring.end
+        return ring
+    
+    def _discover(self) -> List[tuple]:
+        segments = []
+        for path in self.log_prefix.parent.glob(f"{self.log_prefix.name}.*.log"):
+            try:
+                segments.append((int(path.name[len(self.log_prefix.name) + 1:-4]), path))
+            except ValueError:
+                continue
+        return sorted(segments)
+    
+    @property
+    def start(self) -> int:
+        """Oldest offset still held in memory"""
+        return max(self.memory_start, self.end - self.capacity)
+    
+    def _rotate(self) -> None:
+        if self._log:
+            self._log.close()
+        path = Path(f"{self.log_prefix}.{self.end:012d}.log")
+        self._log = open(path, 'ab')
+        self._log_size = 0
+        self.segments.append((self.end, path))
+        while len(self.segments) > self.backups + 1:
+            _, oldest = self.segments.pop(0)
+            oldest.unlink(missing_ok=True)
+    
+    def write(self, data: bytes) -> None:
+        if self.log_prefix:
+            if self._log is None or self._log_size >= self.rotate_bytes:
+                self._rotate()
+            self._log.write(data)
+            self._log.flush()
+            self._log_size += len(data)
+        if len(data) >= self.capacity:
+            self.end += len(data) - self.capacity
+            data = data[-self.capacity:]
+        position = self.end % self.capacity
+        first = min(len(data), self.capacity - position)
+        self.buffer[position:position + first] = data[:first]
+        self.buffer[:len(data) - first] = data[first:]
+        self.end += len(data)
+    
+    def read(self, offset: int, max_bytes: int = PROCESS_POLL_MAX_BYTES) -> tuple:
+        """(data, next_offset, dropped_bytes) from offset; never blocks on the writer"""
+        offset = max(0, min(offset, self.end))
+        dropped = 0
+        if offset < self.start:
+            on_disk = [s for s in self.segments if s[0] <= offset] or self.segments[:1]
+            if on_disk:
+                segment_start, path = on_disk[-1]
+                if offset < segment_start:
+                    dropped = segment_start - offset  # Rotated away
+                    offset = segment_start
+                try:
+                    with open(path, 'rb') as f:
+                        f.seek(offset - segment_start)
+                        data = f.read(min(max_bytes, self.end - offset))
+                    if data:
+                        return data, offset + len(data), dropped
+                except OSError:
+                    pass
+            dropped += self.start - offset
+            offset = self.start
+        length = min(max_bytes, self.end - offset)
+        position = offset % self.capacity
+        first = min(length, self.capacity - position)
+        data = bytes(self.buffer[position:position + first]) + bytes(self.buffer[:length - first])
+        return data, offset + len(data), dropped
+    
+    def disk_bytes(self) -> int:
+        total = 0
+        for _, path in self.segments:
+            try:
+                total += path.stat().st_size
+            except OSError:
+                pass
+        return total
+    
+    def release(self) -> None:
+        """Drop the in-memory copy once the stream is finished and fully on disk"""
+        if self.segments:
+            self.memory_start = self.end
+            self.buffer = bytearray(1)
+            self.capacity = 1
+    
+    def close(self) -> None:
+        if self._log:
+            self._log.close()
+            self._log = None
+    
+    def delete(self) -> None:
+        self.close()
+        for _, path in self.segments:
+            path.unlink(missing_ok=True)
+        self.segments = []
+
+
+def complete_lines(data: bytes, final: bool, full: bool = False) -> bytes:
+    """Trim a chunk to whole lines
+    
+    A trailing partial line is held back until more output completes it.
+    It is only emitted when the chunk filled the read (`full`, trimmed to a
+    whole UTF-8 character) or the stream has ended (`final`).
+    """
+    if final or not data:
+        return data
+    newline = data.rfind(b'\n')
+    if newline >= 0:
+        return data[:newline + 1]
+    if not full:
+        return b''
+    # Step back over continuation bytes to the last character's lead byte
+    lead = len(data) - 1
+    while lead > 0 and len(data) - lead < 4 and (data[lead] & 0xC0) == 0x80:
+        lead -= 1
+    first = data[lead]
+    width = 4 if first >= 0xF0 else 3 if first >= 0xE0 else 2 if first >= 0xC0 else 1
+    return data if len(data) - lead >= width else data[:lead]
+
+
 class ProcessManager:
-    """Manage background exec sessions (like Moltbot's process tool)"""
+    """Manage background exec sessions (like Moltbot's process tool)
     
-    def __init__(self):
+    Session metadata is persisted to Mongo once start() is given a
+    collection, and output goes to rotating log files, so finished sessions
+    stay readable across restarts. A reaper enforces the retention policy
+    (max sessions, max age, max bytes on disk) against finished sessions.
+    """
+    
+    def __init__(
+        self,
+        buffer_bytes: int = PROCESS_BUFFER_BYTES,
+        log_dir: Optional[str] = None,
+        max_sessions: int = 200,
+        max_age: int = 24 * 3600,
+        max_bytes: int = 1024 ** 3,
+        reap_interval: int = 300
+    ):
         self.sessions: Dict[str, Dict[str, Any]] = {}
-        self.lock = asyncio.Lock()
+        self.lock = asyncio.Lock()  # Guards session creation and removal; output is read lock-free
+        self.buffer_bytes = buffer_bytes
+        self.log_dir = Path(log_dir) if log_dir else PROCESS_LOG_DIR
+        self.max_sessions = max_sessions
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.reap_interval = reap_interval
+        self.collection = None
+        self._reaper: Optional[asyncio.Task] = None
+        self.reaped = 0
+    
+    # ---------- persistence ----------
+    
+    @staticmethod
+    def _doc(session: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "id": session["id"],
+            "command": session["command"],
+            "workdir": session.get("workdir"),
+            "status": session["status"],
+            "pid": session["pid"],
+            "exit_code": session.get("exit_code"),
+            "error": session.get("error"),
+            "created_at": session["created_at"],
+            "finished_at": session.get("finished_at"),
+            "timeout": session["timeout"],
+            "stdout_bytes": session["stdout"].end,
+            "stderr_bytes": session["stderr"].end
+        }
+    
+    async def _save(self, session: Dict[str, Any]) -> None:
+        if self.collection is None:
+            return
+        try:
+            await self.collection.replace_one({"id": session["id"]}, self._doc(session), upsert=True)
+        except Exception as e:
+            logger.warning(f"Could not persist session {session['id']}: {e}")
+    
+    async def start(self, collection=None) -> None:
+        """Load persisted sessions and start the retention reaper"""
+        self.collection = collection
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        if collection is not None:
+            try:
+                async for doc in collection.find({}, {"_id": 0}):
+                    if doc["id"] in self.sessions:
+                        continue
+                    if doc["status"] == "running":
+                        # The process did not survive the restart
+                        doc["status"] = "lost"
+                        doc["finished_at"] = doc.get("finished_at") or datetime.now(timezone.utc).isoformat()
+                        await collection.update_one({"id": doc["id"]}, {"$set": {
+                            "status": "lost", "finished_at": doc["finished_at"]
+                        }})
+                    self.sessions[doc["id"]] = {
+                        **doc,
+                        "process": None,
+                        "stdout": OutputRing.restore(self.log_dir / f"{doc['id']}.stdout"),
+                        "stderr": OutputRing.restore(self.log_dir / f"{doc['id']}.stderr"),
+                        "seq": 0,
+                        "changed": asyncio.Condition(),
+                        "finished": True
+                    }
+            except Exception as e:
+                logger.warning(f"Could not load persisted sessions: {e}")
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap_loop())
+    
+    async def close(self) -> None:
+        if self._reaper and not self._reaper.done():
+            self._reaper.cancel()
+            await asyncio.gather(self._reaper, return_exceptions=True)
+        running = [s for s in self.sessions.values() if s["status"] == "running"]
+        for session in running:
+            await self._terminate(session, "killed")
+    
+    # ---------- sessions ----------
     
     async def create_session(
         self,
@@ -44,35 +321,43 @@ class ProcessManager:
         if env:
             process_env.update(env)
         
-        # Start process
+        # Start process in its own process group so kill reaches its children
         try:
             process = await asyncio.create_subprocess_shell(
                 command,
                 stdout=asyncio.subprocess.PIPE,
                 stderr=asyncio.subprocess.PIPE,
                 cwd=workdir or os.getcwd(),
-                env=process_env
+                env=process_env,
+                start_new_session=True
             )
             
+            self.log_dir.mkdir(parents=True, exist_ok=True)
             session = {
                 "id": session_id,
                 "command": command,
+                "workdir": workdir,
                 "status": "running",
                 "pid": process.pid,
                 "process": process,
-                "stdout_lines": [],
-                "stderr_lines": [],
+                "stdout": OutputRing(self.buffer_bytes, self.log_dir / f"{session_id}.stdout"),
+                "stderr": OutputRing(self.buffer_bytes, self.log_dir / f"{session_id}.stderr"),
                 "exit_code": None,
                 "created_at": datetime.now(timezone.utc).isoformat(),
-                "timeout": timeout
+                "finished_at": None,
+                "timeout": timeout,
+                "seq": 0,  # Bumped on every write and on exit; waiters watch it
+                "changed": asyncio.Condition(),
+                "finished": False
             }
             
             async with self.lock:
                 self.sessions[session_id] = session
+            await self._save(session)
             
             # Start output collectors
-            asyncio.create_task(self._collect_output(session_id))
-            asyncio.create_task(self._enforce_timeout(session_id, timeout))
+            session["collector"] = asyncio.create_task(self._collect_output(session))
+            session["timer"] = asyncio.create_task(self._enforce_timeout(session, timeout))
             
             return {
                 "session_id": session_id,
@@ -88,101 +373,216 @@ class ProcessManager:
                 "error": str(e)
             }
     
-    async def _collect_output(self, session_id: str):
-        """Collect stdout/stderr from process"""
-        async with self.lock:
-            session = self.sessions.get(session_id)
-        
-        if not session:
-            return
-        
+    @staticmethod
+    async def _notify(session: Dict[str, Any]):
+        session["seq"] += 1
+        async with session["changed"]:
+            session["changed"].notify_all()
+    
+    async def _drain(self, session: Dict[str, Any], stream: asyncio.StreamReader, ring: OutputRing):
+        while True:
+            chunk = await stream.read(PROCESS_READ_CHUNK)
+            if not chunk:
+                break
+            ring.write(chunk)
+            await self._notify(session)
+    
+    @staticmethod
+    async def _wait_for_change(session: Dict[str, Any], seen: int, timeout: float) -> bool:
+        """Block until the session changes after `seen` or the timeout passes"""
+        if session["seq"] != seen:
+            return True
+        try:
+            async with session["changed"]:
+                await asyncio.wait_for(session["changed"].wait_for(lambda: session["seq"] != seen), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+    
+    async def _collect_output(self, session: Dict[str, Any]):
+        """Drain stdout and stderr concurrently so neither pipe can fill and block the process"""
         process = session["process"]
         
         try:
-            # Collect stdout
-            if process.stdout:
-                async for line in process.stdout:
-                    decoded = line.decode('utf-8', errors='replace').rstrip()
-                    async with self.lock:
-                        if session_id in self.sessions:
-                            self.sessions[session_id]["stdout_lines"].append(decoded)
-            
-            # Wait for process to complete
+            await asyncio.gather(
+                self._drain(session, process.stdout, session["stdout"]),
+                self._drain(session, process.stderr, session["stderr"])
+            )
             exit_code = await process.wait()
             
-            # Collect stderr
-            if process.stderr:
-                stderr_data = await process.stderr.read()
-                decoded_stderr = stderr_data.decode('utf-8', errors='replace')
-                async with self.lock:
-                    if session_id in self.sessions:
-                        self.sessions[session_id]["stderr_lines"].extend(decoded_stderr.splitlines())
-            
-            async with self.lock:
-                if session_id in self.sessions:
-                    self.sessions[session_id]["status"] = "completed"
-                    self.sessions[session_id]["exit_code"] = exit_code
+            if session["status"] == "running":
+                session["status"] = "completed"
+            session["exit_code"] = exit_code
                     
         except Exception as e:
-            logger.error(f"Error collecting output for {session_id}: {e}")
-            async with self.lock:
-                if session_id in self.sessions:
-                    self.sessions[session_id]["status"] = "error"
-                    self.sessions[session_id]["error"] = str(e)
+            logger.error(f"Error collecting output for {session['id']}: {e}")
+            session["status"] = "error"
+            session["error"] = str(e)
+        finally:
+            session["stdout"].close()
+            session["stderr"].close()
+            timer = session.get("timer")
+            if timer and not timer.done():
+                timer.cancel()
+            session["finished_at"] = datetime.now(timezone.utc).isoformat()
+            session["process"] = None
+            session["finished"] = True
+            await self._notify(session)
+            await self._save(session)
     
-    async def _enforce_timeout(self, session_id: str, timeout: int):
+    async def _terminate(self, session: Dict[str, Any], status: str) -> bool:
+        """SIGTERM the session's process group, then SIGKILL whatever is left; False if it had already exited"""
+        process = session["process"]
+        if process is None:
+            return False
+        # start_new_session made the shell a group leader, so the group id is its
+        # pid, and it stays valid after the shell exits while children remain
+        pgid = process.pid
+        try:
+            os.killpg(pgid, 0)
+        except ProcessLookupError:
+            return False  # Keep the status the output collector records on exit
+        session["status"] = status
+        try:
+            os.killpg(pgid, signal.SIGTERM)
+            try:
+                await asyncio.wait_for(process.wait(), PROCESS_KILL_GRACE)
+            except asyncio.TimeoutError:
+                pass
+            # Children may outlive the shell; make sure the whole group is gone
+            os.killpg(pgid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        await self._save(session)
+        return True
+    
+    async def _enforce_timeout(self, session: Dict[str, Any], timeout: int):
         """Kill process after timeout"""
         await asyncio.sleep(timeout)
         
-        async with self.lock:
-            session = self.sessions.get(session_id)
-        
-        if session and session["status"] == "running":
+        if session["status"] == "running":
             try:
-                process = session["process"]
-                process.kill()
-                async with self.lock:
-                    if session_id in self.sessions:
-                        self.sessions[session_id]["status"] = "timeout"
-                logger.info(f"Killed session {session_id} after {timeout}s timeout")
+                if await self._terminate(session, "timeout"):
+                    logger.info(f"Killed session {session['id']} after {timeout}s timeout")
             except Exception as e:
-                logger.error(f"Error killing session {session_id}: {e}")
+                logger.error(f"Error killing session {session['id']}: {e}")
     
-    async def poll(self, session_id: str, offset: int = 0) -> Dict[str, Any]:
-        """Poll session for new output"""
-        async with self.lock:
-            session = self.sessions.get(session_id)
+    def _read(self, session: Dict[str, Any], stream: str, offset: int, max_bytes: int) -> Dict[str, Any]:
+        ring: OutputRing = session[stream]
+        final = session["finished"]
+        data, next_offset, dropped = ring.read(offset, max_bytes)
+        # A read that stopped short of the written end (max_bytes or a log
+        # segment boundary) must make progress even without a newline
+        whole = complete_lines(data, final, full=len(data) >= max_bytes or next_offset < ring.end)
+        return {
+            "text": whole.decode('utf-8', errors='replace'),
+            "offset": next_offset - (len(data) - len(whole)),
+            "dropped": dropped
+        }
+    
+    async def poll(self, session_id: str, offset: int = 0, stderr_offset: int = 0,
+                   max_bytes: int = PROCESS_POLL_MAX_BYTES, wait_ms: int = 0) -> Dict[str, Any]:
+        """Poll session for new output
+        
+        offset/stderr_offset are byte cursors returned by the previous poll.
+        Output that has rotated out of the logs is reported as dropped bytes.
+        With wait_ms the call long-polls: it returns as soon as there is new
+        output or the process exits, or empty-handed once wait_ms has passed.
+        """
+        session = self.sessions.get(session_id)
         
         if not session:
             return {"error": "Session not found"}
         
-        stdout_lines = session["stdout_lines"][offset:]
+        max_bytes = max(4, min(max_bytes, PROCESS_POLL_MAX_BYTES))  # Room for one UTF-8 character
+        deadline = time.monotonic() + min(max(wait_ms, 0), PROCESS_MAX_WAIT_MS) / 1000
+        while True:
+            seen = session["seq"]
+            finished = session["finished"]
+            stdout = self._read(session, "stdout", offset, max_bytes)
+            stderr = self._read(session, "stderr", stderr_offset, max_bytes)
+            if stdout["text"] or stderr["text"] or finished:
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not await self._wait_for_change(session, seen, remaining):
+                break
         
         return {
             "session_id": session_id,
             "status": session["status"],
             "pid": session["pid"],
             "exit_code": session.get("exit_code"),
-            "new_stdout": stdout_lines,
-            "total_lines": len(session["stdout_lines"]),
-            "offset": offset + len(stdout_lines)
+            "new_stdout": stdout["text"].splitlines(),
+            "new_stderr": stderr["text"].splitlines(),
+            "offset": stdout["offset"],
+            "stderr_offset": stderr["offset"],
+            "stdout_bytes": session["stdout"].end,
+            "stderr_bytes": session["stderr"].end,
+            "dropped_bytes": stdout["dropped"] + stderr["dropped"]
         }
     
-    async def list_sessions(self) -> List[Dict[str, Any]]:
-        """List all sessions"""
-        async with self.lock:
-            return [{
-                "id": sid,
+    async def tail(self, session_id: str, offset: int = 0, stderr_offset: int = 0):
+        """
+        Follow a session: yields {"event": "stdout"|"stderr", "data", "offset"}
+        as output arrives, {"event": "dropped"} when the cursor fell behind the
+        ring, and a final {"event": "exit"} with the status and exit code.
+        Any number of subscribers can tail one session; each only holds its
+        own cursors.
+        """
+        session = self.sessions.get(session_id)
+        if not session:
+            yield {"event": "error", "error": "Session not found"}
+            return
+        
+        cursors = {"stdout": offset, "stderr": stderr_offset}
+        while True:
+            seen = session["seq"]
+            finished = session["finished"]
+            emitted = False
+            for stream in ("stdout", "stderr"):
+                chunk = self._read(session, stream, cursors[stream], PROCESS_POLL_MAX_BYTES)
+                if chunk["dropped"]:
+                    yield {"event": "dropped", "stream": stream, "bytes": chunk["dropped"]}
+                if chunk["text"]:
+                    yield {"event": stream, "data": chunk["text"], "offset": chunk["offset"]}
+                    emitted = True
+                cursors[stream] = chunk["offset"]
+            if finished and not emitted:
+                yield {
+                    "event": "exit",
+                    "status": session["status"],
+                    "exit_code": session.get("exit_code"),
+                    "offset": cursors["stdout"],
+                    "stderr_offset": cursors["stderr"]
+                }
+                return
+            if not emitted:
+                await self._wait_for_change(session, seen, PROCESS_MAX_WAIT_MS / 1000)
+    
+    async def list_sessions(self, status: Optional[str] = None, offset: int = 0, limit: int = 50) -> Dict[str, Any]:
+        """List sessions, newest first, optionally filtered by status"""
+        matching = [s for s in list(self.sessions.values()) if status is None or s["status"] == status]
+        matching.sort(key=lambda s: s["created_at"], reverse=True)
+        page = matching[offset:offset + limit]
+        return {
+            "sessions": [{
+                "id": s["id"],
                 "command": s["command"][:50] + "..." if len(s["command"]) > 50 else s["command"],
                 "status": s["status"],
                 "pid": s["pid"],
-                "created_at": s["created_at"]
-            } for sid, s in self.sessions.items()]
+                "exit_code": s.get("exit_code"),
+                "created_at": s["created_at"],
+                "finished_at": s.get("finished_at"),
+                "output_bytes": s["stdout"].end + s["stderr"].end
+            } for s in page],
+            "total": len(matching),
+            "offset": offset,
+            "limit": limit
+        }
     
     async def kill(self, session_id: str) -> Dict[str, Any]:
-        """Kill a running session"""
-        async with self.lock:
-            session = self.sessions.get(session_id)
+        """Kill a running session and every process in its group"""
+        session = self.sessions.get(session_id)
         
         if not session:
             return {"error": "Session not found"}
@@ -191,28 +591,221 @@ class ProcessManager:
             return {"error": f"Session is {session['status']}, cannot kill"}
         
         try:
-            process = session["process"]
-            process.kill()
-            async with self.lock:
-                self.sessions[session_id]["status"] = "killed"
+            if not await self._terminate(session, "killed"):
+                return {"error": "Session already exited"}
             return {"success": True, "session_id": session_id}
         except Exception as e:
             return {"error": str(e)}
+    
+    # ---------- retention ----------
+    
+    async def _remove(self, session: Dict[str, Any]) -> None:
+        async with self.lock:
+            self.sessions.pop(session["id"], None)
+        session["stdout"].delete()
+        session["stderr"].delete()
+        if self.collection is not None:
+            try:
+                await self.collection.delete_one({"id": session["id"]})
+            except Exception as e:
+                logger.warning(f"Could not delete session {session['id']}: {e}")
+        self.reaped += 1
+    
+    async def reap(self) -> Dict[str, Any]:
+        """Apply the retention policy to finished sessions (running ones are never reaped)"""
+        now = datetime.now(timezone.utc)
+        finished = sorted(
+            (s for s in list(self.sessions.values()) if s["finished"]),
+            key=lambda s: s.get("finished_at") or s["created_at"]
+        )
+        for session in finished:
+            session["stdout"].release()
+            session["stderr"].release()
+        
+        doomed = set()
+        for session in finished:
+            ended = datetime.fromisoformat(session.get("finished_at") or session["created_at"])
+            if (now - ended).total_seconds() > self.max_age:
+                doomed.add(session["id"])
+        
+        kept = [s for s in finished if s["id"] not in doomed]
+        excess = len(self.sessions) - len(doomed) - self.max_sessions
+        for session in kept[:max(0, excess)]:
+            doomed.add(session["id"])
+        
+        kept = [s for s in finished if s["id"] not in doomed]
+        sizes = {s["id"]: s["stdout"].disk_bytes() + s["stderr"].disk_bytes() for s in self.sessions.values()}
+        total = sum(size for sid, size in sizes.items() if sid not in doomed)
+        for session in kept:
+            if total <= self.max_bytes:
+                break
+            doomed.add(session["id"])
+            total -= sizes[session["id"]]
+        
+        freed = sum(sizes.get(sid, 0) for sid in doomed)
+        for session in finished:
+            if session["id"] in doomed:
+                await self._remove(session)
+        return {"removed": len(doomed), "bytes_freed": freed, "sessions": len(self.sessions), "bytes": total}
+    
+    async def _reap_loop(self):
+        while True:
+            await asyncio.sleep(self.reap_interval)
+            try:
+                await self.reap()
+            except Exception as e:
+                logger.error(f"Process session reaper error: {e}")
 
 # Global process manager
 process_manager = ProcessManager()
 
 
+# ============== SHARED HTTP CLIENT ==============
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Process-wide keep-alive connection pool for outbound tool requests"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0, connect=10.0),
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=60),
+            follow_redirects=True
+        )
+    return _http_client
+
+
+async def close_http_client() -> None:
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+class TTLCache:
+    """Size-bounded LRU cache whose entries also expire after ttl seconds
+    
+    With a persist path the live entries are written to a JSON file by
+    flush() and reloaded on construction.
+    """
+    
+    def __init__(self, max_entries: int = 512, ttl: float = 900, persist_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.persist_path = Path(persist_path) if persist_path else None
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (value, stored_at)
+        self.hits = 0
+        self.misses = 0
+        self._dirty = False
+        if self.persist_path and self.persist_path.exists():
+            try:
+                for key, value, stored_at in json.loads(self.persist_path.read_text()):
+                    if time.time() - stored_at < self.ttl:
+                        self.entries[key] = (value, stored_at)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable cache file {self.persist_path}: {e}")
+    
+    def get(self, key: str) -> Optional[Any]:
+        item = self.entries.get(key)
+        if item is None or time.time() - item[1] >= self.ttl:
+            if item is not None:
+                del self.entries[key]
+                self._dirty = True
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return item[0]
+    
+    def put(self, key: str, value: Any) -> None:
+        self.entries[key] = (value, time.time())
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self._dirty = True
+    
+    def expire(self) -> int:
+        now = time.time()
+        stale = [k for k, (_, stored_at) in self.entries.items() if now - stored_at >= self.ttl]
+        for key in stale:
+            del self.entries[key]
+        self._dirty = self._dirty or bool(stale)
+        return len(stale)
+    
+    def _write(self, items: List[list]) -> None:
+        self.persist_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.persist_path.with_suffix(f".{uuid.uuid4().hex[:8]}.tmp")
+        tmp.write_text(json.dumps(items))
+        os.replace(tmp, self.persist_path)
+    
+    async def flush(self) -> None:
+        if not self.persist_path or not self._dirty:
+            return
+        self.expire()
+        self._dirty = False
+        items = [[k, v, t] for k, (v, t) in self.entries.items()]
+        try:
+            await asyncio.to_thread(self._write, items)
+        except OSError as e:
+            logger.warning(f"Could not persist cache to {self.persist_path}: {e}")
+    
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {"entries": len(self.entries), "max_entries": self.max_entries, "ttl": self.ttl,
+                "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0}
+
+
+class RateLimiter:
+    """Token bucket: at most `rate` calls per second with bursts up to `burst`"""
+    
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
 # ============== WEB SEARCH (BRAVE API) ==============
 
 class WebSearchTool:
-    """Web search using Brave API (Moltbot-compatible)"""
+    """Web search using Brave API (Moltbot-compatible)
+    
+    Requests go through the shared keep-alive client. Results are kept in a
+    bounded LRU+TTL cache and identical in-flight queries share one request.
+    base_url can point at a local stand-in (BRAVE_SEARCH_URL) for tests.
+    """
     
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        cache_size: int = 512,
+        cache_ttl: int = 900,  # 15 minutes
+        cache_path: Optional[str] = None,
+        rate_limit: float = 5.0,
+        max_concurrency: int = 4
+    ):
         self.api_key = api_key or os.getenv('BRAVE_API_KEY')
-        self.base_url = "https://api.search.brave.com/res/v1/web/search"
-        self.cache = {}
-        self.cache_ttl = 900  # 15 minutes
+        self.base_url = base_url or os.getenv('BRAVE_SEARCH_URL') or "https://api.search.brave.com/res/v1/web/search"
+        self.cache = TTLCache(cache_size, cache_ttl, cache_path)
+        self.rate_limiter = RateLimiter(rate_limit, burst=max(1, int(rate_limit)))
+        self.max_concurrency = max_concurrency
+        self._inflight: Dict[str, asyncio.Future] = {}
     
     async def search(
         self,
@@ -229,13 +822,39 @@ class WebSearchTool:
                 "setup_hint": "Set BRAVE_API_KEY environment variable or run: moltbot configure --section web"
             }
         
-        # Check cache
         cache_key = f"{query}:{count}:{country}:{search_lang}"
-        if cache_key in self.cache:
-            cached_data, cached_time = self.cache[cache_key]
-            if time.time() - cached_time < self.cache_ttl:
-                return cached_data
+        while True:
+            # Check cache
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+            
+            # Identical queries already in flight share the same request
+            pending = self._inflight.get(cache_key)
+            if pending is None:
+                break
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled() or asyncio.current_task().cancelling():
+                    raise  # This caller was cancelled, not the request
+                # The caller that issued the request went away; retry on our own
         
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[cache_key] = future
+        try:
+            result = await self._request(query, count, country, search_lang)
+            if "error" not in result:
+                self.cache.put(cache_key, result)
+                await self.cache.flush()
+            future.set_result(result)
+            return result
+        finally:
+            if not future.done():
+                future.cancel()  # Cancelled or failed: waiting callers retry
+            self._inflight.pop(cache_key, None)
+    
+    async def _request(self, query: str, count: int, country: Optional[str], search_lang: Optional[str]) -> Dict[str, Any]:
         # Make API request
         try:
             params = {
@@ -253,11 +872,11 @@ class WebSearchTool:
                 "X-Subscription-Token": self.api_key
             }
             
-            response = requests.get(
+            await self.rate_limiter.acquire()
+            response = await get_http_client().get(
                 self.base_url,
                 params=params,
-                headers=headers,
-                timeout=30
+                headers=headers
             )
             
             if response.status_code != 200:
@@ -278,108 +897,342 @@ class WebSearchTool:
                     "age": item.get("age", "")
                 })
             
-            result = {
+            return {
                 "query": query,
                 "results": results,
                 "total_count": len(results),
                 "provider": "brave"
             }
             
-            # Cache result
-            self.cache[cache_key] = (result, time.time())
-            
-            return result
-            
         except Exception as e:
             logger.error(f"Web search error: {e}")
             return {
                 "error": str(e),
                 "query": query
             }
+    
+    async def search_many(
+        self,
+        queries: List[str],
+        count: int = 5,
+        country: str = None,
+        search_lang: str = None
+    ) -> List[Dict[str, Any]]:
+        """Run several searches concurrently (bounded, and under the rate limit); results keep query order"""
+        slots = asyncio.Semaphore(self.max_concurrency)
+        
+        async def run(query: str) -> Dict[str, Any]:
+            async with slots:
+                return await self.search(query, count, country, search_lang)
+        
+        return await asyncio.gather(*[run(q) for q in queries])
+    
+    def stats(self) -> Dict[str, Any]:
+        return {"cache": self.cache.stats(), "inflight": len(self._inflight), "base_url": self.base_url}
 
 # Global web search instance
-web_search_tool = WebSearchTool()
+web_search_tool = WebSearchTool(cache_path=os.getenv('MOLTBOT_SEARCH_CACHE'))
 
 
 # ============== WEB FETCH ==============
 
+FETCH_MAX_BYTES = 2 * 1024 * 1024
+FETCH_CACHE_DIR = Path("/tmp/moltbot_workspace/fetch_cache")
+FETCH_CACHE_BYTES = 256 * 1024 * 1024  # Bodies on disk before least recently used pages go
+FETCH_TEXT_TYPES = ('text/html', 'application/xhtml+xml', 'text/plain', 'text/markdown',
+                    'application/json', 'application/xml', 'text/xml')
+BOILERPLATE_TAGS = ["script", "style", "noscript", "svg", "iframe", "nav", "header", "footer", "aside", "form"]
+
+
+def extract_main_content(soup, max_chars: int):
+    """
+    Readability-style pick of the main content element: <article>/<main>
+    when present, otherwise the block with the most paragraph text. Children
+    past roughly what max_chars needs are dropped before conversion.
+    """
+    for tag in soup(BOILERPLATE_TAGS):
+        tag.decompose()
+    
+    main = soup.find("article") or soup.find("main") or soup.find(attrs={"role": "main"})
+    if main is None:
+        scores: Dict[int, tuple] = {}
+        for paragraph in soup.find_all(["p", "pre", "li"]):
+            parent = paragraph.parent
+            if parent is None:
+                continue
+            length = len(paragraph.get_text(strip=True))
+            node, score = scores.get(id(parent), (parent, 0))
+            scores[id(parent)] = (node, score + length)
+        if scores:
+            main = max(scores.values(), key=lambda item: item[1])[0]
+    main = main or soup.body or soup
+    
+    budget = max_chars * 2  # Markdown adds syntax on top of the text
+    used = 0
+    for child in list(main.children):
+        if used > budget:
+            child.extract()
+            continue
+        used += len(child.get_text() if hasattr(child, "get_text") else str(child))
+    return main
+
+
 class WebFetchTool:
-    """Fetch and extract webpage content (Moltbot-compatible)"""
+    """Fetch and extract webpage content (Moltbot-compatible)
     
-    def __init__(self):
-        self.html_converter = html2text.HTML2Text()
-        self.html_converter.ignore_links = False
-        self.html_converter.ignore_images = False
-        self.cache = {}
-        self.cache_ttl = 900  # 15 minutes
+    Pages are streamed through the shared HTTP client with a byte cap and
+    a content-type allow-list. Raw bodies are cached on disk and revalidated
+    with ETag/Last-Modified once stale; if revalidation fails (network error
+    or 5xx) the stale copy is served. The disk cache is trimmed to
+    cache_max_bytes, least recently used first. Parsing, main-content
+    extraction and markdown conversion run in a thread pool.
+    """
+    
+    def __init__(
+        self,
+        cache_dir: Optional[str] = None,
+        cache_ttl: int = 900,  # 15 minutes before revalidating
+        max_bytes: int = FETCH_MAX_BYTES,
+        max_concurrency: int = 4,
+        parser_threads: int = 4,
+        cache_max_bytes: int = FETCH_CACHE_BYTES
+    ):
+        self.cache_dir = Path(cache_dir) if cache_dir else FETCH_CACHE_DIR
+        self.cache_ttl = cache_ttl
+        self.cache_max_bytes = cache_max_bytes
+        self.max_bytes = max_bytes
+        self.max_concurrency = max_concurrency
+        self.executor = ThreadPoolExecutor(max_workers=parser_threads, thread_name_prefix="web_fetch")
+        self.extracted = TTLCache(max_entries=256, ttl=24 * 3600)  # Keyed by body hash, so never stale
+        self.stats_counts = {"hits": 0, "revalidated": 0, "misses": 0, "stale": 0, "evicted": 0}
+        self._disk_bytes: Optional[int] = None  # Measured on first store
+        self._evict_lock = threading.Lock()
+    
+    # ---------- disk cache ----------
+    
+    def _paths(self, url: str) -> tuple:
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return self.cache_dir / f"{key}.json", self.cache_dir / f"{key}.body"
+    
+    def _load(self, url: str) -> Optional[Dict[str, Any]]:
+        meta_path, body_path = self._paths(url)
+        try:
+            meta = json.loads(meta_path.read_text())
+            meta["body"] = body_path.read_bytes()
+            os.utime(meta_path)  # Recency for eviction
+            return meta
+        except (OSError, ValueError):
+            return None
+    
+    def _store(self, url: str, meta: Dict[str, Any], body: Optional[bytes]) -> None:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        meta_path, body_path = self._paths(url)
+        if body is not None:
+            try:
+                previous = body_path.stat().st_size
+            except OSError:
+                previous = 0
+            tmp = body_path.with_suffix(f".{uuid.uuid4().hex[:8]}.tmp")
+            tmp.write_bytes(body)
+            os.replace(tmp, body_path)
+            if self._disk_bytes is not None:
+                self._disk_bytes += len(body) - previous
+        tmp = meta_path.with_suffix(f".{uuid.uuid4().hex[:8]}.tmp")
+        tmp.write_text(json.dumps(meta))
+        os.replace(tmp, meta_path)
+        if self._disk_bytes is None or self._disk_bytes > self.cache_max_bytes:
+            self._evict()
+    
+    def _evict(self) -> None:
+        """Measure the disk cache and drop least recently used pages down to 90% of cache_max_bytes"""
+        if not self._evict_lock.acquire(blocking=False):
+            return  # Another worker is already trimming
+        try:
+            pages = []
+            total = 0
+            for meta_path in self.cache_dir.glob("*.json"):
+                body_path = meta_path.with_suffix(".body")
+                try:
+                    size = body_path.stat().st_size if body_path.exists() else 0
+                    pages.append((meta_path.stat().st_mtime, meta_path, body_path, size))
+                except OSError:
+                    continue
+                total += size
+            if total > self.cache_max_bytes:
+                for _, meta_path, body_path, size in sorted(pages):
+                    if total <= self.cache_max_bytes * 0.9:
+                        break
+                    meta_path.unlink(missing_ok=True)
+                    body_path.unlink(missing_ok=True)
+                    total -= size
+                    self.stats_counts["evicted"] += 1
+            self._disk_bytes = total
+        finally:
+            self._evict_lock.release()
+    
+    # ---------- fetching ----------
+    
+    async def _download(self, url: str, cached: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Stream the body up to max_bytes; a 304 reuses the cached body"""
+        headers = {
+            "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 14_7_2) AppleWebKit/537.36"
+        }
+        if cached:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+        
+        async with get_http_client().stream("GET", url, headers=headers) as response:
+            if response.status_code == 304 and cached:
+                return {**cached, "fetched_at": time.time(), "cache": "revalidated"}
+            if response.status_code != 200:
+                return {"error": f"HTTP {response.status_code}", "status": response.status_code}
+            
+            content_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+            if content_type and not content_type.startswith(FETCH_TEXT_TYPES):
+                return {"error": f"Unsupported content type: {content_type}"}
+            
+            chunks = []
+            size = 0
+            truncated = False
+            async for chunk in response.aiter_bytes():
+                chunks.append(chunk)
+                size += len(chunk)
+                if size >= self.max_bytes:
+                    truncated = True
+                    break
+            return {
+                "body": b"".join(chunks)[:self.max_bytes],
+                "content_type": content_type or "text/html",
+                "encoding": response.charset_encoding,
+                "final_url": str(response.url),
+                "etag": response.headers.get("etag"),
+                "last_modified": response.headers.get("last-modified"),
+                "truncated": truncated,
+                "fetched_at": time.time(),
+                "cache": "miss"
+            }
+    
+    @staticmethod
+    def _extract(page: Dict[str, Any], extract_mode: str, max_chars: int, parser: str) -> Dict[str, Any]:
+        """CPU-bound part: parse, pick the main content, convert; runs in the thread pool"""
+        body = page["body"]
+        content_type = page["content_type"]
+        if content_type not in ("text/html", "application/xhtml+xml"):
+            text = body.decode(page.get("encoding") or "utf-8", errors="replace")
+            return {"content": text, "title": None}
+        
+        soup = BeautifulSoup(body, parser, from_encoding=page.get("encoding"))
+        title = soup.title.string.strip() if soup.title and soup.title.string else None
+        main = extract_main_content(soup, max_chars)
+        
+        # Extract based on mode
+        if extract_mode == "markdown":
+            converter = html2text.HTML2Text()  # Not thread-safe; one per call
+            converter.ignore_links = False
+            converter.ignore_images = False
+            converter.body_width = 0
+            content = converter.handle(str(main))
+        else:
+            content = main.get_text("\n")
+            # Clean up text
+            lines = (line.strip() for line in content.splitlines())
+            content = '\n'.join(line for line in lines if line)
+        return {"content": content.strip(), "title": title}
     
     async def fetch(
         self,
         url: str,
         extract_mode: str = "markdown",
-        max_chars: int = 50000
+        max_chars: int = 50000,
+        parser: str = "auto"
     ) -> Dict[str, Any]:
         """Fetch URL and extract readable content"""
-        
-        # Check cache
-        cache_key = f"{url}:{extract_mode}"
-        if cache_key in self.cache:
-            cached_data, cached_time = self.cache[cache_key]
-            if time.time() - cached_time < self.cache_ttl:
-                return cached_data
+        if parser == "auto":
+            parser = "lxml" if LXML_AVAILABLE else "html.parser"
+        elif parser == "lxml" and not LXML_AVAILABLE:
+            return {"error": "lxml is not installed", "url": url}
+        elif parser != "html.parser":
+            return {"error": f"Unknown parser: {parser}", "url": url}
         
         try:
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 14_7_2) AppleWebKit/537.36"
-            }
-            
-            response = requests.get(url, headers=headers, timeout=30, allow_redirects=True)
-            
-            if response.status_code != 200:
-                return {
-                    "error": f"HTTP {response.status_code}",
-                    "url": url
-                }
-            
-            # Parse HTML
-            soup = BeautifulSoup(response.content, 'html.parser')
-            
-            # Remove script and style elements
-            for script in soup(["script", "style"]):
-                script.decompose()
-            
-            # Extract based on mode
-            if extract_mode == "markdown":
-                content = self.html_converter.handle(str(soup))
+            loop = asyncio.get_running_loop()
+            cached = await loop.run_in_executor(self.executor, self._load, url)
+            if cached and time.time() - cached.get("fetched_at", 0) < self.cache_ttl:
+                page = {**cached, "cache": "hit"}
             else:
-                content = soup.get_text()
-                # Clean up text
-                lines = (line.strip() for line in content.splitlines())
-                content = '\n'.join(line for line in lines if line)
+                try:
+                    page = await self._download(url, cached)
+                except (httpx.HTTPError, OSError) as e:
+                    if not cached:
+                        raise
+                    logger.info(f"Revalidating {url} failed, serving the stale copy: {e}")
+                    page = {**cached, "cache": "stale"}
+                if "error" in page:
+                    if not (cached and page.get("status", 0) >= 500):
+                        return {"error": page["error"], "url": url}
+                    page = {**cached, "cache": "stale"}
+                if page["cache"] != "stale":
+                    body = page["body"] if page["cache"] == "miss" else None
+                    meta = {k: v for k, v in page.items() if k not in ("body", "cache")}
+                    await loop.run_in_executor(self.executor, self._store, url, meta, body)
+            self.stats_counts[{"hit": "hits", "revalidated": "revalidated", "miss": "misses",
+                               "stale": "stale"}[page["cache"]]] += 1
             
+            # Same body, mode and limits -> same extraction
+            extraction_key = f"{hashlib.sha256(page['body']).hexdigest()}:{extract_mode}:{max_chars}:{parser}"
+            extracted = self.extracted.get(extraction_key)
+            if extracted is None:
+                extracted = await loop.run_in_executor(
+                    self.executor, self._extract, page, extract_mode, max_chars, parser
+                )
+                self.extracted.put(extraction_key, extracted)
+            
+            content = extracted["content"]
             # Truncate if needed
             if len(content) > max_chars:
                 content = content[:max_chars] + "\n\n[Content truncated...]"
             
-            result = {
+            return {
                 "url": url,
+                "final_url": page.get("final_url", url),
                 "content": content,
                 "extract_mode": extract_mode,
                 "length": len(content),
-                "title": soup.title.string if soup.title else url
+                "title": extracted["title"] or url,
+                "content_type": page["content_type"],
+                "bytes": len(page["body"]),
+                "truncated": page.get("truncated", False),
+                "cache": page["cache"]
             }
             
-            # Cache result
-            self.cache[cache_key] = (result, time.time())
-            
-            return result
-            
         except Exception as e:
             logger.error(f"Web fetch error: {e}")
             return {
                 "error": str(e),
                 "url": url
             }
+    
+    async def fetch_many(
+        self,
+        urls: List[str],
+        extract_mode: str = "markdown",
+        max_chars: int = 50000,
+        parser: str = "auto"
+    ) -> List[Dict[str, Any]]:
+        """Fetch several URLs with bounded concurrency; results keep URL order"""
+        slots = asyncio.Semaphore(self.max_concurrency)
+        
+        async def run(url: str) -> Dict[str, Any]:
+            async with slots:
+                return await self.fetch(url, extract_mode, max_chars, parser)
+        
+        return await asyncio.gather(*[run(u) for u in urls])
+    
+    def stats(self) -> Dict[str, Any]:
+        return {**self.stats_counts, "disk_bytes": self._disk_bytes, "disk_max_bytes": self.cache_max_bytes,
+                "extracted": self.extracted.stats(), "parser": "lxml" if LXML_AVAILABLE else "html.parser"}
 
 # Global web fetch instance
 web_fetch_tool = WebFetchTool()
@@ -387,202 +1240,823 @@ web_fetch_tool = WebFetchTool()
 
 # ============== BROWSER CONTROL (PLAYWRIGHT) ==============
 
+BROWSER_LAUNCH_ARGS = [
+    '--no-sandbox',
+    '--disable-setuid-sandbox',
+    '--disable-dev-shm-usage',
+    '--disable-blink-features=AutomationControlled'
+]
+BROWSER_CONTEXT_OPTIONS = {
+    'viewport': {'width': 1920, 'height': 1080},
+    'user_agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+}
+
+WAIT_UNTIL = ("commit", "domcontentloaded", "load", "networkidle")
+BLOCKABLE_RESOURCE_TYPES = {
+    "stylesheet", "image", "media", "font", "script", "texttrack", "xhr", "fetch",
+    "eventsource", "websocket", "manifest", "other"
+}
+TRACKER_DOMAINS = (
+    "google-analytics.com", "googletagmanager.com", "doubleclick.net", "googlesyndication.com",
+    "adservice.google.com", "facebook.net", "connect.facebook.com", "hotjar.com", "segment.io",
+    "segment.com", "mixpanel.com", "amplitude.com", "scorecardresearch.com", "quantserve.com",
+    "criteo.com", "taboola.com", "outbrain.com", "newrelic.com", "nr-data.net", "clarity.ms"
+)
+# Navigation profiles: which requests to block and when goto returns
+NAVIGATION_PROFILES = {
+    "full": {"block_types": [], "block_third_party": False, "block_trackers": False, "wait_until": "networkidle"},
+    "fast": {"block_types": ["image", "media", "font"], "block_third_party": False, "block_trackers": True,
+             "wait_until": "domcontentloaded"},
+    "text": {"block_types": ["image", "media", "font", "stylesheet", "websocket", "manifest"],
+             "block_third_party": True, "block_trackers": True, "wait_until": "domcontentloaded"}
+}
+DEFAULT_NAVIGATION_PROFILE = os.getenv("MOLTBOT_BROWSER_PROFILE", "full")
+CACHEABLE_ASSET_TYPES = {"stylesheet", "script", "font", "image"}
+ASSET_MAX_BYTES = 2 * 1024 * 1024
+ASSET_CACHE_BYTES = 64 * 1024 * 1024  # Shared by all sessions of a pool
+
+# Second-level labels under two-letter country TLDs (example.co.uk, example.com.au)
+_SECOND_LEVEL = {"co", "com", "net", "org", "gov", "edu", "ac"}
+
+NAVIGATION_TIMING_JS = """() => {
+    const n = performance.getEntriesByType('navigation')[0];
+    if (!n) return null;
+    const ms = v => v > 0 ? Math.round(v) : null;
+    return {
+        dns_ms: ms(n.domainLookupEnd - n.domainLookupStart),
+        connect_ms: ms(n.connectEnd - n.connectStart),
+        ttfb_ms: ms(n.responseStart - n.requestStart),
+        response_ms: ms(n.responseEnd - n.responseStart),
+        dom_content_loaded_ms: ms(n.domContentLoadedEventEnd),
+        load_ms: ms(n.loadEventEnd)
+    };
+}"""
+
+
+def site_of(host: str) -> str:
+    """Approximate registrable domain: example.com for a.b.example.com, example.co.uk kept whole"""
+    labels = (host or "").lower().rstrip('.').split('.')
+    if len(labels) >= 3 and labels[-2] in _SECOND_LEVEL and len(labels[-1]) == 2:
+        return '.'.join(labels[-3:])
+    return '.'.join(labels[-2:])
+
+
+def resolve_navigation_profile(
+    profile: Optional[str] = None,
+    wait_until: Optional[str] = None,
+    block_types: Optional[List[str]] = None,
+    block_third_party: Optional[bool] = None,
+    block_domains: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    """A named profile with per-call overrides; raises ValueError on unknown values"""
+    name = profile or DEFAULT_NAVIGATION_PROFILE
+    if name not in NAVIGATION_PROFILES:
+        raise ValueError(f"Unknown navigation profile: {name} (use {', '.join(NAVIGATION_PROFILES)})")
+    resolved = {"name": name, **NAVIGATION_PROFILES[name], "block_domains": []}
+    if wait_until is not None:
+        if wait_until not in WAIT_UNTIL:
+            raise ValueError(f"wait_until must be one of {', '.join(WAIT_UNTIL)}")
+        resolved["wait_until"] = wait_until
+    if block_types is not None:
+        unknown = set(block_types) - BLOCKABLE_RESOURCE_TYPES
+        if unknown:
+            raise ValueError(f"Cannot block resource types: {', '.join(sorted(unknown))}")
+        resolved["block_types"] = list(block_types)
+    if block_third_party is not None:
+        resolved["block_third_party"] = block_third_party
+    if block_domains:
+        resolved["block_domains"] = [d.lower().lstrip('.') for d in block_domains]
+    return resolved
+
+
+def profile_blocks(profile: Dict[str, Any]) -> bool:
+    """Whether a resolved profile blocks anything (and so needs request interception)"""
+    return bool(profile["block_types"] or profile["block_trackers"]
+                or profile["block_third_party"] or profile["block_domains"])
+
+SCREENSHOT_DIR = Path("/tmp/moltbot_workspace/screenshots")
+SCREENSHOT_TTL = 900
+SCREENSHOT_FORMATS = ("jpeg", "webp", "png")
+SCREENSHOT_MAX_BYTES = 512 * 1024
+SCREENSHOT_MAX_HEIGHT = 8000
+
+# Readability-style extraction run inside the page: main text as compact
+# markdown-ish lines plus a map of clickable elements with stable selectors.
+SNAPSHOT_JS = r"""(opts) => {
+    const SKIP = new Set(['SCRIPT', 'STYLE', 'NOSCRIPT', 'TEMPLATE', 'SVG', 'CANVAS', 'IFRAME', 'OBJECT']);
+    const INLINE = new Set(['A', 'ABBR', 'B', 'BR', 'CODE', 'EM', 'I', 'IMG', 'KBD', 'LABEL', 'MARK', 'Q', 'S',
+                            'SAMP', 'SMALL', 'SPAN', 'STRONG', 'SUB', 'SUP', 'TIME', 'U', 'VAR']);
+    const CHROME = 'nav, footer, aside, [role=navigation], [role=contentinfo], [role=complementary], [aria-hidden=true]';
+    const clean = t => (t || '').replace(/\s+/g, ' ').trim();
+    const shown = el => !el.checkVisibility || el.checkVisibility();
+
+    const pickRoot = () => {
+        const explicit = document.querySelector('article, main, [role=main]');
+        if (explicit && clean(explicit.textContent).length > 200) return explicit;
+        const scores = new Map();
+        for (const block of document.querySelectorAll('p, pre, li, td, blockquote')) {
+            const length = clean(block.textContent).length;
+            if (length < 25) continue;
+            for (let el = block.parentElement, depth = 0; el && depth < 3; el = el.parentElement, depth++) {
+                scores.set(el, (scores.get(el) || 0) + length / (depth + 1));
+            }
+        }
+        let best = document.body, bestScore = 0;
+        for (const [el, score] of scores) {
+            const linkText = [...el.querySelectorAll('a')].reduce((n, a) => n + a.textContent.length, 0);
+            const adjusted = score * (1 - linkText / Math.max(1, el.textContent.length));
+            if (adjusted > bestScore) { best = el; bestScore = adjusted; }
+        }
+        return best || document.documentElement;
+    };
+
+    const root = pickRoot();
+    const lines = [];
+    let chars = 0, truncated = false;
+    const push = line => {
+        if (!line || truncated) return;
+        if (chars + line.length > opts.maxChars) { truncated = true; return; }
+        lines.push(line);
+        chars += line.length + 1;
+    };
+    const walk = el => {
+        for (const child of el.children) {
+            if (truncated) return;
+            const tag = child.tagName;
+            if (SKIP.has(tag) || child.matches(CHROME) || !shown(child)) continue;
+            if (/^H[1-6]$/.test(tag)) push('#'.repeat(+tag[1]) + ' ' + clean(child.textContent));
+            else if (tag === 'LI') push('- ' + clean(child.textContent));
+            else if (tag === 'PRE') push('```\n' + child.textContent.trim().slice(0, 2000) + '\n```');
+            else if (tag === 'TR') push('| ' + [...child.cells].map(c => clean(c.textContent)).join(' | ') + ' |');
+            else if ([...child.children].every(c => INLINE.has(c.tagName))) push(clean(child.textContent));
+            else walk(child);
+        }
+    };
+    walk(root);
+
+    const CLICKABLE = 'a[href], button, input:not([type=hidden]), select, textarea, summary, [onclick], ' +
+        '[role=button], [role=link], [role=tab], [role=menuitem], [role=checkbox], [role=radio], [role=switch], ' +
+        '[contenteditable=true]';
+    const unique = sel => { try { return document.querySelectorAll(sel).length === 1; } catch (e) { return false; } };
+    const quote = v => '"' + v.replace(/["\\]/g, '\\$&') + '"';
+    const stableId = id => id && !/\d{4,}|^\d|[:.]/.test(id);
+    const selectorFor = el => {
+        if (stableId(el.id) && unique('#' + CSS.escape(el.id))) return '#' + CSS.escape(el.id);
+        for (const attr of ['data-testid', 'data-test', 'data-qa', 'name', 'aria-label', 'href']) {
+            const value = el.getAttribute(attr);
+            if (!value || value.length > 120) continue;
+            const sel = el.localName + '[' + attr + '=' + quote(value) + ']';
+            if (unique(sel)) return sel;
+        }
+        const parts = [];
+        for (let node = el; node && node !== document.documentElement; node = node.parentElement) {
+            if (node !== el && stableId(node.id) && unique('#' + CSS.escape(node.id))) {
+                parts.unshift('#' + CSS.escape(node.id));
+                break;
+            }
+            let part = node.localName;
+            const siblings = node.parentElement ? [...node.parentElement.children].filter(c => c.localName === node.localName) : [];
+            if (siblings.length > 1) part += ':nth-of-type(' + (siblings.indexOf(node) + 1) + ')';
+            parts.unshift(part);
+        }
+        return parts.join(' > ');
+    };
+    const roleOf = el => {
+        const role = el.getAttribute('role');
+        if (role) return role;
+        const tag = el.localName;
+        if (tag === 'a') return 'link';
+        if (tag === 'select') return 'combobox';
+        if (tag === 'textarea') return 'textbox';
+        if (tag === 'input') {
+            const type = (el.getAttribute('type') || 'text').toLowerCase();
+            if (['checkbox', 'radio'].includes(type)) return type;
+            if (['button', 'submit', 'reset', 'image'].includes(type)) return 'button';
+            return 'textbox';
+        }
+        if (tag === 'button' || tag === 'summary' || el.hasAttribute('onclick')) return 'button';
+        return 'textbox';
+    };
+    const nameOf = el => clean(
+        el.getAttribute('aria-label') || el.innerText || el.value || el.getAttribute('placeholder') ||
+        el.getAttribute('title') || el.getAttribute('alt') || (el.querySelector('img') || {}).alt || ''
+    ).slice(0, 80);
+
+    const elements = [];
+    let total = 0;
+    for (const el of document.querySelectorAll(CLICKABLE)) {
+        const rect = el.getBoundingClientRect();
+        if (rect.width === 0 || rect.height === 0 || !shown(el)) continue;
+        total++;
+        if (elements.length >= opts.maxElements) continue;
+        const item = {ref: 'e' + (elements.length + 1), role: roleOf(el), name: nameOf(el), selector: selectorFor(el)};
+        if (el.localName === 'a') item.href = (el.getAttribute('href') || '').slice(0, 200);
+        if (el.disabled) item.disabled = true;
+        elements.push(item);
+    }
+
+    return {
+        url: location.href,
+        title: document.title,
+        lang: document.documentElement.lang || null,
+        text: lines.join('\n'),
+        chars: chars,
+        truncated: truncated,
+        elements: elements,
+        elements_total: total
+    };
+}"""
+
+# Screenshot region in document coordinates: an element, the full page or the viewport
+SCREENSHOT_REGION_JS = r"""([selector, fullPage]) => {
+    const doc = document.documentElement;
+    if (selector) {
+        const el = document.querySelector(selector);
+        if (!el) return null;
+        el.scrollIntoView({block: 'nearest'});
+        const r = el.getBoundingClientRect();
+        return {x: r.left + scrollX, y: r.top + scrollY, width: r.width, height: r.height};
+    }
+    if (fullPage) {
+        return {x: 0, y: 0, width: Math.max(doc.scrollWidth, innerWidth), height: Math.max(doc.scrollHeight, innerHeight)};
+    }
+    return {x: scrollX, y: scrollY, width: innerWidth, height: innerHeight};
+}"""
+
+CONTENT_JS = """([htmlChars, textChars]) => ({
+    html: document.documentElement.outerHTML.slice(0, htmlChars),
+    text: (document.body ? document.body.innerText : '').slice(0, textChars),
+    title: document.title
+})"""
+
+
+def purge_screenshots(ttl: float = SCREENSHOT_TTL) -> int:
+    """Delete screenshot files older than ttl seconds"""
+    if not SCREENSHOT_DIR.exists():
+        return 0
+    cutoff = time.time() - ttl
+    removed = 0
+    for path in SCREENSHOT_DIR.iterdir():
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+class BrowserUnavailable(Exception):
+    """The requested browser session does not exist or cannot be created"""
+
+
+class BrowserSession:
+    """One caller's isolated browser context and page"""
+    
+    def __init__(self, session_id: str, context, page: Page, asset_budget: int = ASSET_CACHE_BYTES):
+        self.id = session_id
+        self.context = context
+        self.page = page
+        self.lock = asyncio.Lock()  # One action at a time per session
+        self.users = 0  # Callers holding a checkout; such sessions are never recycled
+        self.actions = 0
+        self.created_at = time.time()
+        self.last_used = time.time()
+        # Current navigation's profile and counters, read by the route handler
+        self.profile = resolve_navigation_profile("full")
+        self.site = ""
+        self.counters = {"requests": 0, "blocked": 0, "asset_hits": 0}
+        self.routed = False  # Request interception installed (blocking profiles only)
+        # Static assets kept across navigations while routed (routing turns off
+        # Chromium's HTTP cache); dropped when interception is removed
+        self.assets: OrderedDict = OrderedDict()
+        self.asset_bytes = 0
+        self.asset_budget = asset_budget
+        self.refs: Dict[str, str] = {}  # Element refs from the last snapshot -> selectors
+        self.cdp = None
+    
+    def cached_asset(self, url: str) -> Optional[Dict[str, Any]]:
+        asset = self.assets.get(url)
+        if asset is not None:
+            self.assets.move_to_end(url)
+        return asset
+    
+    def store_asset(self, url: str, status: int, headers: Dict[str, str], body: bytes) -> None:
+        if url in self.assets:
+            self.asset_bytes -= len(self.assets.pop(url)["body"])
+        self.assets[url] = {"status": status, "headers": headers, "body": body}
+        self.asset_bytes += len(body)
+        while self.asset_bytes > self.asset_budget and self.assets:
+            _, evicted = self.assets.popitem(last=False)
+            self.asset_bytes -= len(evicted["body"])
+    
+    def clear_assets(self) -> None:
+        self.assets.clear()
+        self.asset_bytes = 0
+    
+    @property
+    def idle(self) -> bool:
+        return self.users == 0 and not self.lock.locked()
+    
+    def info(self) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            "session_id": self.id,
+            "url": self.page.url if not self.page.is_closed() else None,
+            "busy": not self.idle,
+            "actions": self.actions,
+            "profile": self.profile["name"],
+            "intercepting": self.routed,
+            "cached_assets": len(self.assets),
+            "cached_asset_bytes": self.asset_bytes,
+            "age_seconds": round(now - self.created_at, 1),
+            "idle_seconds": round(now - self.last_used, 1)
+        }
+
+
 class BrowserTool:
-    """Browser automation using Playwright (Moltbot-compatible)"""
+    """Browser automation using Playwright (Moltbot-compatible)
     
-    def __init__(self):
+    One long-lived Chromium process is shared by all callers and every
+    session_id gets its own BrowserContext (cookies, storage, cache) and
+    page, so concurrent agents do not share navigation state. Request
+    interception is only installed while a navigation profile blocks
+    something; the static-asset cache that stands in for the HTTP cache
+    under interception splits asset_cache_bytes across sessions. Sessions are
+    created on first use; when the pool is full the least recently used
+    idle session is recycled, and a reaper closes sessions left idle. If
+    the browser process dies it is relaunched on the next call.
+    """
+    
+    def __init__(
+        self,
+        max_sessions: int = 8,
+        max_concurrent: int = 4,
+        idle_timeout: int = 600,
+        reap_interval: int = 60,
+        headless: bool = True,
+        asset_cache_bytes: int = ASSET_CACHE_BYTES
+    ):
         self.playwright = None
         self.browser: Optional[Browser] = None
-        self.context = None
-        self.page: Optional[Page] = None
-        self.is_running = False
-        self._lock = asyncio.Lock()
+        self.sessions: Dict[str, BrowserSession] = {}
+        self.max_sessions = max_sessions
+        self.max_concurrent = max_concurrent
+        self.idle_timeout = idle_timeout
+        self.reap_interval = reap_interval
+        self.headless = headless
+        self.asset_cache_bytes = asset_cache_bytes
+        self._lock = asyncio.Lock()  # Guards launch and session creation/removal
+        self._slots = asyncio.Semaphore(max_concurrent)  # Actions running at once across sessions
+        self._reaper: Optional[asyncio.Task] = None
+        self.launches = 0
+        self.recycled = 0
+    
+    @property
+    def is_running(self) -> bool:
+        return self.browser is not None and self.browser.is_connected()
+    
+    # ---------- pool ----------
+    
+    async def _ensure_browser(self) -> None:
+        """Launch Chromium on first use or after a crash; caller holds _lock"""
+        if self.is_running:
+            return
+        if self.browser is not None:
+            logger.warning("Browser process is gone; relaunching")
+        self.browser = None
+        self.sessions.clear()  # Contexts died with the old process
+        if self.playwright is None:
+            self.playwright = await async_playwright().start()
+        browser = await self.playwright.chromium.launch(headless=self.headless, args=BROWSER_LAUNCH_ARGS)
+        browser.on("disconnected", self._on_disconnected)
+        self.browser = browser
+        self.launches += 1
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap_loop())
+    
+    def _on_disconnected(self, browser) -> None:
+        if browser is self.browser:
+            logger.warning("Browser disconnected")
+            self.browser = None
+            self.sessions.clear()
     
-    async def start(self, headless: bool = True) -> Dict[str, Any]:
-        """Start browser instance"""
+    async def _checkout(self, session_id: str, create: bool) -> BrowserSession:
         async with self._lock:
-            if self.is_running:
-                return {"status": "already_running", "url": self.page.url if self.page else None}
+            if not self.is_running:
+                if not create:
+                    raise BrowserUnavailable("Browser not running")
+                await self._ensure_browser()
+            
+            session = self.sessions.get(session_id)
+            if session is not None and session.page.is_closed():
+                await self._close_session(session)
+                session = None
+            if session is None:
+                if not create:
+                    raise BrowserUnavailable(f"No browser session '{session_id}'; navigate or start first")
+                if len(self.sessions) >= self.max_sessions:
+                    idle = [s for s in self.sessions.values() if s.idle]
+                    if not idle:
+                        raise BrowserUnavailable(f"Browser pool is full ({self.max_sessions} busy sessions)")
+                    await self._close_session(min(idle, key=lambda s: s.last_used))
+                    self.recycled += 1
+                context = await self.browser.new_context(**BROWSER_CONTEXT_OPTIONS)
+                session = BrowserSession(session_id, context, await context.new_page(),
+                                         self.asset_cache_bytes // self.max_sessions)
+                self.sessions[session_id] = session
             
+            session.users += 1
+            return session
+    
+    async def _close_session(self, session: BrowserSession) -> None:
+        if self.sessions.get(session.id) is session:
+            del self.sessions[session.id]
+        try:
+            await session.context.close()
+        except Exception as e:
+            logger.debug(f"Browser context close error: {e}")
+    
+    async def _run(self, session_id: str, action: str, fn, create: bool = False) -> Dict[str, Any]:
+        """Run fn(session) on a checked-out session; a browser crash is retried once on a relaunched browser"""
+        for attempt in range(2):
             try:
-                self.playwright = await async_playwright().start()
-                
-                # Launch browser with proper configuration
-                self.browser = await self.playwright.chromium.launch(
-                    headless=headless,
-                    args=[
-                        '--no-sandbox',
-                        '--disable-setuid-sandbox',
-                        '--disable-dev-shm-usage',
-                        '--disable-blink-features=AutomationControlled'
-                    ]
-                )
-                
-                # Create context with realistic settings
-                self.context = await self.browser.new_context(
-                    viewport={'width': 1920, 'height': 1080},
-                    user_agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-                )
-                
-                self.page = await self.context.new_page()
-                self.is_running = True
-                
-                return {
-                    "status": "started",
-                    "headless": headless,
-                    "message": "Browser started successfully"
-                }
+                session = await self._checkout(session_id, create)
+            except BrowserUnavailable as e:
+                return {"error": str(e), "session_id": session_id}
             except Exception as e:
                 logger.error(f"Browser start error: {e}")
-                return {"error": str(e), "status": "error"}
+                return {"error": str(e), "status": "error", "session_id": session_id}
+            
+            try:
+                async with session.lock, self._slots:
+                    session.actions += 1
+                    result = await fn(session)
+                result["session_id"] = session_id
+                return result
+            except Exception as e:
+                if attempt == 0 and create and not self.is_running:
+                    logger.warning(f"Browser crashed during {action.lower()}; retrying")
+                    continue
+                logger.error(f"{action} error: {e}")
+                return {"error": str(e), "session_id": session_id}
+            finally:
+                session.users -= 1
+                session.last_used = time.time()
     
-    async def stop(self) -> Dict[str, Any]:
-        """Stop browser instance"""
-        async with self._lock:
-            if not self.is_running:
-                return {"status": "not_running"}
+    async def _intercept(self, session: BrowserSession, enabled: bool) -> None:
+        """Install or remove the session's route handler to match its profile"""
+        if enabled and not session.routed:
+            await session.context.route("**/*", lambda route: self._route(session, route))
+            session.routed = True
+        elif not enabled and session.routed:
+            await session.context.unroute("**/*")
+            session.routed = False
+            session.clear_assets()  # Chromium's HTTP cache serves them again
+    
+    async def _route(self, session: BrowserSession, route) -> None:
+        """Apply the session's navigation profile to one request and serve cached static assets"""
+        request = route.request
+        profile = session.profile
+        session.counters["requests"] += 1
+        try:
+            host = urlparse(request.url).hostname or ""
+            if request.is_navigation_request() and request.frame.parent_frame is None:
+                session.site = site_of(host)  # Follows redirects of the top-level document
+                await route.continue_()
+                return
             
+            site = site_of(host)
+            blocked = (
+                request.resource_type in profile["block_types"]
+                or (profile["block_trackers"] and host.endswith(TRACKER_DOMAINS))
+                or any(host == d or host.endswith('.' + d) for d in profile["block_domains"])
+                or (profile["block_third_party"] and host and session.site and site != session.site)
+            )
+            if blocked:
+                session.counters["blocked"] += 1
+                await route.abort("blockedbyclient")
+                return
+            
+            if request.method != "GET" or request.resource_type not in CACHEABLE_ASSET_TYPES:
+                await route.continue_()
+                return
+            asset = session.cached_asset(request.url)
+            if asset is not None:
+                session.counters["asset_hits"] += 1
+                await route.fulfill(status=asset["status"], headers=asset["headers"], body=asset["body"])
+                return
+            response = await route.fetch()
+            body = await response.body()
+            cache_control = response.headers.get("cache-control", "")
+            if response.status == 200 and len(body) <= ASSET_MAX_BYTES and "no-store" not in cache_control:
+                session.store_asset(request.url, response.status, response.headers, body)
+            await route.fulfill(response=response, body=body)
+        except Exception as e:
+            # The page navigated away or closed while this request was in flight
+            logger.debug(f"Browser route error for {request.url}: {e}")
             try:
-                if self.page:
-                    await self.page.close()
-                if self.context:
-                    await self.context.close()
-                if self.browser:
-                    await self.browser.close()
+                await route.continue_()
+            except Exception:
+                pass
+    
+    async def reap(self) -> Dict[str, Any]:
+        """Close sessions idle longer than idle_timeout and delete expired screenshots"""
+        cutoff = time.time() - self.idle_timeout
+        closed = []
+        async with self._lock:
+            for session in list(self.sessions.values()):
+                if session.idle and session.last_used < cutoff:
+                    await self._close_session(session)
+                    closed.append(session.id)
+        screenshots = await asyncio.to_thread(purge_screenshots)
+        return {"closed": closed, "sessions": len(self.sessions), "screenshots_removed": screenshots}
+    
+    async def _reap_loop(self):
+        while True:
+            await asyncio.sleep(self.reap_interval)
+            try:
+                await self.reap()
+            except Exception as e:
+                logger.error(f"Browser session reaper error: {e}")
+    
+    def pool_status(self) -> Dict[str, Any]:
+        return {
+            "running": self.is_running,
+            "sessions": [s.info() for s in self.sessions.values()],
+            "max_sessions": self.max_sessions,
+            "max_concurrent": self.max_concurrent,
+            "idle_timeout": self.idle_timeout,
+            "cached_asset_bytes": sum(s.asset_bytes for s in self.sessions.values()),
+            "asset_cache_bytes": self.asset_cache_bytes,
+            "default_profile": DEFAULT_NAVIGATION_PROFILE,
+            "profiles": NAVIGATION_PROFILES,
+            "launches": self.launches,
+            "recycled": self.recycled
+        }
+    
+    async def close(self) -> None:
+        """Close every session and the browser process"""
+        if self._reaper and not self._reaper.done():
+            self._reaper.cancel()
+            await asyncio.gather(self._reaper, return_exceptions=True)
+        async with self._lock:
+            browser, self.browser = self.browser, None
+            for session in list(self.sessions.values()):
+                await self._close_session(session)
+            try:
+                if browser:
+                    await browser.close()
                 if self.playwright:
                     await self.playwright.stop()
-                
-                self.is_running = False
-                self.page = None
-                self.context = None
-                self.browser = None
-                self.playwright = None
-                
-                return {"status": "stopped", "message": "Browser stopped successfully"}
             except Exception as e:
                 logger.error(f"Browser stop error: {e}")
-                return {"error": str(e)}
+            self.playwright = None
+    
+    @staticmethod
+    def _selector(session: BrowserSession, selector: str) -> str:
+        """Resolve "@e12"-style refs from the session's last snapshot to CSS selectors"""
+        if selector.startswith('@'):
+            resolved = session.refs.get(selector[1:])
+            if resolved is None:
+                raise ValueError(f"Unknown element ref {selector}; take a new snapshot")
+            return resolved
+        return selector
+    
+    # ---------- actions ----------
+    
+    async def start(self, session_id: str = "default", headless: Optional[bool] = None) -> Dict[str, Any]:
+        """Open a session (launching the shared browser if needed)"""
+        if headless is not None and not self.is_running:
+            self.headless = headless
+        existed = self.is_running and session_id in self.sessions
+        
+        async def started(session: BrowserSession) -> Dict[str, Any]:
+            if existed:
+                return {"status": "already_running", "url": session.page.url}
+            return {
+                "status": "started",
+                "headless": self.headless,
+                "message": "Browser session started"
+            }
+        return await self._run(session_id, "Browser start", started, create=True)
+    
+    async def stop(self, session_id: str = "default") -> Dict[str, Any]:
+        """Close a session; the shared browser keeps running for other sessions"""
+        async with self._lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                return {"status": "not_running", "session_id": session_id}
+            await self._close_session(session)
+        return {"status": "stopped", "session_id": session_id, "message": "Browser session closed"}
     
-    async def navigate(self, url: str) -> Dict[str, Any]:
-        """Navigate to URL"""
-        if not self.is_running:
-            # Auto-start browser
-            start_result = await self.start()
-            if "error" in start_result:
-                return start_result
+    async def navigate(
+        self,
+        url: str,
+        session_id: str = "default",
+        profile: Optional[str] = None,
+        wait_until: Optional[str] = None,
+        block_types: Optional[List[str]] = None,
+        block_third_party: Optional[bool] = None,
+        block_domains: Optional[List[str]] = None,
+        timeout: int = 30000
+    ) -> Dict[str, Any]:
+        """Navigate to URL
         
+        profile picks what to block and when to return: "full" (everything,
+        networkidle), "fast" (no images/media/fonts/trackers,
+        domcontentloaded) or "text" (also no stylesheets or third-party
+        requests). The other arguments override the profile for this call.
+        """
         try:
-            response = await self.page.goto(url, wait_until="networkidle", timeout=30000)
-            title = await self.page.title()
-            
+            nav_profile = resolve_navigation_profile(profile, wait_until, block_types, block_third_party, block_domains)
+        except ValueError as e:
+            return {"error": str(e), "session_id": session_id}
+        
+        async def go(session: BrowserSession) -> Dict[str, Any]:
+            session.profile = nav_profile
+            session.site = site_of(urlparse(url).hostname or "")
+            session.counters = {"requests": 0, "blocked": 0, "asset_hits": 0}
+            await self._intercept(session, profile_blocks(nav_profile))
+            started = time.perf_counter()
+            response = await session.page.goto(url, wait_until=nav_profile["wait_until"], timeout=timeout)
+            goto_seconds = time.perf_counter() - started
+            title = await session.page.title()
+            try:
+                page_timing = await session.page.evaluate(NAVIGATION_TIMING_JS)
+            except Exception:
+                page_timing = None
             return {
                 "url": url,
+                "final_url": session.page.url,
                 "title": title,
                 "status": response.status if response else 200,
+                "profile": nav_profile["name"],
+                "wait_until": nav_profile["wait_until"],
+                "requests": dict(session.counters) if session.routed else None,
+                "timing": {
+                    "goto_ms": round(goto_seconds * 1000),
+                    "total_ms": round((time.perf_counter() - started) * 1000),
+                    **(page_timing or {})
+                },
                 "message": f"Navigated to {url}"
             }
-        except Exception as e:
-            logger.error(f"Navigation error: {e}")
-            return {"error": str(e)}
+        return await self._run(session_id, "Navigation", go, create=True)
     
-    async def screenshot(self, full_page: bool = False) -> Dict[str, Any]:
-        """Take screenshot"""
-        if not self.is_running or not self.page:
-            return {"error": "Browser not running"}
+    async def screenshot(
+        self,
+        full_page: bool = False,
+        session_id: str = "default",
+        image_format: str = "jpeg",
+        quality: int = 70,
+        max_width: int = 1280,
+        max_bytes: int = SCREENSHOT_MAX_BYTES,
+        clip: Optional[Dict[str, float]] = None,
+        selector: Optional[str] = None,
+        inline: bool = True
+    ) -> Dict[str, Any]:
+        """Take a size-bounded screenshot of the viewport, full page, an element or a clip region
         
-        try:
-            screenshot_path = f"/tmp/moltbot_screenshot_{int(time.time())}.png"
-            await self.page.screenshot(path=screenshot_path, full_page=full_page)
+        clip is {x, y, width, height} in page (document) coordinates. The
+        image is scaled down to max_width, then quality and scale are
+        lowered until it fits max_bytes. The file is kept for SCREENSHOT_TTL
+        seconds; inline returns it base64-encoded as well.
+        """
+        if image_format not in SCREENSHOT_FORMATS:
+            return {"error": f"format must be one of {', '.join(SCREENSHOT_FORMATS)}", "session_id": session_id}
+        if not 1 <= quality <= 100:
+            return {"error": "quality must be between 1 and 100", "session_id": session_id}
+        
+        async def shoot(session: BrowserSession) -> Dict[str, Any]:
+            if clip:
+                region = {k: float(clip[k]) for k in ("x", "y", "width", "height")}
+            else:
+                css = self._selector(session, selector) if selector else None
+                region = await session.page.evaluate(SCREENSHOT_REGION_JS, [css, full_page])
+                if region is None:
+                    raise ValueError(f"No element matches {selector}")
+            region["height"] = min(region["height"], SCREENSHOT_MAX_HEIGHT)
+            if region["width"] < 1 or region["height"] < 1:
+                raise ValueError("Screenshot region is empty")
             
-            return {
-                "path": screenshot_path,
+            if session.cdp is None:
+                session.cdp = await session.context.new_cdp_session(session.page)
+            scale = min(1.0, max_width / region["width"])
+            current_quality = quality
+            for attempt in range(8):
+                params = {"format": image_format, "clip": {**region, "scale": scale},
+                          "captureBeyondViewport": True, "fromSurface": True}
+                if image_format != "png":
+                    params["quality"] = current_quality
+                data = (await session.cdp.send("Page.captureScreenshot", params))["data"]
+                size = len(data) * 3 // 4
+                if size <= max_bytes:
+                    break
+                if image_format != "png" and current_quality > 40:
+                    current_quality = max(40, current_quality - 20)  # Quality first, then resolution
+                else:
+                    scale *= 0.75
+            
+            raw = base64.b64decode(data)
+            SCREENSHOT_DIR.mkdir(parents=True, exist_ok=True)
+            name = f"{uuid.uuid4().hex[:16]}.{'jpg' if image_format == 'jpeg' else image_format}"
+            await asyncio.to_thread((SCREENSHOT_DIR / name).write_bytes, raw)
+            result = {
+                "path": str(SCREENSHOT_DIR / name),
+                "name": name,
+                "format": image_format,
+                "quality": current_quality if image_format != "png" else None,
+                "width": round(region["width"] * scale),
+                "height": round(region["height"] * scale),
+                "bytes": len(raw),
+                "within_limit": len(raw) <= max_bytes,
+                "clip": region,
                 "full_page": full_page,
+                "expires_at": datetime.fromtimestamp(time.time() + SCREENSHOT_TTL, timezone.utc).isoformat(),
                 "message": "Screenshot saved",
-                "url": self.page.url
+                "url": session.page.url
             }
-        except Exception as e:
-            logger.error(f"Screenshot error: {e}")
-            return {"error": str(e)}
+            if inline:
+                result["data"] = data
+            return result
+        return await self._run(session_id, "Screenshot", shoot)
     
-    async def click(self, selector: str) -> Dict[str, Any]:
+    async def click(self, selector: str, session_id: str = "default") -> Dict[str, Any]:
         """Click element"""
-        if not self.is_running or not self.page:
-            return {"error": "Browser not running"}
-        
-        try:
-            await self.page.click(selector, timeout=10000)
+        async def click(session: BrowserSession) -> Dict[str, Any]:
+            await session.page.click(self._selector(session, selector), timeout=10000)
             return {
                 "selector": selector,
                 "action": "clicked",
                 "message": f"Clicked {selector}"
             }
-        except Exception as e:
-            logger.error(f"Click error: {e}")
-            return {"error": str(e), "selector": selector}
+        result = await self._run(session_id, "Click", click)
+        if "error" in result:
+            result["selector"] = selector
+        return result
     
-    async def type_text(self, selector: str, text: str) -> Dict[str, Any]:
+    async def type_text(self, selector: str, text: str, session_id: str = "default") -> Dict[str, Any]:
         """Type text into element"""
-        if not self.is_running or not self.page:
-            return {"error": "Browser not running"}
-        
-        try:
-            await self.page.fill(selector, text)
+        async def fill(session: BrowserSession) -> Dict[str, Any]:
+            await session.page.fill(self._selector(session, selector), text)
             return {
                 "selector": selector,
                 "text": text,
                 "message": f"Typed into {selector}"
             }
-        except Exception as e:
-            logger.error(f"Type error: {e}")
-            return {"error": str(e)}
+        return await self._run(session_id, "Type", fill)
     
-    async def get_content(self) -> Dict[str, Any]:
+    async def get_content(self, session_id: str = "default") -> Dict[str, Any]:
         """Get page content"""
-        if not self.is_running or not self.page:
-            return {"error": "Browser not running"}
+        async def content(session: BrowserSession) -> Dict[str, Any]:
+            # Truncated in the page so only the kept part crosses the Playwright channel
+            page = await session.page.evaluate(CONTENT_JS, [10000, 5000])
+            return {**page, "url": session.page.url}
+        return await self._run(session_id, "Get content", content)
+    
+    async def snapshot(self, session_id: str = "default", max_chars: int = 8000, max_elements: int = 150) -> Dict[str, Any]:
+        """Compact page state: main text as markdown-ish lines and clickable elements with refs
         
-        try:
-            content = await self.page.content()
-            text = await self.page.evaluate("() => document.body.innerText")
-            
-            return {
-                "html": content[:10000],  # Truncate
-                "text": text[:5000],
-                "url": self.page.url,
-                "title": await self.page.title()
-            }
-        except Exception as e:
-            logger.error(f"Get content error: {e}")
-            return {"error": str(e)}
+        Refs ("@e3") can be passed to click/type in place of a selector
+        until the next snapshot.
+        """
+        async def snap(session: BrowserSession) -> Dict[str, Any]:
+            data = await session.page.evaluate(SNAPSHOT_JS, {"maxChars": max_chars, "maxElements": max_elements})
+            session.refs = {e["ref"]: e["selector"] for e in data["elements"]}
+            return data
+        return await self._run(session_id, "Snapshot", snap)
     
-    async def evaluate(self, expression: str) -> Dict[str, Any]:
+    async def evaluate(self, expression: str, session_id: str = "default") -> Dict[str, Any]:
         """Execute JavaScript"""
-        if not self.is_running or not self.page:
-            return {"error": "Browser not running"}
-        
-        try:
-            result = await self.page.evaluate(expression)
+        async def run(session: BrowserSession) -> Dict[str, Any]:
             return {
                 "expression": expression,
-                "result": result,
+                "result": await session.page.evaluate(expression),
                 "message": "JavaScript executed"
             }
-        except Exception as e:
-            logger.error(f"Evaluate error: {e}")
-            return {"error": str(e)}
+        return await self._run(session_id, "Evaluate", run)
     
-    async def status(self) -> Dict[str, Any]:
-        """Get browser status"""
+    async def status(self, session_id: str = "default") -> Dict[str, Any]:
+        """Get browser status for a session, with the pool summary"""
+        session = self.sessions.get(session_id) if self.is_running else None
+        title = None
+        if session and session.idle and not session.page.is_closed():
+            try:
+                title = await session.page.title()
+            except Exception:
+                pass
         return {
             "running": self.is_running,
-            "url": self.page.url if self.is_running and self.page else None,
-            "title": await self.page.title() if self.is_running and self.page else None
+            "session_id": session_id,
+            "session_open": session is not None,
+            "url": session.page.url if session and not session.page.is_closed() else None,
+            "title": title,
+            "pool": self.pool_status()
         }
 
-# Global browser instance
+# Global browser pool
 browser_tool = BrowserTool()
 
-
 # ============== SKILLS SYSTEM ==============
 
 class SkillsManager:
@@ -653,35 +2127,474 @@ skills_manager = SkillsManager()
 
 # ============== MEMORY SYSTEM ==============
 
+MEMORY_HEADER_RE = re.compile(rb"^## (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2} UTC)\r?\n$")
+# Content lines that look like a header (optionally already backslash-escaped)
+# are written with one more leading backslash and read back with one less
+MEMORY_ESCAPED_HEADER_RE = re.compile(r"^(\\*)(## \d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2} UTC\r?)$", re.M)
+MEMORY_TOKEN_RE = re.compile(r"\w+")
+MEMORY_FSYNC_POLICIES = ("always", "interval", "never")
+MEMORY_SNAPSHOT_EVERY = 500  # Appends between index snapshots
+MEMORY_CHECK_BYTES = 4096
+# Vector recall over memory entries and workspace files
+RECALL_FILE_SUFFIXES = {
+    '.md', '.txt', '.rst', '.json', '.yaml', '.yml', '.toml', '.ini', '.csv', '.html', '.css', '.sh',
+    '.py', '.js', '.jsx', '.ts', '.tsx', '.go', '.rs', '.java', '.c', '.cpp', '.h', '.hpp', '.rb', '.php', '.sql'
+}
+RECALL_SKIP_DIRS = {"process_logs", "fetch_cache", "screenshots", "node_modules", "__pycache__"}
+RECALL_MAX_FILE_BYTES = 256 * 1024
+RECALL_CHUNK_LINES = 40
+RECALL_RESCAN_INTERVAL = 10.0
+RECALL_MIN_SCORE = 0.12  # Below this hashed-feature matches are mostly noise
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def memory_tokens(text: str) -> List[str]:
+    return [t for t in MEMORY_TOKEN_RE.findall(text.lower()) if len(t) > 1]
+
+
+class MemoryIndex:
+    """Inverted index over memory entries with BM25 ranking"""
+    
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.lengths: Dict[int, int] = {}
+        self.total_length = 0
+    
+    def add(self, entry_id: int, text: str) -> None:
+        counts: Dict[str, int] = {}
+        tokens = memory_tokens(text)
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token, tf in counts.items():
+            self.postings.setdefault(token, {})[entry_id] = tf
+        self.lengths[entry_id] = len(tokens)
+        self.total_length += len(tokens)
+    
+    def search(self, query: str, limit: int = 10) -> List[tuple]:
+        """(entry_id, score) pairs, best first"""
+        n = len(self.lengths)
+        if not n:
+            return []
+        average = self.total_length / n or 1
+        scores: Dict[int, float] = {}
+        for token in set(memory_tokens(query)):
+            postings = self.postings.get(token)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for entry_id, tf in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[entry_id] / average)
+                scores[entry_id] = scores.get(entry_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], item[0]))
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "postings": {t: [[i, tf] for i, tf in p.items()] for t, p in self.postings.items()},
+            "lengths": [[i, length] for i, length in self.lengths.items()]
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "MemoryIndex":
+        index = cls()
+        index.postings = {t: {i: tf for i, tf in p} for t, p in data["postings"].items()}
+        index.lengths = {i: length for i, length in data["lengths"]}
+        index.total_length = sum(index.lengths.values())
+        return index
+
+
 class MemorySystem:
-    """Persistent memory system (Markdown files like Moltbot)"""
+    """Persistent memory system (Markdown files like Moltbot)
     
-    def __init__(self, workspace_dir: str = "/tmp/moltbot_workspace"):
+    memory.md is an append-only journal of "## <timestamp>" entries. Appends
+    write one entry at the end of the file under an exclusive file lock and
+    are fsynced according to the fsync policy ("always", "interval" or
+    "never"). Entries are located by byte offset and indexed incrementally
+    into an inverted index, so appends and searches do not re-read the
+    journal; the index is snapshotted to disk and, on startup, only the
+    part of the journal written after the snapshot is parsed.
+    
+    recall() adds semantic-ish lookup: entries and chunks of text files in
+    the workspace are embedded into a local vector index (see
+    vector_index). Vectors are built by a background thread (started at
+    startup and by recall_context) and then kept current on append;
+    workspace files are rescanned by mtime at most every
+    RECALL_RESCAN_INTERVAL seconds. Embedding happens outside the memory
+    lock, which is only taken to apply each batch, so chat requests never
+    wait for the build; until it finishes they recall from what is ready.
+    """
+    
+    def __init__(
+        self,
+        workspace_dir: str = "/tmp/moltbot_workspace",
+        fsync: str = os.getenv("MOLTBOT_MEMORY_FSYNC", "always"),
+        fsync_interval: float = 1.0
+    ):
+        if fsync not in MEMORY_FSYNC_POLICIES:
+            raise ValueError(f"fsync policy must be one of {', '.join(MEMORY_FSYNC_POLICIES)}")
         self.workspace_dir = Path(workspace_dir)
         self.workspace_dir.mkdir(parents=True, exist_ok=True)
         self.memory_file = self.workspace_dir / "memory.md"
+        self.lock_file = self.workspace_dir / ".memory.lock"
+        self.snapshot_file = self.workspace_dir / ".memory.index.json"
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self._last_fsync = 0.0
+        self._lock = threading.RLock()
         
         # Initialize memory file if it doesn't exist
         if not self.memory_file.exists():
             self.memory_file.write_text("# Moltbot Memory\n\n")
+        
+        self.entries: List[Dict[str, Any]] = []  # {offset, length, timestamp}
+        self.index = MemoryIndex()
+        self.indexed_bytes = 0
+        self._since_snapshot = 0
+        self.vectors = VectorIndex()
+        self._embedded = 0  # Entries [0, _embedded) have vectors
+        self._recall_ready = False
+        self._files: Dict[str, tuple] = {}  # Workspace file -> (mtime, size) when embedded
+        self._chunks: Dict[str, Dict[str, Any]] = {}
+        self._files_scanned_at = 0.0
+        self._refresh_lock = threading.Lock()  # One vector refresh at a time
+        self._refresher: Optional[threading.Thread] = None
+        self._load_snapshot()
+        self._catch_up()
+    
+    # ---------- journal ----------
+    
+    @contextmanager
+    def _file_lock(self, exclusive: bool):
+        with open(self.lock_file, "a") as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+    
+    def _tail_check(self, size: int) -> str:
+        with open(self.memory_file, "rb") as f:
+            f.seek(max(0, size - MEMORY_CHECK_BYTES))
+            return hashlib.sha1(f.read(min(size, MEMORY_CHECK_BYTES))).hexdigest()
+    
+    def _parse(self, start: int) -> None:
+        """Index entries found in the journal from byte offset `start` to its end"""
+        with open(self.memory_file, "rb") as f:
+            f.seek(start)
+            offset = start
+            current, lines = None, []
+            for line in f:
+                match = MEMORY_HEADER_RE.match(line)
+                if match:
+                    if current is not None:
+                        self._add_entry(current, lines, offset)
+                    current, lines = {"offset": offset, "timestamp": match.group(1).decode()}, []
+                elif current is not None:
+                    lines.append(line)
+                offset += len(line)
+            if current is not None:
+                self._add_entry(current, lines, offset)
+        self.indexed_bytes = offset
+    
+    def _add_entry(self, entry: Dict[str, Any], lines: List[bytes], end: int) -> None:
+        entry["length"] = end - entry["offset"]
+        text = self._unescape(b"".join(lines).decode("utf-8", errors="replace").strip())
+        self._index_entry(len(self.entries), entry, text)
+    
+    def _reset(self) -> None:
+        self.entries, self.index, self.indexed_bytes = [], MemoryIndex(), 0
+        self.vectors.remove_prefix("memory:")
+        self._embedded = 0
+    
+    def _index_entry(self, entry_id: int, entry: Dict[str, Any], text: str) -> None:
+        self.entries.append(entry)
+        self.index.add(entry_id, text)
+        if self._recall_ready and self._embedded == entry_id:
+            self.vectors.add(f"memory:{entry_id}", embed(text))
+            self._embedded += 1
+    
+    @staticmethod
+    def _escape(content: str) -> str:
+        """Keep header-shaped content lines from starting a new entry"""
+        return MEMORY_ESCAPED_HEADER_RE.sub(lambda m: "\\" + m.group(0), content)
+    
+    @staticmethod
+    def _unescape(text: str) -> str:
+        return MEMORY_ESCAPED_HEADER_RE.sub(lambda m: m.group(1)[1:] + m.group(2), text)
+    
+    @classmethod
+    def _entry_text(cls, raw: bytes) -> str:
+        """Entry content without its header line"""
+        return cls._unescape(raw.decode("utf-8", errors="replace").split("\n", 1)[-1].strip())
+    
+    def _catch_up(self) -> None:
+        """Index anything appended since the last parse (including by other processes)"""
+        with self._lock:
+            size = self.memory_file.stat().st_size
+            if size == self.indexed_bytes:
+                return
+            with self._file_lock(exclusive=False):
+                if size < self.indexed_bytes:
+                    logger.warning("Memory journal shrank; rebuilding its index")
+                    self._reset()
+                self._parse(self.indexed_bytes)
+    
+    def _load_snapshot(self) -> None:
+        try:
+            data = json.loads(self.snapshot_file.read_text())
+            size = data["indexed_bytes"]
+            if self.memory_file.stat().st_size < size or self._tail_check(size) != data["check"]:
+                logger.info("Memory journal changed since its index snapshot; rebuilding")
+                return
+            self.entries = data["entries"]
+            self.index = MemoryIndex.from_dict(data["index"])
+            self.indexed_bytes = size
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Memory index snapshot unreadable, rebuilding: {e}")
+            self._reset()
+    
+    def save_snapshot(self) -> None:
+        with self._lock:
+            data = {
+                "indexed_bytes": self.indexed_bytes,
+                "check": self._tail_check(self.indexed_bytes),
+                "entries": self.entries,
+                "index": self.index.to_dict()
+            }
+            tmp = self.snapshot_file.with_suffix(".tmp")
+            tmp.write_text(json.dumps(data))
+            os.replace(tmp, self.snapshot_file)
+            self._since_snapshot = 0
+    
+    def close(self) -> None:
+        """Flush deferred fsyncs and snapshot the index"""
+        with self._lock:
+            if self.fsync != "always":
+                with open(self.memory_file, "rb") as f:
+                    os.fsync(f.fileno())
+            self.save_snapshot()
+    
+    # ---------- API ----------
     
     def read_memory(self) -> str:
         """Read memory file"""
         return self.memory_file.read_text()
     
-    def append_memory(self, content: str) -> None:
-        """Append to memory file"""
-        current = self.read_memory()
+    def append_memory(self, content: str) -> Dict[str, Any]:
+        """Append an entry to the journal and index it"""
         timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
-        entry = f"\n## {timestamp}\n\n{content}\n"
-        self.memory_file.write_text(current + entry)
-    
-    def search_memory(self, query: str) -> List[str]:
-        """Search memory for query"""
-        content = self.read_memory()
-        lines = content.split('\n')
-        matches = [line for line in lines if query.lower() in line.lower()]
-        return matches[:10]  # Return top 10 matches
+        with self._lock:
+            self._catch_up()
+            with self._file_lock(exclusive=True):
+                with open(self.memory_file, "ab") as f:
+                    offset = f.tell()
+                    if offset != self.indexed_bytes:
+                        # Another process appended after our catch-up check
+                        self._parse(self.indexed_bytes)
+                    data = f"\n## {timestamp}\n\n{self._escape(content)}\n".encode()
+                    f.write(data)
+                    f.flush()
+                    now = time.monotonic()
+                    if self.fsync == "always" or (self.fsync == "interval" and now - self._last_fsync >= self.fsync_interval):
+                        os.fsync(f.fileno())
+                        self._last_fsync = now
+            # The entry's header starts after the leading newline
+            entry = {"offset": offset + 1, "length": len(data) - 1, "timestamp": timestamp}
+            entry_id = len(self.entries)
+            self._index_entry(entry_id, entry, content.strip())
+            self.indexed_bytes = offset + len(data)
+            self._since_snapshot += 1
+            if self._since_snapshot >= MEMORY_SNAPSHOT_EVERY:
+                self.save_snapshot()
+        return {"id": entry_id, "timestamp": timestamp}
+    
+    def get_entries(self, entry_ids: List[int]) -> List[Dict[str, Any]]:
+        """Whole entries by id, read by offset from the journal"""
+        results = []
+        with open(self.memory_file, "rb") as f:
+            for entry_id in entry_ids:
+                entry = self.entries[entry_id]
+                f.seek(entry["offset"])
+                results.append({
+                    "id": entry_id,
+                    "timestamp": entry["timestamp"],
+                    "content": self._entry_text(f.read(entry["length"]))
+                })
+        return results
+    
+    def search_memory(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """BM25-ranked entries matching the query's terms"""
+        self._catch_up()
+        with self._lock:
+            ranked = self.index.search(query, limit)
+            entries = self.get_entries([entry_id for entry_id, _ in ranked])
+        for entry, (_, score) in zip(entries, ranked):
+            entry["score"] = round(score, 4)
+        return entries
+    
+    # ---------- vector recall ----------
+    
+    def _sync_memory_vectors(self) -> None:
+        """Embed entries that have no vector yet (all of them on the first build), a batch at a time"""
+        while True:
+            with self._lock:
+                start = self._embedded
+                end = min(start + 256, len(self.entries))
+                if start >= end:
+                    self._recall_ready = True
+                    return
+                batch = self.get_entries(list(range(start, end)))
+            vectors = [(f"memory:{entry['id']}", embed(entry["content"])) for entry in batch]
+            with self._lock:
+                if self._embedded != start:
+                    continue  # The journal was re-indexed meanwhile
+                for key, vector in vectors:
+                    self.vectors.add(key, vector)
+                self._embedded = end
+    
+    def _sync_files(self) -> None:
+        """Re-embed workspace text files whose mtime or size changed; drop deleted ones"""
+        now = time.monotonic()
+        if now - self._files_scanned_at < RECALL_RESCAN_INTERVAL:
+            return
+        self._files_scanned_at = now
+        seen = set()
+        for dirpath, dirnames, filenames in os.walk(self.workspace_dir):
+            dirnames[:] = [d for d in dirnames if d not in RECALL_SKIP_DIRS and not d.startswith('.')]
+            for filename in filenames:
+                full_path = Path(dirpath) / filename
+                if full_path == self.memory_file or filename.startswith('.') or full_path.suffix not in RECALL_FILE_SUFFIXES:
+                    continue
+                try:
+                    stat = full_path.stat()
+                except OSError:
+                    continue
+                if stat.st_size > RECALL_MAX_FILE_BYTES:
+                    continue
+                rel_path = str(full_path.relative_to(self.workspace_dir))
+                seen.add(rel_path)
+                if self._files.get(rel_path) == (stat.st_mtime, stat.st_size):
+                    continue
+                try:
+                    lines = full_path.read_text(errors='replace').splitlines()
+                except OSError:
+                    continue
+                chunks = []
+                for start in range(0, len(lines), RECALL_CHUNK_LINES):
+                    text = "\n".join(lines[start:start + RECALL_CHUNK_LINES]).strip()
+                    if not text:
+                        continue
+                    chunks.append((f"file:{rel_path}#{start + 1}", embed(f"{rel_path}\n{text}"), {
+                        "path": rel_path,
+                        "start_line": start + 1,
+                        "end_line": min(start + RECALL_CHUNK_LINES, len(lines)),
+                        "content": text
+                    }))
+                with self._lock:
+                    self._forget_file(rel_path)
+                    for key, vector, chunk in chunks:
+                        self.vectors.add(key, vector)
+                        self._chunks[key] = chunk
+                    self._files[rel_path] = (stat.st_mtime, stat.st_size)
+        with self._lock:
+            for rel_path in set(self._files) - seen:
+                self._forget_file(rel_path)
+    
+    def refresh_recall(self, sources: tuple = ("memory", "files")) -> None:
+        """Bring vectors up to date with the journal and workspace files (blocking)"""
+        with self._refresh_lock:
+            if "memory" in sources:
+                self._sync_memory_vectors()
+            if "files" in sources:
+                self._sync_files()
+    
+    def start_recall_refresh(self) -> None:
+        """refresh_recall() in a background thread, if one is due and none is running"""
+        due = not self._recall_ready or time.monotonic() - self._files_scanned_at >= RECALL_RESCAN_INTERVAL
+        if not due or (self._refresher is not None and self._refresher.is_alive()):
+            return
+        self._refresher = threading.Thread(target=self._background_refresh, name="memory_recall", daemon=True)
+        self._refresher.start()
+    
+    def _background_refresh(self) -> None:
+        try:
+            self.refresh_recall()
+        except Exception as e:
+            logger.error(f"Memory recall index refresh failed: {e}")
+    
+    def _forget_file(self, rel_path: str) -> None:
+        prefix = f"file:{rel_path}#"
+        self.vectors.remove_prefix(prefix)
+        for key in [k for k in self._chunks if k.startswith(prefix)]:
+            del self._chunks[key]
+        self._files.pop(rel_path, None)
+    
+    def recall(
+        self,
+        query: str,
+        k: int = 5,
+        sources: tuple = ("memory", "files"),
+        min_score: float = 0.0,
+        refresh: bool = True
+    ) -> List[Dict[str, Any]]:
+        """Entries and workspace file chunks most similar to the query, best first
+        
+        With refresh=False only vectors built so far are searched.
+        """
+        self._catch_up()
+        if refresh:
+            self.refresh_recall(sources)
+        with self._lock:
+            prefix = None if {"memory", "files"} <= set(sources) else ("memory:" if "memory" in sources else "file:")
+            hits = [(key, score) for key, score in self.vectors.search(embed(query), k, prefix) if score >= min_score]
+            
+            results = []
+            for key, score in hits:
+                if key.startswith("memory:"):
+                    entry = self.get_entries([int(key.split(":", 1)[1])])[0]
+                    results.append({"source": "memory", **entry, "score": round(score, 4)})
+                else:
+                    results.append({"source": "file", **self._chunks[key], "score": round(score, 4)})
+        return results
+    
+    def recall_context(self, query: str, k: int = 5, token_budget: int = 800) -> tuple:
+        """Prompt section with the top-k recalled memories that fit the token budget, and how many were used"""
+        if k <= 0 or token_budget <= 0:
+            return "", 0
+        self.start_recall_refresh()
+        lines = []
+        used_tokens = estimate_tokens("## Relevant memory\n")
+        for item in self.recall(query, k, min_score=RECALL_MIN_SCORE, refresh=False):
+            if item["source"] == "memory":
+                line = f"- [{item['timestamp']}] {item['content']}"
+            else:
+                line = f"- [{item['path']}:{item['start_line']}-{item['end_line']}] {item['content']}"
+            remaining = token_budget - used_tokens
+            if remaining < 16:
+                break
+            if estimate_tokens(line) > remaining:
+                line = line[:remaining * 4 - 1] + "…"
+            lines.append(line)
+            used_tokens += estimate_tokens(line)
+        if not lines:
+            return "", 0
+        return "## Relevant memory\n" + "\n".join(lines), len(lines)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self.entries),
+            "terms": len(self.index.postings),
+            "journal_bytes": self.indexed_bytes,
+            "fsync": self.fsync,
+            "recall_ready": self._recall_ready,
+            "vectors": self.vectors.stats()
+        }
     
     def get_workspace_files(self) -> List[str]:
         """List workspace files"""
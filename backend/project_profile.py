@@ -0,0 +1,529 @@
+"""
+Project Profile
+Pluggable project detection over every package root of a workspace.
+
+Each detector declares the manifest files it understands and contributes
+frameworks, entry points, build system, test setup and run commands for a
+package root. Package roots are every directory holding a known manifest
+(so monorepos with npm workspaces, nested pyproject.toml or go.mod are
+covered). Manifests are read and parsed at most once per profile build
+through a shared PackageContext.
+
+The merged result is a ProjectProfile, cached per project and rebuilt only
+when a manifest or candidate entry file changes.
+"""
+
+import asyncio
+import fnmatch
+import json
+import re
+from pathlib import Path, PurePosixPath
+from typing import Dict, List, Optional, Any, Iterable, Set
+from pydantic import BaseModel, Field
+import logging
+
+try:
+    import tomllib
+    TOML_AVAILABLE = True
+except ImportError:  # Python < 3.11
+    TOML_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+MAX_PACKAGE_ROOTS = 50
+MAX_ENTRY_SNIFF_BYTES = 64 * 1024
+
+PORT_FLAG_RE = re.compile(r'(?:--port[= ]|-p\s+|PORT=)(\d{2,5})')
+LISTEN_RE = re.compile(r'(?:\.listen\(\s*|ListenAndServe\(\s*"[^":]*:|\bport\s*[=:]\s*)(\d{2,5})', re.IGNORECASE)
+EXPOSE_RE = re.compile(r'^\s*EXPOSE\s+(\d{2,5})', re.MULTILINE)
+REQUIREMENT_NAME_RE = re.compile(r'^\s*([A-Za-z0-9][A-Za-z0-9._-]*)')
+NODE_ENTRY_CANDIDATES = ['src/index.tsx', 'src/index.ts', 'src/index.js', 'src/main.tsx', 'src/main.jsx',
+                         'src/main.ts', 'index.js', 'server.js', 'app.js']
+NODE_ENTRY_NAMES = {PurePosixPath(c).name for c in NODE_ENTRY_CANDIDATES}
+
+
+class RunCommands(BaseModel):
+    install: Optional[str] = None
+    dev: Optional[str] = None
+    build: Optional[str] = None
+    test: Optional[str] = None
+    port: Optional[str] = None
+    entry_file: Optional[str] = None
+    run: Optional[str] = None  # One-shot command used by /run when none is given
+
+
+class PackageProfile(BaseModel):
+    root: str  # "" for the workspace root
+    ecosystems: List[str] = Field(default_factory=list)
+    frameworks: List[str] = Field(default_factory=list)
+    entry_points: List[str] = Field(default_factory=list)
+    build_system: Optional[str] = None
+    has_tests: bool = False
+    run_commands: RunCommands = Field(default_factory=RunCommands)
+    workspaces: List[str] = Field(default_factory=list)  # npm/yarn workspace globs declared here
+    managed_by: Optional[str] = None  # Root of the workspace package that installs this one
+
+
+class ProjectProfile(BaseModel):
+    frameworks: List[str] = Field(default_factory=list)
+    entry_points: List[str] = Field(default_factory=list)
+    build_system: Optional[str] = None
+    has_tests: bool = False
+    run_commands: RunCommands = Field(default_factory=RunCommands)
+    packages: List[PackageProfile] = Field(default_factory=list)
+    version: int = -1
+
+
+class PackageContext:
+    """One package root: its file listing and lazily parsed manifests"""
+
+    def __init__(self, workspace_path: Path, root: str, files: Set[str], dirs: Set[str]):
+        self.workspace_path = workspace_path
+        self.root = root
+        self.files = files
+        self.dirs = dirs
+        self._text: Dict[str, Optional[str]] = {}
+        self._parsed: Dict[str, Any] = {}
+
+    def path(self, name: str) -> str:
+        return f"{self.root}/{name}" if self.root else name
+
+    def has(self, name: str) -> bool:
+        return name in self.files
+
+    def has_path(self, rel_path: str) -> bool:
+        """Nested path relative to this root (files only lists top-level names)"""
+        return rel_path in self.files or (self.workspace_path / self.path(rel_path)).is_file()
+
+    def text(self, name: str, limit: Optional[int] = None) -> Optional[str]:
+        if name not in self._text:
+            try:
+                with open(self.workspace_path / self.path(name), 'r', errors='replace') as f:
+                    self._text[name] = f.read(limit) if limit else f.read()
+            except OSError:
+                self._text[name] = None
+        return self._text[name]
+
+    def manifest(self, name: str) -> Any:
+        """Parsed manifest (JSON, TOML, requirement names) or None"""
+        if name in self._parsed:
+            return self._parsed[name]
+        text = self.text(name) if self.has(name) else None
+        parsed = None
+        if text is not None:
+            try:
+                if name.endswith('.json'):
+                    parsed = json.loads(text)
+                elif name.endswith('.toml'):
+                    parsed = tomllib.loads(text) if TOML_AVAILABLE else {}
+                elif name.startswith('requirements') and name.endswith('.txt'):
+                    parsed = [m.group(1).lower() for line in text.splitlines()
+                              if (m := REQUIREMENT_NAME_RE.match(line)) and not line.lstrip().startswith('-')]
+                else:
+                    parsed = text
+            except Exception as e:
+                logger.warning(f"Unparseable manifest {self.path(name)}: {e}")
+        self._parsed[name] = parsed
+        return parsed
+
+
+class Detector:
+    """Base detector: override manifests and detect()"""
+
+    name = "base"
+    manifests: List[str] = []
+
+    def applies(self, ctx: PackageContext) -> bool:
+        return any(ctx.has(m) for m in self.manifests)
+
+    def detect(self, ctx: PackageContext, profile: PackageProfile) -> None:
+        raise NotImplementedError
+
+
+class DetectorRegistry:
+    """Ordered detectors; earlier ones win when filling the same command"""
+
+    def __init__(self):
+        self.detectors: List[Detector] = []
+
+    def register(self, detector_cls):
+        self.detectors.append(detector_cls())
+        return detector_cls
+
+    @property
+    def manifest_names(self) -> Set[str]:
+        return {m for d in self.detectors for m in d.manifests}
+
+
+registry = DetectorRegistry()
+
+
+def first_port(*texts: Optional[str], pattern=PORT_FLAG_RE) -> Optional[str]:
+    for text in texts:
+        if text:
+            match = pattern.search(text)
+            if match:
+                return match.group(1)
+    return None
+
+
+@registry.register
+class NodeDetector(Detector):
+    name = "node"
+    manifests = ['package.json']
+
+    FRAMEWORKS = [
+        ('next', 'Next.js', '3000'), ('react', 'React', '3000'), ('vue', 'Vue.js', '8080'),
+        ('@angular/core', 'Angular', '4200'), ('angular', 'Angular', '4200'), ('svelte', 'Svelte', '5173'),
+        ('@nestjs/core', 'NestJS', '3000'), ('nestjs', 'NestJS', '3000'), ('express', 'Express.js', '3000'),
+        ('fastify', 'Fastify', '3000'), ('vite', None, '5173')
+    ]
+
+    def detect(self, ctx: PackageContext, profile: PackageProfile) -> None:
+        pkg = ctx.manifest('package.json') or {}
+        deps = {**pkg.get('dependencies', {}), **pkg.get('devDependencies', {})}
+        scripts = pkg.get('scripts', {}) or {}
+        profile.ecosystems.append("node")
+        workspaces = pkg.get('workspaces') or []
+        if isinstance(workspaces, dict):  # yarn: {"packages": [...]}
+            workspaces = workspaces.get('packages') or []
+        profile.workspaces = [w.rstrip('/') for w in workspaces if isinstance(w, str)]
+
+        default_port = None
+        for dep, framework, port in self.FRAMEWORKS:
+            if dep in deps:
+                if framework and framework not in profile.frameworks:
+                    profile.frameworks.append(framework)
+                default_port = default_port or port
+        if 'vite' in deps or any('vite' in str(v) for v in scripts.values()):
+            default_port = '5173'
+
+        if ctx.has('yarn.lock'):
+            manager = 'yarn'
+        elif ctx.has('pnpm-lock.yaml'):
+            manager = 'pnpm'
+        else:
+            manager = 'npm'
+        profile.build_system = profile.build_system or 'npm/yarn'
+
+        commands = profile.run_commands
+        commands.install = commands.install or f"{manager} install"
+        for script in ('dev', 'start', 'serve'):
+            if script in scripts:
+                commands.dev = commands.dev or ("npm start" if script == 'start' else f"npm run {script}")
+                break
+        if 'build' in scripts:
+            commands.build = commands.build or "npm run build"
+        if 'test' in scripts:
+            commands.test = commands.test or "npm test"
+
+        main_field = pkg.get('main')
+        entry = main_field
+        if not entry:
+            for candidate in NODE_ENTRY_CANDIDATES:
+                if ctx.has_path(candidate):
+                    entry = candidate
+                    break
+        commands.entry_file = commands.entry_file or entry
+        if main_field:
+            profile.entry_points.append(main_field)
+        if 'start' in scripts:
+            profile.entry_points.append('npm start')
+            commands.run = commands.run or "npm start"
+        elif main_field:
+            commands.run = commands.run or f"node {main_field}"
+
+        entry_text = ctx.text(entry, MAX_ENTRY_SNIFF_BYTES) if entry else None
+        commands.port = commands.port or first_port(
+            scripts.get('dev'), scripts.get('start'), scripts.get('serve'), ctx.text('.env') if ctx.has('.env') else None
+        ) or first_port(entry_text, pattern=LISTEN_RE) or default_port or ("3000" if commands.dev else None)
+
+        if any(d in deps for d in ('jest', 'mocha', 'vitest', '@playwright/test', 'cypress')):
+            profile.has_tests = True
+
+
+@registry.register
+class PythonDetector(Detector):
+    name = "python"
+    manifests = ['requirements.txt', 'pyproject.toml', 'setup.py', 'Pipfile']
+
+    FRAMEWORKS = [('django', 'Django'), ('flask', 'Flask'), ('fastapi', 'FastAPI'),
+                  ('torch', 'PyTorch'), ('pytorch', 'PyTorch'), ('tensorflow', 'TensorFlow'),
+                  ('streamlit', 'Streamlit')]
+    ENTRY_CANDIDATES = ['main.py', 'app.py', 'server.py', 'manage.py', 'run.py', '__main__.py']
+
+    def _requirements(self, ctx: PackageContext) -> List[str]:
+        names = list(ctx.manifest('requirements.txt') or [])
+        pyproject = ctx.manifest('pyproject.toml') or {}
+        project_deps = (pyproject.get('project') or {}).get('dependencies') or []
+        names += [m.group(1).lower() for d in project_deps if (m := REQUIREMENT_NAME_RE.match(d))]
+        poetry = ((pyproject.get('tool') or {}).get('poetry') or {})
+        names += [n.lower() for n in (poetry.get('dependencies') or {})]
+        names += [n.lower() for n in ((poetry.get('group') or {}).get('dev', {}).get('dependencies') or {})]
+        if not TOML_AVAILABLE and ctx.has('pyproject.toml'):
+            names += re.findall(r'["\']([A-Za-z0-9_.-]+)', (ctx.text('pyproject.toml') or '').lower())
+        return names
+
+    def detect(self, ctx: PackageContext, profile: PackageProfile) -> None:
+        profile.ecosystems.append("python")
+        profile.build_system = profile.build_system or 'pip'
+        requirements = set(self._requirements(ctx))
+        for dep, framework in self.FRAMEWORKS:
+            if dep in requirements and framework not in profile.frameworks:
+                profile.frameworks.append(framework)
+        if 'pytest' in requirements:
+            profile.has_tests = True
+        pyproject = ctx.manifest('pyproject.toml') or {}
+        if 'pytest' in ((pyproject.get('tool') or {})) or ctx.has('pytest.ini') or ctx.has('conftest.py'):
+            profile.has_tests = True
+
+        commands = profile.run_commands
+        if ctx.has('requirements.txt'):
+            commands.install = commands.install or "pip install -r requirements.txt"
+        elif ctx.has('pyproject.toml') or ctx.has('setup.py'):
+            commands.install = commands.install or "pip install -e ."
+        if profile.has_tests:
+            commands.test = commands.test or "pytest"
+
+        for entry in self.ENTRY_CANDIDATES:
+            if ctx.has(entry):
+                profile.entry_points.append(entry)
+        entry = next((e for e in self.ENTRY_CANDIDATES if ctx.has(e)), None)
+        if not entry:
+            return
+        commands.entry_file = commands.entry_file or entry
+        commands.run = commands.run or f"python {entry}"
+
+        source = ctx.text(entry, MAX_ENTRY_SNIFF_BYTES) or ""
+        explicit_port = first_port(source, pattern=LISTEN_RE)
+        if entry == 'manage.py':
+            commands.dev = commands.dev or "python manage.py runserver"
+            commands.port = commands.port or explicit_port or "8000"
+        elif 'FastAPI' in source:
+            port = explicit_port or "8000"
+            commands.dev = commands.dev or f"uvicorn {entry[:-3]}:app --reload --port {port}"
+            commands.port = commands.port or port
+        elif 'Flask' in source:
+            commands.dev = commands.dev or f"python {entry}"
+            commands.port = commands.port or explicit_port or "5000"
+        else:
+            commands.dev = commands.dev or f"python {entry}"
+            commands.port = commands.port or explicit_port
+
+
+@registry.register
+class GoDetector(Detector):
+    name = "go"
+    manifests = ['go.mod']
+
+    def detect(self, ctx: PackageContext, profile: PackageProfile) -> None:
+        profile.ecosystems.append("go")
+        profile.build_system = profile.build_system or 'Go Modules'
+        if 'Go' not in profile.frameworks:
+            profile.frameworks.append('Go')
+        commands = profile.run_commands
+        commands.install = commands.install or "go mod download"
+        commands.build = commands.build or "go build ./..."
+        commands.test = commands.test or "go test ./..."
+        if ctx.has('main.go'):
+            profile.entry_points.append('main.go')
+            commands.entry_file = commands.entry_file or 'main.go'
+            commands.run = commands.run or "go run ."
+            commands.dev = commands.dev or "go run ."
+            commands.port = commands.port or first_port(ctx.text('main.go', MAX_ENTRY_SNIFF_BYTES), pattern=LISTEN_RE)
+        if any(f.endswith('_test.go') for f in ctx.files):
+            profile.has_tests = True
+
+
+@registry.register
+class RustDetector(Detector):
+    name = "rust"
+    manifests = ['Cargo.toml']
+
+    def detect(self, ctx: PackageContext, profile: PackageProfile) -> None:
+        profile.ecosystems.append("rust")
+        profile.build_system = profile.build_system or 'Cargo'
+        if 'Rust' not in profile.frameworks:
+            profile.frameworks.append('Rust')
+        commands = profile.run_commands
+        commands.build = commands.build or "cargo build"
+        commands.test = commands.test or "cargo test"
+        commands.run = commands.run or "cargo run"
+        commands.dev = commands.dev or "cargo run"
+
+
+@registry.register
+class JvmDetector(Detector):
+    name = "jvm"
+    manifests = ['pom.xml', 'build.gradle', 'build.gradle.kts']
+
+    def detect(self, ctx: PackageContext, profile: PackageProfile) -> None:
+        profile.ecosystems.append("jvm")
+        commands = profile.run_commands
+        if ctx.has('pom.xml'):
+            profile.build_system = 'Maven'
+            profile.frameworks.append('Java/Maven')
+            commands.build = commands.build or "mvn package"
+            commands.test = commands.test or "mvn test"
+        else:
+            profile.build_system = 'Gradle'
+            profile.frameworks.append('Java/Gradle')
+            gradle = "./gradlew" if ctx.has('gradlew') else "gradle"
+            commands.build = commands.build or f"{gradle} build"
+            commands.test = commands.test or f"{gradle} test"
+
+
+@registry.register
+class DockerDetector(Detector):
+    name = "docker"
+    manifests = ['Dockerfile', 'docker-compose.yml', 'docker-compose.yaml', 'compose.yaml']
+
+    def detect(self, ctx: PackageContext, profile: PackageProfile) -> None:
+        if 'Docker' not in profile.frameworks:
+            profile.frameworks.append('Docker')
+        if not ctx.has('Dockerfile'):
+            return
+        exposed = first_port(ctx.text('Dockerfile'), pattern=EXPOSE_RE)
+        commands = profile.run_commands
+        port = exposed or commands.port or "3000"
+        commands.build = commands.build or "docker build -t myapp ."
+        commands.dev = commands.dev or f"docker run -p {port}:{port} myapp"
+        commands.port = commands.port or exposed
+
+
+@registry.register
+class TestDirsDetector(Detector):
+    name = "tests"
+    manifests = []
+
+    def applies(self, ctx: PackageContext) -> bool:
+        return True
+
+    def detect(self, ctx: PackageContext, profile: PackageProfile) -> None:
+        if ctx.dirs & {'tests', 'test', '__tests__', 'spec'}:
+            profile.has_tests = True
+
+
+def find_package_roots(paths: Iterable[str], manifest_names: Set[str]) -> Dict[str, Dict[str, Set[str]]]:
+    """Directory -> {"files": top-level file names, "dirs": child dir names} for every package root"""
+    listing: Dict[str, Dict[str, Set[str]]] = {}
+    for path in paths:
+        pure = PurePosixPath(path)
+        parent = "" if str(pure.parent) == "." else str(pure.parent)
+        listing.setdefault(parent, {"files": set(), "dirs": set()})["files"].add(pure.name)
+        parts = pure.parts
+        for i in range(len(parts) - 1):
+            d = "/".join(parts[:i])
+            listing.setdefault(d, {"files": set(), "dirs": set()})["dirs"].add(parts[i])
+
+    roots = {d: entry for d, entry in listing.items() if d == "" or entry["files"] & manifest_names}
+    ordered = sorted(roots, key=lambda d: (d.count('/') if d else -1, d))[:MAX_PACKAGE_ROOTS]
+    return {d: roots[d] for d in ordered}
+
+
+def _prefixed(root: str, command: Optional[str]) -> Optional[str]:
+    return f"cd {root} && {command}" if command and root else command
+
+
+def build_profile(workspace_path: Path, paths: Iterable[str], version: int = -1) -> ProjectProfile:
+    """Run every applicable detector over every package root and merge the results"""
+    workspace_path = Path(workspace_path)
+    roots = find_package_roots(paths, registry.manifest_names)
+    packages: List[PackageProfile] = []
+
+    for root, listing in roots.items():
+        ctx = PackageContext(workspace_path, root, listing["files"], listing["dirs"])
+        package = PackageProfile(root=root)
+        for detector in registry.detectors:
+            if detector.applies(ctx):
+                try:
+                    detector.detect(ctx, package)
+                except Exception as e:
+                    logger.warning(f"Detector {detector.name} failed on '{root or '.'}': {e}")
+        if root == "" or package.ecosystems:
+            packages.append(package)
+
+    # Workspace members are installed by their workspace root, not on their own
+    for owner in packages:
+        for member in packages:
+            if member is owner or not owner.workspaces or "node" not in member.ecosystems:
+                continue
+            prefix = f"{owner.root}/" if owner.root else ""
+            if member.root.startswith(prefix) and any(
+                fnmatch.fnmatch(member.root[len(prefix):], pattern) for pattern in owner.workspaces
+            ):
+                member.managed_by = owner.root
+
+    profile = ProjectProfile(packages=packages, version=version)
+    for package in packages:
+        for framework in package.frameworks:
+            if framework not in profile.frameworks:
+                profile.frameworks.append(framework)
+        for entry in package.entry_points:
+            qualified = entry if not package.root or ' ' in entry else f"{package.root}/{entry}"
+            if qualified not in profile.entry_points:
+                profile.entry_points.append(qualified)
+        profile.build_system = profile.build_system or package.build_system
+        profile.has_tests = profile.has_tests or package.has_tests
+
+    # Project-level commands: the root package, else the first package that defines each one
+    merged = RunCommands()
+    for package in packages:
+        commands = package.run_commands
+        for field in ('install', 'dev', 'build', 'test', 'run'):
+            if getattr(merged, field) is None and getattr(commands, field):
+                setattr(merged, field, _prefixed(package.root, getattr(commands, field)))
+        if merged.entry_file is None and commands.entry_file:
+            merged.entry_file = f"{package.root}/{commands.entry_file}" if package.root else commands.entry_file
+        merged.port = merged.port or commands.port
+    profile.run_commands = merged
+    return profile
+
+
+def is_profile_input(path: str, manifest_names: Optional[Set[str]] = None) -> bool:
+    """Whether editing an existing file can change the profile (manifests, entry files, env)"""
+    names = manifest_names if manifest_names is not None else registry.manifest_names
+    name = PurePosixPath(path).name
+    return (
+        name in names
+        or name in PythonDetector.ENTRY_CANDIDATES
+        or name in NODE_ENTRY_NAMES
+        or name in ('main.go', '.env', 'pytest.ini', 'conftest.py', 'yarn.lock', 'pnpm-lock.yaml')
+    )
+
+
+class ProjectProfiler:
+    """Per-project cache of ProjectProfile, invalidated by relevant manifest changes"""
+
+    def __init__(self):
+        self.profiles: Dict[str, ProjectProfile] = {}
+        self.layouts: Dict[str, int] = {}  # project -> hash of the path set the profile was built from
+
+    def put(self, project_id: str, profile: ProjectProfile, paths: Iterable[str]) -> ProjectProfile:
+        self.profiles[project_id] = profile
+        self.layouts[project_id] = hash(frozenset(paths))
+        return profile
+
+    async def get(self, project_id: str, workspace_path: Path, manifest: Dict[str, Any], manifest_store) -> ProjectProfile:
+        cached = self.profiles.get(project_id)
+        paths = manifest["files"].keys()
+        if cached is not None:
+            if cached.version == manifest["version"]:
+                return cached
+            # Adding or removing files changes package roots and test layout; edits
+            # only matter when they touch a manifest or an entry file
+            delta = manifest_store.changes_since(manifest, cached.version) if cached.version >= 0 else None
+            if delta is not None and not delta["deleted"] and self.layouts.get(project_id) == hash(frozenset(paths)):
+                if not any(is_profile_input(c["path"]) for c in delta["changed"]):
+                    cached.version = manifest["version"]
+                    return cached
+        profile = await asyncio.to_thread(build_profile, workspace_path, list(paths), manifest["version"])
+        return self.put(project_id, profile, paths)
+
+    def forget(self, project_id: str) -> None:
+        self.profiles.pop(project_id, None)
+        self.layouts.pop(project_id, None)
+
+
+# Global profile cache
+project_profiler = ProjectProfiler()
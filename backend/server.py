@@ -1,15 +1,18 @@
-from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Form, WebSocket, WebSocketDisconnect, Request
+from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Form, WebSocket, WebSocketDisconnect, Request, Response
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import StreamingResponse, JSONResponse
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
 import requests
 import json
+import re
 import httpx
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Iterator
+from contextlib import asynccontextmanager, contextmanager
 import uuid
 from datetime import datetime, timezone
 import zipfile
@@ -19,6 +22,7 @@ import base64
 import subprocess
 import asyncio
 import shutil
+import hashlib
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -69,6 +73,138 @@ class AuthCheckResponse(BaseModel):
 WORKSPACE_DIR = Path("/tmp/live_code_mentor_workspaces")
 WORKSPACE_DIR.mkdir(exist_ok=True)
 
+# Persistent per-project manifests (paths, sizes, mtimes, hashes)
+from workspace_manifest import WorkspaceManifestStore, hash_file
+workspace_manifests = WorkspaceManifestStore(WORKSPACE_DIR / ".manifests")
+
+# Content-addressed storage shared by all workspaces (dedup + cheap forks where the filesystem has reflinks)
+from blob_store import BlobStore, atomic_write, atomic_write_text
+blob_store = BlobStore(WORKSPACE_DIR / ".blobs")
+
+from code_search import code_search
+from symbol_index import symbol_index
+from file_access import (
+    file_etag, etag_version, last_modified, etag_matches, is_binary, guess_media_type,
+    parse_range, parse_line_range, iter_file, line_indexes
+)
+from text_patch import PatchError, apply_edits, apply_unified_diff
+from suite_runner import suite_runner
+from dependency_cache import DependencyCache
+dependency_cache = DependencyCache(WORKSPACE_DIR / ".deps")
+from build_cache import BuildCache, BuildError, TOOLCHAINS, resolve_language, language_for_path, default_main, project_sources
+build_cache = BuildCache(WORKSPACE_DIR / ".builds")
+
+# Idle workspaces are archived to tarballs and restored on next access
+from workspace_lifecycle import WorkspaceLifecycle, WorkspaceArchivedError
+from project_profile import project_profiler, ProjectProfile
+from static_analysis import static_analyzer
+from warmup import warmup_pipeline
+workspace_lifecycle = WorkspaceLifecycle(
+    db.workspace_lifecycle,
+    WORKSPACE_DIR / ".archive",
+    idle_ttl=float(os.environ.get('WORKSPACE_IDLE_SECONDS', 6 * 3600)),
+    global_quota=int(os.environ.get('WORKSPACE_GLOBAL_QUOTA_BYTES', 20 * 1024 ** 3)),
+    user_quota=int(os.environ.get('WORKSPACE_USER_QUOTA_BYTES', 2 * 1024 ** 3))
+)
+workspace_lifecycle.add_root("project", WORKSPACE_DIR)
+def forget_project_state(kind: str, workspace_id: str) -> None:
+    """Drop in-memory per-project state (indexes, caches, watcher) of an archived or deleted workspace"""
+    if kind == "project":
+        workspace_manifests.forget(workspace_id)
+        code_search.forget(workspace_id)
+        symbol_index.forget(workspace_id)
+        suite_runner.forget(workspace_id)
+        project_profiler.forget(workspace_id)
+        static_analyzer.forget(workspace_id)
+        warmup_pipeline.forget(workspace_id)
+
+workspace_lifecycle.archive_hooks.append(forget_project_state)
+
+# Directories with a terminal or foreground exec command running in them -> count
+active_workdirs: Dict[str, int] = {}
+
+@contextmanager
+def running_in(workdir) -> Iterator[None]:
+    key = str(Path(workdir).resolve())
+    active_workdirs[key] = active_workdirs.get(key, 0) + 1
+    try:
+        yield
+    finally:
+        active_workdirs[key] -= 1
+        if not active_workdirs[key]:
+            del active_workdirs[key]
+
+def workspace_in_use(kind: str, workspace_id: str) -> bool:
+    """Whether a terminal command or exec session is running inside the workspace"""
+    root = workspace_lifecycle.roots.get(kind)
+    if root is None:
+        return False
+    path = (root / workspace_id).resolve()
+
+    def inside(workdir) -> bool:
+        return bool(workdir) and Path(workdir).resolve().is_relative_to(path)
+
+    if any(inside(workdir) for workdir in active_workdirs):
+        return True
+    return any(s["status"] == "running" and inside(s.get("workdir")) for s in process_manager.sessions.values())
+
+workspace_lifecycle.busy_checks.append(workspace_in_use)
+
+async def collect_blobs() -> int:
+    """Drop upload trees of projects that are archived or gone, and the blobs only they referenced"""
+    archived = {r["workspace_id"] for r in workspace_lifecycle.records.values()
+                if r["kind"] == "project" and r["archived"]}
+    live_trees = set()
+    async for doc in projects_collection.find({"archive_hash": {"$exists": True}},
+                                             {"_id": 0, "project_id": 1, "archive_hash": 1}):
+        if doc["project_id"] not in archived:
+            live_trees.add(doc["archive_hash"])
+    result = await asyncio.to_thread(blob_store.gc, live_trees)
+    if result["blobs_removed"]:
+        logger.info(f"Blob store gc: {result}")
+    return result["bytes_freed"]
+
+workspace_lifecycle.reclaim_hooks.append(collect_blobs)
+
+WORKSPACE_ROUTES = [
+    ("project", re.compile(r"^/api/project/([0-9a-f-]{36})(?:/|$)")),
+    ("remotion", re.compile(r"^/api/remotion/(?:studio|project|installed-packages)/([\w-]+)")),
+]
+
+@app.middleware("http")
+async def track_workspace_access(request: Request, call_next):
+    """Restore archived workspaces and record last access before handling the request
+
+    The workspace is held for the duration of the handler so the reaper
+    does not archive it underneath the request.
+    """
+    for kind, pattern in WORKSPACE_ROUTES:
+        match = pattern.match(request.url.path)
+        if not match:
+            continue
+        route = request.url.path.rstrip('/')
+        if request.method == "DELETE" and route == match.group(0).rstrip('/'):
+            break  # Deleting: no point restoring the archive first
+        try:
+            await workspace_lifecycle.ensure_active(kind, match.group(1))
+        except WorkspaceArchivedError as e:
+            return JSONResponse(status_code=410, content={"detail": str(e)})
+        except Exception as e:
+            logger.error(f"Workspace restore error: {e}")
+            break
+        if request.method == "POST" and route == match.group(0).rstrip('/') + "/archive":
+            break  # The archive request itself must not count as using the workspace
+        with workspace_lifecycle.hold(kind, match.group(1)):
+            return await call_next(request)
+    return await call_next(request)
+
+MAX_INLINE_FILE_SIZE = 1024 * 1024  # Largest file (or line window) returned inline as JSON
+
+PROMPT_CONTEXT_TOKENS = 3750  # Source context budget for whole-project prompts
+
+from analysis_cache import AnalysisCache, cache_key
+analysis_cache = AnalysisCache(db.analysis_cache)
+
 # ============== SKILL LEVEL DEFINITIONS ==============
 
 SKILL_LEVEL_PROMPTS = {
@@ -100,56 +236,7 @@ SKILL_LEVEL_PROMPTS = {
 
 # ============== LANGUAGE DETECTION ==============
 
-LANGUAGE_EXTENSIONS = {
-    '.py': {'name': 'Python', 'color': '#3572A5'},
-    '.js': {'name': 'JavaScript', 'color': '#f1e05a'},
-    '.ts': {'name': 'TypeScript', 'color': '#2b7489'},
-    '.jsx': {'name': 'JavaScript', 'color': '#f1e05a'},
-    '.tsx': {'name': 'TypeScript', 'color': '#2b7489'},
-    '.java': {'name': 'Java', 'color': '#b07219'},
-    '.cpp': {'name': 'C++', 'color': '#f34b7d'},
-    '.c': {'name': 'C', 'color': '#555555'},
-    '.h': {'name': 'C/C++ Header', 'color': '#555555'},
-    '.hpp': {'name': 'C++', 'color': '#f34b7d'},
-    '.go': {'name': 'Go', 'color': '#00ADD8'},
-    '.rs': {'name': 'Rust', 'color': '#dea584'},
-    '.rb': {'name': 'Ruby', 'color': '#701516'},
-    '.php': {'name': 'PHP', 'color': '#4F5D95'},
-    '.cs': {'name': 'C#', 'color': '#178600'},
-    '.swift': {'name': 'Swift', 'color': '#ffac45'},
-    '.kt': {'name': 'Kotlin', 'color': '#F18E33'},
-    '.scala': {'name': 'Scala', 'color': '#c22d40'},
-    '.sql': {'name': 'SQL', 'color': '#e38c00'},
-    '.html': {'name': 'HTML', 'color': '#e34c26'},
-    '.css': {'name': 'CSS', 'color': '#563d7c'},
-    '.scss': {'name': 'SCSS', 'color': '#c6538c'},
-    '.sass': {'name': 'Sass', 'color': '#a53b70'},
-    '.less': {'name': 'Less', 'color': '#1d365d'},
-    '.json': {'name': 'JSON', 'color': '#292929'},
-    '.xml': {'name': 'XML', 'color': '#0060ac'},
-    '.yaml': {'name': 'YAML', 'color': '#cb171e'},
-    '.yml': {'name': 'YAML', 'color': '#cb171e'},
-    '.md': {'name': 'Markdown', 'color': '#083fa1'},
-    '.sh': {'name': 'Shell', 'color': '#89e051'},
-    '.bash': {'name': 'Bash', 'color': '#89e051'},
-    '.vue': {'name': 'Vue', 'color': '#41b883'},
-    '.svelte': {'name': 'Svelte', 'color': '#ff3e00'},
-    '.dart': {'name': 'Dart', 'color': '#00B4AB'},
-    '.r': {'name': 'R', 'color': '#198CE7'},
-    '.lua': {'name': 'Lua', 'color': '#000080'},
-    '.pl': {'name': 'Perl', 'color': '#0298c3'},
-    '.ex': {'name': 'Elixir', 'color': '#6e4a7e'},
-    '.exs': {'name': 'Elixir', 'color': '#6e4a7e'},
-    '.erl': {'name': 'Erlang', 'color': '#B83998'},
-    '.hs': {'name': 'Haskell', 'color': '#5e5086'},
-    '.clj': {'name': 'Clojure', 'color': '#db5855'},
-    '.dockerfile': {'name': 'Dockerfile', 'color': '#384d54'},
-    '.toml': {'name': 'TOML', 'color': '#9c4221'},
-    '.ini': {'name': 'INI', 'color': '#d1dbe0'},
-    '.env': {'name': 'Environment', 'color': '#faf743'},
-    '.graphql': {'name': 'GraphQL', 'color': '#e10098'},
-    '.proto': {'name': 'Protocol Buffers', 'color': '#5592b5'},
-}
+from workspace_scanner import LANGUAGE_EXTENSIONS, scan_workspace
 
 # ============== MODELS ==============
 
@@ -182,11 +269,18 @@ class ProjectStructure(BaseModel):
     build_system: Optional[str] = None
     has_tests: bool
     readme_content: Optional[str] = None
+    storage: Optional[str] = None  # "reflink" (deduplicated via the blob store) or "copy"
 
 class FileContent(BaseModel):
     path: str
     content: str
     language: str
+    size: Optional[int] = None
+    binary: bool = False
+    start_line: Optional[int] = None
+    end_line: Optional[int] = None
+    total_lines: Optional[int] = None
+    truncated: bool = False
 
 class SaveFileRequest(BaseModel):
     project_id: str
@@ -206,6 +300,9 @@ class RunProjectResponse(BaseModel):
     execution_time: float
     error_explanation: Optional[str] = None
     fix_suggestion: Optional[str] = None
+    compile_time: Optional[float] = None  # Compiled languages only; 0 when the build was cached
+    run_time: Optional[float] = None
+    build_cached: Optional[bool] = None
 
 class TerminalCommand(BaseModel):
     project_id: str
@@ -436,199 +533,6 @@ def get_language_info(filename: str) -> dict:
     ext = Path(filename).suffix.lower()
     return LANGUAGE_EXTENSIONS.get(ext, {'name': 'Unknown', 'color': '#808080'})
 
-def build_file_tree(directory: Path, base_path: str = "") -> FileNode:
-    """Build a file tree structure from a directory"""
-    name = directory.name or "root"
-    children = []
-    
-    try:
-        items = sorted(directory.iterdir(), key=lambda x: (not x.is_dir(), x.name.lower()))
-        for item in items:
-            if item.name.startswith('.') and item.name not in ['.env', '.gitignore', '.eslintrc']:
-                continue
-            if item.name in ['node_modules', '__pycache__', '.git', 'venv', 'env', 'dist', 'build', '.next']:
-                continue
-                
-            rel_path = f"{base_path}/{item.name}" if base_path else item.name
-            
-            if item.is_dir():
-                child_node = build_file_tree(item, rel_path)
-                if child_node.children:  # Only include non-empty directories
-                    children.append(child_node)
-            else:
-                lang_info = get_language_info(item.name)
-                children.append(FileNode(
-                    name=item.name,
-                    path=rel_path,
-                    type='file',
-                    language=lang_info['name'],
-                    size=item.stat().st_size
-                ))
-    except PermissionError:
-        pass
-    
-    return FileNode(
-        name=name,
-        path=base_path or "/",
-        type='directory',
-        children=children
-    )
-
-def calculate_language_stats(directory: Path) -> List[LanguageStats]:
-    """Calculate language statistics like GitHub"""
-    lang_bytes = {}
-    lang_files = {}
-    
-    def scan_files(dir_path: Path):
-        try:
-            for item in dir_path.iterdir():
-                if item.name.startswith('.'):
-                    continue
-                if item.name in ['node_modules', '__pycache__', '.git', 'venv', 'env', 'dist', 'build']:
-                    continue
-                    
-                if item.is_dir():
-                    scan_files(item)
-                elif item.is_file():
-                    ext = item.suffix.lower()
-                    if ext in LANGUAGE_EXTENSIONS:
-                        lang_info = LANGUAGE_EXTENSIONS[ext]
-                        lang_name = lang_info['name']
-                        size = item.stat().st_size
-                        
-                        if lang_name not in lang_bytes:
-                            lang_bytes[lang_name] = 0
-                            lang_files[lang_name] = 0
-                        lang_bytes[lang_name] += size
-                        lang_files[lang_name] += 1
-        except PermissionError:
-            pass
-    
-    scan_files(directory)
-    
-    total_bytes = sum(lang_bytes.values()) or 1
-    
-    stats = []
-    for lang_name, bytes_count in sorted(lang_bytes.items(), key=lambda x: -x[1]):
-        ext = next((k for k, v in LANGUAGE_EXTENSIONS.items() if v['name'] == lang_name), None)
-        color = LANGUAGE_EXTENSIONS.get(ext, {}).get('color', '#808080')
-        
-        stats.append(LanguageStats(
-            name=lang_name,
-            percentage=round((bytes_count / total_bytes) * 100, 1),
-            bytes=bytes_count,
-            color=color,
-            file_count=lang_files[lang_name]
-        ))
-    
-    return stats[:10]  # Top 10 languages
-
-def detect_frameworks_and_entry_points(directory: Path) -> tuple:
-    """Detect frameworks, entry points, and build systems"""
-    frameworks = []
-    entry_points = []
-    build_system = None
-    has_tests = False
-    
-    files_in_root = [f.name for f in directory.iterdir() if f.is_file()]
-    dirs_in_root = [d.name for d in directory.iterdir() if d.is_dir()]
-    
-    # Node.js / JavaScript
-    if 'package.json' in files_in_root:
-        try:
-            pkg = json.loads((directory / 'package.json').read_text())
-            deps = {**pkg.get('dependencies', {}), **pkg.get('devDependencies', {})}
-            
-            if 'react' in deps:
-                frameworks.append('React')
-            if 'vue' in deps:
-                frameworks.append('Vue.js')
-            if 'angular' in deps or '@angular/core' in deps:
-                frameworks.append('Angular')
-            if 'next' in deps:
-                frameworks.append('Next.js')
-            if 'express' in deps:
-                frameworks.append('Express.js')
-            if 'fastify' in deps:
-                frameworks.append('Fastify')
-            if 'nestjs' in deps or '@nestjs/core' in deps:
-                frameworks.append('NestJS')
-            if 'svelte' in deps:
-                frameworks.append('Svelte')
-            
-            # Entry points
-            if pkg.get('main'):
-                entry_points.append(pkg['main'])
-            if 'scripts' in pkg:
-                if 'start' in pkg['scripts']:
-                    entry_points.append('npm start')
-            
-            build_system = 'npm/yarn'
-            
-            if 'jest' in deps or 'mocha' in deps or 'vitest' in deps:
-                has_tests = True
-        except:
-            pass
-    
-    # Python
-    if 'requirements.txt' in files_in_root or 'setup.py' in files_in_root or 'pyproject.toml' in files_in_root:
-        build_system = build_system or 'pip'
-        
-        # Check for frameworks
-        req_file = directory / 'requirements.txt'
-        if req_file.exists():
-            try:
-                reqs = req_file.read_text().lower()
-                if 'django' in reqs:
-                    frameworks.append('Django')
-                if 'flask' in reqs:
-                    frameworks.append('Flask')
-                if 'fastapi' in reqs:
-                    frameworks.append('FastAPI')
-                if 'pytorch' in reqs or 'torch' in reqs:
-                    frameworks.append('PyTorch')
-                if 'tensorflow' in reqs:
-                    frameworks.append('TensorFlow')
-                if 'pytest' in reqs:
-                    has_tests = True
-            except:
-                pass
-        
-        # Common Python entry points
-        for ep in ['main.py', 'app.py', 'server.py', 'manage.py', 'run.py', '__main__.py']:
-            if ep in files_in_root:
-                entry_points.append(ep)
-    
-    # Java / Kotlin
-    if 'pom.xml' in files_in_root:
-        build_system = 'Maven'
-        frameworks.append('Java/Maven')
-    if 'build.gradle' in files_in_root or 'build.gradle.kts' in files_in_root:
-        build_system = 'Gradle'
-        frameworks.append('Java/Gradle')
-    
-    # Go
-    if 'go.mod' in files_in_root:
-        build_system = 'Go Modules'
-        frameworks.append('Go')
-        if 'main.go' in files_in_root:
-            entry_points.append('main.go')
-    
-    # Rust
-    if 'Cargo.toml' in files_in_root:
-        build_system = 'Cargo'
-        frameworks.append('Rust')
-    
-    # Docker
-    if 'Dockerfile' in files_in_root or 'docker-compose.yml' in files_in_root:
-        frameworks.append('Docker')
-    
-    # Tests detection
-    if 'tests' in dirs_in_root or 'test' in dirs_in_root or '__tests__' in dirs_in_root:
-        has_tests = True
-    
-    return frameworks, entry_points, build_system, has_tests
-
 # ============== API ENDPOINTS ==============
 
 @api_router.get("/health")
@@ -717,56 +621,82 @@ async def logout(request: dict):
 
 # ============== PROJECT / IDE ENDPOINTS ==============
 
+async def workspace_owner(request: Request, session_token: Optional[str]) -> str:
+    """Quota key for a new workspace: the signed-in account, else the client address"""
+    if session_token:
+        session = await auth_sessions_collection.find_one({"session_token": session_token})
+        if session and session.get('expires_at', 0) >= datetime.now(timezone.utc).timestamp():
+            return f"user:{session['email']}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
 @api_router.post("/upload-project")
-async def upload_project(file: UploadFile = File(...)):
+async def upload_project(request: Request, file: UploadFile = File(...), session_token: Optional[str] = Form(None)):
     """Upload and extract a project ZIP file"""
     try:
+        user_id = await workspace_owner(request, session_token)
         project_id = str(uuid.uuid4())
         workspace_path = WORKSPACE_DIR / project_id
-        workspace_path.mkdir(parents=True, exist_ok=True)
         
-        # Read and extract ZIP
+        # Read ZIP; on reflink hosts identical archives are materialized from the blob store
         content = await file.read()
+        archive_hash = hashlib.sha256(content).hexdigest()
         
+        # Archive idle workspaces if this one would push the user or host over quota
         with zipfile.ZipFile(io.BytesIO(content), 'r') as zip_ref:
-            zip_ref.extractall(workspace_path)
-        
-        # Handle nested directory (common in GitHub downloads)
-        items = list(workspace_path.iterdir())
-        if len(items) == 1 and items[0].is_dir():
-            nested_dir = items[0]
-            for item in nested_dir.iterdir():
-                shutil.move(str(item), str(workspace_path / item.name))
-            nested_dir.rmdir()
-        
-        # Build file tree
-        file_tree = build_file_tree(workspace_path)
-        
-        # Calculate language stats
-        language_stats = calculate_language_stats(workspace_path)
+            extracted_size = sum(info.file_size for info in zip_ref.infolist())
+        if not await workspace_lifecycle.make_room(user_id, extracted_size):
+            raise HTTPException(status_code=507, detail="Workspace storage quota exceeded")
+        workspace_path.mkdir(parents=True, exist_ok=True)
         
-        # Detect frameworks and entry points
-        frameworks, entry_points, build_system, has_tests = detect_frameworks_and_entry_points(workspace_path)
+        tree = await asyncio.to_thread(blob_store.load_tree, archive_hash)
+        if tree is None or not await asyncio.to_thread(blob_store.materialize_tree, tree, workspace_path):
+            with zipfile.ZipFile(io.BytesIO(content), 'r') as zip_ref:
+                zip_ref.extractall(workspace_path)
+            
+            # Handle nested directory (common in GitHub downloads)
+            items = list(workspace_path.iterdir())
+            if len(items) == 1 and items[0].is_dir():
+                nested_dir = items[0]
+                for item in nested_dir.iterdir():
+                    shutil.move(str(item), str(workspace_path / item.name))
+                nested_dir.rmdir()
+            
+            # Deduplicate into the blob store and remember the pristine tree (no-op without reflinks)
+            ingest = await asyncio.to_thread(blob_store.ingest_workspace, workspace_path)
+            tree = {"entries": ingest["entries"], "modes": ingest["modes"]}
+            if ingest["mode"] == "reflink":
+                await asyncio.to_thread(blob_store.save_tree, archive_hash, tree["entries"], tree["modes"])
+        entries = tree["entries"]
+        storage = await asyncio.to_thread(blob_store.storage_mode, WORKSPACE_DIR)
+        
+        # Single pass: file tree, language stats, totals and root listing
+        scan = await asyncio.to_thread(scan_workspace, workspace_path)
+        file_tree = FileNode(**scan["root"])
+        language_stats = [LanguageStats(**ls) for ls in scan["languages"]]
+        total_files = scan["total_files"]
+        total_size = scan["total_size"]
+        
+        # Persist the scan as the project's manifest and follow terminal-driven changes
+        manifest = await workspace_manifests.build(project_id, workspace_path, scan, known_hashes=entries)
+        workspace_manifests.start_watcher(project_id, workspace_path)
+        
+        # Detect frameworks, entry points and run commands across every package root
+        profile = await project_profiler.get(project_id, workspace_path, manifest, workspace_manifests)
+        frameworks = profile.frameworks
+        entry_points = profile.entry_points
+        build_system = profile.build_system
+        has_tests = profile.has_tests
         
         # Get README content if exists
         readme_content = None
         for readme_name in ['README.md', 'readme.md', 'README.txt', 'README']:
-            readme_path = workspace_path / readme_name
-            if readme_path.exists():
+            if readme_name in scan["root_files"]:
                 try:
-                    readme_content = readme_path.read_text()[:5000]  # Limit size
+                    readme_content = (workspace_path / readme_name).read_text()[:5000]  # Limit size
                 except:
                     pass
                 break
         
-        # Count total files and size
-        total_files = 0
-        total_size = 0
-        for root, dirs, files in os.walk(workspace_path):
-            dirs[:] = [d for d in dirs if d not in ['node_modules', '__pycache__', '.git', 'venv']]
-            total_files += len(files)
-            total_size += sum(os.path.getsize(os.path.join(root, f)) for f in files)
-        
         # Store project info in database
         project_data = {
             "project_id": project_id,
@@ -779,10 +709,16 @@ async def upload_project(file: UploadFile = File(...)):
             "has_tests": has_tests,
             "total_files": total_files,
             "total_size": total_size,
+            "archive_hash": archive_hash,
+            "user_id": user_id,
             "created_at": datetime.now(timezone.utc).isoformat()
         }
         
         await projects_collection.insert_one(project_data)
+        workspace_lifecycle.register("project", project_id, user_id, total_size)
+        
+        # Build indexes and precompute the default analysis before the IDE asks for them
+        warmup_pipeline.enqueue(project_id)
         
         return ProjectStructure(
             project_id=project_id,
@@ -795,7 +731,8 @@ async def upload_project(file: UploadFile = File(...)):
             frameworks=frameworks,
             build_system=build_system,
             has_tests=has_tests,
-            readme_content=readme_content
+            readme_content=readme_content,
+            storage=storage
         )
         
     except Exception as e:
@@ -803,8 +740,22 @@ async def upload_project(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.get("/project/{project_id}/file")
-async def get_file_content(project_id: str, path: str):
-    """Get content of a specific file"""
+async def get_file_content(
+    project_id: str,
+    path: str,
+    request: Request,
+    response: Response,
+    lines: Optional[str] = None,
+    raw: bool = False
+):
+    """Get content of a specific file
+    
+    Every response carries ETag/Last-Modified; a matching If-None-Match
+    returns 304 without touching the file's content.
+    - lines=100-200 (or 100-) returns just those lines, for files of any size
+    - raw=true streams the bytes with the file's media type and honours Range
+    Binary files are reported as binary instead of being decoded.
+    """
     try:
         project = await projects_collection.find_one({"project_id": project_id})
         if not project:
@@ -813,23 +764,78 @@ async def get_file_content(project_id: str, path: str):
         workspace_path = Path(project['workspace_path'])
         file_path = workspace_path / path
         
+        if not str(file_path.resolve()).startswith(str(workspace_path.resolve())):
+            raise HTTPException(status_code=400, detail="Invalid path")
+        
         if not file_path.exists():
             raise HTTPException(status_code=404, detail="File not found")
         
         if not file_path.is_file():
             raise HTTPException(status_code=400, detail="Path is not a file")
         
-        # Check file size (limit to 1MB)
-        if file_path.stat().st_size > 1024 * 1024:
-            raise HTTPException(status_code=400, detail="File too large")
+        line_range = None
+        if lines and not raw:
+            try:
+                line_range = parse_line_range(lines)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        
+        st = file_path.stat()
+        # Raw bytes, the JSON body and each line window are separate representations
+        if raw:
+            etag = file_etag(st)
+        elif line_range:
+            etag = file_etag(st, f"lines={line_range[0]}-{line_range[1] or ''}")
+        else:
+            etag = file_etag(st, "json")
+        headers = {"ETag": etag, "Last-Modified": last_modified(st), "Cache-Control": "no-cache"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        
+        binary = await asyncio.to_thread(is_binary, file_path)
+        
+        if raw:
+            headers["Accept-Ranges"] = "bytes"
+            media_type = guess_media_type(file_path, binary)
+            byte_range = None
+            if_range = request.headers.get("if-range")
+            if not if_range or if_range == etag:
+                try:
+                    byte_range = parse_range(request.headers.get("range"), st.st_size)
+                except ValueError:
+                    return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{st.st_size}"})
+            if byte_range:
+                start, end = byte_range
+                headers["Content-Range"] = f"bytes {start}-{end}/{st.st_size}"
+                headers["Content-Length"] = str(end - start + 1)
+                return StreamingResponse(iter_file(file_path, start, end), status_code=206,
+                                         media_type=media_type, headers=headers)
+            headers["Content-Length"] = str(st.st_size)
+            return StreamingResponse(iter_file(file_path), media_type=media_type, headers=headers)
+        
+        response.headers.update(headers)
+        language = get_language_info(file_path.name)['name'].lower()
+        
+        if binary:
+            return FileContent(path=path, content="", language=language, size=st.st_size, binary=True)
+        
+        if line_range:
+            start_line, end_line = line_range
+            window = await asyncio.to_thread(
+                line_indexes.read_lines, file_path, file_etag(st), start_line, end_line, MAX_INLINE_FILE_SIZE
+            )
+            return FileContent(path=path, language=language, size=st.st_size, **window)
         
-        content = file_path.read_text(errors='replace')
-        lang_info = get_language_info(file_path.name)
+        if st.st_size > MAX_INLINE_FILE_SIZE:
+            raise HTTPException(status_code=400, detail="File too large; request a line range (lines=1-500) or raw=true")
+        
+        content = await asyncio.to_thread(file_path.read_text, errors='replace')
         
         return FileContent(
             path=path,
             content=content,
-            language=lang_info['name'].lower()
+            language=language,
+            size=st.st_size
         )
         
     except HTTPException:
@@ -838,6 +844,52 @@ async def get_file_content(project_id: str, path: str):
         logger.error(f"Get file error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+class TextEdit(BaseModel):
+    start_line: int
+    start_column: int
+    end_line: int
+    end_column: int
+    text: str = ""
+
+class PatchFileRequest(BaseModel):
+    path: str
+    base_etag: str
+    edits: Optional[List[TextEdit]] = None
+    diff: Optional[str] = None
+
+file_write_locks: Dict[str, asyncio.Lock] = {}
+file_write_lock_users: Dict[str, int] = {}
+
+@asynccontextmanager
+async def file_write_lock(file_path: Path):
+    """Serialise writes to one file
+    
+    Keyed by the resolved path, so "a/../b.py" and "b.py" share a lock; the
+    lock is dropped once nobody holds or waits for it.
+    """
+    key = str(file_path.resolve())
+    lock = file_write_locks.setdefault(key, asyncio.Lock())
+    file_write_lock_users[key] = file_write_lock_users.get(key, 0) + 1
+    try:
+        async with lock:
+            yield
+    finally:
+        file_write_lock_users[key] -= 1
+        if not file_write_lock_users[key]:
+            del file_write_lock_users[key]
+            del file_write_locks[key]
+
+async def after_file_saved(project_id: str, workspace_path: Path, paths: List[str]):
+    """Bring the manifest, search and symbol indexes and analysis cache up to date after a write"""
+    changed = await workspace_manifests.refresh_paths(project_id, workspace_path, paths)
+    if changed:
+        await analysis_cache.invalidate_paths(project_id, changed)
+    if project_id in code_search.indexes:
+        manifest = await workspace_manifests.get(project_id, workspace_path)
+        await code_search.sync(project_id, workspace_path, manifest, workspace_manifests)
+    if project_id in symbol_index.indexes:
+        symbol_index.schedule(project_id, workspace_path, workspace_manifests)
+
 @api_router.post("/project/{project_id}/file")
 async def save_file(project_id: str, request: SaveFileRequest):
     """Save/update a file in the project"""
@@ -856,8 +908,11 @@ async def save_file(project_id: str, request: SaveFileRequest):
         # Create parent directories if needed
         file_path.parent.mkdir(parents=True, exist_ok=True)
         
-        # Write file
-        file_path.write_text(request.content)
+        # Write via temp + rename so readers never see a partial file
+        async with file_write_lock(file_path):
+            await asyncio.to_thread(atomic_write_text, file_path, request.content)
+        
+        await after_file_saved(project_id, workspace_path, [request.path])
         
         return {"success": True, "path": request.path}
         
@@ -867,6 +922,87 @@ async def save_file(project_id: str, request: SaveFileRequest):
         logger.error(f"Save file error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.post("/project/{project_id}/file/patch")
+async def patch_file(project_id: str, request: PatchFileRequest, response: Response):
+    """Apply range edits or a unified diff to a file
+    
+    base_etag is the ETag the client's copy was read (or last patched) at. If
+    the file has changed since, nothing is written and 409 returns the
+    current ETag so the client can re-read and rebase. On success the new
+    ETag is returned for the next patch.
+    """
+    if (request.edits is None) == (request.diff is None):
+        raise HTTPException(status_code=400, detail="Provide exactly one of edits or diff")
+    try:
+        project = await projects_collection.find_one({"project_id": project_id})
+        if not project:
+            raise HTTPException(status_code=404, detail="Project not found")
+        
+        workspace_path = Path(project['workspace_path'])
+        file_path = workspace_path / request.path
+        
+        if not str(file_path.resolve()).startswith(str(workspace_path.resolve())):
+            raise HTTPException(status_code=400, detail="Invalid path")
+        if not file_path.is_file():
+            raise HTTPException(status_code=404, detail="File not found")
+        
+        async with file_write_lock(file_path):
+            current_etag = file_etag(file_path.stat(), "json")
+            # base_etag may come from any representation of the file
+            if etag_version(request.base_etag) != etag_version(current_etag):
+                raise HTTPException(
+                    status_code=409,
+                    detail={"message": "File changed since base version", "etag": current_etag}
+                )
+            
+            def apply() -> int:
+                try:
+                    base = file_path.read_bytes().decode('utf-8')
+                except UnicodeDecodeError:
+                    raise PatchError("File is not UTF-8 text")
+                if request.diff is not None:
+                    updated = apply_unified_diff(base, request.diff)
+                else:
+                    updated = apply_edits(base, [e.model_dump() for e in request.edits])
+                data = updated.encode('utf-8')
+                atomic_write(file_path, data)
+                return len(data)
+            
+            try:
+                size = await asyncio.to_thread(apply)
+            except PatchError as e:
+                raise HTTPException(status_code=422, detail=str(e))
+            new_etag = file_etag(file_path.stat(), "json")
+        
+        await after_file_saved(project_id, workspace_path, [request.path])
+        
+        response.headers["ETag"] = new_etag
+        return {"success": True, "path": request.path, "etag": new_etag, "size": size}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Patch file error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def compiled_outcome(result: dict) -> tuple:
+    """(output, error, exit_code) for a build_cache.run result"""
+    if result["run"] is None:
+        return "", result["compile"]["output"] or "Compilation failed", 1
+    run = result["run"]
+    if run["timed_out"]:
+        return run["stdout"], "Execution timed out (30 second limit)", 124
+    return run["stdout"], run["stderr"] if run["exit_code"] != 0 else None, run["exit_code"]
+
+def compiled_timings(result: Optional[dict]) -> dict:
+    if result is None:
+        return {}
+    return {
+        "compile_time": result["compile"]["seconds"],
+        "run_time": result["run"]["seconds"] if result["run"] else None,
+        "build_cached": result["compile"]["cached"]
+    }
+
 @api_router.post("/project/{project_id}/run", response_model=RunProjectResponse)
 async def run_project(project_id: str, request: RunProjectRequest):
     """Run a project or specific file"""
@@ -886,13 +1022,30 @@ async def run_project(project_id: str, request: RunProjectRequest):
         
         # Determine command to run
         command = request.command
+        compiled = None
         if not command:
             if request.file_path:
                 # Run specific file
                 file_path = workspace_path / request.file_path
                 ext = file_path.suffix.lower()
                 
-                if ext == '.py':
+                # Compiled languages go through the build cache; unchanged sources skip compilation
+                language = language_for_path(request.file_path)
+                if language and file_path.is_file():
+                    sources = await asyncio.to_thread(project_sources, workspace_path, request.file_path, language)
+                    if sources is not None:
+                        try:
+                            compiled = await build_cache.run(
+                                language, sources, file_path.name, cwd=file_path.parent, timeout=30,
+                                env={**dependency_cache.project_env(workspace_path), 'NODE_ENV': 'development'}
+                            )
+                        except BuildError as e:
+                            if ext not in ('.ts', '.go'):
+                                raise HTTPException(status_code=400, detail=str(e))
+                
+                if compiled is not None:
+                    command = f"{compiled['language']} {request.file_path}"
+                elif ext == '.py':
                     command = f"python {request.file_path}"
                 elif ext in ['.js', '.mjs']:
                     command = f"node {request.file_path}"
@@ -907,41 +1060,36 @@ async def run_project(project_id: str, request: RunProjectRequest):
                 else:
                     raise HTTPException(status_code=400, detail=f"Cannot run {ext} files directly")
             else:
-                # Auto-detect run command
-                if (workspace_path / 'package.json').exists():
-                    command = "npm start"
-                elif (workspace_path / 'main.py').exists():
-                    command = "python main.py"
-                elif (workspace_path / 'app.py').exists():
-                    command = "python app.py"
-                elif (workspace_path / 'server.py').exists():
-                    command = "python server.py"
-                elif (workspace_path / 'main.go').exists():
-                    command = "go run main.go"
-                else:
+                # Auto-detect run command from the project profile
+                profile = await get_project_profile(project_id)
+                command = profile.run_commands.run
+                if not command:
                     raise HTTPException(status_code=400, detail="No runnable entry point found")
         
         # Execute command
-        try:
-            result = subprocess.run(
-                command,
-                shell=True,
-                cwd=str(workspace_path),
-                capture_output=True,
-                text=True,
-                timeout=30,
-                env={**os.environ, 'NODE_ENV': 'development'}
-            )
-            output = result.stdout
-            if result.returncode != 0:
-                error = result.stderr
-                exit_code = result.returncode
-        except subprocess.TimeoutExpired:
-            error = "Execution timed out (30 second limit)"
-            exit_code = 124
-        except Exception as e:
-            error = str(e)
-            exit_code = 1
+        if compiled is not None:
+            output, error, exit_code = compiled_outcome(compiled)
+        else:
+            try:
+                result = subprocess.run(
+                    command,
+                    shell=True,
+                    cwd=str(workspace_path),
+                    capture_output=True,
+                    text=True,
+                    timeout=30,
+                    env={**dependency_cache.project_env(workspace_path), 'NODE_ENV': 'development'}
+                )
+                output = result.stdout
+                if result.returncode != 0:
+                    error = result.stderr
+                    exit_code = result.returncode
+            except subprocess.TimeoutExpired:
+                error = "Execution timed out (30 second limit)"
+                exit_code = 124
+            except Exception as e:
+                error = str(e)
+                exit_code = 1
         
         execution_time = time.time() - start_time
         
@@ -974,7 +1122,8 @@ Error: {error}""")
             exit_code=exit_code,
             execution_time=execution_time,
             error_explanation=error_explanation,
-            fix_suggestion=fix_suggestion
+            fix_suggestion=fix_suggestion,
+            **compiled_timings(compiled)
         )
         
     except HTTPException:
@@ -1000,14 +1149,16 @@ async def execute_terminal_command(project_id: str, request: TerminalCommand):
             return {"output": "", "error": "Command not allowed for security reasons", "exit_code": 1}
         
         try:
-            result = subprocess.run(
-                request.command,
-                shell=True,
-                cwd=str(workspace_path),
-                capture_output=True,
-                text=True,
-                timeout=60
-            )
+            with running_in(workspace_path):
+                result = await asyncio.to_thread(
+                    subprocess.run,
+                    request.command,
+                    shell=True,
+                    cwd=str(workspace_path),
+                    capture_output=True,
+                    text=True,
+                    timeout=60
+                )
             return {
                 "output": result.stdout,
                 "error": result.stderr if result.returncode != 0 else None,
@@ -1024,104 +1175,180 @@ async def execute_terminal_command(project_id: str, request: TerminalCommand):
         logger.error(f"Terminal command error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def install_package_roots(workspace_path: Path, roots: List[str], on_output=None) -> dict:
+    """Install each package root the dependency cache can handle, in turn
+    
+    Roots it has no installer for (cargo, gradle/maven, pyproject-only) are
+    listed under "skipped" rather than failing the install. A single
+    installable root returns its result unchanged apart from that field.
+    """
+    plans = await asyncio.gather(*(asyncio.to_thread(dependency_cache.plan, workspace_path / root) for root in roots))
+    skipped = [root for root, plan in zip(roots, plans) if plan is None]
+    roots = [root for root, plan in zip(roots, plans) if plan is not None]
+    if skipped and on_output:
+        await on_output(f"Skipping {', '.join(r or '.' for r in skipped)}: no supported package manager")
+    if not roots:
+        return {"success": False, "output": "", "error": "No package manager detected", "ecosystem": None,
+                "cache_hit": False, "key": None, "seconds": 0.0, "skipped": skipped}
+    if len(roots) == 1:
+        return {**await dependency_cache.install(workspace_path / roots[0], on_output), "skipped": skipped}
+    results = []
+    for root in roots:
+        if on_output:
+            await on_output(f"==> {root or '.'}")
+        result = await dependency_cache.install(workspace_path / root, on_output)
+        results.append({"root": root, **result})
+    errors = [f"{r['root'] or '.'}: {r['error']}" for r in results if r.get("error")]
+    return {
+        "success": all(r["success"] for r in results),
+        "output": "\n".join(f"==> {r['root'] or '.'}\n{r['output']}" for r in results),
+        "error": "\n".join(errors) or None,
+        "cache_hit": all(r.get("cache_hit") for r in results),
+        "seconds": round(sum(r.get("seconds") or 0 for r in results), 2),
+        "packages": results,
+        "skipped": skipped
+    }
+
 @api_router.post("/project/{project_id}/install-deps")
-async def install_dependencies(project_id: str):
-    """Install project dependencies"""
+async def install_dependencies(project_id: str, stream: bool = False):
+    """Install project dependencies through the shared dependency cache
+    
+    Identical dependency sets (same manifest/lockfile hash) are installed
+    once and linked into each workspace. With stream=true the response is
+    NDJSON: {"event": "log", "line": ...} per output line, then a final
+    {"event": "done", ...} carrying the same fields as the JSON response.
+    """
+    project = await projects_collection.find_one({"project_id": project_id})
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    
+    workspace_path = Path(project['workspace_path'])
+    profile = await get_project_profile(project_id)
+    roots = [p.root for p in profile.packages if p.ecosystems and p.managed_by is None] or [""]
+    
+    if not stream:
+        try:
+            return await install_package_roots(workspace_path, roots)
+        except Exception as e:
+            logger.error(f"Install deps error: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+    
+    queue: asyncio.Queue = asyncio.Queue()
+    
+    async def on_output(line: str):
+        await queue.put({"event": "log", "line": line})
+    
+    async def run():
+        try:
+            result = await install_package_roots(workspace_path, roots, on_output)
+        except Exception as e:
+            logger.error(f"Install deps error: {e}")
+            result = {"output": "", "error": str(e), "success": False}
+        await queue.put({"event": "done", **result})
+    
+    async def events():
+        task = asyncio.create_task(run())
+        try:
+            while True:
+                event = await queue.get()
+                yield json.dumps(event) + "\n"
+                if event["event"] == "done":
+                    break
+        finally:
+            await task
+    
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+@api_router.get("/build-cache/stats")
+async def build_cache_stats():
+    """Compiled-artifact store size, hit rate and compile time saved"""
+    return await build_cache.stats()
+
+@api_router.get("/dependency-cache/stats")
+async def dependency_cache_stats():
+    """Shared dependency store size, hit rate and evictions"""
+    return await asyncio.to_thread(dependency_cache.stats)
+
+@api_router.get("/workspaces/stats")
+async def workspace_stats():
+    """Active/archived workspace counts, disk usage against quotas and bytes reclaimed"""
+    await workspace_lifecycle.load()
+    return {**workspace_lifecycle.stats(), "blob_store": await asyncio.to_thread(blob_store.stats)}
+
+@api_router.post("/workspaces/reap")
+async def reap_workspaces():
+    """Run one reaper pass now (archive idle workspaces, enforce quotas)"""
     try:
-        project = await projects_collection.find_one({"project_id": project_id})
-        if not project:
-            raise HTTPException(status_code=404, detail="Project not found")
-        
-        workspace_path = Path(project['workspace_path'])
-        
-        output = ""
-        error = None
-        
-        # Detect package manager and install
-        if (workspace_path / 'package.json').exists():
-            if (workspace_path / 'yarn.lock').exists():
-                cmd = "yarn install"
-            elif (workspace_path / 'pnpm-lock.yaml').exists():
-                cmd = "pnpm install"
-            else:
-                cmd = "npm install"
-            
-            result = subprocess.run(
-                cmd, shell=True, cwd=str(workspace_path),
-                capture_output=True, text=True, timeout=300
-            )
-            output = result.stdout
-            if result.returncode != 0:
-                error = result.stderr
-        
-        elif (workspace_path / 'requirements.txt').exists():
-            result = subprocess.run(
-                "pip install -r requirements.txt",
-                shell=True, cwd=str(workspace_path),
-                capture_output=True, text=True, timeout=300
-            )
-            output = result.stdout
-            if result.returncode != 0:
-                error = result.stderr
-        
-        elif (workspace_path / 'go.mod').exists():
-            result = subprocess.run(
-                "go mod download",
-                shell=True, cwd=str(workspace_path),
-                capture_output=True, text=True, timeout=300
-            )
-            output = result.stdout
-            if result.returncode != 0:
-                error = result.stderr
-        
-        else:
-            return {"output": "", "error": "No package manager detected", "success": False}
-        
-        return {"output": output, "error": error, "success": error is None}
-        
-    except subprocess.TimeoutExpired:
-        return {"output": "", "error": "Installation timed out", "success": False}
+        return await workspace_lifecycle.reap()
     except Exception as e:
-        logger.error(f"Install deps error: {e}")
+        logger.error(f"Workspace reap error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.post("/project/{project_id}/archive")
+async def archive_project(project_id: str):
+    """Archive a project workspace now; it is restored on its next access"""
+    project = await projects_collection.find_one({"project_id": project_id})
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    await workspace_lifecycle.load()
+    workspace_lifecycle.register("project", project_id, project.get("user_id"))
+    reclaimed = await workspace_lifecycle.archive("project", project_id, reason="manual")
+    await workspace_lifecycle.flush()
+    archived = workspace_lifecycle.records[f"project:{project_id}"]["archived"]
+    return {"project_id": project_id, "archived": archived, "busy": not archived and workspace_lifecycle.is_busy("project", project_id),
+            "bytes_reclaimed": reclaimed}
+
+@api_router.delete("/project/{project_id}")
+async def delete_project(project_id: str):
+    """Delete a project: its workspace, archive, manifest and database record"""
+    project = await projects_collection.find_one({"project_id": project_id})
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    forget_project_state("project", project_id)
+    workspace_manifests.remove(project_id)
+    await workspace_lifecycle.remove("project", project_id)
+    await asyncio.to_thread(shutil.rmtree, project['workspace_path'], True)
+    await projects_collection.delete_one({"project_id": project_id})
+    return {"project_id": project_id, "deleted": True}
+
 @api_router.post("/project/{project_id}/run-tests")
-async def run_tests(project_id: str, skill_level: str = "intermediate"):
-    """Run project tests"""
+async def run_tests(
+    project_id: str,
+    skill_level: str = "intermediate",
+    mode: str = "all",
+    workers: Optional[int] = None,
+    explain: bool = True
+):
+    """Run project tests
+    
+    Tests run in parallel shards and come back as structured per-test
+    results. mode=affected runs only tests that import (transitively) a
+    file changed since the last run, plus previous failures. Only failing
+    tests' tracebacks are sent to the LLM for explanation.
+    """
+    if mode not in ("all", "affected"):
+        raise HTTPException(status_code=400, detail=f"Unknown test mode: {mode}")
     try:
-        project = await projects_collection.find_one({"project_id": project_id})
-        if not project:
-            raise HTTPException(status_code=404, detail="Project not found")
+        _, workspace_path, manifest = await get_project_manifest(project_id)
         
-        workspace_path = Path(project['workspace_path'])
-        
-        # Detect test command
-        cmd = None
-        if (workspace_path / 'package.json').exists():
-            try:
-                pkg = json.loads((workspace_path / 'package.json').read_text())
-                if 'test' in pkg.get('scripts', {}):
-                    cmd = "npm test"
-            except:
-                pass
+        edges = None
+        if mode == "affected":
+            index = await symbol_index.sync(project_id, workspace_path, manifest, workspace_manifests)
+            edges = index.edges
         
-        if not cmd and (workspace_path / 'pytest.ini').exists() or (workspace_path / 'tests').exists():
-            cmd = "pytest -v"
-        
-        if not cmd:
-            return {"output": "", "error": "No test configuration found", "success": False, "test_results": None}
-        
-        try:
-            result = subprocess.run(
-                cmd, shell=True, cwd=str(workspace_path),
-                capture_output=True, text=True, timeout=120
-            )
-            
-            # Parse test results and explain failures
-            explanation = None
-            if result.returncode != 0:
-                skill_context = get_skill_context(skill_level)
-                system_prompt = f"""You are a coding mentor explaining test failures.
+        run = await suite_runner.run(
+            project_id, workspace_path, manifest, workspace_manifests,
+            dependency_cache.project_env(workspace_path), mode,
+            max(1, min(workers, 16)) if workers else None, edges
+        )
+        if run.get("framework") is None:
+            return {"output": "", "error": run["error"], "success": False, "test_results": None}
+        
+        failing = [t for t in run["tests"] if t["status"] in ("failed", "error")]
+        explanation = None
+        if explain and not run["success"]:
+            skill_context = get_skill_context(skill_level)
+            system_prompt = f"""You are a coding mentor explaining test failures.
 {skill_context}
 Respond ONLY with valid JSON:
 {{
@@ -1129,21 +1356,31 @@ Respond ONLY with valid JSON:
     "failures": [{{"test": "test name", "reason": "why it failed", "fix": "how to fix"}}],
     "overall_assessment": "What the developer should focus on"
 }}"""
-                
-                chat = get_chat_instance(system_prompt)
-                user_msg = UserMessage(text=f"Explain these test results:\n{result.stdout}\n{result.stderr}")
-                response = await chat.send_message(user_msg)
-                explanation = safe_parse_json(response, {})
-            
-            return {
-                "output": result.stdout,
-                "error": result.stderr if result.returncode != 0 else None,
-                "success": result.returncode == 0,
-                "test_results": explanation
-            }
+            if failing:
+                details = "\n\n".join(
+                    f"TEST: {t['id']}\n{(t['traceback'] or t['message'] or '')[-1500:]}" for t in failing[:10]
+                )
+            else:
+                # No structured results (unstructured runner or crash): fall back to the output tail
+                details = run["output"][-4000:]
             
-        except subprocess.TimeoutExpired:
-            return {"output": "", "error": "Tests timed out", "success": False, "test_results": None}
+            chat = get_chat_instance(system_prompt)
+            user_msg = UserMessage(text=f"Explain these failing tests:\n{details}")
+            response = await chat.send_message(user_msg)
+            explanation = safe_parse_json(response, {})
+        
+        return {
+            "output": run["output"],
+            "error": None if run["success"] else "\n".join(t["message"] or t["id"] for t in failing) or run["output"][-2000:],
+            "success": run["success"],
+            "test_results": explanation,
+            "framework": run["framework"],
+            "mode": run["mode"],
+            "selected": run["selected"],
+            "summary": run["summary"],
+            "tests": run["tests"],
+            "shards": run["shards"]
+        }
         
     except HTTPException:
         raise
@@ -1155,41 +1392,48 @@ Respond ONLY with valid JSON:
 async def analyze_full_project(project_id: str, request: ProjectAnalysisRequest):
     """Full AI analysis of uploaded project - Returns complete UI contract"""
     try:
-        project = await projects_collection.find_one({"project_id": project_id})
-        if not project:
-            raise HTTPException(status_code=404, detail="Project not found")
-        
-        workspace_path = Path(project['workspace_path'])
-        skill_context = get_skill_context(request.skill_level)
-        
-        # Gather project info
-        files_summary = []
-        key_files_content = ""
-        
-        for root, dirs, files in os.walk(workspace_path):
-            dirs[:] = [d for d in dirs if d not in ['node_modules', '__pycache__', '.git', 'venv', 'dist', 'build']]
-            rel_root = os.path.relpath(root, workspace_path)
-            
-            for f in files[:50]:  # Limit files
-                rel_path = os.path.join(rel_root, f) if rel_root != '.' else f
-                files_summary.append(rel_path)
-        
-        # Get content of key files
-        key_file_patterns = ['main', 'app', 'index', 'server', 'config', 'routes', 'models', 'package.json', 'requirements.txt', 'README']
-        for pattern in key_file_patterns:
-            for f in files_summary[:30]:
-                if pattern in f.lower():
-                    try:
-                        file_path = workspace_path / f
-                        if file_path.exists() and file_path.stat().st_size < 10000:
-                            key_files_content += f"\n--- {f} ---\n{file_path.read_text()[:3000]}\n"
-                    except:
-                        pass
-        
-        # Detect run commands from package.json or requirements.txt
-        run_commands = detect_run_commands(workspace_path)
-        
-        system_prompt = f"""You are an expert software architect and mentor analyzing a codebase.
+        return await compute_full_analysis(project_id, request.skill_level)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Full project analysis error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def compute_full_analysis(project_id: str, skill_level: str) -> dict:
+    """analyze-full result for a skill level, served from the analysis cache when inputs are unchanged"""
+    project, workspace_path, manifest = await get_project_manifest(project_id)
+    skill_context = get_skill_context(skill_level)
+    
+    # Rank files by import-graph centrality and fill the prompt budget from the top
+    index = await symbol_index.sync(project_id, workspace_path, manifest, workspace_manifests)
+    ranks = index.rank()
+    files_summary = sorted(manifest["files"], key=lambda p: (-ranks.get(p, 0), p))
+    selected = await asyncio.to_thread(
+        index.select_files, workspace_path, PROMPT_CONTEXT_TOKENS, 3000, project.get('entry_points', [])
+    )
+    key_files_content = "".join(f"\n--- {f['path']} ---\n{f['content']}\n" for f in selected)
+    key_symbols = "\n".join(
+        f"{s['path']}:{s['line']} {s['kind']} {(s['container'] + '.') if s['container'] else ''}{s['name']}"
+        for s in index.top_symbols(30)
+    )
+    
+    # Run commands parsed from every package root's manifests
+    profile = await project_profiler.get(project_id, workspace_path, manifest, workspace_manifests)
+    run_commands = profile.run_commands.model_dump(exclude={"run"})
+    
+    # Same prompt inputs -> same analysis: key on the files that feed the prompt
+    relevant_paths = [f['path'] for f in selected]
+    key = cache_key(
+        "analyze-full", skill_level,
+        workspace_manifests.fingerprint(manifest, relevant_paths),
+        files_summary[:50], len(files_summary), run_commands, key_symbols,
+        project.get('languages', []), project.get('frameworks', []), project.get('build_system')
+    )
+    cached = await analysis_cache.get(key)
+    if cached is not None:
+        return {**cached, "cache_hit": True}
+    
+    system_prompt = f"""You are an expert software architect and mentor analyzing a codebase.
 {skill_context}
 
 Analyze this project and provide comprehensive insights with EXACT run commands.
@@ -1246,9 +1490,9 @@ RESPOND ONLY WITH VALID JSON:
     "potential_issues": ["Issue 1", "Issue 2"],
     "improvement_suggestions": ["Suggestion 1", "Suggestion 2"]
 }}"""
-        
-        chat = get_chat_instance(system_prompt)
-        user_msg = UserMessage(text=f"""Analyze this project:
+    
+    chat = get_chat_instance(system_prompt)
+    user_msg = UserMessage(text=f"""Analyze this project:
 
 Project Name: {project['name']}
 Languages: {json.dumps(project.get('languages', []))}
@@ -1261,135 +1505,44 @@ Auto-detected Run Commands: {json.dumps(run_commands)}
 Files ({len(files_summary)} total):
 {chr(10).join(files_summary[:50])}
 
-Key File Contents:
-{key_files_content[:15000]}""")
-        
-        response = await chat.send_message(user_msg)
-        data = safe_parse_json(response, {
-            "project_name": project['name'],
-            "purpose": "Analysis pending",
-            "architecture_overview": "Unable to analyze",
-            "project_type": "Unknown",
-            "entry_points": [],
-            "main_modules": [],
-            "dependencies": [],
-            "frameworks": project.get('frameworks', []),
-            "run_commands": run_commands,
-            "learning_roadmap": {},
-            "weekly_learning_plan": [],
-            "what_you_will_learn": [],
-            "difficulty_level": "Intermediate",
-            "relevant_roles": [],
-            "file_recommendations": [],
-            "potential_issues": [],
-            "improvement_suggestions": []
-        })
-        
-        # Merge detected run commands with AI suggestions
-        if not data.get("run_commands") or not data["run_commands"].get("dev"):
-            data["run_commands"] = run_commands
-        
-        return data
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Full project analysis error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-
+Most Central Symbols:
+{key_symbols or 'None indexed'}
 
-def detect_run_commands(workspace_path: Path) -> dict:
-    """Auto-detect run commands from project files"""
-    commands = {
-        "install": None,
-        "dev": None,
-        "build": None,
-        "test": None,
-        "port": None,
-        "entry_file": None
-    }
+Key File Contents:
+{key_files_content}""")
     
-    # Check package.json (Node/React/Next projects)
-    pkg_json = workspace_path / 'package.json'
-    if pkg_json.exists():
-        try:
-            pkg = json.loads(pkg_json.read_text())
-            scripts = pkg.get('scripts', {})
-            
-            commands["install"] = "npm install"
-            
-            # Detect dev command
-            if 'dev' in scripts:
-                commands["dev"] = "npm run dev"
-            elif 'start' in scripts:
-                commands["dev"] = "npm start"
-            elif 'serve' in scripts:
-                commands["dev"] = "npm run serve"
-            
-            # Detect build command
-            if 'build' in scripts:
-                commands["build"] = "npm run build"
-            
-            # Detect test command
-            if 'test' in scripts:
-                commands["test"] = "npm test"
-            
-            # Detect port from scripts
-            dev_script = scripts.get('dev', '') + scripts.get('start', '')
-            if '3000' in dev_script:
-                commands["port"] = "3000"
-            elif '5173' in dev_script or 'vite' in dev_script.lower():
-                commands["port"] = "5173"
-            elif '8080' in dev_script:
-                commands["port"] = "8080"
-            else:
-                commands["port"] = "3000"  # Default for most Node projects
-            
-            # Detect entry file
-            main_field = pkg.get('main', '')
-            if main_field:
-                commands["entry_file"] = main_field
-            elif (workspace_path / 'src' / 'index.tsx').exists():
-                commands["entry_file"] = "src/index.tsx"
-            elif (workspace_path / 'src' / 'index.js').exists():
-                commands["entry_file"] = "src/index.js"
-            elif (workspace_path / 'src' / 'main.jsx').exists():
-                commands["entry_file"] = "src/main.jsx"
-            
-        except Exception as e:
-            logger.warning(f"Error parsing package.json: {e}")
+    response = await chat.send_message(user_msg)
+    fallback = {
+        "project_name": project['name'],
+        "purpose": "Analysis pending",
+        "architecture_overview": "Unable to analyze",
+        "project_type": "Unknown",
+        "entry_points": [],
+        "main_modules": [],
+        "dependencies": [],
+        "frameworks": project.get('frameworks', []),
+        "run_commands": run_commands,
+        "learning_roadmap": {},
+        "weekly_learning_plan": [],
+        "what_you_will_learn": [],
+        "difficulty_level": "Intermediate",
+        "relevant_roles": [],
+        "file_recommendations": [],
+        "potential_issues": [],
+        "improvement_suggestions": []
+    }
+    data = safe_parse_json(response, fallback)
     
-    # Check requirements.txt (Python projects)
-    req_txt = workspace_path / 'requirements.txt'
-    if req_txt.exists() and not commands["install"]:
-        commands["install"] = "pip install -r requirements.txt"
-        
-        # Find Python entry point
-        for entry in ['app.py', 'main.py', 'server.py', 'run.py', 'manage.py']:
-            if (workspace_path / entry).exists():
-                commands["entry_file"] = entry
-                
-                # Check for Flask/FastAPI
-                try:
-                    content = (workspace_path / entry).read_text()
-                    if 'FastAPI' in content:
-                        commands["dev"] = f"uvicorn {entry[:-3]}:app --reload --port 8000"
-                        commands["port"] = "8000"
-                    elif 'Flask' in content:
-                        commands["dev"] = f"python {entry}"
-                        commands["port"] = "5000"
-                    else:
-                        commands["dev"] = f"python {entry}"
-                except:
-                    pass
-                break
+    # Merge detected run commands with AI suggestions
+    if not data.get("run_commands") or not data["run_commands"].get("dev"):
+        data["run_commands"] = run_commands
     
-    # Check for Dockerfile
-    if (workspace_path / 'Dockerfile').exists():
-        commands["build"] = commands.get("build") or "docker build -t myapp ."
-        commands["dev"] = commands.get("dev") or "docker run -p 3000:3000 myapp"
+    # Placeholder defaults (empty or unparseable reply) are never cached
+    if data is not fallback:
+        await analysis_cache.put(key, "analyze-full", project_id, relevant_paths, data, skill_level)
     
-    return commands
+    return {**data, "cache_hit": False}
+
 
 # ============== CODE ANALYSIS ENDPOINTS ==============
 
@@ -1528,6 +1681,8 @@ class ExecuteCodeRequest(BaseModel):
     code: str
     language: str
     skill_level: str = "intermediate"
+    flags: Optional[List[str]] = None  # Extra compiler flags (allow-listed per language)
+    stdin: Optional[str] = None
 
 class ExecuteCodeResponse(BaseModel):
     output: str
@@ -1536,6 +1691,9 @@ class ExecuteCodeResponse(BaseModel):
     execution_time: float
     error_explanation: Optional[str] = None
     fix_suggestion: Optional[str] = None
+    compile_time: Optional[float] = None
+    run_time: Optional[float] = None
+    build_cached: Optional[bool] = None
 
 @api_router.post("/execute-code", response_model=ExecuteCodeResponse)
 async def execute_code(request: ExecuteCodeRequest):
@@ -1551,10 +1709,24 @@ async def execute_code(request: ExecuteCodeRequest):
         exit_code = 0
         
         # Create temp file and execute
+        compiled = None
         with tempfile.TemporaryDirectory() as temp_dir:
             temp_path = Path(temp_dir)
+            language = resolve_language(request.language)
             
-            if request.language.lower() == "python":
+            if language in TOOLCHAINS:
+                # Compiled languages: cached by source, flags and toolchain version
+                main = default_main(language, request.code)
+                try:
+                    compiled = await build_cache.run(
+                        language, {main: request.code}, main, request.flags, cwd=temp_path, timeout=30,
+                        stdin=request.stdin
+                    )
+                except BuildError as e:
+                    raise HTTPException(status_code=400, detail=str(e))
+                output, error, exit_code = compiled_outcome(compiled)
+                command = None
+            elif request.language.lower() == "python":
                 file_path = temp_path / "code.py"
                 file_path.write_text(request.code)
                 command = f"python code.py"
@@ -1565,26 +1737,28 @@ async def execute_code(request: ExecuteCodeRequest):
             else:
                 raise HTTPException(status_code=400, detail=f"Language {request.language} not supported for direct execution")
             
-            try:
-                result = subprocess.run(
-                    command,
-                    shell=True,
-                    cwd=str(temp_path),
-                    capture_output=True,
-                    text=True,
-                    timeout=30,
-                    env={**os.environ, 'NODE_ENV': 'development'}
-                )
-                output = result.stdout
-                if result.returncode != 0:
-                    error = result.stderr
-                    exit_code = result.returncode
-            except subprocess.TimeoutExpired:
-                error = "Execution timed out (30 second limit)"
-                exit_code = 124
-            except Exception as e:
-                error = str(e)
-                exit_code = 1
+            if command:
+                try:
+                    result = subprocess.run(
+                        command,
+                        shell=True,
+                        cwd=str(temp_path),
+                        capture_output=True,
+                        text=True,
+                        timeout=30,
+                        input=request.stdin,
+                        env={**os.environ, 'NODE_ENV': 'development'}
+                    )
+                    output = result.stdout
+                    if result.returncode != 0:
+                        error = result.stderr
+                        exit_code = result.returncode
+                except subprocess.TimeoutExpired:
+                    error = "Execution timed out (30 second limit)"
+                    exit_code = 124
+                except Exception as e:
+                    error = str(e)
+                    exit_code = 1
         
         execution_time = time.time() - start_time
         
@@ -1618,7 +1792,8 @@ Error: {error}""")
             exit_code=exit_code,
             execution_time=execution_time,
             error_explanation=error_explanation,
-            fix_suggestion=fix_suggestion
+            fix_suggestion=fix_suggestion,
+            **compiled_timings(compiled)
         )
         
     except HTTPException:
@@ -1789,22 +1964,144 @@ Respond ONLY with valid JSON:
         logger.error(f"English chat error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def get_project_manifest(project_id: str) -> tuple:
+    """Look up a project and return (project, workspace_path, manifest)"""
+    project = await projects_collection.find_one({"project_id": project_id})
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    
+    workspace_path = Path(project['workspace_path'])
+    if workspace_manifests.is_watching(project_id):
+        manifest = await workspace_manifests.get(project_id, workspace_path)
+    else:
+        # No watcher to report terminal changes: stat-only incremental rescan
+        manifest = await workspace_manifests.rescan(project_id, workspace_path)
+        workspace_manifests.start_watcher(project_id, workspace_path)
+    
+    return project, workspace_path, manifest
+
+async def get_project_profile(project_id: str) -> ProjectProfile:
+    """Cached detection result for a project, refreshed when its manifests change"""
+    _, workspace_path, manifest = await get_project_manifest(project_id)
+    return await project_profiler.get(project_id, workspace_path, manifest, workspace_manifests)
+
+@api_router.get("/project/{project_id}/profile", response_model=ProjectProfile)
+async def get_project_profile_endpoint(project_id: str):
+    """Frameworks, entry points and run commands for every package root of the project"""
+    try:
+        return await get_project_profile(project_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Project profile error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ============== PROJECT WARM-UP ==============
+
+@warmup_pipeline.step("manifest")
+async def warm_manifest(project_id: str) -> dict:
+    _, _, manifest = await get_project_manifest(project_id)
+    return {"version": manifest["version"], "files": len(manifest["files"])}
+
+@warmup_pipeline.step("profile", after=("manifest",))
+async def warm_profile(project_id: str) -> dict:
+    profile = await get_project_profile(project_id)
+    return {"packages": len(profile.packages), "frameworks": profile.frameworks}
+
+@warmup_pipeline.step("search_index", after=("manifest",))
+async def warm_search_index(project_id: str) -> dict:
+    _, workspace_path, manifest = await get_project_manifest(project_id)
+    index = await code_search.sync(project_id, workspace_path, manifest, workspace_manifests)
+    return {"version": index.version}
+
+@warmup_pipeline.step("symbol_index", after=("manifest",))
+async def warm_symbol_index(project_id: str) -> dict:
+    _, workspace_path, manifest = await get_project_manifest(project_id)
+    index = await symbol_index.sync(project_id, workspace_path, manifest, workspace_manifests)
+    return index.stats()
+
+@warmup_pipeline.step("static_analysis", after=("manifest",))
+async def warm_static_analysis(project_id: str) -> dict:
+    _, workspace_path, manifest = await get_project_manifest(project_id)
+    diagnostics = await static_analyzer.sync(project_id, workspace_path, manifest, workspace_manifests)
+    return diagnostics.summary()
+
+@warmup_pipeline.step("analysis", after=("profile", "symbol_index"))
+async def warm_full_analysis(project_id: str) -> dict:
+    skill_level = ProjectAnalysisRequest.model_fields["skill_level"].default
+    await compute_full_analysis(project_id, skill_level)
+    return {"skill_level": skill_level}
+
+@api_router.get("/project/{project_id}/warmup")
+async def get_warmup_status(project_id: str):
+    """Background warm-up job: overall status and per-artifact readiness"""
+    job = warmup_pipeline.status(project_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="No warm-up job for this project")
+    return job
+
+@api_router.post("/project/{project_id}/warmup")
+async def start_warmup(project_id: str):
+    """Re-run the warm-up job (no-op while one is already running)"""
+    project = await projects_collection.find_one({"project_id": project_id})
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    return warmup_pipeline.enqueue(project_id)
+
+@api_router.websocket("/project/{project_id}/warmup/ws")
+async def warmup_notifications(websocket: WebSocket, project_id: str):
+    """Push warm-up progress: the current job, then one event per step transition until done"""
+    await websocket.accept()
+    queue = warmup_pipeline.subscribe(project_id)
+    try:
+        job = warmup_pipeline.status(project_id)
+        await websocket.send_json({"event": "status", "job": job})
+        if job is None or job["finished_at"]:
+            return
+        while True:
+            event = await queue.get()
+            await websocket.send_json(event)
+            if event["event"] == "done":
+                break
+    except WebSocketDisconnect:
+        pass
+    finally:
+        warmup_pipeline.unsubscribe(project_id, queue)
+        await websocket.close()
+
+@api_router.get("/project/{project_id}/diagnostics")
+async def get_diagnostics(project_id: str, path: Optional[str] = None, severity: Optional[str] = None):
+    """Local static analysis results (syntax errors, unused imports, invalid JSON)"""
+    try:
+        _, workspace_path, manifest = await get_project_manifest(project_id)
+        diagnostics = await static_analyzer.sync(project_id, workspace_path, manifest, workspace_manifests)
+        return {**diagnostics.summary(), "diagnostics": diagnostics.results(path, severity)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Diagnostics error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @api_router.get("/project/{project_id}/structure")
-async def get_project_structure(project_id: str):
-    """Get updated project structure"""
+async def get_project_structure(project_id: str, since: Optional[int] = None):
+    """Get updated project structure
+    
+    Served from the workspace manifest. Pass `since` (a previously returned
+    version) to receive only the files changed or deleted after it.
+    """
     try:
-        project = await projects_collection.find_one({"project_id": project_id})
-        if not project:
-            raise HTTPException(status_code=404, detail="Project not found")
-        
-        workspace_path = Path(project['workspace_path'])
+        _, _, manifest = await get_project_manifest(project_id)
         
-        file_tree = build_file_tree(workspace_path)
-        language_stats = calculate_language_stats(workspace_path)
+        if since is not None:
+            delta = workspace_manifests.changes_since(manifest, since)
+            if delta is not None:
+                return {"full": False, **delta}
         
         return {
-            "root": file_tree.model_dump(),
-            "languages": [ls.model_dump() for ls in language_stats]
+            "full": True,
+            "version": manifest["version"],
+            "root": workspace_manifests.tree(manifest),
+            "languages": workspace_manifests.languages(manifest)
         }
     except HTTPException:
         raise
@@ -1812,6 +2109,186 @@ async def get_project_structure(project_id: str):
         logger.error(f"Get structure error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/project/{project_id}/tree")
+async def get_project_tree(
+    project_id: str,
+    path: str = "",
+    cursor: Optional[str] = None,
+    limit: int = 200,
+    format: str = "level"
+):
+    """Lazy file tree for large repositories
+    
+    format=level (default): one directory level at a time, paginated with
+    `cursor`/`limit`. Directory entries carry a file_count so the UI can
+    show expanders without fetching children.
+    
+    format=flat: the whole tree as parallel arrays (names, parent indices,
+    sizes, language ids) - a fraction of the nested /structure payload.
+    """
+    try:
+        _, _, manifest = await get_project_manifest(project_id)
+        
+        if format == "flat":
+            return workspace_manifests.flat_tree(manifest)
+        if format != "level":
+            raise HTTPException(status_code=400, detail=f"Unknown format: {format}")
+        
+        listing = workspace_manifests.list_directory(manifest, path, cursor, max(1, min(limit, 1000)))
+        if listing is None:
+            raise HTTPException(status_code=404, detail="Directory not found")
+        return listing
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Get tree error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+class ForkProjectRequest(BaseModel):
+    name: Optional[str] = None
+
+@api_router.post("/project/{project_id}/fork")
+async def fork_project(project_id: str, request: ForkProjectRequest = None):
+    """Fork a project into a new workspace
+    
+    Where the filesystem supports reflinks, unchanged files are cloned
+    from the blob store and edited files are deduplicated first; otherwise
+    every file is copied ("storage" in the response says which). Modes and
+    mtimes are preserved. Dependency directories such as node_modules are
+    not carried over.
+    """
+    try:
+        project, workspace_path, manifest = await get_project_manifest(project_id)
+        
+        fork_id = str(uuid.uuid4())
+        fork_path = WORKSPACE_DIR / fork_id
+        fork_size = sum(meta["size"] for meta in manifest["files"].values())
+        if not await workspace_lifecycle.make_room(project.get("user_id"), fork_size, exclude=f"project:{project_id}"):
+            raise HTTPException(status_code=507, detail="Workspace storage quota exceeded")
+        result = await asyncio.to_thread(blob_store.fork_workspace, workspace_path, fork_path, manifest["files"])
+        workspace_lifecycle.register("project", fork_id, project.get("user_id"), fork_size)
+        
+        fork_name = (request.name if request and request.name else None) or f"{project['name']} (fork)"
+        fork_data = {k: v for k, v in project.items() if k != "_id"}
+        fork_data.update({
+            "project_id": fork_id,
+            "name": fork_name,
+            "workspace_path": str(fork_path),
+            "forked_from": project_id,
+            "created_at": datetime.now(timezone.utc).isoformat()
+        })
+        await projects_collection.insert_one(fork_data)
+        
+        fork_manifest = await workspace_manifests.build(fork_id, fork_path, known_hashes=result["entries"])
+        workspace_manifests.start_watcher(fork_id, fork_path)
+        
+        return {
+            "project_id": fork_id,
+            "name": fork_name,
+            "forked_from": project_id,
+            "storage": result["mode"],
+            "files_linked": result["linked"],
+            "files_ingested": result["ingested"],
+            "files_copied": result["copied"],
+            "version": fork_manifest["version"]
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Fork project error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/project/{project_id}/search")
+async def search_project(
+    project_id: str,
+    q: str = "",
+    mode: str = "literal",
+    glob: Optional[str] = None,
+    case_sensitive: bool = False,
+    context: int = 2,
+    max_results: int = 200
+):
+    """Search project files through the trigram index
+    
+    mode=literal | regex | path. `glob` filters by path (e.g. "src/**/*.py"
+    or "*.test.js"). Streams NDJSON: one object per match with line context,
+    then a summary object with "done": true.
+    """
+    if mode not in ("literal", "regex", "path"):
+        raise HTTPException(status_code=400, detail=f"Unknown search mode: {mode}")
+    if mode != "path" and not q:
+        raise HTTPException(status_code=400, detail="Query required")
+    if mode == "regex":
+        try:
+            re.compile(q)
+        except re.error as e:
+            raise HTTPException(status_code=400, detail=f"Invalid regex: {e}")
+    
+    try:
+        _, workspace_path, manifest = await get_project_manifest(project_id)
+        await code_search.sync(project_id, workspace_path, manifest, workspace_manifests)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Search index error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    async def stream():
+        async for result in code_search.search(
+            project_id, workspace_path, q, mode, glob, case_sensitive,
+            max(0, min(context, 10)), max(1, min(max_results, 2000))
+        ):
+            yield json.dumps(result) + "\n"
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+async def get_symbol_index(project_id: str):
+    try:
+        _, workspace_path, manifest = await get_project_manifest(project_id)
+        return await symbol_index.sync(project_id, workspace_path, manifest, workspace_manifests)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Symbol index error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/project/{project_id}/symbols/definition")
+async def find_definition(project_id: str, name: str, path: Optional[str] = None):
+    """Go to definition: where `name` is defined, most central file first
+    
+    When `path` is given, definitions in that file and in the files it
+    imports are listed before the rest.
+    """
+    index = await get_symbol_index(project_id)
+    definitions = index.definitions(name)
+    if path:
+        nearby = {path} | index.edges.get(path, set())
+        definitions.sort(key=lambda d: d["path"] not in nearby)
+    return {"name": name, "definitions": definitions}
+
+@api_router.get("/project/{project_id}/symbols/references")
+async def find_references(project_id: str, name: str, limit: int = 500):
+    """Find references: every file and line that uses `name`"""
+    index = await get_symbol_index(project_id)
+    limit = max(1, min(limit, 5000))
+    references = index.references(name, limit)
+    return {"name": name, "references": references, "truncated": len(references) >= limit}
+
+@api_router.get("/project/{project_id}/symbols")
+async def get_project_symbols(project_id: str, path: Optional[str] = None, limit: int = 30):
+    """Outline of one file, or the project's most central symbols and files"""
+    index = await get_symbol_index(project_id)
+    if path:
+        return {"path": path, "symbols": index.outline(path), "imports": sorted(index.edges.get(path, ()))}
+    ranks = index.rank()
+    fan_in = index.fan_in()
+    top_files = sorted(ranks.items(), key=lambda kv: -kv[1])[:limit]
+    return {
+        **index.stats(),
+        "top_files": [{"path": p, "rank": round(r, 6), "imported_by": fan_in.get(p, 0)} for p, r in top_files],
+        "top_symbols": index.top_symbols(limit)
+    }
+
 # ============== MULTI-INDUSTRY AGENT SYSTEM ==============
 
 AGENT_DEFINITIONS = {
@@ -3303,37 +3780,39 @@ class FileTeachingRequest(BaseModel):
 async def teach_project(project_id: str, request: ProjectTeachingRequest):
     """AI Senior Agent teaches about the entire project comprehensively"""
     try:
-        project = await projects_collection.find_one({"project_id": project_id})
-        if not project:
-            raise HTTPException(status_code=404, detail="Project not found")
-        
-        workspace_path = Path(project['workspace_path'])
+        project, workspace_path, manifest = await get_project_manifest(project_id)
         
-        # Analyze multiple key files
-        key_files = []
-        for entry_point in project.get('entry_points', [])[:3]:
-            try:
-                file_path = workspace_path / entry_point
-                if file_path.exists() and file_path.is_file():
-                    content = file_path.read_text(errors='replace')[:3000]
-                    key_files.append({
-                        "path": entry_point,
-                        "content": content[:1000]  # Truncate for analysis
-                    })
-            except:
-                pass
+        # Entry points first, then the most imported files, within a small budget
+        index = await symbol_index.sync(project_id, workspace_path, manifest, workspace_manifests)
+        key_files = await asyncio.to_thread(
+            index.select_files, workspace_path, PROMPT_CONTEXT_TOKENS // 3, 1000, project.get('entry_points', [])[:3]
+        )
+        key_files = [f for f in key_files if f['path'] not in ('README.md', 'readme.md')]
         
         # Get README if exists
         readme_content = ""
+        readme_file = None
         for readme_name in ['README.md', 'readme.md', 'README.txt']:
             readme_path = workspace_path / readme_name
             if readme_path.exists():
                 try:
                     readme_content = readme_path.read_text(errors='replace')[:2000]
+                    readme_file = readme_name
                     break
                 except:
                     pass
         
+        relevant_paths = [f['path'] for f in key_files] + ([readme_file] if readme_file else [])
+        key = cache_key(
+            "teach", request.skill_level,
+            workspace_manifests.fingerprint(manifest, relevant_paths),
+            project.get('name'), project.get('frameworks', []), project.get('entry_points', []),
+            project.get('build_system'), project.get('total_files', 0), project.get('has_tests', False)
+        )
+        cached = await analysis_cache.get(key)
+        if cached is not None:
+            return {**cached, "cache_hit": True}
+        
         skill_context = get_skill_context(request.skill_level)
         
         system_prompt = f"""You are a world-class senior software engineer and mentor teaching a developer about this codebase.
@@ -3390,19 +3869,25 @@ README CONTENT:
 {readme_content if readme_content else 'No README found'}
 
 KEY FILES SAMPLE:
-{newline.join([f"File: {f['path']}{newline}{f['content'][:500]}..." for f in key_files[:2]])}
+{newline.join([f"File: {f['path']}{newline}{f['content']}" for f in key_files])}
 """
         
         chat = get_chat_instance(system_prompt)
         user_msg = UserMessage(text=f"Teach me about this project:\n\n{context}")
         response = await chat.send_message(user_msg)
         
-        return {
+        result = {
             "teaching_content": response or "Unable to analyze project",
             "project_name": project.get('name', 'Unknown'),
             "key_files_analyzed": [f['path'] for f in key_files]
         }
+        if response:
+            await analysis_cache.put(key, "teach", project_id, relevant_paths, result, request.skill_level)
         
+        return {**result, "cache_hit": False}
+        
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Project teaching error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -3411,16 +3896,20 @@ KEY FILES SAMPLE:
 async def teach_file(project_id: str, request: FileTeachingRequest):
     """AI Senior Agent explains a specific file in detail"""
     try:
-        project = await projects_collection.find_one({"project_id": project_id})
-        if not project:
-            raise HTTPException(status_code=404, detail="Project not found")
-        
-        workspace_path = Path(project['workspace_path'])
+        _, workspace_path, manifest = await get_project_manifest(project_id)
         file_path = workspace_path / request.file_path
         
         if not file_path.exists():
             raise HTTPException(status_code=404, detail="File not found")
         
+        # The explanation depends only on this file's content, so unchanged files are instant
+        meta = manifest["files"].get(request.file_path)
+        file_hash = meta["hash"] if meta and meta.get("hash") else await asyncio.to_thread(hash_file, file_path)
+        key = cache_key("teach-file", request.skill_level, request.file_path, file_hash)
+        cached = await analysis_cache.get(key)
+        if cached is not None:
+            return {**cached, "cache_hit": True}
+        
         content = file_path.read_text(errors='replace')
         skill_context = get_skill_context(request.skill_level)
         
@@ -3462,11 +3951,17 @@ Be detailed, clear, and educational."""
         user_msg = UserMessage(text=f"Explain this file:\n\nPath: {request.file_path}\n\nCode:\n{content[:5000]}")
         response = await chat.send_message(user_msg)
         
-        return {
+        result = {
             "teaching_content": response or "Unable to analyze file",
             "file_path": request.file_path
         }
+        if response:
+            await analysis_cache.put(key, "teach-file", project_id, [request.file_path], result, request.skill_level)
+        
+        return {**result, "cache_hit": False}
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"File teaching error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -5376,7 +5871,9 @@ from moltbot_tools import (
     web_fetch_tool,
     browser_tool,
     skills_manager,
-    memory_system
+    memory_system,
+    close_http_client,
+    SCREENSHOT_DIR
 )
 
 # Moltbot API Router
@@ -5415,17 +5912,19 @@ async def exec_tool(request: ExecRequest):
             }
         else:
             # Foreground execution (quick commands)
-            process = await asyncio.create_subprocess_shell(
-                request.command,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                cwd=request.workdir or os.getcwd()
-            )
-            
-            stdout, stderr = await asyncio.wait_for(
-                process.communicate(),
-                timeout=min(request.timeout, 60)
-            )
+            workdir = request.workdir or os.getcwd()
+            with running_in(workdir):
+                process = await asyncio.create_subprocess_shell(
+                    request.command,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    cwd=workdir
+                )
+                
+                stdout, stderr = await asyncio.wait_for(
+                    process.communicate(),
+                    timeout=min(request.timeout, 60)
+                )
             
             return {
                 "status": "completed",
@@ -5448,17 +5947,52 @@ async def exec_tool(request: ExecRequest):
 # ============== PROCESS TOOL ==============
 
 @moltbot_router.get("/process/list")
-async def process_list():
-    """List all background process sessions"""
-    sessions = await process_manager.list_sessions()
-    return {"sessions": sessions, "count": len(sessions)}
+async def process_list(status: Optional[str] = None, offset: int = 0, limit: int = 50):
+    """List background process sessions, newest first, optionally filtered by status"""
+    result = await process_manager.list_sessions(status, max(0, offset), max(1, min(limit, 500)))
+    return {**result, "count": len(result["sessions"])}
+
+@moltbot_router.post("/process/reap")
+async def process_reap():
+    """Apply the session retention policy now (max sessions, age and bytes on disk)"""
+    return await process_manager.reap()
 
 @moltbot_router.post("/process/poll")
-async def process_poll(session_id: str, offset: int = 0):
-    """Poll process session for new output"""
-    result = await process_manager.poll(session_id, offset)
+async def process_poll(session_id: str, offset: int = 0, stderr_offset: int = 0, max_bytes: int = 256 * 1024,
+                       wait_ms: int = 0):
+    """Poll process session for new output
+    
+    offset and stderr_offset are byte cursors; pass back the values from the
+    previous response to receive only what was written since. wait_ms > 0
+    long-polls until there is new output or the process exits (max 30s).
+    """
+    result = await process_manager.poll(session_id, offset, stderr_offset, max_bytes, wait_ms)
     return result
 
+@moltbot_router.get("/process/tail")
+async def process_tail(session_id: str, offset: int = 0, stderr_offset: int = 0):
+    """Server-sent events: stdout/stderr chunks as they arrive, then an exit event"""
+    if session_id not in process_manager.sessions:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    async def events():
+        async for event in process_manager.tail(session_id, offset, stderr_offset):
+            yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+    
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@moltbot_router.websocket("/process/tail/ws")
+async def process_tail_ws(websocket: WebSocket, session_id: str, offset: int = 0, stderr_offset: int = 0):
+    """WebSocket variant of /process/tail"""
+    await websocket.accept()
+    try:
+        async for event in process_manager.tail(session_id, offset, stderr_offset):
+            await websocket.send_json(event)
+    except WebSocketDisconnect:
+        return
+    await websocket.close()
+
 @moltbot_router.post("/process/kill")
 async def process_kill(session_id: str):
     """Kill a running process session"""
@@ -5487,12 +6021,32 @@ async def web_search(request: WebSearchRequest):
     )
     return result
 
+class WebSearchBatchRequest(BaseModel):
+    queries: List[str]
+    count: int = 5
+    country: Optional[str] = None
+    search_lang: Optional[str] = None
+
+@moltbot_router.post("/web/search/batch")
+async def web_search_batch(request: WebSearchBatchRequest):
+    """Run several searches concurrently under the search rate limit; results keep query order"""
+    if len(request.queries) > 20:
+        raise HTTPException(status_code=400, detail="At most 20 queries per batch")
+    results = await web_search_tool.search_many(
+        queries=request.queries,
+        count=request.count,
+        country=request.country,
+        search_lang=request.search_lang
+    )
+    return {"results": results, "count": len(results)}
+
 # ============== WEB FETCH TOOL ==============
 
 class WebFetchRequest(BaseModel):
     url: str
     extract_mode: str = "markdown"
     max_chars: int = 50000
+    parser: str = "auto"
 
 @moltbot_router.post("/web/fetch")
 async def web_fetch(request: WebFetchRequest):
@@ -5503,59 +6057,143 @@ async def web_fetch(request: WebFetchRequest):
     result = await web_fetch_tool.fetch(
         url=request.url,
         extract_mode=request.extract_mode,
-        max_chars=request.max_chars
+        max_chars=request.max_chars,
+        parser=request.parser
     )
     return result
 
+class WebFetchBatchRequest(BaseModel):
+    urls: List[str]
+    extract_mode: str = "markdown"
+    max_chars: int = 50000
+    parser: str = "auto"
+
+@moltbot_router.post("/web/fetch/batch")
+async def web_fetch_batch(request: WebFetchBatchRequest):
+    """Fetch several pages concurrently; results keep URL order"""
+    if len(request.urls) > 20:
+        raise HTTPException(status_code=400, detail="At most 20 URLs per batch")
+    results = await web_fetch_tool.fetch_many(
+        urls=request.urls,
+        extract_mode=request.extract_mode,
+        max_chars=request.max_chars,
+        parser=request.parser
+    )
+    return {"results": results, "count": len(results)}
+
 # ============== BROWSER TOOL ==============
 
 class BrowserAction(BaseModel):
     action: str
+    session_id: str = "default"
     url: Optional[str] = None
     selector: Optional[str] = None
     text: Optional[str] = None
     full_page: bool = False
+    # navigate only: profile (full/fast/text) and per-call overrides
+    profile: Optional[str] = None
+    wait_until: Optional[str] = None
+    block_types: Optional[List[str]] = None
+    block_third_party: Optional[bool] = None
+    block_domains: Optional[List[str]] = None
+    timeout: int = 30000
+    # snapshot
+    max_chars: int = 8000
+    max_elements: int = 150
+    # screenshot: selector (or clip, in page coordinates) limits the region
+    format: str = "jpeg"
+    quality: int = 70
+    max_width: int = 1280
+    max_bytes: int = 512 * 1024
+    clip: Optional[Dict[str, float]] = None
+    inline: bool = True
 
 @moltbot_router.post("/browser")
 async def browser_control(request: BrowserAction):
     """
     Control browser using Playwright (Moltbot browser tool)
-    Actions: start, stop, navigate, screenshot, click, type, content, status
+    Actions: start, stop, navigate, snapshot, screenshot, click, type, content, status
+    Each session_id gets its own isolated context in the shared browser
     """
     try:
         action = request.action.lower()
+        session_id = request.session_id
         
         if action == "start":
-            result = await browser_tool.start()
+            result = await browser_tool.start(session_id)
         elif action == "stop":
-            result = await browser_tool.stop()
+            result = await browser_tool.stop(session_id)
         elif action == "navigate":
             if not request.url:
                 raise HTTPException(status_code=400, detail="URL required for navigate")
-            result = await browser_tool.navigate(request.url)
+            result = await browser_tool.navigate(
+                request.url,
+                session_id,
+                profile=request.profile,
+                wait_until=request.wait_until,
+                block_types=request.block_types,
+                block_third_party=request.block_third_party,
+                block_domains=request.block_domains,
+                timeout=request.timeout
+            )
+        elif action == "snapshot":
+            result = await browser_tool.snapshot(session_id, request.max_chars, request.max_elements)
         elif action == "screenshot":
-            result = await browser_tool.screenshot(request.full_page)
+            result = await browser_tool.screenshot(
+                request.full_page,
+                session_id,
+                image_format=request.format,
+                quality=request.quality,
+                max_width=request.max_width,
+                max_bytes=request.max_bytes,
+                clip=request.clip,
+                selector=request.selector,
+                inline=request.inline
+            )
         elif action == "click":
             if not request.selector:
                 raise HTTPException(status_code=400, detail="Selector required for click")
-            result = await browser_tool.click(request.selector)
+            result = await browser_tool.click(request.selector, session_id)
         elif action == "type":
             if not request.selector or not request.text:
                 raise HTTPException(status_code=400, detail="Selector and text required for type")
-            result = await browser_tool.type_text(request.selector, request.text)
+            result = await browser_tool.type_text(request.selector, request.text, session_id)
         elif action == "content":
-            result = await browser_tool.get_content()
+            result = await browser_tool.get_content(session_id)
         elif action == "status":
-            result = await browser_tool.status()
+            result = await browser_tool.status(session_id)
         else:
             raise HTTPException(status_code=400, detail=f"Unknown action: {action}")
         
         return result
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Browser tool error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@moltbot_router.get("/browser/sessions")
+async def browser_sessions():
+    """Shared browser pool: open sessions, limits, navigation profiles and relaunch/recycle counters"""
+    return browser_tool.pool_status()
+
+@moltbot_router.get("/browser/screenshots/{name}")
+async def browser_screenshot_file(name: str):
+    """Serve a screenshot taken with inline=false until it expires"""
+    if not re.fullmatch(r"[0-9a-f]{16}\.(jpg|webp|png)", name):
+        raise HTTPException(status_code=400, detail="Invalid screenshot name")
+    path = SCREENSHOT_DIR / name
+    if not path.exists():
+        raise HTTPException(status_code=404, detail="Screenshot not found or expired")
+    media_type = {"jpg": "image/jpeg", "webp": "image/webp", "png": "image/png"}[name.rsplit('.', 1)[1]]
+    return Response(content=await asyncio.to_thread(path.read_bytes), media_type=media_type)
+
+@moltbot_router.post("/browser/reap")
+async def browser_reap():
+    """Close browser sessions idle longer than the pool's idle timeout and expired screenshots"""
+    return await browser_tool.reap()
+
 # ============== SKILLS SYSTEM ==============
 
 @moltbot_router.get("/skills/list")
@@ -5598,16 +6236,25 @@ async def memory_read():
 
 @moltbot_router.post("/memory/append")
 async def memory_append(content: str):
-    """Append to memory file"""
-    memory_system.append_memory(content)
-    return {"success": True, "message": "Memory appended"}
+    """Append an entry to the memory journal"""
+    entry = await asyncio.to_thread(memory_system.append_memory, content)
+    return {"success": True, "message": "Memory appended", **entry}
 
 @moltbot_router.get("/memory/search")
-async def memory_search(query: str):
-    """Search memory"""
-    matches = memory_system.search_memory(query)
+async def memory_search(query: str, limit: int = 10):
+    """Search memory; whole entries ranked by BM25"""
+    matches = await asyncio.to_thread(memory_system.search_memory, query, max(1, min(limit, 100)))
     return {"query": query, "matches": matches, "count": len(matches)}
 
+@moltbot_router.get("/memory/recall")
+async def memory_recall(query: str, k: int = 5, sources: str = "memory,files", min_score: float = 0.0):
+    """Vector recall over memory entries and workspace files; finds notes phrased differently from the query"""
+    selected = tuple(s.strip() for s in sources.split(",") if s.strip())
+    if not selected or not set(selected) <= {"memory", "files"}:
+        raise HTTPException(status_code=400, detail="sources must be memory, files or both")
+    results = await asyncio.to_thread(memory_system.recall, query, max(1, min(k, 50)), selected, min_score)
+    return {"query": query, "results": results, "count": len(results)}
+
 @moltbot_router.get("/memory/workspace")
 async def memory_workspace():
     """List workspace files"""
@@ -5638,9 +6285,9 @@ async def gateway_status():
         "tools": {
             "exec": {"enabled": True, "security": "allowlist"},
             "process": {"sessions": len(process_manager.sessions)},
-            "browser": {"running": browser_tool.is_running},
+            "browser": {"running": browser_tool.is_running, "sessions": len(browser_tool.sessions)},
             "skills": {"count": len(skills_manager.skills)},
-            "memory": {"workspace": str(memory_system.workspace_dir)}
+            "memory": {"workspace": str(memory_system.workspace_dir), **memory_system.stats()}
         },
         "timestamp": datetime.now(timezone.utc).isoformat()
     }
@@ -5652,6 +6299,8 @@ class MoltbotAgentRequest(BaseModel):
     tools_enabled: List[str] = ["web_search", "web_fetch", "browser", "exec"]
     session_id: str
     skill_level: str = "intermediate"
+    memory_k: int = 5
+    memory_token_budget: int = 800  # 0 disables memory recall
 
 @moltbot_router.post("/agent/chat")
 async def moltbot_agent_chat(request: MoltbotAgentRequest):
@@ -5661,6 +6310,9 @@ async def moltbot_agent_chat(request: MoltbotAgentRequest):
     """
     try:
         skill_context = get_skill_context(request.skill_level)
+        memory_context, memories_used = await asyncio.to_thread(
+            memory_system.recall_context, request.message, request.memory_k, request.memory_token_budget
+        )
         
         # Build tools description
         tools_desc = []
@@ -5679,6 +6331,8 @@ You are a FULL-FEATURED AI assistant with REAL tool access.
 
 {skill_context}
 
+{memory_context}
+
 ## 🛠️ Your REAL Tools:
 
 {chr(10).join(tools_desc)}
@@ -5747,7 +6401,8 @@ Remember: You have REAL tools - use them! 🦞"""
             "response": response,
             "tool_result": tool_result,
             "session_id": request.session_id,
-            "tools_enabled": request.tools_enabled
+            "tools_enabled": request.tools_enabled,
+            "memories_used": memories_used
         }
         
     except Exception as e:
@@ -8101,6 +8756,13 @@ REMOTION_PROJECTS_DIR.mkdir(exist_ok=True)
 # Track running Remotion studio processes
 remotion_processes = {}
 
+# "shared" holds packages installed outside any one project
+workspace_lifecycle.add_root("remotion", REMOTION_PROJECTS_DIR, skip={"shared"})
+workspace_lifecycle.busy_checks.append(
+    lambda kind, workspace_id: kind == "remotion" and workspace_id in remotion_processes
+    and remotion_processes[workspace_id]["process"].poll() is None
+)
+
 class RemotionProjectSetup(BaseModel):
     code: str
     component_name: str = "VideoComponent"
@@ -9075,6 +9737,21 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def start_workspace_reaper():
+    workspace_lifecycle.start()
+    workspace_manifests.start()
+    await process_manager.start(db.process_sessions)
+    memory_system.start_recall_refresh()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await warmup_pipeline.close()
+    await process_manager.close()
+    await browser_tool.close()
+    await close_http_client()
+    web_fetch_tool.executor.shutdown(wait=False)
+    await asyncio.to_thread(memory_system.close)
+    await workspace_lifecycle.close()
+    await workspace_manifests.close()
     client.close()
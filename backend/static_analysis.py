@@ -0,0 +1,211 @@
+"""
+Static Analysis
+Local, LLM-free diagnostics for project files.
+
+Python files are checked with pyflakes when it is installed, otherwise with
+a built-in pass (syntax errors, compiler warnings, unused imports). JSON
+files are checked for syntax errors. Results are kept per file and brought
+up to date from the workspace manifest, so only changed files are
+re-checked.
+"""
+
+import ast
+import asyncio
+import json
+import warnings
+from pathlib import Path
+from typing import Dict, List, Any, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    from pyflakes import api as pyflakes_api
+    from pyflakes import reporter as pyflakes_reporter
+    PYFLAKES_AVAILABLE = True
+except ImportError:
+    PYFLAKES_AVAILABLE = False
+    logger.info("pyflakes not installed; using built-in Python checks")
+
+MAX_ANALYZED_FILE_SIZE = 512 * 1024
+ANALYZED_SUFFIXES = ('.py', '.json')
+
+
+def diagnostic(line: int, column: int, severity: str, code: str, message: str) -> Dict[str, Any]:
+    return {"line": line, "column": column, "severity": severity, "code": code, "message": message}
+
+
+class _CollectingReporter:
+    """pyflakes reporter that records diagnostics instead of printing"""
+
+    def __init__(self):
+        self.diagnostics: List[Dict[str, Any]] = []
+
+    def unexpectedError(self, filename, msg):
+        self.diagnostics.append(diagnostic(1, 1, "error", "E999", str(msg)))
+
+    def syntaxError(self, filename, msg, lineno, offset, text):
+        self.diagnostics.append(diagnostic(lineno or 1, offset or 1, "error", "E999", msg))
+
+    def flake(self, message):
+        code = "F401" if type(message).__name__ == "UnusedImport" else "F"
+        severity = "error" if type(message).__name__ in ("UndefinedName", "UndefinedLocal") else "warning"
+        self.diagnostics.append(diagnostic(
+            message.lineno, (message.col or 0) + 1, severity, code, message.message % message.message_args
+        ))
+
+
+def check_python(path: str, source: str) -> List[Dict[str, Any]]:
+    if PYFLAKES_AVAILABLE:
+        reporter = _CollectingReporter()
+        pyflakes_api.check(source, path, reporter)
+        return reporter.diagnostics
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        try:
+            tree = ast.parse(source, filename=path)
+            compile(tree, path, "exec", dont_inherit=True)
+        except SyntaxError as e:
+            return [diagnostic(e.lineno or 1, e.offset or 1, "error", "E999", e.msg)]
+    results = [
+        diagnostic(getattr(w.message, 'lineno', None) or w.lineno or 1, 1, "warning", "W", str(w.message))
+        for w in caught if issubclass(w.category, SyntaxWarning)
+    ]
+
+    if path.endswith('__init__.py'):
+        return results  # Imports there are usually re-exports
+    imported: Dict[str, ast.AST] = {}
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            if isinstance(node, ast.ImportFrom) and node.module == '__future__':
+                continue
+            for alias in node.names:
+                if alias.name == '*':
+                    continue
+                name = alias.asname or alias.name.split('.')[0]
+                imported[name] = node
+    if not imported:
+        return results
+
+    used = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            used.add(node.id)
+        elif isinstance(node, ast.Constant) and isinstance(node.value, str):
+            used.update(node.value.replace(',', ' ').split())  # __all__ entries and string annotations
+    for name, node in imported.items():
+        if name not in used:
+            results.append(diagnostic(node.lineno, node.col_offset + 1, "warning", "F401",
+                                      f"'{name}' imported but unused"))
+    return results
+
+
+def check_json(path: str, source: str) -> List[Dict[str, Any]]:
+    if path.endswith(('tsconfig.json', 'jsconfig.json')) or '.vscode/' in path:
+        return []  # JSON with comments
+    try:
+        json.loads(source)
+    except json.JSONDecodeError as e:
+        return [diagnostic(e.lineno, e.colno, "error", "JSON", e.msg)]
+    return []
+
+
+def check_file(full_path: Path, rel_path: str) -> Optional[List[Dict[str, Any]]]:
+    """Diagnostics for one file, or None when it is not analyzed"""
+    if not rel_path.endswith(ANALYZED_SUFFIXES):
+        return None
+    try:
+        if full_path.stat().st_size > MAX_ANALYZED_FILE_SIZE:
+            return None
+        source = full_path.read_text(errors='replace')
+    except OSError:
+        return None
+    if rel_path.endswith('.py'):
+        return check_python(rel_path, source)
+    return check_json(rel_path, source)
+
+
+class ProjectDiagnostics:
+    """Per-file diagnostics for one project at a manifest version"""
+
+    def __init__(self):
+        self.files: Dict[str, List[Dict[str, Any]]] = {}
+        self.version = -1
+
+    def summary(self) -> Dict[str, Any]:
+        counts = {"error": 0, "warning": 0}
+        for diagnostics in self.files.values():
+            for d in diagnostics:
+                counts[d["severity"]] = counts.get(d["severity"], 0) + 1
+        return {
+            "version": self.version,
+            "files_checked": len(self.files),
+            "files_with_issues": sum(1 for d in self.files.values() if d),
+            **counts
+        }
+
+    def results(self, path: Optional[str] = None, severity: Optional[str] = None) -> List[Dict[str, Any]]:
+        items = []
+        for file in sorted(self.files):
+            if path and file != path:
+                continue
+            for d in self.files[file]:
+                if severity is None or d["severity"] == severity:
+                    items.append({"path": file, **d})
+        return items
+
+
+class StaticAnalyzer:
+    """Keeps each project's diagnostics in step with its manifest"""
+
+    def __init__(self):
+        self.projects: Dict[str, ProjectDiagnostics] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def _lock(self, project_id: str) -> asyncio.Lock:
+        if project_id not in self._locks:
+            self._locks[project_id] = asyncio.Lock()
+        return self._locks[project_id]
+
+    @staticmethod
+    def _apply(project: ProjectDiagnostics, workspace_path: Path,
+               changed: List[Dict[str, Any]], deleted: List[str]) -> None:
+        for path in deleted:
+            project.files.pop(path, None)
+        for entry in changed:
+            result = check_file(workspace_path / entry["path"], entry["path"])
+            if result is None:
+                project.files.pop(entry["path"], None)
+            else:
+                project.files[entry["path"]] = result
+
+    async def sync(self, project_id: str, workspace_path: Path, manifest: Dict[str, Any],
+                   manifest_store) -> ProjectDiagnostics:
+        """Re-check only files changed since the last run (everything on first use)"""
+        workspace_path = Path(workspace_path)
+        async with self._lock(project_id):
+            project = self.projects.get(project_id)
+            if project is not None and project.version == manifest["version"]:
+                return project
+
+            delta = manifest_store.changes_since(manifest, project.version) if project is not None else None
+            if delta is None:
+                project = ProjectDiagnostics()
+                changed = [{"path": p, **meta} for p, meta in manifest["files"].items()]
+                deleted = []
+            else:
+                changed, deleted = delta["changed"], delta["deleted"]
+
+            await asyncio.to_thread(self._apply, project, workspace_path, changed, deleted)
+            project.version = manifest["version"]
+            self.projects[project_id] = project
+            return project
+
+    def forget(self, project_id: str) -> None:
+        self.projects.pop(project_id, None)
+        self._locks.pop(project_id, None)
+
+
+# Global analyzer
+static_analyzer = StaticAnalyzer()
@@ -0,0 +1,371 @@
+"""
+Suite Runner
+Structured, sharded test runs for project workspaces.
+
+Test files are discovered from the workspace manifest, split into shards
+balanced by the duration each file took last time, and run as parallel
+worker processes that each write a machine-readable report (pytest JUnit
+XML, jest JSON, vitest JUnit). Reports are merged into per-test results.
+
+"affected" mode runs only the tests that transitively import a file changed
+since the last run (from manifest versions and the symbol index's import
+graph), plus tests that failed last time.
+"""
+
+import asyncio
+import json
+import os
+import shutil
+import signal
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from pathlib import Path, PurePosixPath
+from typing import Dict, List, Optional, Any, Set
+import logging
+
+logger = logging.getLogger(__name__)
+
+PYTHON_TEST_GLOBS = ('test_*.py', '*_test.py')
+JS_TEST_SUFFIXES = ('.test.js', '.test.jsx', '.test.ts', '.test.tsx', '.test.mjs',
+                    '.spec.js', '.spec.jsx', '.spec.ts', '.spec.tsx', '.spec.mjs')
+MAX_OUTPUT_CHARS = 20000
+KILL_GRACE = 5  # Seconds to wait for output to close after killing a shard's process group
+
+
+def is_test_file(path: str, framework: str) -> bool:
+    pure = PurePosixPath(path)
+    if framework == "pytest":
+        return any(pure.match(g) for g in PYTHON_TEST_GLOBS)
+    return path.endswith(JS_TEST_SUFFIXES) or ('__tests__/' in path and pure.suffix in ('.js', '.jsx', '.ts', '.tsx'))
+
+
+def detect_framework(workspace_path: Path) -> Optional[str]:
+    """pytest | jest | vitest | npm (unstructured `npm test`) | None"""
+    package_json = workspace_path / 'package.json'
+    if package_json.exists():
+        try:
+            pkg = json.loads(package_json.read_text())
+        except (OSError, ValueError):
+            pkg = {}
+        deps = {**pkg.get('dependencies', {}), **pkg.get('devDependencies', {})}
+        test_script = pkg.get('scripts', {}).get('test', '')
+        if 'vitest' in deps or 'vitest' in test_script:
+            return "vitest"
+        if 'jest' in deps or 'jest' in test_script or 'react-scripts' in deps:
+            return "jest"
+        if test_script:
+            return "npm"
+    if (workspace_path / 'pytest.ini').exists() or (workspace_path / 'tests').exists() \
+            or (workspace_path / 'conftest.py').exists() or any(workspace_path.glob('test_*.py')):
+        return "pytest"
+    return None
+
+
+def junit_file(classname: str, files: List[str], workspace_path: Path) -> Optional[str]:
+    """Test file for a JUnit testcase without a file attribute
+    
+    vitest puts the file path in classname; pytest's xunit2 reports only
+    carry the dotted module path (tests.test_app.TestLogin).
+    """
+    if not classname:
+        return None
+    path = Path(classname)
+    if path.is_absolute():
+        try:
+            classname = path.relative_to(workspace_path).as_posix()
+        except ValueError:
+            pass
+    if classname in files:
+        return classname
+    for file in files:
+        if file.endswith('.py'):
+            module = file[:-3].replace('/', '.')
+            if classname == module or classname.startswith(module + '.'):
+                return file
+    return None
+
+
+def parse_junit(report: Path, files: List[str], workspace_path: Path) -> List[Dict[str, Any]]:
+    tests = []
+    root = ET.parse(report).getroot()
+    for case in root.iter('testcase'):
+        status = "passed"
+        message = None
+        traceback = None
+        for child in case:
+            if child.tag in ('failure', 'error'):
+                status = "failed" if child.tag == 'failure' else "error"
+                message = child.get('message')
+                traceback = child.text
+                break
+            if child.tag == 'skipped':
+                status = "skipped"
+                message = child.get('message')
+        classname = case.get('classname', '')
+        name = case.get('name', '')
+        tests.append({
+            "id": f"{classname}::{name}" if classname else name,
+            "file": case.get('file') or junit_file(classname, files, workspace_path),
+            "name": name,
+            "classname": classname,
+            "status": status,
+            "duration": float(case.get('time') or 0),
+            "message": message,
+            "traceback": traceback
+        })
+    return tests
+
+
+def parse_jest_json(report: Path, workspace_path: Path) -> List[Dict[str, Any]]:
+    tests = []
+    data = json.loads(report.read_text())
+    for suite in data.get('testResults', []):
+        try:
+            file = Path(suite.get('name', '')).relative_to(workspace_path).as_posix()
+        except ValueError:
+            file = suite.get('name')
+        for case in suite.get('assertionResults', []):
+            status = {"passed": "passed", "failed": "failed"}.get(case.get('status'), "skipped")
+            failures = case.get('failureMessages') or []
+            tests.append({
+                "id": f"{file}::{case.get('fullName') or case.get('title')}",
+                "file": file,
+                "name": case.get('title', ''),
+                "classname": " ".join(case.get('ancestorTitles') or []),
+                "status": status,
+                "duration": (case.get('duration') or 0) / 1000,
+                "message": failures[0].splitlines()[0] if failures else None,
+                "traceback": "\n".join(failures) or None
+            })
+        if suite.get('status') == 'failed' and not suite.get('assertionResults'):
+            # Suite failed to load (syntax error, missing module)
+            tests.append({"id": f"{file}::<load>", "file": file, "name": "<load>", "classname": "",
+                          "status": "error", "duration": 0, "message": "Test file failed to run",
+                          "traceback": suite.get('message')})
+    return tests
+
+
+class SuiteRunner:
+    """Runs a project's tests in parallel shards and tracks what to re-run"""
+
+    def __init__(self, max_workers: Optional[int] = None, timeout: int = 120):
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self.timeout = timeout
+        self.durations: Dict[str, Dict[str, float]] = {}   # project -> test file -> seconds
+        self.last_version: Dict[str, int] = {}             # project -> manifest version of last run
+        self.last_failed: Dict[str, Set[str]] = {}         # project -> test files that failed
+
+    # ---------- selection ----------
+
+    def discover(self, manifest: Dict[str, Any], framework: str) -> List[str]:
+        return sorted(p for p in manifest["files"] if is_test_file(p, framework))
+
+    def affected(self, project_id: str, manifest: Dict[str, Any], manifest_store,
+                 test_files: List[str], edges: Dict[str, Set[str]]) -> Optional[List[str]]:
+        """
+        Test files affected by changes since the last run, or None when there
+        is no usable baseline (first run, or history pruned) and everything
+        should run.
+        """
+        since = self.last_version.get(project_id)
+        if since is None:
+            return None
+        delta = manifest_store.changes_since(manifest, since)
+        if delta is None:
+            return None
+        changed = {c["path"] for c in delta["changed"]} | set(delta["deleted"])
+
+        importers: Dict[str, Set[str]] = {}
+        for source, targets in edges.items():
+            for target in targets:
+                importers.setdefault(target, set()).add(source)
+
+        reached = set(changed)
+        frontier = list(changed)
+        while frontier:
+            for importer in importers.get(frontier.pop(), ()):
+                if importer not in reached:
+                    reached.add(importer)
+                    frontier.append(importer)
+
+        previously_failed = self.last_failed.get(project_id, set())
+        return [t for t in test_files if t in reached or t in previously_failed]
+
+    def shard(self, project_id: str, workspace_path: Path, test_files: List[str], workers: int) -> List[List[str]]:
+        """Greedy longest-first split using last known durations (file size as a fallback)"""
+        workers = max(1, min(workers, len(test_files)))
+        known = self.durations.get(project_id, {})
+
+        def weight(path: str) -> float:
+            if path in known:
+                return known[path]
+            try:
+                return (workspace_path / path).stat().st_size / 10000
+            except OSError:
+                return 0.1
+
+        shards: List[List[str]] = [[] for _ in range(workers)]
+        loads = [0.0] * workers
+        for path in sorted(test_files, key=weight, reverse=True):
+            i = loads.index(min(loads))
+            shards[i].append(path)
+            loads[i] += weight(path)
+        return [s for s in shards if s]
+
+    # ---------- running ----------
+
+    def _command(self, framework: str, files: List[str], report: Path) -> str:
+        quoted = " ".join(f'"{f}"' for f in files)
+        if framework == "pytest":
+            return f'python -m pytest -q -o junit_family=xunit1 --junitxml="{report}" {quoted}'
+        if framework == "jest":
+            return f'npx jest --ci --json --outputFile="{report}" --runTestsByPath {quoted}'
+        if framework == "vitest":
+            return f'npx vitest run --reporter=junit --outputFile="{report}" {quoted}'
+        return "npm test"
+
+    async def _run_shard(self, framework: str, files: List[str], workspace_path: Path,
+                         env: Dict[str, str], report: Path) -> Dict[str, Any]:
+        command = self._command(framework, files, report)
+        started = time.perf_counter()
+        # Own process group, so a timeout kills the runner and its workers, not just the shell
+        process = await asyncio.create_subprocess_shell(
+            command, cwd=str(workspace_path), env={**env, "CI": "true"},
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+            start_new_session=True
+        )
+        chunks: List[bytes] = []
+
+        async def drain():
+            while chunk := await process.stdout.read(65536):
+                chunks.append(chunk)
+
+        reader = asyncio.ensure_future(drain())
+        waiter = asyncio.ensure_future(process.wait())
+        try:
+            await asyncio.wait({reader, waiter}, timeout=self.timeout)
+            timed_out = not waiter.done()
+            if not (reader.done() and waiter.done()):
+                # Timed out, or the shell exited leaving children that still hold the pipe
+                self._kill_group(process)
+                await asyncio.wait({reader, waiter}, timeout=KILL_GRACE)
+            await waiter
+        finally:
+            if process.returncode is None:
+                self._kill_group(process)  # Cancelled (e.g. the request went away)
+            reader.cancel()
+            waiter.cancel()
+        stdout = b"".join(chunks)
+
+        tests: List[Dict[str, Any]] = []
+        if report.exists():
+            try:
+                if framework == "jest":
+                    tests = parse_jest_json(report, workspace_path)
+                else:
+                    tests = parse_junit(report, files, workspace_path)
+            except (ET.ParseError, ValueError) as e:
+                logger.warning(f"Unreadable test report {report}: {e}")
+        return {
+            "files": files,
+            "tests": tests,
+            "returncode": 124 if timed_out else process.returncode,
+            # pytest exits 5 when a shard's files hold no tests; that is not a failure
+            "empty": not timed_out and framework == "pytest" and process.returncode == 5,
+            "timed_out": timed_out,
+            "seconds": round(time.perf_counter() - started, 2),
+            "output": stdout.decode(errors='replace')
+        }
+
+    @staticmethod
+    def _kill_group(process) -> None:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    async def run(self, project_id: str, workspace_path: Path, manifest: Dict[str, Any], manifest_store,
+                  env: Dict[str, str], mode: str = "all", workers: Optional[int] = None,
+                  edges: Optional[Dict[str, Set[str]]] = None) -> Dict[str, Any]:
+        workspace_path = Path(workspace_path)
+        framework = await asyncio.to_thread(detect_framework, workspace_path)
+        if framework is None:
+            return {"success": False, "error": "No test configuration found", "framework": None}
+
+        test_files = self.discover(manifest, framework) if framework != "npm" else []
+        selected = test_files
+        if mode == "affected" and test_files:
+            affected = self.affected(project_id, manifest, manifest_store, test_files, edges or {})
+            if affected is not None:
+                selected = affected
+        if framework != "npm" and mode == "affected" and not selected:
+            self.last_version[project_id] = manifest["version"]
+            return {"success": True, "framework": framework, "mode": mode, "selected": [],
+                    "tests": [], "summary": self._summary([], 0.0), "shards": [], "output": "No affected tests"}
+
+        started = time.perf_counter()
+        report_dir = Path(tempfile.mkdtemp(prefix="test_reports_"))
+        try:
+            if framework == "npm" or not selected:
+                shards = [[]]
+            else:
+                shards = self.shard(project_id, workspace_path, selected, workers or self.max_workers)
+            results = await asyncio.gather(*[
+                self._run_shard(framework, files, workspace_path, env, report_dir / f"shard_{i}.report")
+                for i, files in enumerate(shards)
+            ])
+        finally:
+            shutil.rmtree(report_dir, ignore_errors=True)
+
+        tests = [t for r in results for t in r["tests"]]
+        success = all(r["returncode"] == 0 or r["empty"] for r in results)
+        self._record(project_id, manifest, results, tests)
+
+        output = "\n".join(r["output"] for r in results)
+        return {
+            "success": success,
+            "framework": framework,
+            "mode": mode,
+            "selected": selected,
+            "tests": tests,
+            "summary": self._summary(tests, time.perf_counter() - started),
+            "shards": [{"files": len(r["files"]), "seconds": r["seconds"], "returncode": r["returncode"],
+                        "empty": r["empty"], "timed_out": r["timed_out"]} for r in results],
+            "output": output[-MAX_OUTPUT_CHARS:]
+        }
+
+    def _record(self, project_id: str, manifest: Dict[str, Any], results: List[Dict[str, Any]],
+                tests: List[Dict[str, Any]]) -> None:
+        durations = self.durations.setdefault(project_id, {})
+        for result in results:
+            if len(result["files"]) == 1:
+                durations[result["files"][0]] = result["seconds"]
+        per_file: Dict[str, float] = {}
+        for test in tests:
+            if test.get("file"):
+                per_file[test["file"]] = per_file.get(test["file"], 0) + test["duration"]
+        durations.update(per_file)
+
+        failed = self.last_failed.setdefault(project_id, set())
+        ran = {f for r in results for f in r["files"]}
+        failed -= ran
+        failed |= {t["file"] for t in tests if t["status"] in ("failed", "error") and t.get("file")}
+        failed |= {f for r in results if r["timed_out"] for f in r["files"]}
+        self.last_version[project_id] = manifest["version"]
+
+    @staticmethod
+    def _summary(tests: List[Dict[str, Any]], seconds: float) -> Dict[str, Any]:
+        counts = {status: 0 for status in ("passed", "failed", "error", "skipped")}
+        for test in tests:
+            counts[test["status"]] += 1
+        return {"total": len(tests), **counts, "seconds": round(seconds, 2)}
+
+    def forget(self, project_id: str) -> None:
+        self.durations.pop(project_id, None)
+        self.last_version.pop(project_id, None)
+        self.last_failed.pop(project_id, None)
+
+
+# Global suite runner
+suite_runner = SuiteRunner()
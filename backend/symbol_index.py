@@ -0,0 +1,469 @@
+"""
+Symbol Index
+Per-project definitions, references and import graph.
+
+Python files are parsed with ast; JavaScript/TypeScript with a lightweight
+line-based parser (imports, exports, functions, classes, methods). Import
+edges are resolved to workspace files and ranked with PageRank, which drives
+which files and symbols go into AI prompts under a token budget.
+"""
+
+import ast
+import asyncio
+import posixpath
+import re
+from pathlib import Path
+from typing import Dict, List, Optional, Any, Set, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+PYTHON_EXTENSIONS = {'.py'}
+JS_EXTENSIONS = {'.js', '.jsx', '.ts', '.tsx', '.mjs', '.cjs'}
+JS_RESOLVE_EXTENSIONS = ['.ts', '.tsx', '.js', '.jsx', '.mjs', '.cjs', '.json']
+MAX_PARSE_FILE_SIZE = 512 * 1024
+MAX_REFS_PER_NAME = 50
+CHARS_PER_TOKEN = 4
+
+# Files that describe the project better than any source file
+PROJECT_FILES = ['README.md', 'readme.md', 'package.json', 'requirements.txt', 'pyproject.toml', 'go.mod', 'Cargo.toml']
+
+JS_IMPORT_RE = re.compile(
+    r'''(?:\bimport\s+(?:[\w$*{}\s,]+?\s+from\s+)?|\bexport\s+[\w$*{}\s,]+?\s+from\s+|\brequire\s*\(\s*|\bimport\s*\(\s*)['"]([^'"\n]+)['"]'''
+)
+JS_DEF_PATTERNS = [
+    (re.compile(r'^\s*(?:export\s+)?(?:default\s+)?(?:async\s+)?function\s*\*?\s*([A-Za-z_$][\w$]*)'), 'function'),
+    (re.compile(r'^\s*(?:export\s+)?(?:default\s+)?(?:abstract\s+)?class\s+([A-Za-z_$][\w$]*)'), 'class'),
+    (re.compile(r'^\s*(?:export\s+)?(?:interface|type|enum)\s+([A-Za-z_$][\w$]*)'), 'type'),
+    (re.compile(r'^\s*(?:export\s+)?(?:const|let|var)\s+([A-Za-z_$][\w$]*)\s*=\s*(?:async\s*)?(?:\([^)]*\)|[A-Za-z_$][\w$]*)\s*=>'), 'function'),
+    (re.compile(r'^\s*(?:export\s+)?(?:const|let|var)\s+([A-Za-z_$][\w$]*)\s*='), 'variable'),
+]
+JS_METHOD_RE = re.compile(r'^\s+(?:static\s+|async\s+|get\s+|set\s+|public\s+|private\s+|protected\s+)*([A-Za-z_$][\w$]*)\s*\([^)]*\)\s*(?::\s*[^{]+)?\{')
+JS_IDENT_RE = re.compile(r'[A-Za-z_$][\w$]{2,}')
+JS_KEYWORDS = {
+    'if', 'for', 'while', 'switch', 'catch', 'function', 'return', 'const', 'let', 'var', 'new',
+    'import', 'export', 'from', 'default', 'class', 'extends', 'this', 'true', 'false', 'null',
+    'undefined', 'typeof', 'instanceof', 'async', 'await', 'yield', 'else', 'try', 'finally',
+    'throw', 'break', 'continue', 'case', 'interface', 'type', 'enum', 'implements', 'public',
+    'private', 'protected', 'static', 'require', 'module', 'exports', 'void', 'delete', 'super'
+}
+
+
+def _add_ref(refs: Dict[str, List[int]], name: str, line: int) -> None:
+    lines = refs.setdefault(name, [])
+    if len(lines) < MAX_REFS_PER_NAME and (not lines or lines[-1] != line):
+        lines.append(line)
+
+
+def parse_python(source: str) -> Dict[str, Any]:
+    """Definitions, references and raw imports of a Python module"""
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return {"defs": [], "refs": {}, "imports": []}
+
+    defs = []
+    refs: Dict[str, List[int]] = {}
+    imports = []
+
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            defs.append({"name": node.name, "kind": "function", "line": node.lineno, "container": None})
+        elif isinstance(node, ast.ClassDef):
+            defs.append({"name": node.name, "kind": "class", "line": node.lineno, "container": None})
+            for item in node.body:
+                if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    defs.append({"name": item.name, "kind": "method", "line": item.lineno, "container": node.name})
+        elif isinstance(node, (ast.Assign, ast.AnnAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            for target in targets:
+                if isinstance(target, ast.Name):
+                    defs.append({"name": target.id, "kind": "variable", "line": node.lineno, "container": None})
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                imports.append({"module": alias.name, "names": [], "level": 0})
+        elif isinstance(node, ast.ImportFrom):
+            imports.append({
+                "module": node.module or "",
+                "names": [alias.name for alias in node.names],
+                "level": node.level
+            })
+            for alias in node.names:
+                _add_ref(refs, alias.name, node.lineno)
+        elif isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load):
+            _add_ref(refs, node.id, node.lineno)
+        elif isinstance(node, ast.Attribute):
+            _add_ref(refs, node.attr, node.lineno)
+
+    return {"defs": defs, "refs": refs, "imports": imports}
+
+
+def parse_javascript(source: str) -> Dict[str, Any]:
+    """Best-effort definitions, references and imports of a JS/TS module"""
+    defs = []
+    refs: Dict[str, List[int]] = {}
+    imports = []
+    current_class = None
+    def_lines: Set[Tuple[str, int]] = set()
+
+    for lineno, line in enumerate(source.splitlines(), 1):
+        stripped = line.strip()
+        if stripped.startswith('//') or stripped.startswith('*') or stripped.startswith('/*'):
+            continue
+
+        for match in JS_IMPORT_RE.finditer(line):
+            imports.append({"module": match.group(1), "names": [], "level": 0})
+
+        matched_def = False
+        for pattern, kind in JS_DEF_PATTERNS:
+            m = pattern.match(line)
+            if m:
+                defs.append({"name": m.group(1), "kind": kind, "line": lineno, "container": None})
+                def_lines.add((m.group(1), lineno))
+                if kind == 'class':
+                    current_class = m.group(1)
+                matched_def = True
+                break
+
+        if not matched_def and current_class:
+            m = JS_METHOD_RE.match(line)
+            if m and m.group(1) not in JS_KEYWORDS:
+                defs.append({"name": m.group(1), "kind": "method", "line": lineno, "container": current_class})
+                def_lines.add((m.group(1), lineno))
+        if line.startswith('}'):
+            current_class = None
+
+        for ident in JS_IDENT_RE.findall(line):
+            if ident not in JS_KEYWORDS and (ident, lineno) not in def_lines:
+                _add_ref(refs, ident, lineno)
+
+    return {"defs": defs, "refs": refs, "imports": imports}
+
+
+class ProjectSymbolIndex:
+    """Parsed files, resolved import graph and ranks for one workspace"""
+
+    def __init__(self):
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.edges: Dict[str, Set[str]] = {}
+        self.external: Dict[str, Set[str]] = {}
+        self.ranks: Dict[str, float] = {}
+        self.version = -1
+        self._dirty = True
+
+    # ---------- building ----------
+
+    def copy(self) -> "ProjectSymbolIndex":
+        """Shallow copy to build the next version on; parsed entries are shared, never mutated"""
+        clone = ProjectSymbolIndex()
+        clone.files = dict(self.files)
+        clone.edges, clone.external, clone.ranks = self.edges, self.external, self.ranks
+        clone.version, clone._dirty = self.version, self._dirty
+        return clone
+
+    def update(self, workspace_path: Path, path: str, size: int) -> None:
+        ext = posixpath.splitext(path)[1].lower()
+        if ext not in PYTHON_EXTENSIONS and ext not in JS_EXTENSIONS or size > MAX_PARSE_FILE_SIZE:
+            self.remove(path)
+            return
+        try:
+            source = (workspace_path / path).read_text(errors='replace')
+        except OSError:
+            self.remove(path)
+            return
+        parsed = parse_python(source) if ext in PYTHON_EXTENSIONS else parse_javascript(source)
+        parsed["language"] = "python" if ext in PYTHON_EXTENSIONS else "javascript"
+        self.files[path] = parsed
+        self._dirty = True
+
+    def remove(self, path: str) -> None:
+        if self.files.pop(path, None) is not None:
+            self._dirty = True
+
+    def _resolve_python(self, importer: str, imp: Dict[str, Any], all_paths: Set[str]) -> List[str]:
+        importer_dir = posixpath.dirname(importer)
+        if imp["level"]:
+            base = importer_dir
+            for _ in range(imp["level"] - 1):
+                base = posixpath.dirname(base)
+            roots = [base]
+        else:
+            # The importing script's directory and every ancestor up to the root
+            roots = []
+            d = importer_dir
+            while True:
+                roots.append(d)
+                if not d:
+                    break
+                d = posixpath.dirname(d)
+
+        module_path = imp["module"].replace('.', '/') if imp["module"] else ""
+        targets = [module_path] + [posixpath.join(module_path, n).strip('/') for n in imp["names"] if n != '*']
+
+        resolved = []
+        for root in roots:
+            for target in targets:
+                base = posixpath.join(root, target).strip('/') if target else root
+                if not base:
+                    continue
+                for candidate in (f"{base}.py", f"{base}/__init__.py"):
+                    if candidate in all_paths and candidate != importer:
+                        resolved.append(candidate)
+                        break
+            if resolved:
+                break
+        return resolved
+
+    def _resolve_javascript(self, importer: str, spec: str, all_paths: Set[str]) -> Optional[str]:
+        if spec.startswith('.'):
+            base = posixpath.normpath(posixpath.join(posixpath.dirname(importer), spec))
+        elif spec.startswith('@/') or spec.startswith('~/'):
+            base = 'src/' + spec[2:]
+        else:
+            return None
+        candidates = [base] + [base + ext for ext in JS_RESOLVE_EXTENSIONS] + \
+                     [f"{base}/index{ext}" for ext in JS_RESOLVE_EXTENSIONS]
+        for candidate in candidates:
+            if candidate in all_paths:
+                return candidate
+        return None
+
+    def resolve(self, all_paths: Set[str]) -> None:
+        """Recompute import edges for every parsed file (dictionary lookups only)"""
+        self.edges = {}
+        self.external = {}
+        for path, parsed in self.files.items():
+            edges = set()
+            external = set()
+            for imp in parsed["imports"]:
+                if parsed["language"] == "python":
+                    targets = self._resolve_python(path, imp, all_paths)
+                    if targets:
+                        edges.update(targets)
+                    elif not imp["level"] and imp["module"]:
+                        external.add(imp["module"].split('.')[0])
+                else:
+                    spec = imp["module"]
+                    target = self._resolve_javascript(path, spec, all_paths)
+                    if target:
+                        edges.add(target)
+                    elif not spec.startswith('.'):
+                        parts = spec.split('/')
+                        external.add('/'.join(parts[:2]) if spec.startswith('@') else parts[0])
+            self.edges[path] = edges
+            self.external[path] = external
+        self._dirty = True
+
+    # ---------- ranking ----------
+
+    def rank(self, iterations: int = 30, damping: float = 0.85) -> Dict[str, float]:
+        """PageRank over the import graph: heavily imported files rank highest"""
+        if not self._dirty:
+            return self.ranks
+        nodes = list(self.files)
+        n = len(nodes)
+        if n == 0:
+            self.ranks = {}
+            self._dirty = False
+            return self.ranks
+
+        ranks = {node: 1.0 / n for node in nodes}
+        out_edges = {node: [t for t in self.edges.get(node, ()) if t in ranks] for node in nodes}
+        for _ in range(iterations):
+            dangling = sum(ranks[node] for node in nodes if not out_edges[node])
+            new_ranks = {node: (1 - damping) / n + damping * dangling / n for node in nodes}
+            for node in nodes:
+                targets = out_edges[node]
+                if targets:
+                    share = damping * ranks[node] / len(targets)
+                    for target in targets:
+                        new_ranks[target] += share
+            ranks = new_ranks
+
+        self.ranks = ranks
+        self._dirty = False
+        return ranks
+
+    def fan_in(self) -> Dict[str, int]:
+        counts = {path: 0 for path in self.files}
+        for targets in self.edges.values():
+            for target in targets:
+                if target in counts:
+                    counts[target] += 1
+        return counts
+
+    # ---------- queries ----------
+
+    def definitions(self, name: str) -> List[Dict[str, Any]]:
+        ranks = self.rank()
+        results = [
+            {"path": path, **d}
+            for path, parsed in self.files.items()
+            for d in parsed["defs"]
+            if d["name"] == name
+        ]
+        results.sort(key=lambda r: -ranks.get(r["path"], 0))
+        return results
+
+    def references(self, name: str, limit: int = 500) -> List[Dict[str, Any]]:
+        results = []
+        for path in sorted(self.files):
+            for line in self.files[path]["refs"].get(name, []):
+                results.append({"path": path, "line": line})
+                if len(results) >= limit:
+                    return results
+        return results
+
+    def outline(self, path: str) -> List[Dict[str, Any]]:
+        parsed = self.files.get(path)
+        return list(parsed["defs"]) if parsed else []
+
+    def top_symbols(self, limit: int = 30) -> List[Dict[str, Any]]:
+        """Definitions ranked by file rank times how often the name is referenced elsewhere"""
+        ranks = self.rank()
+        ref_counts: Dict[str, int] = {}
+        for parsed in self.files.values():
+            for name, lines in parsed["refs"].items():
+                ref_counts[name] = ref_counts.get(name, 0) + len(lines)
+        scored = []
+        for path, parsed in self.files.items():
+            for d in parsed["defs"]:
+                if d["kind"] == "variable":
+                    continue
+                score = ranks.get(path, 0) * (1 + ref_counts.get(d["name"], 0))
+                scored.append({"path": path, "score": round(score, 6), **d})
+        scored.sort(key=lambda s: -s["score"])
+        return scored[:limit]
+
+    def select_files(
+        self,
+        workspace_path: Path,
+        budget_tokens: int = 4000,
+        max_file_chars: int = 3000,
+        prefer: Optional[List[str]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Pick files for a prompt, highest ranked first, until the token budget
+        is spent. Files longer than max_file_chars are sent as a symbol
+        outline plus their opening lines instead of being cut blindly.
+        """
+        ranks = self.rank()
+        workspace_path = Path(workspace_path)
+        ordered = []
+        for path in (prefer or []) + [p for p in PROJECT_FILES]:
+            if path not in ordered and (workspace_path / path).is_file():
+                ordered.append(path)
+        ordered += [p for p, _ in sorted(ranks.items(), key=lambda kv: -kv[1]) if p not in ordered]
+
+        selected = []
+        remaining = budget_tokens * CHARS_PER_TOKEN
+        for path in ordered:
+            if remaining <= 200:
+                break
+            try:
+                content = (workspace_path / path).read_text(errors='replace')
+            except OSError:
+                continue
+            limit = min(max_file_chars, remaining)
+            if len(content) > limit:
+                outline = self.outline(path)
+                header = ""
+                if outline:
+                    header = "# Outline: " + ", ".join(
+                        f"{d['container'] + '.' if d['container'] else ''}{d['name']} (L{d['line']})"
+                        for d in outline[:40]
+                    ) + "\n"
+                content = header + content[:max(0, limit - len(header))] + "\n... [truncated]"
+            selected.append({"path": path, "content": content, "score": round(ranks.get(path, 0), 6)})
+            remaining -= len(content)
+        return selected
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "files": len(self.files),
+            "definitions": sum(len(p["defs"]) for p in self.files.values()),
+            "import_edges": sum(len(e) for e in self.edges.values()),
+            "external_dependencies": sorted(set().union(*self.external.values())) if self.external else []
+        }
+
+
+class SymbolIndexService:
+    """Owns per-project symbol indexes, built in the background"""
+
+    def __init__(self):
+        self.indexes: Dict[str, ProjectSymbolIndex] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def _lock(self, project_id: str) -> asyncio.Lock:
+        if project_id not in self._locks:
+            self._locks[project_id] = asyncio.Lock()
+        return self._locks[project_id]
+
+    @staticmethod
+    def _apply(base: Optional[ProjectSymbolIndex], workspace_path: Path, changed: List[Dict[str, Any]],
+               deleted: List[str], all_paths: Set[str]) -> ProjectSymbolIndex:
+        """Build the next index off a copy; the published one keeps serving queries meanwhile"""
+        index = base.copy() if base is not None else ProjectSymbolIndex()
+        for path in deleted:
+            index.remove(path)
+        for entry in changed:
+            index.update(workspace_path, entry["path"], entry["size"])
+        index.resolve(all_paths)
+        index.rank()
+        return index
+
+    async def sync(self, project_id: str, workspace_path: Path, manifest: Dict[str, Any],
+                   manifest_store) -> ProjectSymbolIndex:
+        """Bring the index up to the manifest's version, re-parsing only changed files"""
+        workspace_path = Path(workspace_path)
+        async with self._lock(project_id):
+            index = self.indexes.get(project_id)
+            if index is not None and index.version == manifest["version"]:
+                return index
+
+            delta = manifest_store.changes_since(manifest, index.version) if index is not None else None
+            if delta is None:
+                index = None
+                changed = [{"path": p, **meta} for p, meta in manifest["files"].items()]
+                deleted = []
+            else:
+                changed, deleted = delta["changed"], delta["deleted"]
+
+            all_paths = set(manifest["files"])
+            index = await asyncio.to_thread(self._apply, index, workspace_path, changed, deleted, all_paths)
+            index.version = manifest["version"]
+            # Published in one step on the loop; readers never see a half-applied update
+            self.indexes[project_id] = index
+            return index
+
+    def schedule(self, project_id: str, workspace_path: Path, manifest_store) -> asyncio.Task:
+        """Build or refresh an index in the background"""
+        task = self._tasks.get(project_id)
+        if task and not task.done():
+            return task
+
+        async def run():
+            try:
+                manifest = await manifest_store.get(project_id, workspace_path)
+                await self.sync(project_id, workspace_path, manifest, manifest_store)
+            except Exception as e:
+                logger.error(f"Symbol index build error for {project_id}: {e}")
+
+        task = asyncio.create_task(run())
+        self._tasks[project_id] = task
+        return task
+
+    def forget(self, project_id: str) -> None:
+        task = self._tasks.pop(project_id, None)
+        if task and not task.done():
+            task.cancel()
+        self.indexes.pop(project_id, None)
+        self._locks.pop(project_id, None)
+
+
+# Global symbol index service
+symbol_index = SymbolIndexService()
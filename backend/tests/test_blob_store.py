@@ -0,0 +1,84 @@
+"""
+Unit tests for the content-addressed blob store
+- Without reflinks the store is bypassed: no blobs on upload, forks are plain copies
+- With reflinks (where the filesystem has them) uploads deduplicate and forks clone blobs
+"""
+
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from blob_store import BlobStore
+
+
+def make_workspace(root: Path) -> Path:
+    path = root / "workspaces" / "p1"
+    (path / "src").mkdir(parents=True)
+    (path / "src" / "a.py").write_text("A = 1\n")
+    (path / "src" / "b.py").write_text("A = 1\n")
+    (path / "run.sh").write_text("#!/bin/sh\n")
+    os.chmod(path / "run.sh", 0o755)
+    os.utime(path / "src" / "a.py", (1_600_000_000, 1_600_000_000))
+    (path / "node_modules" / "x").mkdir(parents=True)
+    (path / "node_modules" / "x" / "index.js").write_text("")
+    return path
+
+
+def blob_count(store: BlobStore) -> int:
+    return store.stats()["blobs"]
+
+
+class TestCopyMode:
+    """Hosts without reflink support"""
+
+    def test_upload_is_not_ingested(self, tmp_path):
+        store = BlobStore(tmp_path / "store")
+        store.reflink_supported = False
+        ingest = store.ingest_workspace(make_workspace(tmp_path))
+        assert ingest["mode"] == "copy"
+        assert ingest["entries"] == {}
+        assert blob_count(store) == 0
+
+    def test_fork_copies_files_with_mode_and_mtime(self, tmp_path):
+        store = BlobStore(tmp_path / "store")
+        store.reflink_supported = False
+        src = make_workspace(tmp_path)
+        dst = tmp_path / "workspaces" / "fork"
+
+        result = store.fork_workspace(src, dst)
+        assert result["mode"] == "copy"
+        assert result["copied"] == 3 and result["linked"] == result["ingested"] == 0
+        assert (dst / "src" / "b.py").read_text() == "A = 1\n"
+        assert os.stat(dst / "run.sh").st_mode & 0o777 == 0o755
+        assert os.stat(dst / "src" / "a.py").st_mtime == 1_600_000_000
+        assert not (dst / "node_modules").exists()
+        assert blob_count(store) == 0
+
+
+class TestReflinkMode:
+    """Hosts whose filesystem supports FICLONE (skipped elsewhere)"""
+
+    @pytest.fixture
+    def store(self, tmp_path):
+        store = BlobStore(tmp_path / "store")
+        (tmp_path / "workspaces").mkdir()
+        if store.storage_mode(tmp_path / "workspaces") != "reflink":
+            pytest.skip("filesystem has no reflink support")
+        return store
+
+    def test_upload_deduplicates(self, store, tmp_path):
+        ingest = store.ingest_workspace(make_workspace(tmp_path))
+        assert ingest["mode"] == "reflink"
+        assert ingest["entries"]["src/a.py"] == ingest["entries"]["src/b.py"]
+        assert ingest["duplicate_bytes"] == len("A = 1\n")
+
+    def test_fork_clones_known_files(self, store, tmp_path):
+        src = make_workspace(tmp_path)
+        store.ingest_workspace(src)
+        result = store.fork_workspace(src, tmp_path / "workspaces" / "fork")
+        assert result["mode"] == "reflink" and result["copied"] == 0
+        assert os.stat(tmp_path / "workspaces" / "fork" / "src" / "a.py").st_mtime == 1_600_000_000
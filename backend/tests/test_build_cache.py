@@ -0,0 +1,66 @@
+"""
+Unit tests for the compiled-artifact store
+- In-memory size index and least recently used eviction
+- Entries pinned by a running program survive eviction
+"""
+
+import asyncio
+import json
+import os
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from build_cache import BuildCache
+
+
+def make_entry(root: Path, key: str, size: int, last_used: float) -> Path:
+    entry = root / "c" / key
+    (entry / "out").mkdir(parents=True)
+    (entry / "out" / "program").write_bytes(b"x" * size)
+    (entry / "meta.json").write_text(json.dumps({"key": key, "success": True}))
+    os.utime(entry / "meta.json", (last_used, last_used))
+    return entry
+
+
+class TestBuildCacheEviction:
+    """Eviction works from the in-memory index and respects pins"""
+
+    def test_evicts_least_recently_used(self, tmp_path):
+        cache = BuildCache(tmp_path)
+        old = make_entry(tmp_path, "old", 1000, 1)
+        new = make_entry(tmp_path, "new", 1000, 2)
+
+        result = asyncio.run(cache.evict(max_bytes=1500))
+        assert result["entries_removed"] == 1
+        assert not old.exists() and new.exists()
+        assert [e["key"] for e in cache.entries()] == ["new"]
+
+    def test_pinned_entry_survives(self, tmp_path):
+        cache = BuildCache(tmp_path)
+        pinned = make_entry(tmp_path, "pinned", 1000, 1)
+        other = make_entry(tmp_path, "other", 1000, 2)
+        cache._pins["pinned"] = 1
+
+        asyncio.run(cache.evict(max_bytes=1500))
+        assert pinned.exists() and not other.exists()
+        assert not cache._locks
+
+    @pytest.mark.skipif(shutil.which("gcc") is None, reason="gcc not installed")
+    def test_rerun_is_cached(self, tmp_path):
+        cache = BuildCache(tmp_path)
+        sources = {"main.c": '#include <stdio.h>\nint main(void) { puts("hi"); return 0; }\n'}
+
+        async def run():
+            first = await cache.run("c", sources, "main.c")
+            second = await cache.run("c", sources, "main.c")
+            return first, second, await cache.stats()
+
+        first, second, stats = asyncio.run(run())
+        assert first["run"]["stdout"] == "hi\n" and not first["compile"]["cached"]
+        assert second["run"]["stdout"] == "hi\n" and second["compile"]["cached"]
+        assert stats["entries"] == 1 and not cache._pins
@@ -0,0 +1,638 @@
+"""
+Unit tests for the in-process building blocks of the Moltbot tools
+- Process output: byte ring with log segments, whole-line trimming
+- Background processes: kill status only for processes that were running,
+  kills that reach children outliving the shell,
+  long polls that wake on output and the tail stream
+- Web search: LRU+TTL cache, token bucket and single-flight requests
+- Web fetch: stale copies on failed revalidation, bounded disk cache
+- Browser navigation profiles, interception and the per-session asset budget
+- Browser pool: per-session contexts, LRU recycling, crash and idle cleanup
+- Page snapshots: element refs, size-bounded screenshots and their expiry
+- Memory journal: restart, index snapshots and header-shaped content
+- Vector recall: CSR/IVF index, compaction and background index builds
+"""
+
+import asyncio
+import base64
+import os
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import moltbot_tools
+import vector_index
+from moltbot_tools import (
+    BrowserSession, BrowserTool, MemorySystem, OutputRing, ProcessManager, RateLimiter, TTLCache, WebFetchTool, WebSearchTool,
+    complete_lines, profile_blocks, resolve_navigation_profile
+)
+from vector_index import VectorIndex, embed
+
+
+class TestOutputRing:
+    """Absolute-offset reads from the in-memory ring and its log segments"""
+
+    def test_wraparound_read(self):
+        ring = OutputRing(capacity=8)
+        ring.write(b"abcdef")
+        ring.write(b"ghij")
+        data, next_offset, dropped = ring.read(2)
+        assert (data, next_offset, dropped) == (b"cdefghij", 10, 0)
+
+    def test_overwritten_bytes_reported_as_dropped(self):
+        ring = OutputRing(capacity=4)
+        ring.write(b"0123456789")
+        data, next_offset, dropped = ring.read(0)
+        assert (data, next_offset, dropped) == (b"6789", 10, 6)
+
+    def test_reads_behind_ring_served_from_logs(self, tmp_path):
+        ring = OutputRing(capacity=4, log_prefix=tmp_path / "out", rotate_bytes=4, backups=10)
+        for chunk in (b"line", b"-one", b"\nmore"):
+            ring.write(chunk)
+        data, next_offset, dropped = ring.read(0)
+        assert (data, next_offset, dropped) == (b"line", 4, 0)
+        ring.close()
+
+        restored = OutputRing.restore(tmp_path / "out")
+        assert restored.end == 13
+        assert restored.read(8)[0] == b"\nmore"
+
+
+class TestCompleteLines:
+    """Partial trailing lines are held back until complete or forced out"""
+
+    def test_holds_back_partial_line(self):
+        assert complete_lines(b"def", False) == b""
+        assert complete_lines(b"one\ntw", False) == b"one\n"
+
+    def test_final_returns_everything(self):
+        assert complete_lines(b"one\ntw", True) == b"one\ntw"
+
+    def test_full_read_emits_whole_characters(self):
+        snowman = "\u2603".encode()
+        assert complete_lines(b"abc" + snowman[:2], False, full=True) == b"abc"
+        assert complete_lines(b"abc" + snowman, False, full=True) == b"abc" + snowman
+
+
+def process_alive(pid: int) -> bool:
+    """Running, as opposed to exited (zombies included)"""
+    try:
+        return Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()[0] != "Z"
+    except (FileNotFoundError, IndexError):
+        return False
+
+
+class TestProcessManager:
+    """Kill and exit status of background sessions"""
+
+    def test_kill_running_session(self, tmp_path):
+        async def run():
+            manager = ProcessManager(log_dir=str(tmp_path))
+            started = await manager.create_session("sleep 30")
+            killed = await manager.kill(started["session_id"])
+            session = manager.sessions[started["session_id"]]
+            await session["collector"]
+            return killed, session["status"]
+
+        killed, status = asyncio.run(run())
+        assert killed["success"] is True
+        assert status == "killed"
+
+    def test_kill_reaches_children_after_the_shell_exits(self, tmp_path):
+        async def run():
+            manager = ProcessManager(log_dir=str(tmp_path))
+            started = await manager.create_session("sleep 30 & echo $!")
+            session = manager.sessions[started["session_id"]]
+            child = int((await manager.poll(started["session_id"], wait_ms=5000))["new_stdout"][0])
+            # process.wait() would also wait for sleep to close the pipes; watch the shell itself
+            while process_alive(session["pid"]):
+                await asyncio.sleep(0.05)
+            killed = await manager.kill(started["session_id"])
+            await asyncio.wait_for(session["collector"], 5)
+            return killed, session["status"], child
+
+        killed, status, child = asyncio.run(run())
+        assert killed["success"] is True
+        assert status == "killed"
+        assert not process_alive(child)
+
+    def test_exited_process_keeps_its_status(self, tmp_path):
+        async def run():
+            manager = ProcessManager(log_dir=str(tmp_path))
+            started = await manager.create_session("true")
+            session = manager.sessions[started["session_id"]]
+            if session["process"] is not None:
+                await session["process"].wait()
+            terminated = await manager._terminate(session, "killed")
+            await session["collector"]
+            return terminated, session
+
+        terminated, session = asyncio.run(run())
+        assert terminated is False
+        assert session["status"] == "completed" and session["exit_code"] == 0
+
+    def test_long_poll_returns_when_output_arrives(self, tmp_path):
+        async def run():
+            manager = ProcessManager(log_dir=str(tmp_path))
+            started = await manager.create_session("sleep 0.2; echo ready; sleep 5")
+            began = time.monotonic()
+            polled = await manager.poll(started["session_id"], wait_ms=3000)
+            waited = time.monotonic() - began
+            await manager.kill(started["session_id"])
+            return polled, waited
+
+        polled, waited = asyncio.run(run())
+        assert polled["new_stdout"] == ["ready"]
+        assert polled["offset"] == len("ready\n")
+        assert waited < 2
+
+    def test_tail_streams_output_then_exit(self, tmp_path):
+        async def run():
+            manager = ProcessManager(log_dir=str(tmp_path))
+            started = await manager.create_session("echo one; sleep 0.1; echo two")
+            return [event async for event in manager.tail(started["session_id"])]
+
+        events = asyncio.run(run())
+        assert "".join(e["data"] for e in events if e["event"] == "stdout") == "one\ntwo\n"
+        assert events[-1]["event"] == "exit"
+        assert events[-1]["exit_code"] == 0 and events[-1]["offset"] == 8
+
+
+class TestTTLCache:
+    """LRU bound, expiry and persistence of TTLCache"""
+
+    def test_lru_eviction(self):
+        cache = TTLCache(max_entries=2, ttl=60)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        assert cache.get("a") == 1
+        cache.put("c", 3)
+        assert cache.get("b") is None
+        assert cache.get("a") == 1 and cache.get("c") == 3
+
+    def test_entries_expire(self):
+        cache = TTLCache(max_entries=4, ttl=0.05)
+        cache.put("a", 1)
+        time.sleep(0.1)
+        assert cache.get("a") is None
+        assert cache.stats()["misses"] == 1
+
+    def test_persisted_entries_reload(self, tmp_path):
+        path = tmp_path / "cache.json"
+        cache = TTLCache(max_entries=4, ttl=60, persist_path=str(path))
+        cache.put("a", {"results": []})
+        asyncio.run(cache.flush())
+        assert TTLCache(max_entries=4, ttl=60, persist_path=str(path)).get("a") == {"results": []}
+
+
+class TestRateLimiter:
+    """Token bucket pacing"""
+
+    def test_burst_then_paced(self):
+        async def run():
+            limiter = RateLimiter(rate=20, burst=2)
+            started = time.monotonic()
+            for _ in range(4):
+                await limiter.acquire()
+            return time.monotonic() - started
+
+        # Two calls ride the burst; the other two wait ~50ms each
+        assert 0.08 <= asyncio.run(run()) < 0.5
+
+
+class SlowSearch(WebSearchTool):
+    """WebSearchTool whose request just counts calls and sleeps"""
+
+    def __init__(self):
+        super().__init__(api_key="test", rate_limit=1000)
+        self.requests = 0
+
+    async def _request(self, query, count, country, search_lang):
+        self.requests += 1
+        await asyncio.sleep(0.05)
+        return {"query": query, "results": [], "total_count": 0, "provider": "stub"}
+
+
+class TestSingleFlight:
+    """Identical concurrent searches share one request"""
+
+    def test_concurrent_queries_share_request(self):
+        async def run():
+            tool = SlowSearch()
+            results = await asyncio.gather(*[tool.search("python") for _ in range(5)])
+            return tool, results
+
+        tool, results = asyncio.run(run())
+        assert tool.requests == 1
+        assert all(r["query"] == "python" for r in results)
+
+    def test_followers_retry_when_leader_cancelled(self):
+        async def run():
+            tool = SlowSearch()
+            leader = asyncio.create_task(tool.search("python"))
+            await asyncio.sleep(0)
+            follower = asyncio.create_task(tool.search("python"))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            return tool, await follower
+
+        tool, result = asyncio.run(run())
+        assert result["query"] == "python"
+        assert tool.requests == 2
+
+
+PAGE = b"<html><head><title>Doc</title></head><body><article><p>Hello cache</p></article></body></html>"
+
+
+class TestWebFetchCache:
+    """Disk cache revalidation, stale fallback and size bound"""
+
+    def fetch_with(self, monkeypatch, tool, handler, url="http://example.test/doc"):
+        async def run():
+            client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            monkeypatch.setattr(moltbot_tools, "_http_client", client)
+            try:
+                return await tool.fetch(url, parser="html.parser")
+            finally:
+                await client.aclose()
+        return asyncio.run(run())
+
+    def test_stale_copy_served_on_network_error(self, tmp_path, monkeypatch):
+        tool = WebFetchTool(cache_dir=str(tmp_path), cache_ttl=0)
+        first = self.fetch_with(monkeypatch, tool, lambda request: httpx.Response(
+            200, content=PAGE, headers={"content-type": "text/html", "etag": '"v1"'}))
+        assert first["cache"] == "miss"
+
+        def offline(request):
+            raise httpx.ConnectError("offline", request=request)
+        second = self.fetch_with(monkeypatch, tool, offline)
+        assert second["cache"] == "stale"
+        assert "Hello cache" in second["content"]
+
+    def test_stale_copy_served_on_server_error(self, tmp_path, monkeypatch):
+        tool = WebFetchTool(cache_dir=str(tmp_path), cache_ttl=0)
+        self.fetch_with(monkeypatch, tool, lambda request: httpx.Response(
+            200, content=PAGE, headers={"content-type": "text/html"}))
+        result = self.fetch_with(monkeypatch, tool, lambda request: httpx.Response(503))
+        assert result["cache"] == "stale"
+
+        missing = self.fetch_with(monkeypatch, tool, lambda request: httpx.Response(404))
+        assert missing["error"] == "HTTP 404"
+
+    def test_unsupported_content_type_with_cached_copy_is_an_error(self, tmp_path, monkeypatch):
+        tool = WebFetchTool(cache_dir=str(tmp_path), cache_ttl=0)
+        self.fetch_with(monkeypatch, tool, lambda request: httpx.Response(
+            200, content=PAGE, headers={"content-type": "text/html"}))
+        result = self.fetch_with(monkeypatch, tool, lambda request: httpx.Response(
+            200, content=b"\x89PNG", headers={"content-type": "image/png"}))
+        assert result["error"] == "Unsupported content type: image/png"
+
+    def test_disk_cache_evicts_least_recently_used(self, tmp_path):
+        tool = WebFetchTool(cache_dir=str(tmp_path), cache_max_bytes=1000)
+        tool._store("http://a", {"fetched_at": 0}, b"a" * 600)
+        old = tool._paths("http://a")[0]
+        os.utime(old, (1, 1))
+        tool._store("http://b", {"fetched_at": 0}, b"b" * 600)
+        assert tool._load("http://a") is None
+        assert tool._load("http://b")["body"] == b"b" * 600
+        assert tool.stats()["disk_bytes"] <= 1000
+
+
+class TestNavigationProfiles:
+    """Profile resolution, overrides and whether interception is needed"""
+
+    def test_full_profile_needs_no_interception(self):
+        profile = resolve_navigation_profile("full")
+        assert profile["wait_until"] == "networkidle"
+        assert not profile_blocks(profile)
+
+    def test_overrides_apply_on_top_of_profile(self):
+        profile = resolve_navigation_profile("fast", wait_until="load", block_domains=[".Example.com"])
+        assert profile["wait_until"] == "load"
+        assert profile["block_domains"] == ["example.com"]
+        assert "image" in profile["block_types"]
+        assert profile_blocks(profile)
+
+    def test_full_profile_with_blocked_domain_intercepts(self):
+        assert profile_blocks(resolve_navigation_profile("full", block_domains=["ads.example"]))
+
+    def test_unknown_values_rejected(self):
+        with pytest.raises(ValueError):
+            resolve_navigation_profile("turbo")
+        with pytest.raises(ValueError):
+            resolve_navigation_profile("full", block_types=["document"])
+        with pytest.raises(ValueError):
+            resolve_navigation_profile("full", wait_until="never")
+
+    def test_asset_cache_stays_within_budget(self):
+        session = BrowserSession("s", context=None, page=None, asset_budget=10)
+        session.store_asset("a", 200, {}, b"12345")
+        session.store_asset("b", 200, {}, b"12345")
+        session.cached_asset("a")
+        session.store_asset("c", 200, {}, b"12345")
+        assert list(session.assets) == ["a", "c"]
+        assert session.asset_bytes == 10
+        session.clear_assets()
+        assert session.asset_bytes == 0 and not session.assets
+
+
+class FakePage:
+    url = "about:blank"
+
+    def __init__(self):
+        self.closed = False
+        self.evaluated = None  # Returned by evaluate()
+        self.clicked = []
+
+    def is_closed(self):
+        return self.closed
+
+    async def evaluate(self, script, arg=None):
+        return self.evaluated
+
+    async def click(self, selector, timeout=None):
+        self.clicked.append(selector)
+
+
+class FakeContext:
+    def __init__(self):
+        self.closed = False
+
+    async def new_page(self):
+        return FakePage()
+
+    async def new_cdp_session(self, page):
+        return FakeCDP()
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeCDP:
+    """Screenshot size grows with the scaled area and the quality"""
+
+    def __init__(self):
+        self.calls = []
+
+    async def send(self, method, params):
+        self.calls.append(params)
+        clip = params["clip"]
+        area = clip["width"] * clip["height"] * clip["scale"] ** 2
+        size = int(area * params.get("quality", 100) / 100)
+        return {"data": base64.b64encode(bytes(size)).decode()}
+
+
+class FakeBrowser:
+    def __init__(self):
+        self.connected = True
+        self.contexts = []
+
+    def is_connected(self):
+        return self.connected
+
+    async def new_context(self, **options):
+        context = FakeContext()
+        self.contexts.append(context)
+        return context
+
+
+class TestBrowserPool:
+    """Session checkout, recycling and reaping over an already launched browser"""
+
+    @staticmethod
+    def pool(**kwargs):
+        tool = BrowserTool(**kwargs)
+        tool.browser = FakeBrowser()
+        return tool
+
+    @staticmethod
+    async def url_of(session):
+        return {"url": session.page.url}
+
+    def test_sessions_get_their_own_context(self):
+        async def run():
+            tool = self.pool()
+            await tool._run("a", "Test", self.url_of, create=True)
+            await tool._run("b", "Test", self.url_of, create=True)
+            await tool._run("a", "Test", self.url_of, create=True)
+            return tool
+
+        tool = asyncio.run(run())
+        assert sorted(tool.sessions) == ["a", "b"]
+        assert len(tool.browser.contexts) == 2
+        assert tool.sessions["a"].actions == 2 and tool.sessions["a"].idle
+
+    def test_full_pool_recycles_least_recently_used_idle_session(self):
+        async def run():
+            tool = self.pool(max_sessions=2)
+            for session_id in ("a", "b", "a", "c"):
+                await tool._run(session_id, "Test", self.url_of, create=True)
+            return tool
+
+        tool = asyncio.run(run())
+        assert sorted(tool.sessions) == ["a", "c"]
+        assert tool.recycled == 1
+        assert tool.browser.contexts[1].closed
+
+    def test_full_pool_of_busy_sessions_is_an_error(self):
+        async def run():
+            tool = self.pool(max_sessions=1)
+            held = await tool._checkout("a", create=True)
+            result = await tool._run("b", "Test", self.url_of, create=True)
+            held.users -= 1
+            return result
+
+        result = asyncio.run(run())
+        assert "pool is full" in result["error"]
+
+    def test_actions_need_a_running_browser_or_session(self):
+        async def run():
+            idle = await BrowserTool().screenshot(session_id="x")
+            tool = self.pool()
+            missing = await tool.screenshot(session_id="x")
+            return idle, missing, tool
+
+        idle, missing, tool = asyncio.run(run())
+        assert idle["error"] == "Browser not running"
+        assert "No browser session 'x'" in missing["error"]
+        assert not tool.sessions and not tool.browser.contexts
+
+    def test_disconnect_drops_sessions(self):
+        async def run():
+            tool = self.pool()
+            await tool._run("a", "Test", self.url_of, create=True)
+            browser = tool.browser
+            browser.connected = False
+            tool._on_disconnected(browser)
+            return tool
+
+        tool = asyncio.run(run())
+        assert tool.browser is None and not tool.sessions
+        assert not tool.is_running
+
+    def test_reap_closes_idle_sessions(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(moltbot_tools, "SCREENSHOT_DIR", tmp_path)
+
+        async def run():
+            tool = self.pool(idle_timeout=60)
+            await tool._run("old", "Test", self.url_of, create=True)
+            await tool._run("new", "Test", self.url_of, create=True)
+            tool.sessions["old"].last_used -= 120
+            return await tool.reap(), tool
+
+        reaped, tool = asyncio.run(run())
+        assert reaped["closed"] == ["old"]
+        assert list(tool.sessions) == ["new"]
+
+
+class TestPageSnapshots:
+    """Snapshot element refs, bounded screenshots and screenshot expiry"""
+
+    def test_snapshot_refs_resolve_in_later_actions(self):
+        async def run():
+            tool = TestBrowserPool.pool()
+            await tool.start(session_id="s")
+            page = tool.sessions["s"].page
+            page.evaluated = {"text": "Hello", "elements": [{"ref": "e1", "selector": "#login"}]}
+            snapshot = await tool.snapshot(session_id="s")
+            clicked = await tool.click("@e1", session_id="s")
+            unknown = await tool.click("@e9", session_id="s")
+            return snapshot, clicked, unknown, page
+
+        snapshot, clicked, unknown, page = asyncio.run(run())
+        assert snapshot["elements"][0]["ref"] == "e1"
+        assert clicked["action"] == "clicked"
+        assert page.clicked == ["#login"]
+        assert "Unknown element ref @e9" in unknown["error"]
+
+    def test_screenshot_fits_byte_limit(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(moltbot_tools, "SCREENSHOT_DIR", tmp_path)
+
+        async def run():
+            tool = TestBrowserPool.pool()
+            await tool.start(session_id="s")
+            clip = {"x": 0, "y": 0, "width": 1000, "height": 1000}
+            return await tool.screenshot(session_id="s", clip=clip, max_width=500, max_bytes=40000, inline=False)
+
+        result = asyncio.run(run())
+        assert result["within_limit"] and result["bytes"] <= 40000
+        assert result["quality"] == 40
+        assert result["width"] < 500
+        assert "data" not in result
+        assert Path(result["path"]).stat().st_size == result["bytes"]
+
+    def test_screenshot_rejects_bad_arguments(self):
+        tool = TestBrowserPool.pool()
+        assert "format" in asyncio.run(tool.screenshot(image_format="gif"))["error"]
+        assert "quality" in asyncio.run(tool.screenshot(quality=0))["error"]
+
+    def test_purge_removes_only_expired_screenshots(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(moltbot_tools, "SCREENSHOT_DIR", tmp_path)
+        old = tmp_path / "old.jpg"
+        old.write_bytes(b"x")
+        os.utime(old, (time.time() - 120, time.time() - 120))
+        (tmp_path / "new.jpg").write_bytes(b"x")
+        assert moltbot_tools.purge_screenshots(ttl=60) == 1
+        assert [p.name for p in tmp_path.iterdir()] == ["new.jpg"]
+
+
+class TestMemorySystem:
+    """Journal parsing, snapshots and restart of MemorySystem"""
+
+    def test_entries_survive_restart(self, tmp_path):
+        memory = MemorySystem(str(tmp_path), fsync="never")
+        memory.append_memory("The deploy key lives in vault")
+        memory.append_memory("Prefer pnpm over npm in this repo")
+        memory.close()
+
+        reopened = MemorySystem(str(tmp_path), fsync="never")
+        assert len(reopened.entries) == 2
+        results = reopened.search_memory("pnpm")
+        assert [r["content"] for r in results] == ["Prefer pnpm over npm in this repo"]
+
+    def test_snapshot_catches_up_on_later_appends(self, tmp_path):
+        memory = MemorySystem(str(tmp_path), fsync="never")
+        memory.append_memory("first entry about caching")
+        memory.save_snapshot()
+        memory.append_memory("second entry about caching")
+
+        reopened = MemorySystem(str(tmp_path), fsync="never")
+        assert len(reopened.entries) == 2
+        assert {r["content"] for r in reopened.search_memory("caching")} == {
+            "first entry about caching", "second entry about caching"
+        }
+
+    def test_header_shaped_lines_do_not_split_entries(self, tmp_path):
+        content = "Notes copied from the log:\n## 2024-01-01 00:00:00 UTC\n\\## 2024-01-02 00:00:00 UTC\nend"
+        memory = MemorySystem(str(tmp_path), fsync="never")
+        memory.append_memory(content)
+        memory.append_memory("next entry")
+        assert memory.get_entries([0])[0]["content"] == content
+
+        (tmp_path / ".memory.index.json").unlink(missing_ok=True)
+        reopened = MemorySystem(str(tmp_path), fsync="never")
+        assert len(reopened.entries) == 2
+        assert reopened.get_entries([0])[0]["content"] == content
+        assert reopened.get_entries([1])[0]["content"] == "next entry"
+
+
+    def test_recall_context_builds_index_in_background(self, tmp_path):
+        memory = MemorySystem(str(tmp_path), fsync="never")
+        memory.append_memory("The staging database runs on port 5433")
+        memory.start_recall_refresh()
+        memory._refresher.join(timeout=10)
+        assert memory.stats()["recall_ready"]
+
+        context, used = memory.recall_context("which port does the staging database use")
+        assert used == 1
+        assert "5433" in context
+
+
+TOPICS = ["database migration rollback", "frontend bundle size", "flaky network tests", "memory leak in worker"]
+
+
+@pytest.fixture(params=["numpy", "python"])
+def backend(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    monkeypatch.setattr(vector_index, "NUMPY_AVAILABLE", request.param == "numpy")
+    return request.param
+
+
+class TestVectorIndex:
+    """Search, replacement and compaction on both storage backends"""
+
+    def test_nearest_topic_ranks_first(self, backend):
+        index = VectorIndex()
+        for i, topic in enumerate(TOPICS):
+            index.add(f"t{i}", embed(topic))
+        assert index.search(embed("rolling back a database migration"), 1)[0][0] == "t0"
+        assert index.stats()["backend"] == backend
+
+    def test_re_add_replaces_and_compaction_keeps_results(self, backend):
+        index = VectorIndex()
+        for i in range(2100):
+            index.add(f"n{i}", embed(f"note{i:04d} about {TOPICS[i % 4]}"))
+        for i in range(2100):
+            if i % 4:
+                index.remove(f"n{i}")
+        index.add("n0", embed("flaky network tests"))
+        assert len(index) == 525
+        assert len(index.keys) < 2100  # Compacted
+        top = index.search(embed("flaky network tests"), 1)
+        assert top[0][0] == "n0"
+        assert index.search(embed("note0004 about database migration rollback"), 1)[0][0] == "n4"
+
+    def test_ivf_layout_trained(self):
+        pytest.importorskip("numpy")
+        index = VectorIndex(ivf_threshold=200, nprobe=4, train_sample=100)
+        for i in range(400):
+            index.add(f"n{i}", embed(f"record{i:04d} {TOPICS[i % 4]}"))
+        stats = index.stats()
+        assert stats["layout"] == "ivf" and stats["lists"] > 1
+        assert index.search(embed("record0007 memory leak in worker"), 1)[0][0] == "n7"
@@ -0,0 +1,77 @@
+"""
+Unit tests for structured test runs
+- JUnit reports without a file attribute (vitest, pytest xunit2)
+- pytest shards that collect no tests
+- Shard timeouts kill the whole runner process group
+"""
+
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from suite_runner import SuiteRunner, parse_junit
+
+VITEST_REPORT = """<?xml version="1.0" encoding="UTF-8" ?>
+<testsuites name="vitest tests" tests="2" failures="1" errors="0" time="0.01">
+    <testsuite name="src/math.test.ts" timestamp="2024-01-01T00:00:00" hostname="ci" tests="2" failures="1" errors="0" skipped="0" time="0.01">
+        <testcase classname="src/math.test.ts" name="math &gt; adds" time="0.001">
+        </testcase>
+        <testcase classname="src/math.test.ts" name="math &gt; divides" time="0.002">
+            <failure message="expected 2 to be 3" type="AssertionError">AssertionError: expected 2 to be 3</failure>
+        </testcase>
+    </testsuite>
+</testsuites>
+"""
+
+PYTEST_XUNIT2_REPORT = """<?xml version="1.0" encoding="utf-8"?>
+<testsuites><testsuite name="pytest" errors="0" failures="0" skipped="0" tests="1" time="0.01">
+<testcase classname="tests.test_app.TestLogin" name="test_ok" time="0.001" />
+</testsuite></testsuites>
+"""
+
+
+class TestJUnitParsing:
+    """Test files are recovered from classname when the report has no file attribute"""
+
+    def test_vitest_classname_is_the_file(self, tmp_path):
+        report = tmp_path / "report.xml"
+        report.write_text(VITEST_REPORT)
+        tests = parse_junit(report, ["src/math.test.ts"], tmp_path)
+        assert [t["file"] for t in tests] == ["src/math.test.ts", "src/math.test.ts"]
+        assert [t["status"] for t in tests] == ["passed", "failed"]
+
+    def test_pytest_module_path_maps_to_file(self, tmp_path):
+        report = tmp_path / "report.xml"
+        report.write_text(PYTEST_XUNIT2_REPORT)
+        tests = parse_junit(report, ["tests/test_app.py", "tests/test_db.py"], tmp_path)
+        assert tests[0]["file"] == "tests/test_app.py"
+
+
+class TestShards:
+    """Shard exit codes"""
+
+    def test_pytest_shard_without_tests_is_empty_not_failed(self, tmp_path):
+        (tmp_path / "tests").mkdir()
+        (tmp_path / "tests" / "test_empty.py").write_text("VALUE = 1\n")
+        manifest = {"version": 1, "files": {"tests/test_empty.py": {}}}
+        env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+
+        result = asyncio.run(SuiteRunner(timeout=60).run("p", tmp_path, manifest, None, env))
+        assert result["shards"][0]["returncode"] == 5
+        assert result["shards"][0]["empty"] is True
+        assert result["success"] is True
+
+    def test_timeout_kills_children_of_the_shell(self, tmp_path, monkeypatch):
+        runner = SuiteRunner(timeout=1)
+        monkeypatch.setattr(runner, "_command", lambda *args: "echo started; sleep 60; echo finished")
+
+        started = time.monotonic()
+        result = asyncio.run(runner._run_shard("pytest", [], tmp_path, dict(os.environ), tmp_path / "report"))
+        assert time.monotonic() - started < 10
+        assert result["timed_out"] is True
+        assert result["returncode"] == 124
+        assert result["output"] == "started\n"
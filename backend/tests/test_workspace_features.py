@@ -0,0 +1,631 @@
+"""
+Test IDE workspace features for Live Code Mentor
+- Incremental project structure (manifest versions, ?since= deltas)
+- Lazy, paginated file tree and flat tree encoding
+- Project forks: copy-on-write via the blob store on reflink hosts, plain copies elsewhere
+- Trigram-indexed code search (literal, regex, path glob)
+- Symbol index: go-to-definition, references, import-graph ranking
+- Content-fingerprint cache for AI analysis results
+- Conditional, ranged and line-range file reads
+- Patch-based saves against a base ETag
+- Shared dependency cache for install-deps
+- Structured, sharded test runs with affected-test selection
+- Workspace archival, quotas and restore on access
+- Project profile across monorepo package roots
+- Background warm-up job and local static analysis
+- Compiled-language execution with a content-hashed build cache
+"""
+
+import io
+import json
+import time
+import zipfile
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+def make_project_zip() -> bytes:
+    """Small Python project with a nested package and a few files per directory"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("demo/main.py", "from app.utils import add\n\nprint(add(1, 2))\n")
+        zf.writestr("demo/requirements.txt", "fastapi\npytest\n")
+        zf.writestr("demo/README.md", "# Demo\n")
+        zf.writestr("demo/app/__init__.py", "")
+        zf.writestr("demo/app/utils.py", "def add(a, b):\n    return a + b\n")
+        for i in range(5):
+            zf.writestr(f"demo/app/module_{i}.py", f"VALUE = {i}\n")
+        zf.writestr("demo/tests/test_utils.py", "from app.utils import add\n\ndef test_add():\n    assert add(1, 2) == 3\n")
+    return buffer.getvalue()
+
+
+@pytest.fixture(scope="module")
+def project_id():
+    files = {'file': ('demo.zip', make_project_zip(), 'application/zip')}
+    response = requests.post(f"{BASE_URL}/api/upload-project", files=files, timeout=60)
+    assert response.status_code == 200
+    return response.json()["project_id"]
+
+
+class TestIncrementalStructure:
+    """Test manifest-backed /api/project/{id}/structure"""
+
+    def test_full_structure_has_version(self, project_id):
+        response = requests.get(f"{BASE_URL}/api/project/{project_id}/structure")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["full"] is True
+        assert isinstance(data["version"], int)
+        assert data["root"]["type"] == "directory"
+        assert any(lang["name"] == "Python" for lang in data["languages"])
+        print(f"✓ Structure served at version {data['version']}")
+
+    def test_delta_after_save(self, project_id):
+        version = requests.get(f"{BASE_URL}/api/project/{project_id}/structure").json()["version"]
+
+        save = requests.post(
+            f"{BASE_URL}/api/project/{project_id}/file",
+            json={"project_id": project_id, "path": "app/new_module.py", "content": "NEW = True\n"}
+        )
+        assert save.status_code == 200
+
+        response = requests.get(f"{BASE_URL}/api/project/{project_id}/structure?since={version}")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["full"] is False
+        assert data["version"] > version
+        assert "app/new_module.py" in [f["path"] for f in data["changed"]]
+        print("✓ Structure delta reports saved file")
+
+    def test_delta_reports_terminal_delete(self, project_id):
+        version = requests.get(f"{BASE_URL}/api/project/{project_id}/structure").json()["version"]
+        command = requests.post(f"{BASE_URL}/api/project/{project_id}/terminal",
+                                json={"project_id": project_id, "command": "rm app/module_4.py"})
+        assert command.json()["exit_code"] == 0
+
+        deleted = []
+        for _ in range(20):  # The watcher reports asynchronously
+            data = requests.get(f"{BASE_URL}/api/project/{project_id}/structure?since={version}").json()
+            deleted = data.get("deleted", [])
+            if deleted:
+                break
+            time.sleep(0.25)
+        assert deleted == ["app/module_4.py"]
+        print("✓ Structure delta reports file removed from the terminal")
+
+    def test_delete_project(self):
+        files = {'file': ('demo.zip', make_project_zip(), 'application/zip')}
+        pid = requests.post(f"{BASE_URL}/api/upload-project", files=files, timeout=60).json()["project_id"]
+        assert requests.get(f"{BASE_URL}/api/project/{pid}/structure").status_code == 200
+
+        response = requests.delete(f"{BASE_URL}/api/project/{pid}")
+        assert response.status_code == 200
+        assert requests.get(f"{BASE_URL}/api/project/{pid}/structure").status_code == 404
+        print("✓ Deleted project is gone along with its manifest")
+
+
+class TestLazyTree:
+    """Test /api/project/{id}/tree"""
+
+    def test_directory_level_pagination(self, project_id):
+        seen = []
+        cursor = None
+        while True:
+            params = {"path": "app", "limit": 3}
+            if cursor:
+                params["cursor"] = cursor
+            response = requests.get(f"{BASE_URL}/api/project/{project_id}/tree", params=params)
+            assert response.status_code == 200
+            data = response.json()
+            assert len(data["entries"]) <= 3
+            seen.extend(e["path"] for e in data["entries"])
+            cursor = data["next_cursor"]
+            if not cursor:
+                break
+
+        assert len(seen) == len(set(seen)) == data["total"]
+        assert "app/utils.py" in seen
+        print(f"✓ Paginated {len(seen)} entries of app/")
+
+    def test_root_level_directories_first(self, project_id):
+        response = requests.get(f"{BASE_URL}/api/project/{project_id}/tree")
+        assert response.status_code == 200
+        entries = response.json()["entries"]
+        types = [e["type"] for e in entries]
+        assert types == sorted(types, key=lambda t: t != "directory")
+        app_dir = next(e for e in entries if e["name"] == "app")
+        assert app_dir["file_count"] >= 7
+        print("✓ Root level lists directories first with file counts")
+
+    def test_flat_format(self, project_id):
+        response = requests.get(f"{BASE_URL}/api/project/{project_id}/tree?format=flat")
+        assert response.status_code == 200
+        data = response.json()
+        n = len(data["names"])
+        assert len(data["parents"]) == len(data["sizes"]) == len(data["language_ids"]) == n
+        assert data["parents"][0] == -1
+        assert all(-1 <= lid < len(data["languages"]) for lid in data["language_ids"])
+        print(f"✓ Flat tree encodes {n} nodes")
+
+    def test_missing_directory(self, project_id):
+        response = requests.get(f"{BASE_URL}/api/project/{project_id}/tree?path=does/not/exist")
+        assert response.status_code == 404
+        print("✓ Missing directory returns 404")
+
+
+class TestForkProject:
+    """Test /api/project/{id}/fork"""
+
+    def test_fork_is_copy_on_write(self, project_id):
+        response = requests.post(f"{BASE_URL}/api/project/{project_id}/fork", json={"name": "demo-fork"})
+        assert response.status_code == 200
+        fork = response.json()
+        assert fork["project_id"] != project_id
+        assert fork["forked_from"] == project_id
+        fork_id = fork["project_id"]
+
+        save = requests.post(
+            f"{BASE_URL}/api/project/{fork_id}/file",
+            json={"project_id": fork_id, "path": "app/utils.py", "content": "def add(a, b):\n    return 0\n"}
+        )
+        assert save.status_code == 200
+
+        original = requests.get(f"{BASE_URL}/api/project/{project_id}/file", params={"path": "app/utils.py"})
+        forked = requests.get(f"{BASE_URL}/api/project/{fork_id}/file", params={"path": "app/utils.py"})
+        assert "return a + b" in original.json()["content"]
+        assert "return 0" in forked.json()["content"]
+        assert fork["storage"] in ("reflink", "copy")
+        print(f"✓ Fork ({fork['storage']}) linked {fork['files_linked']} files, "
+              f"copied {fork['files_copied']}; edits stay private")
+
+    def test_duplicate_upload_reuses_blobs(self):
+        files = {'file': ('demo.zip', make_project_zip(), 'application/zip')}
+        first = requests.post(f"{BASE_URL}/api/upload-project", files=files, timeout=60)
+        files = {'file': ('demo.zip', make_project_zip(), 'application/zip')}
+        second = requests.post(f"{BASE_URL}/api/upload-project", files=files, timeout=60)
+        assert first.status_code == second.status_code == 200
+        assert first.json()["total_files"] == second.json()["total_files"]
+        assert first.json()["storage"] in ("reflink", "copy")
+        print(f"✓ Duplicate upload stored as {second.json()['storage']}")
+
+    def test_in_place_writes_stay_private(self):
+        def run(pid: str, command: str) -> dict:
+            response = requests.post(f"{BASE_URL}/api/project/{pid}/terminal",
+                                     json={"project_id": pid, "command": command})
+            assert response.status_code == 200
+            return response.json()
+
+        ids = []
+        for _ in range(2):
+            files = {'file': ('demo.zip', make_project_zip(), 'application/zip')}
+            upload = requests.post(f"{BASE_URL}/api/upload-project", files=files, timeout=60)
+            assert upload.status_code == 200
+            ids.append(upload.json()["project_id"])
+        first, second = ids
+
+        assert run(first, "echo '# local' >> README.md && chmod +x main.py")["exit_code"] == 0
+        assert run(second, "cat README.md")["output"] == "# Demo\n"
+
+        fork = requests.post(f"{BASE_URL}/api/project/{first}/fork", json={"name": "mode-fork"})
+        assert fork.status_code == 200
+        assert run(fork.json()["project_id"], "test -x main.py")["exit_code"] == 0
+        print("✓ Appends stay in their workspace; forks keep file modes")
+
+
+def search(project_id: str, **params) -> list:
+    response = requests.get(f"{BASE_URL}/api/project/{project_id}/search", params=params)
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.text.splitlines() if line.strip()]
+
+
+class TestCodeSearch:
+    """Test /api/project/{id}/search (NDJSON stream)"""
+
+    def test_literal_search_with_context(self, project_id):
+        results = search(project_id, q="def add", context=1)
+        summary = results[-1]
+        matches = results[:-1]
+        assert summary["done"] is True
+        assert any(m["path"] == "app/utils.py" and m["line"] == 1 for m in matches)
+        assert all("before" in m and "after" in m for m in matches)
+        print(f"✓ Literal search found {len(matches)} matches in {summary['elapsed_ms']}ms")
+
+    def test_regex_search(self, project_id):
+        matches = search(project_id, q=r"VALUE = [0-9]", mode="regex")[:-1]
+        assert {m["path"] for m in matches} >= {f"app/module_{i}.py" for i in range(5)}
+        print("✓ Regex search matches all modules")
+
+    def test_glob_filter(self, project_id):
+        matches = search(project_id, q="add", glob="tests/*")[:-1]
+        assert matches
+        assert all(m["path"].startswith("tests/") for m in matches)
+        print("✓ Glob filter restricts results")
+
+    def test_path_mode(self, project_id):
+        paths = [r["path"] for r in search(project_id, mode="path", glob="*module_*")[:-1]]
+        assert "app/module_0.py" in paths
+        print(f"✓ Path search returned {len(paths)} files")
+
+    def test_search_sees_saved_file(self, project_id):
+        requests.post(
+            f"{BASE_URL}/api/project/{project_id}/file",
+            json={"project_id": project_id, "path": "app/search_marker.py", "content": "UNIQUE_MARKER_XYZ = 1\n"}
+        )
+        matches = search(project_id, q="unique_marker_xyz")[:-1]
+        assert [m["path"] for m in matches] == ["app/search_marker.py"]
+        print("✓ Index updated incrementally after save")
+
+    def test_search_drops_overwritten_content(self, project_id):
+        save = lambda content: requests.post(
+            f"{BASE_URL}/api/project/{project_id}/file",
+            json={"project_id": project_id, "path": "app/rewritten.py", "content": content}
+        )
+        save("FIRST_VERSION_TOKEN = 1\n")
+        assert len(search(project_id, q="first_version_token")) == 2
+        save("SECOND_VERSION_TOKEN = 2\n")
+        assert search(project_id, q="first_version_token")[:-1] == []
+        assert [m["path"] for m in search(project_id, q="second_version_token")[:-1]] == ["app/rewritten.py"]
+        print("✓ Overwritten content drops out of the index")
+
+    def test_invalid_regex(self, project_id):
+        response = requests.get(f"{BASE_URL}/api/project/{project_id}/search", params={"q": "(", "mode": "regex"})
+        assert response.status_code == 400
+        print("✓ Invalid regex rejected")
+
+
+class TestSymbolIndex:
+    """Test /api/project/{id}/symbols endpoints"""
+
+    def test_go_to_definition(self, project_id):
+        response = requests.get(f"{BASE_URL}/api/project/{project_id}/symbols/definition", params={"name": "add"})
+        assert response.status_code == 200
+        definitions = response.json()["definitions"]
+        assert definitions[0]["path"] == "app/utils.py"
+        assert definitions[0]["kind"] == "function"
+        assert definitions[0]["line"] == 1
+        print("✓ Definition of add found in app/utils.py")
+
+    def test_find_references(self, project_id):
+        response = requests.get(f"{BASE_URL}/api/project/{project_id}/symbols/references", params={"name": "add"})
+        assert response.status_code == 200
+        paths = {r["path"] for r in response.json()["references"]}
+        assert {"main.py", "tests/test_utils.py"} <= paths
+        print(f"✓ add referenced from {len(paths)} files")
+
+    def test_import_graph_ranking(self, project_id):
+        response = requests.get(f"{BASE_URL}/api/project/{project_id}/symbols")
+        assert response.status_code == 200
+        data = response.json()
+        utils = next(f for f in data["top_files"] if f["path"] == "app/utils.py")
+        assert utils["imported_by"] >= 2
+        assert data["top_files"][0]["rank"] >= utils["rank"]
+        print(f"✓ {data['files']} files indexed, {data['import_edges']} import edges")
+
+    def test_file_outline(self, project_id):
+        response = requests.get(f"{BASE_URL}/api/project/{project_id}/symbols", params={"path": "main.py"})
+        assert response.status_code == 200
+        assert response.json()["imports"] == ["app/utils.py"]
+        print("✓ File outline lists resolved imports")
+
+    def test_index_rebuilt_after_archive(self):
+        files = {'file': ('demo.zip', make_project_zip(), 'application/zip')}
+        pid = requests.post(f"{BASE_URL}/api/upload-project", files=files, timeout=60).json()["project_id"]
+        url = f"{BASE_URL}/api/project/{pid}/symbols/definition"
+        assert requests.get(url, params={"name": "add"}).json()["definitions"]
+
+        assert requests.post(f"{BASE_URL}/api/project/{pid}/archive").json()["archived"] is True
+        definitions = requests.get(url, params={"name": "add"}).json()["definitions"]
+        assert definitions[0]["path"] == "app/utils.py"
+        print("✓ Symbol index dropped on archive and rebuilt on restore")
+
+
+class TestAnalysisCache:
+    """Test fingerprint-keyed caching of teach-file results"""
+
+    def test_teach_file_cached_until_saved(self, project_id):
+        body = {"project_id": project_id, "file_path": "app/utils.py", "skill_level": "beginner"}
+        first = requests.post(f"{BASE_URL}/api/project/{project_id}/teach-file", json=body, timeout=120)
+        assert first.status_code == 200
+        assert first.json()["cache_hit"] is False
+        second = requests.post(f"{BASE_URL}/api/project/{project_id}/teach-file", json=body, timeout=120)
+        assert second.status_code == 200
+        assert second.json()["cache_hit"] is True
+        assert second.json()["teaching_content"] == first.json()["teaching_content"]
+        print(f"✓ Second teach-file served from cache in {second.elapsed.total_seconds():.2f}s")
+
+
+class TestFileAccess:
+    """Test ETag, Range and line-range reads of /api/project/{id}/file"""
+
+    def test_etag_revalidation(self, project_id):
+        url = f"{BASE_URL}/api/project/{project_id}/file"
+        first = requests.get(url, params={"path": "main.py"})
+        assert first.status_code == 200
+        etag = first.headers["ETag"]
+        assert "Last-Modified" in first.headers
+
+        second = requests.get(url, params={"path": "main.py"}, headers={"If-None-Match": etag})
+        assert second.status_code == 304
+        print("✓ Unchanged file revalidated with 304")
+
+    def test_etag_per_representation(self, project_id):
+        url = f"{BASE_URL}/api/project/{project_id}/file"
+        json_etag = requests.get(url, params={"path": "main.py"}).headers["ETag"]
+        raw = requests.get(url, params={"path": "main.py", "raw": "true"}, headers={"If-None-Match": json_etag})
+        assert raw.status_code == 200
+        assert raw.headers["ETag"] != json_etag
+        window = requests.get(url, params={"path": "main.py", "lines": "1-1"}, headers={"If-None-Match": json_etag})
+        assert window.status_code == 200
+        assert window.headers["ETag"] not in (json_etag, raw.headers["ETag"])
+        print("✓ Raw, JSON and line-range reads carry distinct ETags")
+
+    def test_raw_range_request(self, project_id):
+        response = requests.get(
+            f"{BASE_URL}/api/project/{project_id}/file",
+            params={"path": "app/utils.py", "raw": "true"},
+            headers={"Range": "bytes=0-6"}
+        )
+        assert response.status_code == 206
+        assert response.content == b"def add"
+        assert response.headers["Content-Range"].startswith("bytes 0-6/")
+        print("✓ Range request returned 206 partial content")
+
+    def test_line_range(self, project_id):
+        response = requests.get(f"{BASE_URL}/api/project/{project_id}/file", params={"path": "app/utils.py", "lines": "2-2"})
+        assert response.status_code == 200
+        data = response.json()
+        assert data["content"] == "    return a + b\n"
+        assert data["total_lines"] == 2
+        print("✓ Line window served with total line count")
+
+
+class TestPatchFile:
+    """Test /api/project/{id}/file/patch"""
+
+    def test_range_edit_then_conflict(self, project_id):
+        url = f"{BASE_URL}/api/project/{project_id}/file"
+        requests.post(url, json={"project_id": project_id, "path": "app/patched.py", "content": "x = 1\ny = 2\n"})
+        etag = requests.get(url, params={"path": "app/patched.py"}).headers["ETag"]
+
+        edit = {"start_line": 2, "start_column": 5, "end_line": 2, "end_column": 6, "text": "42"}
+        response = requests.post(f"{url}/patch", json={"path": "app/patched.py", "base_etag": etag, "edits": [edit]})
+        assert response.status_code == 200
+        new_etag = response.json()["etag"]
+        assert new_etag != etag
+        assert requests.get(url, params={"path": "app/patched.py"}).json()["content"] == "x = 1\ny = 42\n"
+
+        stale = requests.post(f"{url}/patch", json={"path": "app/patched.py", "base_etag": etag, "edits": [edit]})
+        assert stale.status_code == 409
+        print("✓ Range edit applied; stale base rejected with 409")
+
+    def test_unified_diff(self, project_id):
+        url = f"{BASE_URL}/api/project/{project_id}/file"
+        requests.post(url, json={"project_id": project_id, "path": "app/diffed.py", "content": "a = 1\nb = 2\n"})
+        etag = requests.get(url, params={"path": "app/diffed.py"}).headers["ETag"]
+        diff = "--- a/app/diffed.py\n+++ b/app/diffed.py\n@@ -1,2 +1,2 @@\n a = 1\n-b = 2\n+b = 3\n"
+        response = requests.post(f"{url}/patch", json={"path": "app/diffed.py", "base_etag": etag, "diff": diff})
+        assert response.status_code == 200
+        assert requests.get(url, params={"path": "app/diffed.py"}).json()["content"] == "a = 1\nb = 3\n"
+
+        results = search(project_id, q="b = 3")[:-1]
+        assert "app/diffed.py" in [m["path"] for m in results]
+        print("✓ Unified diff applied and search index updated")
+
+    def test_unified_diff_keeps_crlf(self, project_id):
+        url = f"{BASE_URL}/api/project/{project_id}/file"
+        requests.post(url, json={"project_id": project_id, "path": "app/crlf.py", "content": "a = 1\r\nb = 2\r\n"})
+        etag = requests.get(url, params={"path": "app/crlf.py"}).headers["ETag"]
+        diff = "@@ -1,2 +1,3 @@\n a = 1\n+c = 3\n b = 2\n"
+        response = requests.post(f"{url}/patch", json={"path": "app/crlf.py", "base_etag": etag, "diff": diff})
+        assert response.status_code == 200
+        raw = requests.get(url, params={"path": "app/crlf.py", "raw": "true"})
+        assert raw.content == b"a = 1\r\nc = 3\r\nb = 2\r\n"
+        print("✓ Added lines keep the file's CRLF line endings")
+
+
+class TestDependencyCache:
+    """Test shared dependency installs via /api/project/{id}/install-deps"""
+
+    def test_second_install_hits_cache(self, project_id):
+        url = f"{BASE_URL}/api/project/{project_id}/install-deps"
+        first = requests.post(url, timeout=600)
+        assert first.status_code == 200
+        assert first.json()["success"], first.json()["error"]
+
+        second = requests.post(url, timeout=600)
+        data = second.json()
+        assert data["success"]
+        assert data["cache_hit"] is True
+        print(f"✓ Cached install took {data['seconds']}s")
+
+    def test_streamed_install(self, project_id):
+        response = requests.post(f"{BASE_URL}/api/project/{project_id}/install-deps", params={"stream": "true"}, timeout=600)
+        assert response.status_code == 200
+        events = [json.loads(line) for line in response.text.splitlines() if line.strip()]
+        assert events[-1]["event"] == "done"
+        assert events[-1]["success"]
+        print(f"✓ Streamed {len(events) - 1} progress events")
+
+    def test_stats(self):
+        response = requests.get(f"{BASE_URL}/api/dependency-cache/stats")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["hits"] >= 1
+        assert 0 <= data["hit_rate"] <= 1
+        assert data["bytes"] <= data["max_bytes"]
+        assert "go_mod_cache_bytes" in data
+        print(f"✓ Dependency cache hit rate {data['hit_rate']}")
+
+
+class TestSuiteRunner:
+    """Test structured, sharded /api/project/{id}/run-tests"""
+
+    def test_structured_results(self, project_id):
+        response = requests.post(f"{BASE_URL}/api/project/{project_id}/run-tests", params={"workers": 2}, timeout=300)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["framework"] == "pytest"
+        test = next(t for t in data["tests"] if t["name"] == "test_add")
+        assert test["file"] == "tests/test_utils.py"
+        assert test["status"] == "passed"
+        assert data["summary"]["passed"] >= 1
+        print(f"✓ {data['summary']['total']} tests in {len(data['shards'])} shards")
+
+    def test_affected_mode_skips_unchanged(self, project_id):
+        url = f"{BASE_URL}/api/project/{project_id}/run-tests"
+        requests.post(url, timeout=300)
+        response = requests.post(url, params={"mode": "affected"}, timeout=300)
+        assert response.status_code == 200
+        assert response.json()["selected"] == []
+
+        requests.post(
+            f"{BASE_URL}/api/project/{project_id}/file",
+            json={"project_id": project_id, "path": "app/utils.py", "content": "def add(a, b):\n    return b + a\n"}
+        )
+        response = requests.post(url, params={"mode": "affected"}, timeout=300)
+        assert response.json()["selected"] == ["tests/test_utils.py"]
+        print("✓ Affected mode selects only tests importing the changed file")
+
+
+class TestWorkspaceLifecycle:
+    """Test workspace archival and transparent restore"""
+
+    def test_archive_and_restore_on_access(self):
+        files = {'file': ('demo.zip', make_project_zip(), 'application/zip')}
+        upload = requests.post(f"{BASE_URL}/api/upload-project", files=files, timeout=60)
+        assert upload.status_code == 200
+        pid = upload.json()["project_id"]
+
+        archived = requests.post(f"{BASE_URL}/api/project/{pid}/archive")
+        assert archived.status_code == 200
+        assert archived.json()["archived"] is True
+
+        response = requests.get(f"{BASE_URL}/api/project/{pid}/file", params={"path": "app/utils.py"})
+        assert response.status_code == 200
+        assert "def add" in response.json()["content"]
+        print(f"✓ Archived ({archived.json()['bytes_reclaimed']} bytes reclaimed) and restored on access")
+
+    def test_busy_workspace_is_not_archived(self):
+        files = {'file': ('demo.zip', make_project_zip(), 'application/zip')}
+        upload = requests.post(f"{BASE_URL}/api/upload-project", files=files, timeout=60)
+        pid = upload.json()["project_id"]
+        workdir = requests.post(f"{BASE_URL}/api/project/{pid}/terminal",
+                                json={"project_id": pid, "command": "pwd"}).json()["output"].strip()
+
+        session = requests.post(f"{BASE_URL}/api/moltbot/tools/exec",
+                                json={"command": "sleep 30", "workdir": workdir, "background": True}).json()
+        try:
+            archived = requests.post(f"{BASE_URL}/api/project/{pid}/archive").json()
+            assert archived["archived"] is False
+            assert archived["busy"] is True
+        finally:
+            requests.post(f"{BASE_URL}/api/moltbot/tools/process/kill", params={"session_id": session["session_id"]})
+        print("✓ Workspace with a running exec session is left in place")
+
+    def test_stats(self):
+        response = requests.get(f"{BASE_URL}/api/workspaces/stats")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["restores"] >= 1
+        assert "bytes_reclaimed" in data
+        print(f"✓ {data['active']} active / {data['archived']} archived workspaces")
+
+
+def make_monorepo_zip() -> bytes:
+    """npm workspaces root with a Vite app plus a nested FastAPI service"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("mono/package.json", json.dumps({"name": "mono", "workspaces": ["packages/*"]}))
+        zf.writestr("mono/packages/web/package.json", json.dumps({
+            "dependencies": {"react": "18.0.0", "vite": "5.0.0"},
+            "scripts": {"dev": "vite --port 4000"}
+        }))
+        zf.writestr("mono/packages/web/src/main.jsx", "console.log('web')\n")
+        zf.writestr("mono/services/api/pyproject.toml", '[project]\nname = "api"\ndependencies = ["fastapi"]\n')
+        zf.writestr("mono/services/api/main.py", "from fastapi import FastAPI\napp = FastAPI()\n")
+    return buffer.getvalue()
+
+
+class TestProjectProfile:
+    """Test detector registry output over every package root"""
+
+    def test_monorepo_profile(self):
+        files = {'file': ('mono.zip', make_monorepo_zip(), 'application/zip')}
+        upload = requests.post(f"{BASE_URL}/api/upload-project", files=files, timeout=60)
+        assert upload.status_code == 200
+        assert {"React", "FastAPI"} <= set(upload.json()["frameworks"])
+        pid = upload.json()["project_id"]
+
+        response = requests.get(f"{BASE_URL}/api/project/{pid}/profile")
+        assert response.status_code == 200
+        packages = {p["root"]: p for p in response.json()["packages"]}
+        assert packages["packages/web"]["run_commands"]["port"] == "4000"
+        assert packages["packages/web"]["managed_by"] == ""
+        assert packages["services/api"]["run_commands"]["dev"] == "uvicorn main:app --reload --port 8000"
+        print(f"✓ Profile covers {len(packages)} package roots")
+
+    def test_install_skips_unsupported_roots(self):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr("crate/Cargo.toml", '[package]\nname = "crate"\nversion = "0.1.0"\n')
+            zf.writestr("crate/src/main.rs", 'fn main() {}\n')
+        files = {'file': ('crate.zip', buffer.getvalue(), 'application/zip')}
+        upload = requests.post(f"{BASE_URL}/api/upload-project", files=files, timeout=60)
+        assert upload.status_code == 200
+        pid = upload.json()["project_id"]
+
+        response = requests.post(f"{BASE_URL}/api/project/{pid}/install-deps", timeout=60)
+        assert response.status_code == 200
+        assert response.json()["skipped"] == [""]
+        print("✓ Roots without a supported package manager are reported as skipped")
+
+
+class TestWarmup:
+    """Test the post-upload warm-up job and diagnostics"""
+
+    def test_warmup_builds_indexes(self, project_id):
+        deadline = time.time() + 120
+        while True:
+            response = requests.get(f"{BASE_URL}/api/project/{project_id}/warmup")
+            assert response.status_code == 200
+            job = response.json()
+            if job["finished_at"] or time.time() > deadline:
+                break
+            time.sleep(1)
+        steps = job["steps"]
+        for step in ("manifest", "profile", "search_index", "symbol_index", "static_analysis"):
+            assert steps[step]["status"] == "ready", step
+        print(f"✓ Warm-up finished: {job['status']} (analysis: {steps['analysis']['status']})")
+
+    def test_diagnostics(self, project_id):
+        response = requests.get(f"{BASE_URL}/api/project/{project_id}/diagnostics")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["files_checked"] >= 1
+        assert all(d["severity"] != "error" for d in data["diagnostics"])
+        print(f"✓ {data['files_checked']} files checked, {data['warning']} warnings")
+
+
+class TestBuildCache:
+    """Test compiled execution skips the compiler for unchanged code"""
+
+    def test_c_rebuild_is_skipped(self):
+        payload = {"language": "c", "code": '#include <stdio.h>\nint main(){puts("built");return 0;}\n'}
+        first = requests.post(f"{BASE_URL}/api/execute-code", json=payload, timeout=120)
+        assert first.status_code == 200
+        assert first.json()["output"].strip() == "built"
+
+        second = requests.post(f"{BASE_URL}/api/execute-code", json=payload, timeout=120)
+        data = second.json()
+        assert data["build_cached"] is True
+        assert data["compile_time"] == 0
+        assert data["run_time"] is not None
+        print(f"✓ Cold compile {first.json()['compile_time']}s, cached rerun ran in {data['run_time']}s")
+
+    def test_disallowed_flags(self):
+        payload = {"language": "c", "code": "int main(){return 0;}", "flags": ["-o/tmp/x"]}
+        response = requests.post(f"{BASE_URL}/api/execute-code", json=payload, timeout=60)
+        assert response.status_code == 400
@@ -0,0 +1,160 @@
+"""
+Unit tests for workspace archival and restore
+- Symlinks pointing outside the workspace and virtualenvs are left out of archives
+- Failed restores clean up and report the workspace as gone
+- Requests wait for an archive in progress; held workspaces are not archived
+"""
+
+import asyncio
+import io
+import os
+import sys
+import tarfile
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from workspace_lifecycle import WorkspaceArchivedError, WorkspaceLifecycle
+
+
+class FakeCollection:
+    """The slice of a Motor collection the lifecycle uses, with nothing stored"""
+
+    def find(self, *args):
+        return self
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        raise StopAsyncIteration
+
+    async def update_one(self, *args, **kwargs):
+        pass
+
+    async def delete_one(self, *args, **kwargs):
+        pass
+
+
+def make_lifecycle(tmp_path: Path) -> WorkspaceLifecycle:
+    lifecycle = WorkspaceLifecycle(FakeCollection(), tmp_path / "archives")
+    lifecycle.add_root("project", tmp_path / "projects")
+    return lifecycle
+
+
+def make_workspace(tmp_path: Path, workspace_id: str = "p1") -> Path:
+    path = tmp_path / "projects" / workspace_id
+    (path / "app").mkdir(parents=True)
+    (path / "app" / "main.py").write_text("print('hi')\n")
+    (path / "app" / "alias.py").symlink_to("main.py")
+    (path / "env" / "bin").mkdir(parents=True)
+    (path / "env" / "pyvenv.cfg").write_text("home = /usr/bin\n")
+    (path / "env" / "bin" / "python").symlink_to("/usr/bin/python3")
+    (path / "host-config").symlink_to("/etc/hostname")
+    (path / "parent").symlink_to("../../outside")
+    return path
+
+
+class TestArchiveRestore:
+    """Round trips through an archive"""
+
+    def test_unsafe_links_and_virtualenvs_are_not_archived(self, tmp_path):
+        lifecycle = make_lifecycle(tmp_path)
+        path = make_workspace(tmp_path)
+
+        async def run():
+            lifecycle.register("project", "p1")
+            await lifecycle.archive("project", "p1")
+            assert not path.exists()
+            return await lifecycle.ensure_active("project", "p1")
+
+        assert asyncio.run(run())
+        assert (path / "app" / "main.py").read_text() == "print('hi')\n"
+        assert os.readlink(path / "app" / "alias.py") == "main.py"
+        assert not (path / "env").exists()
+        assert not os.path.lexists(path / "host-config")
+        assert not os.path.lexists(path / "parent")
+        assert lifecycle.records["project:p1"]["archived"] is False
+
+    def test_existing_archive_with_absolute_link_restores(self, tmp_path):
+        lifecycle = make_lifecycle(tmp_path)
+        archive = tmp_path / "archives" / "project" / "p1.tar.gz"
+        archive.parent.mkdir(parents=True)
+        with tarfile.open(archive, "w:gz") as tar:
+            data = b"x = 1\n"
+            info = tarfile.TarInfo("./main.py")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+            link = tarfile.TarInfo("./env/bin/python")
+            link.type = tarfile.SYMTYPE
+            link.linkname = "/usr/bin/python3"
+            tar.addfile(link)
+        lifecycle._record("project", "p1").update({"archived": True, "archive_path": str(archive)})
+
+        assert asyncio.run(lifecycle.ensure_active("project", "p1"))
+        path = tmp_path / "projects" / "p1"
+        assert (path / "main.py").read_text() == "x = 1\n"
+        assert not os.path.lexists(path / "env" / "bin" / "python")
+        assert not archive.exists()
+
+    def test_unreadable_archive_is_gone_and_cleaned_up(self, tmp_path):
+        lifecycle = make_lifecycle(tmp_path)
+        archive = tmp_path / "archives" / "project" / "p1.tar.gz"
+        archive.parent.mkdir(parents=True)
+        archive.write_bytes(b"not a tarball")
+        (tmp_path / "projects").mkdir()
+        lifecycle._record("project", "p1").update({"archived": True, "archive_path": str(archive)})
+
+        with pytest.raises(WorkspaceArchivedError):
+            asyncio.run(lifecycle.ensure_active("project", "p1"))
+        assert list((tmp_path / "projects").iterdir()) == []
+        assert lifecycle.records["project:p1"]["archived"] is True
+        assert archive.exists()
+
+
+class TestArchiveConcurrency:
+    """Requests and archives on the same workspace"""
+
+    def test_access_during_archive_waits_and_restores(self, tmp_path, monkeypatch):
+        lifecycle = make_lifecycle(tmp_path)
+        path = make_workspace(tmp_path)
+        archive_sync = lifecycle._archive_sync
+
+        def slow_archive(record):
+            result = archive_sync(record)
+            time.sleep(0.2)
+            return result
+
+        monkeypatch.setattr(lifecycle, "_archive_sync", slow_archive)
+
+        async def run():
+            lifecycle.register("project", "p1")
+            archiving = asyncio.create_task(lifecycle.archive("project", "p1"))
+            await asyncio.sleep(0.05)
+            assert await lifecycle.ensure_active("project", "p1")
+            return path.exists(), await archiving
+
+        restored, reclaimed = asyncio.run(run())
+        assert restored
+        assert (path / "app" / "main.py").exists()
+        assert lifecycle.records["project:p1"]["archived"] is False
+
+    def test_held_workspace_is_not_archived(self, tmp_path):
+        lifecycle = make_lifecycle(tmp_path)
+        path = make_workspace(tmp_path)
+
+        async def run():
+            lifecycle.register("project", "p1")
+            with lifecycle.hold("project", "p1"):
+                assert lifecycle.is_busy("project", "p1")
+                held = await lifecycle.archive("project", "p1")
+            return held, await lifecycle.archive("project", "p1")
+
+        held, released = asyncio.run(run())
+        assert held == 0
+        assert lifecycle.records["project:p1"]["archived"] is True
+        assert not path.exists()
+        assert not lifecycle.is_busy("project", "p1")
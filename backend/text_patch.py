@@ -0,0 +1,127 @@
+"""
+Text Patch
+Apply editor range edits or unified diffs to file text.
+
+Range edits use editor coordinates (1-based line and column, end exclusive)
+and are all relative to the base text, like a Monaco edit batch. Unified
+diff hunks must match the base exactly (no fuzz): a patch that does not
+apply is rejected rather than guessed at. Added lines take the base text's
+line ending (CRLF or LF).
+"""
+
+import re
+from typing import Dict, List, Any
+
+HUNK_RE = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+
+class PatchError(ValueError):
+    """Raised when edits or a diff do not apply to the base text"""
+
+
+def _line_starts(text: str) -> List[int]:
+    starts = [0]
+    for i, ch in enumerate(text):
+        if ch == '\n':
+            starts.append(i + 1)
+    return starts
+
+
+def _offset(starts: List[int], text: str, line: int, column: int) -> int:
+    if line < 1 or line > len(starts) or column < 1:
+        raise PatchError(f"Position {line}:{column} is outside the document")
+    line_start = starts[line - 1]
+    line_end = starts[line] - 1 if line < len(starts) else len(text)
+    if column - 1 > line_end - line_start:
+        raise PatchError(f"Position {line}:{column} is outside the document")
+    return line_start + column - 1
+
+
+def apply_edits(text: str, edits: List[Dict[str, Any]]) -> str:
+    """Apply non-overlapping {start_line, start_column, end_line, end_column, text} edits"""
+    starts = _line_starts(text)
+    spans = []
+    for edit in edits:
+        start = _offset(starts, text, edit["start_line"], edit["start_column"])
+        end = _offset(starts, text, edit["end_line"], edit["end_column"])
+        if end < start:
+            raise PatchError("Edit range ends before it starts")
+        spans.append((start, end, edit.get("text", "")))
+
+    spans.sort(key=lambda s: (s[0], s[1]))
+    for (_, prev_end, _), (start, _, _) in zip(spans, spans[1:]):
+        if start < prev_end:
+            raise PatchError("Edits overlap")
+
+    parts = []
+    position = 0
+    for start, end, new_text in spans:
+        parts.append(text[position:start])
+        parts.append(new_text)
+        position = end
+    parts.append(text[position:])
+    return ''.join(parts)
+
+
+def apply_unified_diff(text: str, diff: str) -> str:
+    """Apply the hunks of a single-file unified diff"""
+    original = text.splitlines(keepends=True)
+    first_eol = text.find('\n')
+    newline = '\r\n' if first_eol > 0 and text[first_eol - 1] == '\r' else '\n'
+    result: List[str] = []
+    position = 0  # Index into original of the next line not yet copied
+    diff_lines = diff.splitlines()
+    i = 0
+    applied = 0
+
+    def strip_eol(line: str) -> str:
+        return line.rstrip('\r\n')
+
+    while i < len(diff_lines):
+        match = HUNK_RE.match(diff_lines[i])
+        if not match:
+            i += 1  # ---/+++ headers and anything outside hunks
+            continue
+        old_start = int(match.group(1))
+        old_count = int(match.group(2)) if match.group(2) is not None else 1
+        new_count = int(match.group(4)) if match.group(4) is not None else 1
+        hunk_start = old_start - 1 if old_count else old_start
+        if hunk_start < position or hunk_start > len(original):
+            raise PatchError(f"Hunk at line {old_start} is out of order or past the end of the file")
+        result.extend(original[position:hunk_start])
+        position = hunk_start
+        i += 1
+
+        # Hunk bodies are delimited by their line counts, not by content
+        while old_count > 0 or new_count > 0 or (i < len(diff_lines) and diff_lines[i].startswith('\\')):
+            if i >= len(diff_lines):
+                raise PatchError("Diff ends in the middle of a hunk")
+            line = diff_lines[i]
+            i += 1
+            if line.startswith('\\'):
+                # "\ No newline at end of file" applies to the previous line
+                if result and diff_lines[i - 2][:1] in ('+', ' '):
+                    result[-1] = strip_eol(result[-1])
+                continue
+            tag, body = line[:1], line[1:]
+            if tag in (' ', '-', ''):
+                if position >= len(original) or strip_eol(original[position]) != body:
+                    raise PatchError(f"Hunk does not match the base at line {position + 1}")
+                if tag != '-':
+                    result.append(original[position])
+                    new_count -= 1
+                old_count -= 1
+                position += 1
+            elif tag == '+':
+                result.append(body + newline)
+                new_count -= 1
+            else:
+                raise PatchError(f"Unexpected line in hunk: {line[:40]}")
+            if old_count < 0 or new_count < 0:
+                raise PatchError("Hunk line counts do not match its header")
+        applied += 1
+
+    if not applied:
+        raise PatchError("Diff contains no hunks")
+    result.extend(original[position:])
+    return ''.join(result)
@@ -0,0 +1,272 @@
+"""
+Vector Index
+Local, offline similarity search over short texts.
+
+Texts are embedded by feature hashing: words, crude word stems, word
+bigrams and character trigrams are hashed (with a sign bit) into a fixed
+number of dimensions, weighted by sublinear term frequency and normalised,
+so cosine similarity is a dot product. Nothing is downloaded and no model
+is loaded, yet notes that share stems or word pieces with a query score
+above unrelated ones even when they are phrased differently.
+
+Vectors stay sparse. With NumPy installed they are appended to CSR
+arrays (row offsets, int16 column indices, float32 values) and scored with
+vectorised gathers, and once the index grows past `ivf_threshold` vectors
+an IVF layout (k-means centroids trained on a sample, scanning the
+`nprobe` nearest lists) is built; without NumPy a pure-Python scan over
+dict vectors is used.
+"""
+
+import heapq
+import math
+import random
+import re
+import zlib
+from typing import Dict, List, Optional, Tuple, Iterable
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+    logger.info("numpy not installed; vector recall uses the pure-Python index")
+
+DEFAULT_DIMS = 1024
+TOKEN_RE = re.compile(r"\w+")
+STEM_SUFFIXES = ("ations", "ation", "ings", "ing", "ies", "ied", "ers", "er", "ed", "es", "ly", "s")
+STOPWORDS = frozenset(
+    "a about after all also an and any are as at be been but by can could did do does for from had has have "
+    "how if in into is it its just like me my no not of on or our out so some than that the their them then "
+    "there these they this to up us was we were what when where which who why will with would you your".split()
+)
+TRIGRAM_WEIGHT = 0.35
+BIGRAM_WEIGHT = 0.5
+
+SparseVector = Dict[int, float]
+
+
+def stem(token: str) -> str:
+    for suffix in STEM_SUFFIXES:
+        if len(token) > len(suffix) + 2 and token.endswith(suffix):
+            return token[:-len(suffix)]
+    return token
+
+
+def embed(text: str, dims: int = DEFAULT_DIMS) -> SparseVector:
+    """Hashed-feature embedding as a normalised sparse vector"""
+    tokens = [t for t in TOKEN_RE.findall(text.lower()) if len(t) > 1 and t not in STOPWORDS]
+    features: Dict[str, float] = {}
+
+    def add(feature: str, weight: float) -> None:
+        features[feature] = features.get(feature, 0.0) + weight
+
+    for i, token in enumerate(tokens):
+        stemmed = stem(token)
+        add("w:" + stemmed, 1.0)
+        padded = f"#{stemmed}#"
+        for j in range(len(padded) - 2):
+            add("c:" + padded[j:j + 3], TRIGRAM_WEIGHT)
+        if i:
+            add("b:" + stem(tokens[i - 1]) + " " + stemmed, BIGRAM_WEIGHT)
+
+    vector: SparseVector = {}
+    for feature, weight in features.items():
+        if weight > 1:
+            weight = 1.0 + math.log(weight)  # Sublinear tf
+        h = zlib.crc32(feature.encode())
+        index = (h & 0x7fffffff) % dims
+        sign = 1.0 if h & 0x80000000 else -1.0
+        vector[index] = vector.get(index, 0.0) + sign * weight
+    norm = math.sqrt(sum(v * v for v in vector.values()))
+    if not norm:
+        return {}
+    return {i: v / norm for i, v in vector.items() if v}
+
+
+def sparse_dot(a: SparseVector, b: SparseVector) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(i, 0.0) for i, v in a.items())
+
+
+class VectorIndex:
+    """Keyed vectors with top-k cosine search; keys are replaced on re-add"""
+
+    def __init__(self, dims: int = DEFAULT_DIMS, ivf_threshold: int = 20000, nprobe: int = 8,
+                 train_sample: int = 4096):
+        self.dims = dims
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+        self.train_sample = train_sample
+        self.keys: List[Optional[str]] = []  # Row -> key; None marks a removed row
+        self.rows: Dict[str, int] = {}
+        self.sparse: List[Optional[SparseVector]] = []  # Pure-Python storage
+        # NumPy CSR storage, grown by doubling: row i is _indices/_data[_indptr[i]:_indptr[i + 1]]
+        self._indptr = None
+        self._indices = None
+        self._data = None
+        self._nnz = 0
+        self._centroids = None
+        self._lists: List[set] = []
+        self._trained_at = 0
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _dense(self, vector: SparseVector):
+        dense = np.zeros(self.dims, dtype=np.float32)
+        for i, v in vector.items():
+            dense[i] = v
+        return dense
+
+    def _append_row(self, vector: SparseVector) -> None:
+        row = len(self.keys) - 1
+        if self._indptr is None:
+            self._indptr = np.zeros(1024, dtype=np.int64)
+            self._indices = np.zeros(16384, dtype=np.int16 if self.dims <= 32767 else np.int32)
+            self._data = np.zeros(16384, dtype=np.float32)
+        if row + 2 > len(self._indptr):
+            self._indptr = np.concatenate([self._indptr, np.zeros(len(self._indptr), dtype=np.int64)])
+        end = self._nnz + len(vector)
+        if end > len(self._data):
+            size = max(end, 2 * len(self._data))
+            self._indices = np.concatenate([self._indices[:self._nnz], np.zeros(size - self._nnz, self._indices.dtype)])
+            self._data = np.concatenate([self._data[:self._nnz], np.zeros(size - self._nnz, np.float32)])
+        self._indices[self._nnz:end] = list(vector.keys())
+        self._data[self._nnz:end] = list(vector.values())
+        self._nnz = end
+        self._indptr[row + 1] = end
+
+    def _positions(self, rows):
+        """Storage positions of the given rows' values, row after row, with each row's length and offset"""
+        starts = self._indptr[rows]
+        lengths = self._indptr[rows + 1] - starts
+        offsets = np.cumsum(lengths) - lengths
+        positions = np.repeat(starts - offsets, lengths) + np.arange(int(lengths.sum()))
+        return positions, lengths, offsets
+
+    def _scores(self, rows, query):
+        """Dot products of the given CSR rows with a dense query"""
+        positions, lengths, offsets = self._positions(rows)
+        scores = np.zeros(len(rows), dtype=np.float32)
+        if len(positions):
+            products = self._data[positions] * query[self._indices[positions]]
+            nonempty = lengths > 0
+            scores[nonempty] = np.add.reduceat(products, offsets[nonempty])
+        return scores
+
+    def _densify(self, rows):
+        """Dense (len(rows), dims) copy of a few rows"""
+        positions, lengths, _ = self._positions(rows)
+        dense = np.zeros((len(rows), self.dims), dtype=np.float32)
+        dense[np.repeat(np.arange(len(rows)), lengths), self._indices[positions]] = self._data[positions]
+        return dense
+
+    def add(self, key: str, vector: SparseVector) -> None:
+        self.remove(key)
+        row = len(self.keys)
+        self.keys.append(key)
+        self.rows[key] = row
+        if not NUMPY_AVAILABLE:
+            self.sparse.append(vector)
+            return
+        self._append_row(vector)
+        if self._centroids is not None:
+            self._lists[int(np.argmax(self._centroids @ self._dense(vector)))].add(row)
+        if len(self.rows) >= self.ivf_threshold and len(self.rows) >= 2 * self._trained_at:
+            self._train()
+
+    def remove(self, key: str) -> None:
+        row = self.rows.pop(key, None)
+        if row is None:
+            return
+        self.keys[row] = None
+        if NUMPY_AVAILABLE:
+            for members in self._lists:
+                members.discard(row)
+        else:
+            self.sparse[row] = None
+        if len(self.keys) > 1024 and len(self.rows) < len(self.keys) // 2:
+            self._compact()
+
+    def remove_prefix(self, prefix: str) -> None:
+        for key in [k for k in self.rows if k.startswith(prefix)]:
+            self.remove(key)
+
+    def _compact(self) -> None:
+        live = [(key, row) for row, key in enumerate(self.keys) if key is not None]
+        self.keys = [key for key, _ in live]
+        self.rows = {key: i for i, (key, _) in enumerate(live)}
+        if NUMPY_AVAILABLE:
+            positions, lengths, _ = self._positions(np.array([row for _, row in live], dtype=np.int64))
+            self._indices = self._indices[positions]
+            self._data = self._data[positions]
+            self._nnz = len(positions)
+            self._indptr = np.zeros(max(1024, len(live) + 1), dtype=np.int64)
+            self._indptr[1:len(live) + 1] = np.cumsum(lengths)
+            if self._centroids is not None:
+                self._train()
+        else:
+            self.sparse = [self.sparse[row] for _, row in live]
+
+    def _train(self, iterations: int = 8, batch: int = 1024) -> None:
+        """k-means on a densified sample of live rows; every row is then bucketed by nearest centroid"""
+        live = np.array(sorted(self.rows.values()), dtype=np.int64)
+        nlist = max(1, int(math.sqrt(len(live))))
+        rng = random.Random(0)
+        sample = live[sorted(rng.sample(range(len(live)), min(len(live), max(self.train_sample, nlist))))]
+        data = self._densify(sample)  # Only the sample is ever dense
+        centroids = data[rng.sample(range(len(sample)), nlist)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(data @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = data[assignment == c]
+                if len(members):
+                    centroid = members.mean(axis=0)
+                    centroids[c] = centroid / (np.linalg.norm(centroid) or 1.0)
+        self._centroids = centroids
+        self._lists = [set() for _ in range(nlist)]
+        for begin in range(0, len(live), batch):
+            rows = live[begin:begin + batch]
+            for row, c in zip(rows, np.argmax(self._densify(rows) @ centroids.T, axis=1)):
+                self._lists[int(c)].add(int(row))
+        self._trained_at = len(live)
+        logger.info(f"Vector index trained: {len(live)} vectors in {nlist} lists")
+
+    def search(self, vector: SparseVector, k: int = 5, prefix: Optional[str] = None) -> List[Tuple[str, float]]:
+        """Top-k (key, cosine) pairs, optionally limited to keys starting with prefix"""
+        if not self.rows or not vector:
+            return []
+        if not NUMPY_AVAILABLE:
+            scored: Iterable[Tuple[str, float]] = (
+                (key, sparse_dot(vector, self.sparse[row])) for key, row in self.rows.items()
+                if prefix is None or key.startswith(prefix)
+            )
+            return heapq.nlargest(k, scored, key=lambda item: item[1])
+
+        query = self._dense(vector)
+        if self._centroids is not None:
+            probes = np.argsort(-(self._centroids @ query))[:self.nprobe]
+            rows = np.array(sorted(set().union(*(self._lists[int(c)] for c in probes))), dtype=np.int64)
+        else:
+            rows = np.array(sorted(self.rows.values()), dtype=np.int64)
+        if prefix is not None:
+            rows = np.array([r for r in rows if self.keys[r].startswith(prefix)], dtype=np.int64)
+        if not len(rows):
+            return []
+        scores = self._scores(rows, query)
+        top = np.argsort(-scores)[:k]
+        return [(self.keys[int(rows[i])], float(scores[i])) for i in top]
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "vectors": len(self.rows),
+            "dims": self.dims,
+            "backend": "numpy" if NUMPY_AVAILABLE else "python",
+            "layout": "ivf" if self._centroids is not None else "flat",
+            "lists": len(self._lists),
+            "stored_values": self._nnz if NUMPY_AVAILABLE else sum(len(v) for v in self.sparse if v)
+        }
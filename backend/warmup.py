@@ -0,0 +1,140 @@
+"""
+Warm-up Pipeline
+Background preparation of a freshly uploaded project.
+
+Upload enqueues a job that runs the registered steps (manifest, search and
+symbol indexes, static analysis, precomputed AI analysis) so the requests
+an IDE fires when a project is opened find their artifacts ready. Steps
+declare the steps they depend on; independent steps run concurrently.
+
+Job status is kept per project and every step transition is pushed to
+subscribers (the warm-up WebSocket) as it happens.
+"""
+
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Any, Optional, Callable, Awaitable, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+StepFunction = Callable[[str], Awaitable[Optional[Dict[str, Any]]]]
+
+
+class WarmupPipeline:
+    """Runs warm-up steps per project and publishes their progress"""
+
+    def __init__(self, max_concurrent_jobs: int = 2, step_timeout: float = 300):
+        self.steps: List[Tuple[str, StepFunction, Tuple[str, ...]]] = []
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self.subscribers: Dict[str, List[asyncio.Queue]] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._slots = asyncio.Semaphore(max_concurrent_jobs)
+        self.step_timeout = step_timeout
+
+    def step(self, name: str, after: Tuple[str, ...] = ()):
+        """Register a step: async fn(project_id) -> optional detail dict"""
+        def decorator(fn: StepFunction) -> StepFunction:
+            self.steps.append((name, fn, tuple(after)))
+            return fn
+        return decorator
+
+    # ---------- jobs ----------
+
+    def enqueue(self, project_id: str) -> Dict[str, Any]:
+        """Start (or restart) a project's warm-up; a running job is left alone"""
+        task = self._tasks.get(project_id)
+        if task and not task.done():
+            return self.jobs[project_id]
+        job = {
+            "project_id": project_id,
+            "status": "queued",
+            "steps": {name: {"status": "pending", "seconds": None, "error": None, "detail": None}
+                      for name, _, _ in self.steps},
+            "queued_at": datetime.now(timezone.utc).isoformat(),
+            "started_at": None,
+            "finished_at": None
+        }
+        self.jobs[project_id] = job
+        self._tasks[project_id] = asyncio.create_task(self._run(project_id, job))
+        return job
+
+    def status(self, project_id: str) -> Optional[Dict[str, Any]]:
+        return self.jobs.get(project_id)
+
+    async def wait(self, project_id: str) -> Optional[Dict[str, Any]]:
+        task = self._tasks.get(project_id)
+        if task:
+            await asyncio.shield(task)
+        return self.jobs.get(project_id)
+
+    async def _run(self, project_id: str, job: Dict[str, Any]) -> None:
+        async with self._slots:
+            job["status"] = "running"
+            job["started_at"] = datetime.now(timezone.utc).isoformat()
+            self._publish(project_id, {"event": "started", "project_id": project_id})
+            done: Dict[str, asyncio.Event] = {name: asyncio.Event() for name, _, _ in self.steps}
+
+            async def run_step(name: str, fn: StepFunction, after: Tuple[str, ...]):
+                state = job["steps"][name]
+                try:
+                    for dependency in after:
+                        await done[dependency].wait()
+                    failed = [d for d in after if job["steps"][d]["status"] != "ready"]
+                    if failed:
+                        state.update(status="skipped", error=f"Requires {', '.join(failed)}")
+                        return
+                    state["status"] = "running"
+                    self._publish(project_id, {"event": "step", "step": name, **state})
+                    started = time.perf_counter()
+                    try:
+                        state["detail"] = await asyncio.wait_for(fn(project_id), timeout=self.step_timeout)
+                        state["status"] = "ready"
+                    except Exception as e:
+                        logger.warning(f"Warm-up step {name} failed for {project_id}: {e}")
+                        state.update(status="failed", error=str(e) or type(e).__name__)
+                    state["seconds"] = round(time.perf_counter() - started, 2)
+                finally:
+                    self._publish(project_id, {"event": "step", "step": name, **state})
+                    done[name].set()
+
+            await asyncio.gather(*[run_step(name, fn, after) for name, fn, after in self.steps])
+            statuses = {s["status"] for s in job["steps"].values()}
+            job["status"] = "ready" if statuses <= {"ready"} else "partial"
+            job["finished_at"] = datetime.now(timezone.utc).isoformat()
+            self._publish(project_id, {"event": "done", "status": job["status"]})
+
+    # ---------- notifications ----------
+
+    def subscribe(self, project_id: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue()
+        self.subscribers.setdefault(project_id, []).append(queue)
+        return queue
+
+    def unsubscribe(self, project_id: str, queue: asyncio.Queue) -> None:
+        queues = self.subscribers.get(project_id, [])
+        if queue in queues:
+            queues.remove(queue)
+        if not queues:
+            self.subscribers.pop(project_id, None)
+
+    def _publish(self, project_id: str, event: Dict[str, Any]) -> None:
+        for queue in self.subscribers.get(project_id, []):
+            queue.put_nowait(dict(event))
+
+    def forget(self, project_id: str) -> None:
+        task = self._tasks.pop(project_id, None)
+        if task and not task.done():
+            task.cancel()
+        self.jobs.pop(project_id, None)
+
+    async def close(self) -> None:
+        tasks = [t for t in self._tasks.values() if not t.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# Global warm-up pipeline
+warmup_pipeline = WarmupPipeline()
@@ -0,0 +1,447 @@
+"""
+Workspace Lifecycle
+Last-access tracking, disk quotas and archival for on-disk workspaces.
+
+Workspaces are grouped by kind (uploaded projects, Remotion projects), each
+with its own root directory. Every request that touches a workspace marks
+it accessed; a background reaper archives workspaces that have been idle
+longer than idle_ttl, or the least recently used ones when a user or the
+whole host is over quota, into compressed tarballs. Dependency directories
+and virtualenvs are left out of archives (they are reinstalled from the
+dependency cache), as are symlinks pointing outside the workspace. An
+archived workspace is restored transparently on its next access; requests
+arriving while it is being archived wait for the archive and then restore.
+
+State lives in MongoDB so archives survive restarts; access times are kept
+in memory and flushed by the reaper.
+"""
+
+import asyncio
+import os
+import shutil
+import tarfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Any, Callable, Tuple, Awaitable, Iterator
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Rebuilt by install-deps / the dependency cache rather than archived
+ARCHIVE_SKIP_DIRS = {'node_modules', '.venv', 'venv', 'env', '__pycache__', '.next', '.cache'}
+
+
+def link_escapes(info: tarfile.TarInfo) -> bool:
+    """Whether a symlink member points at an absolute path or outside the archive root"""
+    if os.path.isabs(info.linkname):
+        return True
+    target = os.path.normpath(os.path.join(os.path.dirname(info.name), info.linkname))
+    return target == '..' or target.startswith('..' + os.sep)
+
+
+def restore_member(info: tarfile.TarInfo, dest: str) -> Optional[tarfile.TarInfo]:
+    """The "data" extraction filter, skipping unsafe links instead of failing the whole restore
+
+    Archives written before such links were excluded may still contain them.
+    """
+    try:
+        return tarfile.data_filter(info, dest)
+    except (tarfile.AbsoluteLinkError, tarfile.LinkOutsideDestinationError):
+        logger.warning(f"Skipping link {info.name} -> {info.linkname} outside the workspace")
+        return None
+
+
+def directory_size(path: Path) -> int:
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_blocks * 512
+            except OSError:
+                pass
+    return total
+
+
+class WorkspaceArchivedError(Exception):
+    """Raised when an archived workspace cannot be restored"""
+
+
+class WorkspaceLifecycle:
+    """Tracks workspace usage and archives/restores idle workspaces"""
+
+    def __init__(
+        self,
+        collection,
+        archive_dir: Path,
+        idle_ttl: float = 6 * 3600,
+        archive_ttl: Optional[float] = 30 * 24 * 3600,
+        global_quota: int = 20 * 1024 ** 3,
+        user_quota: int = 2 * 1024 ** 3,
+        interval: float = 300
+    ):
+        self.collection = collection
+        self.archive_dir = Path(archive_dir)
+        self.idle_ttl = idle_ttl
+        self.archive_ttl = archive_ttl
+        self.global_quota = global_quota
+        self.user_quota = user_quota
+        self.interval = interval
+        self.roots: Dict[str, Path] = {}
+        self.skip: Dict[str, set] = {}
+        self.records: Dict[str, Dict[str, Any]] = {}
+        self.busy_checks: List[Callable[[str, str], bool]] = []
+        self.archive_hooks: List[Callable[[str, str], None]] = []
+        # Run after workspaces are archived or archives purged; free shared storage, return bytes freed
+        self.reclaim_hooks: List[Callable[[], Awaitable[int]]] = []
+        self._dirty: set = set()
+        self._locks: Dict[str, asyncio.Lock] = {}  # Held while a workspace is archived or restored
+        self._holds: Dict[str, int] = {}  # Requests currently working in a workspace
+        self._task: Optional[asyncio.Task] = None
+        self._loaded = False
+        self.metrics = {"archives_created": 0, "restores": 0, "archives_purged": 0, "bytes_reclaimed": 0, "last_reap": None}
+
+    @staticmethod
+    def _key(kind: str, workspace_id: str) -> str:
+        return f"{kind}:{workspace_id}"
+
+    def _lock(self, key: str) -> asyncio.Lock:
+        if key not in self._locks:
+            self._locks[key] = asyncio.Lock()
+        return self._locks[key]
+
+    def add_root(self, kind: str, root: Path, skip: Optional[set] = None) -> None:
+        """Register a directory whose children are workspaces of `kind`"""
+        self.roots[kind] = Path(root)
+        self.skip[kind] = set(skip or ())
+
+    # ---------- persistence ----------
+
+    async def load(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        async for doc in self.collection.find({}, {"_id": 0}):
+            self.records[doc["key"]] = doc
+
+    async def flush(self) -> None:
+        dirty, self._dirty = self._dirty, set()
+        for key in dirty:
+            record = self.records.get(key)
+            if record is None:
+                await self.collection.delete_one({"key": key})
+            else:
+                await self.collection.update_one({"key": key}, {"$set": record}, upsert=True)
+
+    def _record(self, kind: str, workspace_id: str) -> Dict[str, Any]:
+        key = self._key(kind, workspace_id)
+        record = self.records.get(key)
+        if record is None:
+            path = self.roots[kind] / workspace_id
+            try:
+                last_access = path.stat().st_mtime
+            except OSError:
+                last_access = time.time()
+            record = {"key": key, "kind": kind, "workspace_id": workspace_id, "path": str(path),
+                      "user_id": None, "size": None, "last_access": last_access,
+                      "archived": False, "archive_path": None, "archived_at": None, "archive_size": None}
+            self.records[key] = record
+            self._dirty.add(key)
+        return record
+
+    # ---------- access ----------
+
+    def register(self, kind: str, workspace_id: str, user_id: Optional[str] = None,
+                 size: Optional[int] = None) -> None:
+        record = self._record(kind, workspace_id)
+        record.update({"user_id": user_id, "size": size, "last_access": time.time()})
+        self._dirty.add(record["key"])
+
+    def touch(self, kind: str, workspace_id: str) -> None:
+        record = self.records.get(self._key(kind, workspace_id))
+        if record is not None:
+            record["last_access"] = time.time()  # Size is re-measured by the next reaper pass
+            self._dirty.add(record["key"])
+
+    async def ensure_active(self, kind: str, workspace_id: str) -> bool:
+        """Mark a workspace accessed, restoring it first if archived. False if unknown."""
+        await self.load()
+        key = self._key(kind, workspace_id)
+        record = self.records.get(key)
+        if record is None:
+            if kind in self.roots and (self.roots[kind] / workspace_id).is_dir():
+                self._record(kind, workspace_id)
+                return True
+            return False
+        if record["archived"] or self._lock(key).locked():
+            # Also wait out an archive in progress rather than using a half-deleted tree
+            async with self._lock(key):
+                if record["archived"]:
+                    await self._restore(record)
+        self.touch(kind, workspace_id)
+        return True
+
+    @contextmanager
+    def hold(self, kind: str, workspace_id: str) -> Iterator[None]:
+        """Keep a workspace from being archived while a request works in it"""
+        key = self._key(kind, workspace_id)
+        self._holds[key] = self._holds.get(key, 0) + 1
+        try:
+            yield
+        finally:
+            self._holds[key] -= 1
+            if not self._holds[key]:
+                del self._holds[key]
+
+    # ---------- archive / restore ----------
+
+    @staticmethod
+    def _free_bytes(path: Path) -> int:
+        st = os.statvfs(path)
+        return st.f_bfree * st.f_frsize
+
+    def _archive_sync(self, record: Dict[str, Any]) -> Tuple[int, int, int]:
+        """Returns (workspace size, archive size, bytes the filesystem actually got back)"""
+        path = Path(record["path"])
+        size = directory_size(path)
+        archive = self.archive_dir / record["kind"] / f"{record['workspace_id']}.tar.gz"
+        archive.parent.mkdir(parents=True, exist_ok=True)
+        tmp = archive.with_name(f".{archive.name}.tmp")
+
+        def exclude(info: tarfile.TarInfo):
+            if info.isdir() and (Path(info.name).name in ARCHIVE_SKIP_DIRS
+                                 or (path / info.name / "pyvenv.cfg").exists()):
+                return None
+            if info.issym() and link_escapes(info):
+                return None  # Would not survive extraction (virtualenv interpreters, host paths)
+            return info
+
+        with tarfile.open(tmp, "w:gz", compresslevel=6) as tar:
+            tar.add(str(path), arcname=".", filter=exclude)
+        os.replace(tmp, archive)
+        # Reflinked files share extents with the blob store, so removing them may free
+        # less than their size; measure what the filesystem actually reclaimed
+        free_before = self._free_bytes(path.parent)
+        shutil.rmtree(path, ignore_errors=True)
+        freed = min(size, max(0, self._free_bytes(path.parent) - free_before))
+        record["archive_path"] = str(archive)
+        return size, archive.stat().st_size, freed
+
+    async def archive(self, kind: str, workspace_id: str, reason: str = "idle") -> int:
+        """Archive one workspace; returns bytes reclaimed (0 if skipped)"""
+        key = self._key(kind, workspace_id)
+        record = self.records.get(key)
+        if record is None or record["archived"] or self.is_busy(kind, workspace_id):
+            return 0
+        async with self._lock(key):
+            # Re-checked under the lock: requests arriving from here on wait in ensure_active
+            if record["archived"] or not Path(record["path"]).is_dir() or self.is_busy(kind, workspace_id):
+                return 0
+            for hook in self.archive_hooks:
+                try:
+                    hook(kind, workspace_id)
+                except Exception as e:
+                    logger.warning(f"Archive hook failed for {key}: {e}")
+            size, archive_size, freed = await asyncio.to_thread(self._archive_sync, record)
+            record.update({"archived": True, "archived_at": time.time(), "size": size,
+                           "archive_size": archive_size, "archive_reason": reason})
+            self._dirty.add(key)
+        reclaimed = max(0, freed - archive_size) + await self._reclaim()
+        self.metrics["archives_created"] += 1
+        self.metrics["bytes_reclaimed"] += reclaimed
+        logger.info(f"Archived workspace {key} ({reason}): {size} -> {archive_size} bytes")
+        return reclaimed
+
+    async def _reclaim(self) -> int:
+        freed = 0
+        for hook in self.reclaim_hooks:
+            try:
+                freed += await hook()
+            except Exception as e:
+                logger.warning(f"Reclaim hook failed: {e}")
+        return freed
+
+    def _restore_sync(self, record: Dict[str, Any]) -> None:
+        archive = Path(record["archive_path"] or "")
+        if not archive.exists():
+            raise WorkspaceArchivedError(f"Archive for {record['key']} is missing")
+        path = Path(record["path"])
+        tmp = path.with_name(f".{path.name}.restoring")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        try:
+            with tarfile.open(archive, "r:gz") as tar:
+                try:
+                    tar.extractall(tmp, filter=restore_member)
+                except TypeError:  # Python without extraction filters
+                    tar.extractall(tmp)
+        except (tarfile.TarError, OSError) as e:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise WorkspaceArchivedError(f"Archive for {record['key']} could not be restored: {e}") from e
+        if path.exists():
+            shutil.rmtree(path)
+        os.replace(tmp, path)
+        archive.unlink()
+
+    async def _restore(self, record: Dict[str, Any]) -> None:
+        await asyncio.to_thread(self._restore_sync, record)
+        record.update({"archived": False, "archive_path": None, "archived_at": None,
+                       "archive_size": None, "size": None, "dependencies_dropped": True})
+        self._dirty.add(record["key"])
+        self.metrics["restores"] += 1
+        logger.info(f"Restored workspace {record['key']}")
+
+    async def remove(self, kind: str, workspace_id: str) -> None:
+        """Stop tracking a deleted workspace and drop its archive, if any"""
+        await self.load()
+        key = self._key(kind, workspace_id)
+        record = self.records.pop(key, None)
+        self._locks.pop(key, None)
+        self._dirty.add(key)
+        if record and record["archive_path"]:
+            Path(record["archive_path"]).unlink(missing_ok=True)
+        await self.flush()
+
+    def is_busy(self, kind: str, workspace_id: str) -> bool:
+        if self._holds.get(self._key(kind, workspace_id)):
+            return True
+        return any(check(kind, workspace_id) for check in self.busy_checks)
+
+    # ---------- quotas ----------
+
+    def usage(self, user_id: Optional[str] = None) -> int:
+        return sum(r["size"] or 0 for r in self.records.values()
+                   if not r["archived"] and (user_id is None or r["user_id"] == user_id))
+
+    async def make_room(self, user_id: Optional[str], incoming: int, exclude: Optional[str] = None) -> bool:
+        """Archive least recently used workspaces until `incoming` bytes fit both quotas"""
+        await self.load()
+        await asyncio.to_thread(self._measure)
+
+        def over() -> bool:
+            if self.usage() + incoming > self.global_quota:
+                return True
+            return user_id is not None and self.usage(user_id) + incoming > self.user_quota
+
+        if not over():
+            return True
+        candidates = sorted(
+            (r for r in self.records.values() if not r["archived"] and r["key"] != exclude),
+            key=lambda r: r["last_access"]
+        )
+        for record in candidates:
+            user_over = user_id is not None and self.usage(user_id) + incoming > self.user_quota
+            if user_over and self.usage() + incoming <= self.global_quota and record["user_id"] != user_id:
+                continue  # Only the user's own workspaces count against their quota
+            await self.archive(record["kind"], record["workspace_id"], reason="quota")
+            if not over():
+                return True
+        return not over()
+
+    # ---------- reaper ----------
+
+    def _discover(self) -> None:
+        for kind, root in self.roots.items():
+            if not root.is_dir():
+                continue
+            for entry in os.scandir(root):
+                if entry.is_dir(follow_symlinks=False) and not entry.name.startswith('.') \
+                        and entry.name not in self.skip[kind]:
+                    self._record(kind, entry.name)
+
+    def _measure(self, refresh: bool = False) -> None:
+        """Size unmeasured workspaces; with refresh, also those accessed since they were last measured"""
+        for record in list(self.records.values()):
+            if record["archived"]:
+                continue
+            stale = refresh and record["last_access"] > record.get("measured_at", 0)
+            if record["size"] is None or stale:
+                path = Path(record["path"])
+                if path.is_dir():
+                    record["size"] = directory_size(path)
+                    record["measured_at"] = time.time()
+                    self._dirty.add(record["key"])
+                elif record["kind"] in self.roots:
+                    # Deleted out from under us (e.g. remotion project removed)
+                    self.records.pop(record["key"], None)
+                    self._dirty.add(record["key"])
+
+    async def reap(self) -> Dict[str, Any]:
+        """One reaper pass: archive idle workspaces, enforce quotas, purge old archives"""
+        await self.load()
+        await asyncio.to_thread(self._discover)
+        await asyncio.to_thread(self._measure, True)
+        now = time.time()
+        reclaimed = 0
+
+        for record in sorted(self.records.values(), key=lambda r: r["last_access"]):
+            if not record["archived"] and now - record["last_access"] > self.idle_ttl:
+                reclaimed += await self.archive(record["kind"], record["workspace_id"])
+
+        for user_id in {r["user_id"] for r in self.records.values() if r["user_id"]}:
+            if self.usage(user_id) > self.user_quota:
+                await self.make_room(user_id, 0)
+        if self.usage() > self.global_quota:
+            await self.make_room(None, 0)
+
+        purged = 0
+        if self.archive_ttl is not None:
+            for record in list(self.records.values()):
+                if record["archived"] and now - (record["archived_at"] or now) > self.archive_ttl:
+                    try:
+                        Path(record["archive_path"]).unlink()
+                    except (OSError, TypeError):
+                        pass
+                    self.records.pop(record["key"])
+                    self._dirty.add(record["key"])
+                    purged += 1
+        self.metrics["archives_purged"] += purged
+        if purged:
+            self.metrics["bytes_reclaimed"] += await self._reclaim()
+        self.metrics["last_reap"] = datetime.now(timezone.utc).isoformat()
+
+        await self.flush()
+        return {"bytes_reclaimed": reclaimed, "purged": purged, **self.stats()}
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await self.reap()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Workspace reaper error: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        active = [r for r in self.records.values() if not r["archived"]]
+        archived = [r for r in self.records.values() if r["archived"]]
+        by_kind: Dict[str, Dict[str, int]] = {}
+        for record in self.records.values():
+            kind = by_kind.setdefault(record["kind"], {"active": 0, "archived": 0, "bytes": 0})
+            kind["archived" if record["archived"] else "active"] += 1
+            kind["bytes"] += (record["archive_size"] if record["archived"] else record["size"]) or 0
+        return {
+            "active": len(active),
+            "archived": len(archived),
+            "active_bytes": self.usage(),
+            "archive_bytes": sum(r["archive_size"] or 0 for r in archived),
+            "global_quota": self.global_quota,
+            "user_quota": self.user_quota,
+            "by_kind": by_kind,
+            **self.metrics
+        }
@@ -0,0 +1,551 @@
+"""
+Workspace Manifest
+Persistent per-project manifest of paths, sizes, mtimes, languages and content
+hashes, kept up to date incrementally instead of rescanning the workspace.
+
+Every change bumps a monotonically increasing version number so clients can
+ask for "changes since version N" and refresh in O(changed files).
+
+Published manifest dicts are never mutated in place: updates are computed
+on copies in a worker thread and swapped in on the event loop, so readers
+on the loop always see a consistent manifest. Manifests nobody has asked
+for in idle_ttl seconds are flushed and dropped from memory, and their
+watchers stopped.
+"""
+
+import asyncio
+import bisect
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Any, Iterable, Tuple
+import logging
+
+from workspace_scanner import (
+    scan_workspace, is_ignored, language_for, build_tree, summarize_languages,
+    build_directory_index, encode_flat_tree, directory_sort_key
+)
+
+logger = logging.getLogger(__name__)
+
+try:
+    from watchfiles import awatch
+    WATCHER_AVAILABLE = True
+except ImportError:
+    WATCHER_AVAILABLE = False
+    logger.warning("watchfiles not installed. Terminal-driven changes will be picked up by rescans.")
+
+MANIFEST_FORMAT = 1
+
+
+def hash_file(path: Path, chunk_size: int = 1024 * 1024) -> Optional[str]:
+    """SHA-256 of a file's content, or None if it cannot be read"""
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+def is_tracked_path(rel_path: str) -> bool:
+    """Whether a workspace-relative path passes the shared ignore rules"""
+    parts = rel_path.split('/')
+    if any(is_ignored(part, True) for part in parts[:-1]):
+        return False
+    return not is_ignored(parts[-1], False)
+
+
+def merkle_hash(files: Dict[str, Dict[str, Any]], paths: Optional[Iterable[str]] = None) -> str:
+    """
+    Merkle root over path -> content hash. Each directory hashes its sorted
+    children (name + child hash), so the root changes iff some file under
+    it was added, removed, renamed or edited. `paths` restricts the tree to
+    a subset of files (missing paths hash as absent).
+    """
+    selected = files if paths is None else {p: files.get(p, {}) for p in paths}
+    tree: Dict[str, Any] = {}
+    for path, meta in selected.items():
+        node = tree
+        parts = path.split('/')
+        for part in parts[:-1]:
+            node = node.setdefault(part + '/', {})
+        node[parts[-1]] = meta.get("hash") or "-"
+
+    def digest(node: Dict[str, Any]) -> str:
+        h = hashlib.sha256()
+        for name in sorted(node):
+            child = node[name]
+            h.update(name.encode('utf-8', 'surrogateescape') + b'\0')
+            h.update((digest(child) if isinstance(child, dict) else child).encode() + b'\n')
+        return h.hexdigest()
+
+    return digest(tree)
+
+
+class WorkspaceManifestStore:
+    """Load, update and persist workspace manifests (sidecar JSON files)"""
+
+    def __init__(self, manifest_dir: Path, max_tombstones: int = 5000, flush_delay: float = 1.0,
+                 idle_ttl: float = 1800, interval: float = 300):
+        self.manifest_dir = Path(manifest_dir)
+        self.manifest_dir.mkdir(parents=True, exist_ok=True)
+        self.max_tombstones = max_tombstones
+        self.flush_delay = flush_delay
+        self.idle_ttl = idle_ttl
+        self.interval = interval
+        self.manifests: Dict[str, Dict[str, Any]] = {}
+        self.last_access: Dict[str, float] = {}
+        self.watchers: Dict[str, asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._flush_tasks: Dict[str, asyncio.Task] = {}
+        self._tree_cache: Dict[str, tuple] = {}
+        self._dir_index_cache: Dict[str, tuple] = {}
+        self._flat_cache: Dict[str, tuple] = {}
+        self._fingerprint_cache: Dict[str, tuple] = {}
+
+    def _lock(self, project_id: str) -> asyncio.Lock:
+        if project_id not in self._locks:
+            self._locks[project_id] = asyncio.Lock()
+        return self._locks[project_id]
+
+    def _manifest_path(self, project_id: str) -> Path:
+        return self.manifest_dir / f"{project_id}.json"
+
+    # ---------- persistence ----------
+
+    def _read(self, project_id: str) -> Optional[Dict[str, Any]]:
+        path = self._manifest_path(project_id)
+        if not path.exists():
+            return None
+        try:
+            manifest = json.loads(path.read_text())
+            if manifest.get("format") != MANIFEST_FORMAT:
+                return None
+            return manifest
+        except Exception as e:
+            logger.warning(f"Discarding unreadable manifest for {project_id}: {e}")
+            return None
+
+    def _write(self, project_id: str, manifest: Dict[str, Any]) -> None:
+        path = self._manifest_path(project_id)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(manifest))
+        os.replace(tmp_path, path)
+
+    def _schedule_flush(self, project_id: str) -> None:
+        """Debounce manifest writes so bursts of saves persist once"""
+        if project_id in self._flush_tasks and not self._flush_tasks[project_id].done():
+            return
+
+        async def flush():
+            await asyncio.sleep(self.flush_delay)
+            manifest = self.manifests.get(project_id)
+            if manifest is None:
+                return
+            try:
+                async with self._lock(project_id):
+                    await asyncio.to_thread(self._write, project_id, manifest)
+            except Exception as e:
+                logger.error(f"Manifest flush error for {project_id}: {e}")
+
+        self._flush_tasks[project_id] = asyncio.create_task(flush())
+
+    # ---------- building ----------
+
+    def _build_from_scan(self, project_id: str, workspace_path: Path, scan: Dict[str, Any],
+                         previous: Optional[Dict[str, Any]] = None,
+                         known_hashes: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        """Turn a scan into a manifest, re-hashing only files whose size or mtime changed"""
+        known_hashes = known_hashes or {}
+        if previous:
+            version = previous["version"]
+            old_files = previous["files"]
+            deleted = dict(previous.get("deleted", {}))
+        else:
+            version = 0
+            old_files = {}
+            deleted = {}
+
+        files = {}
+        changed = False
+        for entry in scan["files"]:
+            path = entry["path"]
+            old = old_files.get(path)
+            if old and old["size"] == entry["size"] and old["mtime"] == entry["mtime"]:
+                files[path] = old
+                continue
+            if not changed:
+                version += 1
+                changed = True
+            files[path] = {
+                "size": entry["size"],
+                "mtime": entry["mtime"],
+                "language": entry["language"],
+                "hash": known_hashes.get(path) or hash_file(workspace_path / path),
+                "version": version
+            }
+            deleted.pop(path, None)
+
+        for path in old_files:
+            if path not in files:
+                if not changed:
+                    version += 1
+                    changed = True
+                deleted[path] = version
+
+        manifest = {
+            "format": MANIFEST_FORMAT,
+            "project_id": project_id,
+            "root_name": workspace_path.name,
+            "version": version,
+            "floor": previous.get("floor", 0) if previous else 0,
+            "files": files,
+            "deleted": deleted,
+            "root_files": scan["root_files"],
+            "root_dirs": scan["root_dirs"],
+            "updated_at": time.time()
+        }
+        self._prune_tombstones(manifest)
+        return manifest
+
+    def _prune_tombstones(self, manifest: Dict[str, Any]) -> None:
+        """Cap deletion records; clients older than the floor get a full refresh"""
+        deleted = manifest["deleted"]
+        if len(deleted) <= self.max_tombstones:
+            return
+        ordered = sorted(deleted.items(), key=lambda kv: kv[1])
+        drop = ordered[:len(deleted) - self.max_tombstones]
+        for path, _ in drop:
+            del deleted[path]
+        manifest["floor"] = max(manifest["floor"], drop[-1][1])
+
+    async def build(self, project_id: str, workspace_path: Path, scan: Optional[Dict[str, Any]] = None,
+                    known_hashes: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        """Build (or rebuild) a project's manifest, reusing an existing scan and
+        content hashes (e.g. from the blob store) if given"""
+        workspace_path = Path(workspace_path)
+        async with self._lock(project_id):
+            if scan is None:
+                scan = await asyncio.to_thread(scan_workspace, workspace_path)
+            previous = self.manifests.get(project_id)
+            manifest = await asyncio.to_thread(
+                self._build_from_scan, project_id, workspace_path, scan, previous, known_hashes
+            )
+            self.manifests[project_id] = manifest
+            await asyncio.to_thread(self._write, project_id, manifest)
+            return manifest
+
+    async def get(self, project_id: str, workspace_path: Path) -> Dict[str, Any]:
+        """Return the manifest, loading it from disk or building it on first use"""
+        self.last_access[project_id] = time.monotonic()
+        return await self._load(project_id, workspace_path)
+
+    async def _load(self, project_id: str, workspace_path: Path) -> Dict[str, Any]:
+        manifest = self.manifests.get(project_id)
+        if manifest is not None:
+            return manifest
+        loaded = await asyncio.to_thread(self._read, project_id)
+        if loaded is not None:
+            self.manifests.setdefault(project_id, loaded)
+            # Files may have changed while nobody was watching
+            return await self.rescan(project_id, workspace_path)
+        return await self.build(project_id, workspace_path)
+
+    async def rescan(self, project_id: str, workspace_path: Path) -> Dict[str, Any]:
+        """Stat-only rescan; content is re-hashed only for files that changed"""
+        self.last_access[project_id] = time.monotonic()
+        return await self.build(project_id, workspace_path)
+
+    # ---------- incremental updates ----------
+
+    def _expand_paths(self, manifest: Dict[str, Any], workspace_path: Path, paths: Iterable[str]) -> List[str]:
+        """Expand directory events into the files they contain (or used to contain)"""
+        expanded = set()
+        for rel_path in paths:
+            rel_path = rel_path.strip('/')
+            if not rel_path:
+                continue
+            full_path = workspace_path / rel_path
+            if full_path.is_dir():
+                for root, dirs, files in os.walk(full_path):
+                    dirs[:] = [d for d in dirs if not is_ignored(d, True)]
+                    rel_root = os.path.relpath(root, workspace_path).replace(os.sep, '/')
+                    expanded.update(f"{rel_root}/{f}" for f in files)
+            elif rel_path not in manifest["files"] and not full_path.exists():
+                prefix = rel_path + '/'
+                expanded.update(p for p in manifest["files"] if p.startswith(prefix))
+            expanded.add(rel_path)
+        return sorted(expanded)
+
+    def _refresh_paths_sync(self, manifest: Dict[str, Any], workspace_path: Path,
+                            paths: List[str]) -> Tuple[List[str], Dict[str, Any]]:
+        """Re-stat paths against a manifest without modifying it; returns (changed paths, updated fields)"""
+        files = dict(manifest["files"])
+        deleted = dict(manifest["deleted"])
+        root_files = set(manifest["root_files"])
+        root_dirs = set(manifest["root_dirs"])
+        changed = []
+        version = manifest["version"] + 1
+
+        for rel_path in paths:
+            rel_path = rel_path.strip('/')
+            if rel_path and '/' not in rel_path and not os.path.lexists(workspace_path / rel_path):
+                root_files.discard(rel_path)
+                root_dirs.discard(rel_path)
+
+        for rel_path in self._expand_paths(manifest, workspace_path, paths):
+            if not is_tracked_path(rel_path):
+                continue
+            full_path = workspace_path / rel_path
+            try:
+                st = full_path.stat() if full_path.is_file() else None
+            except OSError:
+                st = None
+
+            old = files.get(rel_path)
+            if st is None:
+                if old is not None:
+                    del files[rel_path]
+                    deleted[rel_path] = version
+                    changed.append(rel_path)
+                continue
+
+            if old and old["size"] == st.st_size and old["mtime"] == st.st_mtime:
+                continue
+
+            files[rel_path] = {
+                "size": st.st_size,
+                "mtime": st.st_mtime,
+                "language": language_for(rel_path)['name'],
+                "hash": hash_file(full_path),
+                "version": version
+            }
+            deleted.pop(rel_path, None)
+            changed.append(rel_path)
+
+            if '/' not in rel_path:
+                root_files.add(rel_path)
+            else:
+                root_dirs.add(rel_path.split('/', 1)[0])
+
+        update: Dict[str, Any] = {"root_files": sorted(root_files), "root_dirs": sorted(root_dirs)}
+        if changed:
+            update.update({"files": files, "deleted": deleted, "version": version,
+                           "floor": manifest.get("floor", 0), "updated_at": time.time()})
+            self._prune_tombstones(update)
+        return changed, update
+
+    async def refresh_paths(self, project_id: str, workspace_path: Path, paths: Iterable[str]) -> List[str]:
+        """Re-stat specific paths (after save_file or watcher events) and record changes"""
+        workspace_path = Path(workspace_path)
+        await self._load(project_id, workspace_path)
+        async with self._lock(project_id):
+            # Read under the lock: a concurrent build may have replaced the manifest
+            manifest = self.manifests[project_id]
+            changed, update = await asyncio.to_thread(self._refresh_paths_sync, manifest, workspace_path, list(paths))
+            updated = {**manifest, **update}
+            self.manifests[project_id] = updated
+        if changed or updated["root_files"] != manifest["root_files"] or updated["root_dirs"] != manifest["root_dirs"]:
+            self._schedule_flush(project_id)
+        return changed
+
+    # ---------- queries ----------
+
+    def tree(self, manifest: Dict[str, Any]) -> Dict[str, Any]:
+        """Nested FileNode-compatible tree, cached per manifest version"""
+        project_id = manifest["project_id"]
+        cached = self._tree_cache.get(project_id)
+        if cached and cached[0] == manifest["version"]:
+            return cached[1]
+        files = [{"path": p, **meta} for p, meta in manifest["files"].items()]
+        tree = build_tree(files, manifest.get("root_name") or "root")
+        self._tree_cache[project_id] = (manifest["version"], tree)
+        return tree
+
+    def _cached(self, cache: Dict[str, tuple], manifest: Dict[str, Any], build):
+        project_id = manifest["project_id"]
+        cached = cache.get(project_id)
+        if cached and cached[0] == manifest["version"]:
+            return cached[1]
+        files = [{"path": p, **meta} for p, meta in manifest["files"].items()]
+        value = build(files)
+        cache[project_id] = (manifest["version"], value)
+        return value
+
+    def list_directory(self, manifest: Dict[str, Any], dir_path: str = "",
+                       cursor: Optional[str] = None, limit: int = 200) -> Optional[Dict[str, Any]]:
+        """
+        One directory level with cursor pagination.
+
+        The cursor is the sort key of the last entry returned ("d:<name>" or
+        "f:<name>"), so pages stay consistent when entries are added or removed
+        between requests. Returns None if the directory does not exist.
+        """
+        index = self._cached(self._dir_index_cache, manifest, build_directory_index)
+        dir_path = dir_path.strip('/')
+        children = index.get(dir_path)
+        if children is None:
+            return None
+
+        start = 0
+        if cursor:
+            kind, _, name = cursor.partition(':')
+            after = (kind != 'd', name.lower(), name)
+            start = bisect.bisect_right(children, after, key=directory_sort_key)
+
+        page = children[start:start + limit]
+        next_cursor = None
+        if start + limit < len(children) and page:
+            last = page[-1]
+            next_cursor = f"{'d' if last['type'] == 'directory' else 'f'}:{last['name']}"
+
+        return {
+            "version": manifest["version"],
+            "path": dir_path or "/",
+            "entries": page,
+            "total": len(children),
+            "next_cursor": next_cursor
+        }
+
+    def flat_tree(self, manifest: Dict[str, Any]) -> Dict[str, Any]:
+        """Whole tree as parallel arrays (see encode_flat_tree)"""
+        root_name = manifest.get("root_name") or "root"
+        encoded = self._cached(self._flat_cache, manifest, lambda files: encode_flat_tree(files, root_name))
+        return {"version": manifest["version"], "format": "flat", **encoded}
+
+    def fingerprint(self, manifest: Dict[str, Any], paths: Optional[Iterable[str]] = None) -> str:
+        """Merkle root of the workspace (or of `paths` only); the full root is cached per version"""
+        if paths is not None:
+            return merkle_hash(manifest["files"], paths)
+        return self._cached(self._fingerprint_cache, manifest,
+                            lambda files: merkle_hash(manifest["files"]))
+
+    def languages(self, manifest: Dict[str, Any]) -> List[Dict[str, Any]]:
+        files = [{"path": p, **meta} for p, meta in manifest["files"].items()]
+        return summarize_languages(files)
+
+    def changes_since(self, manifest: Dict[str, Any], since: int) -> Optional[Dict[str, Any]]:
+        """Delta against an older version, or None if the client must refetch everything"""
+        if since < manifest.get("floor", 0):
+            return None
+        changed = [
+            {"path": p, **meta}
+            for p, meta in manifest["files"].items()
+            if meta["version"] > since
+        ]
+        deleted = [p for p, v in manifest["deleted"].items() if v > since]
+        return {
+            "version": manifest["version"],
+            "since": since,
+            "changed": changed,
+            "deleted": deleted
+        }
+
+    # ---------- file watching ----------
+
+    def is_watching(self, project_id: str) -> bool:
+        task = self.watchers.get(project_id)
+        return task is not None and not task.done()
+
+    def start_watcher(self, project_id: str, workspace_path: Path) -> bool:
+        """Follow terminal-driven changes with inotify (via watchfiles)"""
+        if not WATCHER_AVAILABLE:
+            return False
+        if self.is_watching(project_id):
+            return True
+        workspace_path = Path(workspace_path)
+        self.watchers[project_id] = asyncio.create_task(self._watch(project_id, workspace_path))
+        return True
+
+    async def _watch(self, project_id: str, workspace_path: Path):
+        root = str(workspace_path.resolve())
+
+        def watch_filter(change, path: str) -> bool:
+            rel_path = os.path.relpath(path, root).replace(os.sep, '/')
+            return not rel_path.startswith('..') and is_tracked_path(rel_path)
+
+        try:
+            async for changes in awatch(root, watch_filter=watch_filter, recursive=True):
+                rel_paths = {os.path.relpath(path, root).replace(os.sep, '/') for _, path in changes}
+                await self.refresh_paths(project_id, workspace_path, rel_paths)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Workspace watcher error for {project_id}: {e}")
+
+    def stop_watcher(self, project_id: str) -> None:
+        task = self.watchers.pop(project_id, None)
+        if task and not task.done():
+            task.cancel()
+
+    # ---------- idle eviction ----------
+
+    async def _flush_now(self, project_id: str) -> None:
+        task = self._flush_tasks.pop(project_id, None)
+        manifest = self.manifests.get(project_id)
+        if task and not task.done():
+            task.cancel()
+            if manifest is not None:
+                await asyncio.to_thread(self._write, project_id, manifest)
+
+    async def evict_idle(self) -> int:
+        """Flush and drop manifests (and stop watchers) not requested for idle_ttl; returns count"""
+        cutoff = time.monotonic() - self.idle_ttl
+        idle = [pid for pid in set(self.manifests) | set(self.watchers)
+                if self.last_access.get(pid, 0) < cutoff]
+        evicted = 0
+        for project_id in idle:
+            if self._lock(project_id).locked():
+                continue
+            await self._flush_now(project_id)
+            self.forget(project_id)
+            evicted += 1
+        return evicted
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                evicted = await self.evict_idle()
+                if evicted:
+                    logger.info(f"Dropped {evicted} idle workspace manifests")
+            except Exception as e:
+                logger.error(f"Manifest eviction error: {e}")
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    async def close(self) -> None:
+        """Stop watchers and flush pending manifest writes"""
+        if self._task:
+            self._task.cancel()
+        for project_id in list(self.watchers):
+            self.stop_watcher(project_id)
+        for project_id in list(self.manifests):
+            await self._flush_now(project_id)
+
+    def forget(self, project_id: str) -> None:
+        """Drop in-memory state; the manifest file stays and is reloaded on next use"""
+        self.stop_watcher(project_id)
+        task = self._flush_tasks.pop(project_id, None)
+        if task and not task.done():
+            task.cancel()
+        self.manifests.pop(project_id, None)
+        self.last_access.pop(project_id, None)
+        self._tree_cache.pop(project_id, None)
+        self._dir_index_cache.pop(project_id, None)
+        self._flat_cache.pop(project_id, None)
+        self._fingerprint_cache.pop(project_id, None)
+        self._locks.pop(project_id, None)
+
+    def remove(self, project_id: str) -> None:
+        """Forget a deleted workspace and remove its manifest file"""
+        self.forget(project_id)
+        self._manifest_path(project_id).unlink(missing_ok=True)
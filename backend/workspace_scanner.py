@@ -0,0 +1,331 @@
+"""
+Workspace Scanner
+Single-pass traversal of an uploaded project workspace.
+
+One os.scandir walk produces the file tree, language statistics, totals and
+the root listing used for framework detection, so upload and structure
+requests no longer walk the same directory four times with four slightly
+different ignore lists.
+"""
+
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Any
+
+# ============== SHARED IGNORE RULES ==============
+
+IGNORED_DIRS = {'node_modules', '__pycache__', '.git', 'venv', 'env', 'dist', 'build', '.next'}
+VISIBLE_DOTFILES = {'.env', '.gitignore', '.eslintrc'}
+
+# ============== LANGUAGE DETECTION ==============
+
+LANGUAGE_EXTENSIONS = {
+    '.py': {'name': 'Python', 'color': '#3572A5'},
+    '.js': {'name': 'JavaScript', 'color': '#f1e05a'},
+    '.ts': {'name': 'TypeScript', 'color': '#2b7489'},
+    '.jsx': {'name': 'JavaScript', 'color': '#f1e05a'},
+    '.tsx': {'name': 'TypeScript', 'color': '#2b7489'},
+    '.java': {'name': 'Java', 'color': '#b07219'},
+    '.cpp': {'name': 'C++', 'color': '#f34b7d'},
+    '.c': {'name': 'C', 'color': '#555555'},
+    '.h': {'name': 'C/C++ Header', 'color': '#555555'},
+    '.hpp': {'name': 'C++', 'color': '#f34b7d'},
+    '.go': {'name': 'Go', 'color': '#00ADD8'},
+    '.rs': {'name': 'Rust', 'color': '#dea584'},
+    '.rb': {'name': 'Ruby', 'color': '#701516'},
+    '.php': {'name': 'PHP', 'color': '#4F5D95'},
+    '.cs': {'name': 'C#', 'color': '#178600'},
+    '.swift': {'name': 'Swift', 'color': '#ffac45'},
+    '.kt': {'name': 'Kotlin', 'color': '#F18E33'},
+    '.scala': {'name': 'Scala', 'color': '#c22d40'},
+    '.sql': {'name': 'SQL', 'color': '#e38c00'},
+    '.html': {'name': 'HTML', 'color': '#e34c26'},
+    '.css': {'name': 'CSS', 'color': '#563d7c'},
+    '.scss': {'name': 'SCSS', 'color': '#c6538c'},
+    '.sass': {'name': 'Sass', 'color': '#a53b70'},
+    '.less': {'name': 'Less', 'color': '#1d365d'},
+    '.json': {'name': 'JSON', 'color': '#292929'},
+    '.xml': {'name': 'XML', 'color': '#0060ac'},
+    '.yaml': {'name': 'YAML', 'color': '#cb171e'},
+    '.yml': {'name': 'YAML', 'color': '#cb171e'},
+    '.md': {'name': 'Markdown', 'color': '#083fa1'},
+    '.sh': {'name': 'Shell', 'color': '#89e051'},
+    '.bash': {'name': 'Bash', 'color': '#89e051'},
+    '.vue': {'name': 'Vue', 'color': '#41b883'},
+    '.svelte': {'name': 'Svelte', 'color': '#ff3e00'},
+    '.dart': {'name': 'Dart', 'color': '#00B4AB'},
+    '.r': {'name': 'R', 'color': '#198CE7'},
+    '.lua': {'name': 'Lua', 'color': '#000080'},
+    '.pl': {'name': 'Perl', 'color': '#0298c3'},
+    '.ex': {'name': 'Elixir', 'color': '#6e4a7e'},
+    '.exs': {'name': 'Elixir', 'color': '#6e4a7e'},
+    '.erl': {'name': 'Erlang', 'color': '#B83998'},
+    '.hs': {'name': 'Haskell', 'color': '#5e5086'},
+    '.clj': {'name': 'Clojure', 'color': '#db5855'},
+    '.dockerfile': {'name': 'Dockerfile', 'color': '#384d54'},
+    '.toml': {'name': 'TOML', 'color': '#9c4221'},
+    '.ini': {'name': 'INI', 'color': '#d1dbe0'},
+    '.env': {'name': 'Environment', 'color': '#faf743'},
+    '.graphql': {'name': 'GraphQL', 'color': '#e10098'},
+    '.proto': {'name': 'Protocol Buffers', 'color': '#5592b5'},
+}
+
+UNKNOWN_LANGUAGE = {'name': 'Unknown', 'color': '#808080'}
+
+# First color registered for each language name (e.g. .js and .jsx share one)
+LANGUAGE_COLORS: Dict[str, str] = {}
+for _info in LANGUAGE_EXTENSIONS.values():
+    LANGUAGE_COLORS.setdefault(_info['name'], _info['color'])
+
+
+def is_ignored(name: str, is_dir: bool) -> bool:
+    """Shared ignore rule for every workspace walk"""
+    if is_dir and name in IGNORED_DIRS:
+        return True
+    if name.startswith('.') and name not in VISIBLE_DOTFILES:
+        return True
+    return False
+
+
+def language_for(filename: str) -> dict:
+    """Language info for a filename based on its extension"""
+    ext = os.path.splitext(filename)[1].lower()
+    return LANGUAGE_EXTENSIONS.get(ext, UNKNOWN_LANGUAGE)
+
+
+def summarize_languages(files: List[Dict[str, Any]], limit: int = 10) -> List[Dict[str, Any]]:
+    """GitHub-style language breakdown from manifest file entries"""
+    lang_bytes: Dict[str, int] = {}
+    lang_files: Dict[str, int] = {}
+
+    for entry in files:
+        lang_name = entry.get('language')
+        if not lang_name or lang_name == UNKNOWN_LANGUAGE['name']:
+            continue
+        lang_bytes[lang_name] = lang_bytes.get(lang_name, 0) + entry['size']
+        lang_files[lang_name] = lang_files.get(lang_name, 0) + 1
+
+    total_bytes = sum(lang_bytes.values()) or 1
+
+    stats = []
+    for lang_name, bytes_count in sorted(lang_bytes.items(), key=lambda x: -x[1]):
+        stats.append({
+            "name": lang_name,
+            "percentage": round((bytes_count / total_bytes) * 100, 1),
+            "bytes": bytes_count,
+            "color": LANGUAGE_COLORS.get(lang_name, UNKNOWN_LANGUAGE['color']),
+            "file_count": lang_files[lang_name]
+        })
+
+    return stats[:limit]
+
+
+def _scan_directory(dir_path: str, rel_path: str, files: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Recursively scan one directory, appending file entries and returning its tree node"""
+    dirs = []
+    file_nodes = []
+
+    try:
+        with os.scandir(dir_path) as it:
+            entries = list(it)
+    except (PermissionError, FileNotFoundError):
+        entries = []
+
+    for entry in entries:
+        try:
+            is_dir = entry.is_dir(follow_symlinks=False)
+            if is_ignored(entry.name, is_dir):
+                continue
+
+            child_rel = f"{rel_path}/{entry.name}" if rel_path else entry.name
+
+            if is_dir:
+                child_node = _scan_directory(entry.path, child_rel, files)
+                if child_node is not None:
+                    dirs.append(child_node)
+            elif entry.is_file():
+                st = entry.stat()
+                lang_info = language_for(entry.name)
+                files.append({
+                    "path": child_rel,
+                    "size": st.st_size,
+                    "mtime": st.st_mtime,
+                    "language": lang_info['name']
+                })
+                file_nodes.append({
+                    "name": entry.name,
+                    "path": child_rel,
+                    "type": "file",
+                    "language": lang_info['name'],
+                    "size": st.st_size
+                })
+        except OSError:
+            continue
+
+    if rel_path and not dirs and not file_nodes:
+        return None  # Only include non-empty directories
+
+    dirs.sort(key=lambda n: n['name'].lower())
+    file_nodes.sort(key=lambda n: n['name'].lower())
+
+    return {
+        "name": os.path.basename(dir_path) or "root",
+        "path": rel_path or "/",
+        "type": "directory",
+        "children": dirs + file_nodes
+    }
+
+
+def scan_workspace(directory: Path) -> Dict[str, Any]:
+    """
+    Walk a workspace once and return a reusable manifest.
+
+    The manifest contains:
+    - root: nested file tree (FileNode-compatible dicts)
+    - files: flat list of {path, size, mtime, language}
+    - languages: top language statistics
+    - total_files / total_size
+    - root_files / root_dirs: unfiltered root listing for framework detection
+
+    Blocking - call through asyncio.to_thread from request handlers.
+    """
+    directory = Path(directory)
+    files: List[Dict[str, Any]] = []
+    root = _scan_directory(str(directory), "", files)
+
+    root_files = []
+    root_dirs = []
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.is_dir():
+                    root_dirs.append(entry.name)
+                elif entry.is_file():
+                    root_files.append(entry.name)
+    except (PermissionError, FileNotFoundError):
+        pass
+
+    return {
+        "root": root,
+        "files": files,
+        "languages": summarize_languages(files),
+        "total_files": len(files),
+        "total_size": sum(f['size'] for f in files),
+        "root_files": sorted(root_files),
+        "root_dirs": sorted(root_dirs),
+        "scanned_at": time.time()
+    }
+
+
+def build_tree(files: List[Dict[str, Any]], root_name: str = "root") -> Dict[str, Any]:
+    """Rebuild the nested file tree from flat manifest entries (no disk access)"""
+    root = {"name": root_name, "path": "/", "type": "directory", "children": []}
+    dir_nodes: Dict[str, Dict[str, Any]] = {"": root}
+
+    for entry in files:
+        parts = entry['path'].split('/')
+        parent_key = ""
+        parent = root
+        for part in parts[:-1]:
+            key = f"{parent_key}/{part}" if parent_key else part
+            node = dir_nodes.get(key)
+            if node is None:
+                node = {"name": part, "path": key, "type": "directory", "children": []}
+                dir_nodes[key] = node
+                parent["children"].append(node)
+            parent = node
+            parent_key = key
+        parent["children"].append({
+            "name": parts[-1],
+            "path": entry['path'],
+            "type": "file",
+            "language": entry.get('language'),
+            "size": entry.get('size')
+        })
+
+    for node in dir_nodes.values():
+        node["children"].sort(key=lambda n: (n["type"] != "directory", n["name"].lower()))
+
+    return root
+
+
+def directory_sort_key(entry: Dict[str, Any]) -> tuple:
+    return (entry["type"] != "directory", entry["name"].lower(), entry["name"])
+
+
+def build_directory_index(files: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    """Map each directory path ("" for root) to its sorted immediate children"""
+    index: Dict[str, List[Dict[str, Any]]] = {"": []}
+    dir_counts: Dict[str, int] = {}
+
+    for entry in files:
+        parts = entry['path'].split('/')
+        parent = ""
+        for part in parts[:-1]:
+            key = f"{parent}/{part}" if parent else part
+            dir_counts[key] = dir_counts.get(key, 0) + 1
+            if key not in index:
+                index[key] = []
+                index[parent].append({"name": part, "path": key, "type": "directory"})
+            parent = key
+        index[parent].append({
+            "name": parts[-1],
+            "path": entry['path'],
+            "type": "file",
+            "language": entry.get('language'),
+            "size": entry.get('size')
+        })
+
+    for children in index.values():
+        for child in children:
+            if child["type"] == "directory":
+                child["file_count"] = dir_counts.get(child["path"], 0)
+        children.sort(key=directory_sort_key)
+
+    return index
+
+
+def encode_flat_tree(files: List[Dict[str, Any]], root_name: str = "root") -> Dict[str, Any]:
+    """
+    Compact tree encoding as parallel arrays.
+
+    Node 0 is the root (parent -1). Directories have size -1 and language -1;
+    language ids index into the returned `languages` table. Paths are rebuilt
+    client-side by following parent indices.
+    """
+    index = build_directory_index(files)
+    languages: List[str] = []
+    language_ids: Dict[str, int] = {}
+
+    names = [root_name]
+    parents = [-1]
+    sizes = [-1]
+    langs = [-1]
+
+    stack = [("", 0)]
+    while stack:
+        dir_path, node_id = stack.pop()
+        for child in index.get(dir_path, []):
+            child_id = len(names)
+            names.append(child["name"])
+            parents.append(node_id)
+            if child["type"] == "directory":
+                sizes.append(-1)
+                langs.append(-1)
+                stack.append((child["path"], child_id))
+            else:
+                sizes.append(child.get("size") or 0)
+                lang = child.get("language")
+                if lang not in language_ids:
+                    language_ids[lang] = len(languages)
+                    languages.append(lang)
+                langs.append(language_ids[lang])
+
+    return {
+        "languages": languages,
+        "names": names,
+        "parents": parents,
+        "sizes": sizes,
+        "language_ids": langs
+    }